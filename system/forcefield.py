@@ -11,7 +11,11 @@ from openforcefield.utils import toolkits
 from openforcefield.typing.engines.smirnoff import ForceField
 from openforcefield.topology import ValenceDict
 
-from timemachine.lib import custom_ops
+try:
+    from timemachine.lib import custom_ops
+except ImportError:
+    # cpu only build, the host potentials share the names and arguments of the gpu ones
+    from timemachine.lib import custom_ops_cpu as custom_ops
 
 def merge_potentials(nrgs):
     c_nrgs = []
@@ -25,9 +29,11 @@ def merge_potentials(nrgs):
         elif a_name == custom_ops.PeriodicTorsion_f32:
             c_nrgs.append(custom_ops.PeriodicTorsion_f32(a_args[0], a_args[1]))
         elif a_name == custom_ops.LennardJones_f32:
-            c_nrgs.append(custom_ops.LennardJones_f32(a_args[0].astype(np.float32), a_args[1]))
+            c_nrgs.append(custom_ops.LennardJones_f32(a_args[0], a_args[1].astype(np.float32), a_args[2]))
         elif a_name == custom_ops.Electrostatics_f32:
-            c_nrgs.append(custom_ops.Electrostatics_f32(a_args[0].astype(np.float32), a_args[1]))
+            c_nrgs.append(custom_ops.Electrostatics_f32(a_args[0], a_args[1].astype(np.float32), a_args[2]))
+        elif a_name == custom_ops.Nonbonded_f32:
+            c_nrgs.append(custom_ops.Nonbonded_f32(a_args[0], a_args[1].astype(np.float32), a_args[2].astype(np.float32), a_args[3], a_args[4]))
         else:
             raise Exception("Unknown potential", a_name)
 
@@ -78,23 +84,47 @@ def combiner(
             torsion_param_idxs = np.concatenate([a_args[1], b_args[1] + len(a_params)], axis=0)
             c_nrgs.append((custom_ops.PeriodicTorsion_f32, (torsion_idxs, torsion_param_idxs)))
         elif a_name == custom_ops.LennardJones_f32:
-            lj_scale_matrix = np.ones(shape=(len(c_masses), len(c_masses)), dtype=np.float64)
-            lj_scale_matrix[:num_a_atoms, :num_a_atoms] = a_args[0]
-            lj_scale_matrix[num_a_atoms:, num_a_atoms:] = b_args[0]
-            lj_param_idxs = np.concatenate([a_args[1], b_args[1] + len(a_params)], axis=0)
-            c_nrgs.append((custom_ops.LennardJones_f32, (lj_scale_matrix, lj_param_idxs)))
+            # interactions between a and b are never excluded
+            exclusion_idxs = np.concatenate([a_args[0], b_args[0] + num_a_atoms], axis=0)
+            lj_scales = np.concatenate([a_args[1], b_args[1]], axis=0)
+            lj_param_idxs = np.concatenate([a_args[2], b_args[2] + len(a_params)], axis=0)
+            c_nrgs.append((custom_ops.LennardJones_f32, (exclusion_idxs, lj_scales, lj_param_idxs)))
         elif a_name == custom_ops.Electrostatics_f32:
-            es_scale_matrix = np.ones(shape=(len(c_masses), len(c_masses)), dtype=np.float64)
-            es_scale_matrix[:num_a_atoms, :num_a_atoms] = a_args[0]
-            es_scale_matrix[num_a_atoms:, num_a_atoms:] = b_args[0]
-            es_param_idxs = np.concatenate([a_args[1], b_args[1] + len(a_params)], axis=0)
-            c_nrgs.append((custom_ops.Electrostatics_f32, (es_scale_matrix, es_param_idxs)))
+            exclusion_idxs = np.concatenate([a_args[0], b_args[0] + num_a_atoms], axis=0)
+            es_scales = np.concatenate([a_args[1], b_args[1]], axis=0)
+            es_param_idxs = np.concatenate([a_args[2], b_args[2] + len(a_params)], axis=0)
+            c_nrgs.append((custom_ops.Electrostatics_f32, (exclusion_idxs, es_scales, es_param_idxs)))
+        elif a_name == custom_ops.Nonbonded_f32:
+            exclusion_idxs = np.concatenate([a_args[0], b_args[0] + num_a_atoms], axis=0)
+            lj_scales = np.concatenate([a_args[1], b_args[1]], axis=0)
+            es_scales = np.concatenate([a_args[2], b_args[2]], axis=0)
+            lj_param_idxs = np.concatenate([a_args[3], b_args[3] + len(a_params)], axis=0)
+            es_param_idxs = np.concatenate([a_args[4], b_args[4] + len(a_params)], axis=0)
+            c_nrgs.append((custom_ops.Nonbonded_f32, (exclusion_idxs, lj_scales, es_scales, lj_param_idxs, es_param_idxs)))
         else:
             raise Exception("Unknown potential", a_name)
 
     return c_nrgs, c_params, c_param_groups, c_conf, c_masses
 
 
+def generate_exclusion_idxs(bond_idxs, angle_idxs, torsion_idxs):
+    """
+    Generate the unique (src, dst) pairs, src < dst, that are separated by
+    a bond, an angle, or a torsion.
+    """
+    exclusions = set()
+    for (src, dst) in bond_idxs:
+        exclusions.add((min(src, dst), max(src, dst)))
+
+    for (src, _, dst) in angle_idxs:
+        exclusions.add((min(src, dst), max(src, dst)))
+
+    for (src, _, _, dst) in torsion_idxs:
+        exclusions.add((min(src, dst), max(src, dst)))
+
+    return np.array(sorted(exclusions), dtype=np.int32).reshape(-1, 2)
+
+
 def to_md_units(q):
     return q.value_in_unit_system(simtk.unit.md_unit_system)
 
@@ -152,9 +182,13 @@ def simple_charge_model():
     }
     return model
 
-def parameterize(mol, forcefield):
+def parameterize(mol, forcefield, fused_nonbonded=False):
     """
     Parameterize an RDKit molecule with a given forcefield.
+
+    If fused_nonbonded is True then the vdW and charge terms are emitted as a single
+    Nonbonded potential instead of separate LennardJones and Electrostatics potentials,
+    which requires the forcefield to have a vdW handler.
     """
     # do this in a separate pass later
     global_params = []
@@ -170,6 +204,10 @@ def parameterize(mol, forcefield):
 
     nrg_fns = []
 
+    # only bound by the vdW handler, the fused Nonbonded potential needs both
+    lj_scales = None
+    lj_param_idxs = None
+
     for handler in forcefield._parameter_handlers.items():
 
         handler_name, handler_params = handler
@@ -272,33 +310,29 @@ def parameterize(mol, forcefield):
                 for m in matches:
                     vd[m] = (s_idx, e_idx)
 
-                scale_matrix = np.ones(shape=(num_atoms, num_atoms), dtype=np.float64) - np.eye(num_atoms)
-
-                # fully exclude 1-2, 1-3, tbd: 1-4
-                for (src, dst) in bond_idxs:
-                    scale_matrix[src][dst] = 0
-                    scale_matrix[dst][src] = 0
-
-                for (src, _, dst) in angle_idxs:
-                    scale_matrix[src][dst] = 0
-                    scale_matrix[dst][src] = 0
-
-                for (src, _, _, dst) in torsion_idxs:
-                    scale_matrix[src][dst] = 0
-                    scale_matrix[dst][src] = 0
+            # fully exclude 1-2, 1-3, tbd: 1-4
+            exclusion_idxs = generate_exclusion_idxs(bond_idxs, angle_idxs, torsion_idxs)
+            lj_scales = np.zeros(exclusion_idxs.shape[0], dtype=np.float64)
 
             lj_param_idxs = []
 
             for k, v in vd.items():
                 lj_param_idxs.append(v)
 
-            nrg_fns.append((
-                custom_ops.LennardJones_f32,
-                (
-                    np.array(scale_matrix, dtype=np.int32),
-                    np.array(lj_param_idxs, dtype=np.int32)
-                )
-            ))
+            lj_param_idxs = np.array(lj_param_idxs, dtype=np.int32)
+
+            if not fused_nonbonded:
+                nrg_fns.append((
+                    custom_ops.LennardJones_f32,
+                    (
+                        exclusion_idxs,
+                        lj_scales,
+                        lj_param_idxs
+                    )
+                ))
+
+    if fused_nonbonded and lj_param_idxs is None:
+        raise ValueError("fused_nonbonded requires a forcefield with a vdW handler")
 
     # process charges separately
     model = simple_charge_model()
@@ -311,31 +345,36 @@ def parameterize(mol, forcefield):
         for m in matches:
             vd[m] = c_idx
 
-        scale_matrix = np.ones(shape=(num_atoms, num_atoms), dtype=np.float64) - np.eye(num_atoms)
-        # fully exclude 1-2, 1-3, tbd: 1-4
-        for (src, dst) in bond_idxs:
-            scale_matrix[src][dst] = 0
-            scale_matrix[dst][src] = 0
-
-        for (src, _, dst) in angle_idxs:
-            scale_matrix[src][dst] = 0
-            scale_matrix[dst][src] = 0
-
-        for (src, _, _, dst) in torsion_idxs:
-            scale_matrix[src][dst] = 0
-            scale_matrix[dst][src] = 0
+    # fully exclude 1-2, 1-3, tbd: 1-4
+    exclusion_idxs = generate_exclusion_idxs(bond_idxs, angle_idxs, torsion_idxs)
+    es_scales = np.zeros(exclusion_idxs.shape[0], dtype=np.float64)
 
     charge_param_idxs = []
     for k, v in vd.items():
         charge_param_idxs.append(v)
 
-    nrg_fns.append((
-        custom_ops.Electrostatics_f32,
-        (
-            np.array(scale_matrix, dtype=np.int32),
-            np.array(charge_param_idxs, dtype=np.int32)
-        )
-    ))
+    charge_param_idxs = np.array(charge_param_idxs, dtype=np.int32)
+
+    if fused_nonbonded:
+        nrg_fns.append((
+            custom_ops.Nonbonded_f32,
+            (
+                exclusion_idxs,
+                lj_scales,
+                es_scales,
+                lj_param_idxs,
+                charge_param_idxs
+            )
+        ))
+    else:
+        nrg_fns.append((
+            custom_ops.Electrostatics_f32,
+            (
+                exclusion_idxs,
+                es_scales,
+                charge_param_idxs
+            )
+        ))
 
     c = mol.GetConformer(0)
     conf = np.array(c.GetPositions(), dtype=np.float64)
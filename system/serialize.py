@@ -1,7 +1,11 @@
 import os
 import numpy as np
 
-from timemachine.lib import custom_ops
+try:
+    from timemachine.lib import custom_ops
+except ImportError:
+    # cpu only build, the host potentials share the names and arguments of the gpu ones
+    from timemachine.lib import custom_ops_cpu as custom_ops
 
 from simtk import openmm as mm
 from simtk import unit
@@ -9,7 +13,7 @@ from simtk import unit
 def value(quantity):
     return quantity.value_in_unit_system(unit.md_unit_system)
 
-def deserialize_system(filepath):
+def deserialize_system(filepath, fused_nonbonded=False):
     """
     Deserialize an OpenMM XML file
 
@@ -18,6 +22,10 @@ def deserialize_system(filepath):
     filepath: str
         Location to an existing xml file to be deserialized
 
+    fused_nonbonded: bool
+        If True then the NonbondedForce is emitted as a single Nonbonded potential
+        instead of separate LennardJones and Electrostatics potentials.
+
     """
 
     filename, file_extension = os.path.splitext(filepath)
@@ -133,13 +141,11 @@ def deserialize_system(filepath):
         if isinstance(force, mm.NonbondedForce):
 
             num_atoms = force.getNumParticles()
-            scale_matrix = np.ones((num_atoms, num_atoms)) - np.eye(num_atoms)
 
             charge_param_idxs = []
             lj_param_idxs = []
 
             for a_idx in range(num_atoms):
-                scale_matrix[a_idx][a_idx] = 0
                 charge, sig, eps = force.getParticleParameters(a_idx)
 
                 charge = value(charge)
@@ -159,18 +165,39 @@ def deserialize_system(filepath):
                 charge_param_idxs.append(charge_idx)
                 lj_param_idxs.append([sig_idx, eps_idx])
 
+            exclusion_idxs = []
+
             for a_idx in range(force.getNumExceptions()):
 
                 src, dst, _, _, _ = force.getExceptionParameters(a_idx)
-                scale_matrix[src][dst] = 0
-                scale_matrix[dst][src] = 0
+                exclusion_idxs.append([src, dst])
 
             charge_param_idxs = np.array(charge_param_idxs, dtype=np.int32)
             lj_param_idxs = np.array(lj_param_idxs, dtype=np.int32)
+            exclusion_idxs = np.array(exclusion_idxs, dtype=np.int32).reshape(-1, 2)
+
+            # exceptions are fully excluded
+            lj_scales = np.zeros(exclusion_idxs.shape[0], dtype=np.float64)
+            es_scales = np.zeros(exclusion_idxs.shape[0], dtype=np.float64)
+
+            if fused_nonbonded:
+                test_nb = (custom_ops.Nonbonded_f32,
+                    (
+                        exclusion_idxs,
+                        lj_scales,
+                        es_scales,
+                        lj_param_idxs,
+                        charge_param_idxs
+                    )
+                )
+
+                test_potentials.append(test_nb)
+                continue
 
             test_lj = (custom_ops.LennardJones_f32,
                 (
-                    scale_matrix,
+                    exclusion_idxs,
+                    lj_scales,
                     lj_param_idxs
                 )
             )
@@ -179,7 +206,8 @@ def deserialize_system(filepath):
 
             test_es = (custom_ops.Electrostatics_f32,
                 (
-                    scale_matrix,
+                    exclusion_idxs,
+                    es_scales,
                     charge_param_idxs,
                 )
             )
@@ -2,7 +2,16 @@ import numpy as np
 import random
 
 from system import forcefield
-from timemachine.lib import custom_ops
+try:
+    from timemachine.lib import custom_ops_cpu
+except ImportError:
+    # gpu only build
+    custom_ops_cpu = None
+try:
+    from timemachine.lib import custom_ops
+except ImportError:
+    # cpu only build, without a CUDA toolchain
+    custom_ops = None
 from timemachine.integrator import langevin_coefficients
 
 from timemachine import constants
@@ -56,6 +65,33 @@ def average_E_and_derivatives(reservoir):
     return running_sum_E/n_reservoir, running_sum_total_derivs/n_reservoir, -constants.BOLTZ*(thermo_deriv/n_reservoir)/(100)
 
 
+def select_backend(potentials):
+    """
+    Pick the optimizer and context classes matching the potentials, which must all be
+    host (custom_ops_cpu) or all be device (custom_ops) potentials.
+
+    Returns
+    -------
+    (LangevinOptimizer, Context)
+        single precision classes of the chosen backend
+
+    """
+    if custom_ops_cpu is None and custom_ops is None:
+        raise ImportError("Neither custom_ops_cpu nor custom_ops could be imported, build timemachine/cpp first.")
+
+    is_cpu = [custom_ops_cpu is not None and isinstance(p, custom_ops_cpu.PotentialCpu_f32) for p in potentials]
+
+    # potentials built without nvcc run on the host Context
+    if custom_ops_cpu is not None and all(is_cpu):
+        return custom_ops_cpu.LangevinOptimizer_cpu_f32, custom_ops_cpu.Context_cpu_f32
+    if any(is_cpu):
+        raise TypeError("Cannot mix host and device potentials in a single simulation.")
+    if custom_ops is None:
+        raise ImportError("The potentials require the GPU backend, but custom_ops could not be imported.")
+
+    return custom_ops.LangevinOptimizer_f32, custom_ops.Context_f32
+
+
 def run_simulation(
     potentials,
     params,
@@ -78,7 +114,9 @@ def run_simulation(
 
     m_dt, m_ca, m_cb, m_cc = dt, 0.5, cb, np.zeros_like(masses)
 
-    opt = custom_ops.LangevinOptimizer_f32(
+    LangevinOptimizer, Context = select_backend(potentials)
+
+    opt = LangevinOptimizer(
         m_dt,
         m_ca,
         m_cb.astype(np.float32),
@@ -88,7 +126,7 @@ def run_simulation(
     v0 = np.zeros_like(conf)
     dp_idxs = dp_idxs.astype(np.int32)
 
-    ctxt = custom_ops.Context_f32(
+    ctxt = Context(
         potentials,
         opt,
         params.astype(np.float32),
@@ -63,9 +63,9 @@ class TestEnthalpyDerivatives(unittest.TestCase):
             elif potential == timemachine.lib.custom_ops.PeriodicTorsion_f64:
                 jp = functools.partial(jax_potential, box=None, torsion_idxs=params[0], param_idxs=params[1])
             elif potential == timemachine.lib.custom_ops.LennardJones_f64:
-                jp = functools.partial(jax_potential, box=None, scale_matrix=params[0], param_idxs=params[1])
+                jp = functools.partial(jax_potential, box=None, exclusion_idxs=params[0], exclusion_scales=params[1], param_idxs=params[2])
             elif potential == timemachine.lib.custom_ops.Electrostatics_f64:
-                jp = functools.partial(jax_potential, box=None, scale_matrix=params[0], param_idxs=params[1])
+                jp = functools.partial(jax_potential, box=None, exclusion_idxs=params[0], exclusion_scales=params[1], param_idxs=params[2])
             else:
                 raise ValueError("unknown functional form")
 
@@ -0,0 +1,192 @@
+import unittest
+import numpy as np
+import functools
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+
+from timemachine import integrator
+from timemachine.constants import AVOGADRO, BOLTZ
+from timemachine.potentials import jax_barostat, jax_utils, neighborlist, nonbonded
+
+
+def diatomic_system(num_mols, box_length, bond_length=0.1):
+    centers = np.random.rand(num_mols, 3)*box_length
+    directions = np.random.randn(num_mols, 3)
+    directions /= np.linalg.norm(directions, axis=-1, keepdims=True)
+    conf = np.stack([centers, centers + bond_length*directions], axis=1).reshape(-1, 3)
+    molecule_idxs = np.repeat(np.arange(num_mols), 2).astype(np.int32)
+    return conf, molecule_idxs
+
+
+def lattice_system(num_atoms, box_length):
+    # atoms on a cubic lattice, jittered so that no two start at the same distance
+    n = int(round(num_atoms**(1/3)))
+    grid = np.stack(np.meshgrid(*[np.arange(n)]*3, indexing='ij'), axis=-1).reshape(-1, 3)
+    return (grid + 0.5 + 0.05*np.random.randn(num_atoms, 3))*box_length/n
+
+
+class TestBarostat(unittest.TestCase):
+
+    def test_rescale_coordinates(self):
+        np.random.seed(2020)
+        conf, molecule_idxs = diatomic_system(20, 2.0)
+        box = np.eye(3)*2.0
+        scales = np.array([1.1, 1.1, 1.1])
+
+        new_conf, new_box = jax_utils.rescale_coordinates(conf, molecule_idxs, box, scales)
+        np.testing.assert_array_equal(new_box, box*scales)
+
+        old_centers = conf.reshape(20, 2, 3).mean(axis=1)
+        new_centers = np.asarray(new_conf).reshape(20, 2, 3).mean(axis=1)
+        np.testing.assert_allclose(new_centers, old_centers*scales, rtol=1e-12)
+
+        old_bonds = conf[1::2] - conf[0::2]
+        new_bonds = new_conf[1::2] - new_conf[0::2]
+        np.testing.assert_allclose(new_bonds, old_bonds, atol=1e-12)
+
+    def test_intermolecular_energy_delta(self):
+        np.random.seed(2021)
+        num_mols = 50
+        box = np.eye(3)*2.5
+        cutoff = 0.8
+        conf, molecule_idxs = diatomic_system(num_mols, 2.5)
+
+        params = np.array([0.3, 0.5])
+        param_idxs = np.zeros((2*num_mols, 2), dtype=np.int32)
+        param_idxs[:, 1] = 1
+        exclusion_idxs = np.stack([np.arange(0, 2*num_mols, 2), np.arange(1, 2*num_mols, 2)], axis=-1).astype(np.int32)
+        exclusion_scales = np.full(num_mols, 0.5)
+
+        full_fn = functools.partial(nonbonded.lennard_jones, params=params, param_idxs=param_idxs,
+            exclusion_idxs=exclusion_idxs, exclusion_scales=exclusion_scales, cutoff=cutoff)
+
+        nblist = neighborlist.NeighborList(cutoff, skin=0.3)
+        pair_idxs = nblist.update(conf, box)
+        inter_idxs = jax_barostat.intermolecular_pair_idxs(pair_idxs, molecule_idxs)
+        assert np.sum(inter_idxs[:, 0] >= 0) < np.sum(pair_idxs[:, 0] >= 0)
+        assert np.all(molecule_idxs[inter_idxs[inter_idxs[:, 0] >= 0]][:, 0] != molecule_idxs[inter_idxs[inter_idxs[:, 0] >= 0]][:, 1])
+
+        # the exclusions are all intramolecular, so the barostat never needs them
+        pair_energy_fn = functools.partial(nonbonded.lennard_jones, params=jax.numpy.asarray(params), param_idxs=param_idxs,
+            exclusion_idxs=np.zeros((0, 2), dtype=np.int32), exclusion_scales=np.zeros(0), cutoff=cutoff)
+
+        barostat = jax_barostat.IsotropicMonteCarloBarostat(1.0, 300.0, 1, molecule_idxs, pair_energy_fn,
+            neighbor_list=nblist, seed=2021)
+        np.testing.assert_array_equal(barostat.pair_idxs(conf, box), inter_idxs)
+        energy = barostat._energy(conf, box, inter_idxs)
+        for length_scale in [0.99, 1.01]:
+            new_conf, new_box, new_energy = barostat._trial(conf, box, inter_idxs, length_scale)
+            np.testing.assert_allclose(new_box, box*length_scale)
+            ref_delta = full_fn(new_conf, box=new_box) - full_fn(conf, box=box)
+            np.testing.assert_allclose(new_energy - energy, ref_delta, rtol=1e-8)
+
+    def test_update_frequency(self):
+        np.random.seed(2022)
+        conf, molecule_idxs = diatomic_system(10, 2.0)
+        box = np.eye(3)*2.0
+        # with no energy and a huge pressure every compression is accepted
+        barostat = jax_barostat.IsotropicMonteCarloBarostat(1e6, 300.0, 5, molecule_idxs, lambda conf, box, pair_idxs: 0.0, seed=0)
+
+        num_changes = 0
+        for step in range(1, 21):
+            new_conf, new_box = barostat.update(conf, box)
+            if step % 5 != 0:
+                assert new_conf is conf and new_box is box
+            elif not np.array_equal(new_box, box):
+                num_changes += 1
+            conf, box = new_conf, new_box
+
+        assert num_changes > 0
+
+    def test_ideal_gas_volume(self):
+        # for an ideal gas the NPT volume distribution has <V> = (N+1)kT/P
+        np.random.seed(2023)
+        num_mols = 100
+        temperature = 300.0
+        pressure = 1000.0
+        conf, molecule_idxs = diatomic_system(num_mols, 3.0)
+        box = np.eye(3)*3.0
+
+        barostat = jax_barostat.IsotropicMonteCarloBarostat(pressure, temperature, 1, molecule_idxs,
+            lambda conf, box, pair_idxs: 0.0, seed=2023)
+
+        volumes = []
+        for step in range(20000):
+            conf, box = barostat.update(conf, box)
+            if step >= 2000:
+                volumes.append(np.prod(np.diag(box)))
+
+        expected = (num_mols + 1)*BOLTZ*temperature/(pressure*AVOGADRO*1e-25)
+        np.testing.assert_allclose(np.mean(volumes), expected, rtol=0.06)
+
+    def test_energy_cache(self):
+        np.random.seed(2024)
+        conf, molecule_idxs = diatomic_system(10, 2.0)
+        box = np.eye(3)*2.0
+        barostat = jax_barostat.IsotropicMonteCarloBarostat(1.0, 300.0, 1, molecule_idxs,
+            lambda conf, box, pair_idxs: np.sum(box), seed=2024)
+
+        num_evals = [0]
+        energy_fn = barostat._energy
+        def counted_energy(*args):
+            num_evals[0] += 1
+            return energy_fn(*args)
+        barostat._energy = counted_energy
+
+        # moves on the returned state reuse its energy, accepted or not
+        for _ in range(10):
+            conf, box = barostat.update(conf, box)
+        assert num_evals[0] == 1
+
+        # while a changed state has to be evaluated again
+        barostat.update(np.array(conf), box)
+        assert num_evals[0] == 2
+
+    def test_npt_simulation(self):
+        np.random.seed(2025)
+        num_atoms = 64
+        box_length = 2.0
+        cutoff = 0.6
+        conf = lattice_system(num_atoms, box_length)
+        box = np.eye(3)*box_length
+        masses = np.full(num_atoms, 40.0)
+        molecule_idxs = np.arange(num_atoms, dtype=np.int32)
+
+        params = np.array([0.3, 0.5])
+        param_idxs = np.zeros((num_atoms, 2), dtype=np.int32)
+        param_idxs[:, 1] = 1
+        lj_fn = functools.partial(nonbonded.lennard_jones, params=jax.numpy.asarray(params), param_idxs=param_idxs,
+            exclusion_idxs=np.zeros((0, 2), dtype=np.int32), exclusion_scales=np.zeros(0), cutoff=cutoff)
+        grad_fn = jax.jit(jax.grad(lambda conf, box, pair_idxs: lj_fn(conf, box=box, pair_idxs=pair_idxs)))
+        force_fn = lambda conf, box, pair_idxs: grad_fn(conf, box, pair_idxs)
+
+        dt = 0.002
+        ca, cb, cc = integrator.langevin_coefficients(300.0, dt, 1.0, masses)
+
+        def run():
+            nblist = neighborlist.NeighborList(cutoff, skin=0.1)
+            barostat = jax_barostat.IsotropicMonteCarloBarostat(1000.0, 300.0, 5, molecule_idxs, lj_fn,
+                neighbor_list=nblist, seed=2025)
+            x_t, v_t, new_box = integrator.simulate(conf, np.zeros_like(conf), box, force_fn, ca, cb, cc, dt, 2025, 100,
+                neighbor_list=nblist, barostat=barostat)
+            return x_t, v_t, new_box, nblist, barostat
+
+        x_t, v_t, new_box, nblist, barostat = run()
+        assert not np.array_equal(new_box, box)
+        assert np.all(np.isfinite(x_t))
+
+        # the list is rebuilt after every accepted move, so it matches a fresh build of the final state
+        np.testing.assert_array_equal(nblist._ref_box, new_box)
+        ref_pairs = neighborlist.cell_list_pairs(x_t, new_box, cutoff)
+        pairs = set(map(tuple, nblist.update(x_t, new_box)[:nblist.num_pairs]))
+        assert set(map(tuple, ref_pairs)) <= pairs
+
+        # the noise and the volume moves are reproducible
+        x_ref, v_ref, box_ref, _, _ = run()
+        np.testing.assert_array_equal(x_t, x_ref)
+        np.testing.assert_array_equal(new_box, box_ref)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import numpy as np
+import functools
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+
+from timemachine.potentials import batching, bonded, implicit, nonbonded
+
+
+class TestBatching(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2022)
+        self.num_atoms = 11
+        self.num_confs = 7
+        self.confs = np.random.rand(self.num_confs, self.num_atoms, 3)*2.0
+
+    def energy_fns(self):
+        num_atoms = self.num_atoms
+        bond_idxs = np.stack([np.arange(num_atoms - 1), np.arange(1, num_atoms)], axis=-1)
+        exclusion_idxs = bond_idxs.astype(np.int32)
+        exclusion_scales = np.zeros(len(bond_idxs))
+
+        # bonds, LJ, charges, then GB radii and scale factors
+        params = np.array([100.0, 0.15, 0.3, 0.25, 0.2, 0.4, -0.3, 0.5, 0.15, 0.19, 0.8, 0.72], dtype=np.float64)
+        lj_param_idxs = np.stack([np.random.randint(2, 4, size=num_atoms), np.random.randint(4, 6, size=num_atoms)], axis=-1)
+        charge_param_idxs = np.random.randint(6, 8, size=num_atoms)
+        gb_param_idxs = np.stack([charge_param_idxs, np.random.randint(8, 10, size=num_atoms),
+            np.random.randint(10, 12, size=num_atoms)], axis=-1)
+
+        energy_fns = [
+            functools.partial(bonded.harmonic_bond, box=None, bond_idxs=bond_idxs,
+                param_idxs=np.zeros_like(bond_idxs) + np.array([0, 1])),
+            functools.partial(nonbonded.nonbonded, box=None, lj_param_idxs=lj_param_idxs,
+                charge_param_idxs=charge_param_idxs, exclusion_idxs=exclusion_idxs,
+                lj_scales=exclusion_scales, es_scales=exclusion_scales),
+            functools.partial(nonbonded.electrostatics, box=np.eye(3)*2.5, param_idxs=charge_param_idxs,
+                exclusion_idxs=exclusion_idxs, exclusion_scales=exclusion_scales, cutoff=1.0, alpha=2.0, kmax=4),
+            functools.partial(implicit.gbsa, box=None, param_idxs=gb_param_idxs),
+        ]
+
+        return energy_fns, params
+
+    def test_batch_energy(self):
+        energy_fns, params = self.energy_fns()
+        for energy_fn in energy_fns:
+            ref_nrgs = np.array([energy_fn(conf, params) for conf in self.confs])
+            for chunk_size in [None, 1, 3, 7, 16]:
+                test_nrgs = batching.batch_energy(energy_fn, chunk_size)(self.confs, params)
+                assert test_nrgs.shape == (self.num_confs,)
+                np.testing.assert_allclose(test_nrgs, ref_nrgs, rtol=1e-10)
+
+    def test_batch_derivatives(self):
+        energy_fns, params = self.energy_fns()
+        for energy_fn in energy_fns:
+            grad_fn = jax.grad(energy_fn, argnums=(0, 1))
+            ref_grads = [grad_fn(conf, params) for conf in self.confs]
+            ref_dE_dx = np.stack([g[0] for g in ref_grads])
+            ref_dE_dp = np.stack([g[1] for g in ref_grads])
+            for chunk_size in [None, 3]:
+                test_E, test_dE_dx, test_dE_dp = batching.batch_derivatives(energy_fn, chunk_size)(self.confs, params)
+                assert test_E.shape == (self.num_confs,)
+                np.testing.assert_allclose(test_dE_dx, ref_dE_dx, rtol=1e-8, atol=1e-8)
+                np.testing.assert_allclose(test_dE_dp, ref_dE_dp, rtol=1e-8, atol=1e-8)
+
+            # gradients of a reweighting style average flow back through the batch
+            avg_fn = lambda params: np.mean(batching.batch_energy(energy_fn, 3)(self.confs, params))
+            np.testing.assert_allclose(jax.grad(avg_fn)(params), np.mean(ref_dE_dp, axis=0), rtol=1e-8, atol=1e-8)
+
+
+if __name__ == "__main__":
+    unittest.main()
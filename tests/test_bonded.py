@@ -3,6 +3,7 @@ import numpy as np
 import functools
 
 from jax.config import config; config.update("jax_enable_x64", True)
+import jax
 from jax.test_util import check_grads
 
 from tests.invariances import assert_potential_invariance
@@ -307,6 +308,135 @@ class TestPeriodicTorsion(unittest.TestCase):
         for conf_idx, conf in enumerate(self.conformers):
             assert_potential_invariance(energy_fn, conf, params, box)
 
+    def test_grouped_torsions(self):
+        """
+        Test that grouped multi-term torsions agree with the expanded torsion terms.
+        """
+        np.random.seed(2020)
+        num_atoms = 10
+        x0 = np.random.rand(num_atoms, 3)*2.0
+
+        # force constants, phases and periods
+        params = np.array([2.3, 5.4, 9.0, 0.7, 0.0, 3.0, 5.8, 1.2, 1.0, 2.0, 3.0, 6.0])
+
+        quads = np.stack([np.arange(num_atoms - 3), np.arange(1, num_atoms - 2), np.arange(2, num_atoms - 1), np.arange(3, num_atoms)], axis=-1)
+        torsion_idxs = []
+        param_idxs = []
+        for quad in quads:
+            # between one and four terms per torsion
+            for k_idx in np.random.permutation(4)[:np.random.randint(1, 5)]:
+                torsion_idxs.append(quad)
+                param_idxs.append([k_idx, np.random.randint(4, 8), np.random.randint(8, 12)])
+        # interleave the terms of different torsions
+        order = np.random.permutation(len(torsion_idxs))
+        torsion_idxs = np.array(torsion_idxs, dtype=np.int32)[order]
+        param_idxs = np.array(param_idxs, dtype=np.int32)[order]
+
+        grouped_torsion_idxs, grouped_param_idxs = bonded.group_torsions(torsion_idxs, param_idxs)
+        assert grouped_torsion_idxs.shape == (len(quads), 4)
+        assert grouped_param_idxs.shape[:2] == (len(quads), 4)
+        assert np.sum(np.all(grouped_param_idxs >= 0, axis=-1)) == len(torsion_idxs)
+
+        ref_fn = functools.partial(bonded.periodic_torsion, box=None, torsion_idxs=torsion_idxs, param_idxs=param_idxs)
+        test_fn = functools.partial(bonded.grouped_periodic_torsion, box=None,
+            torsion_idxs=grouped_torsion_idxs, param_idxs=grouped_param_idxs)
+
+        for conf in [x0, x0*0.5]:
+            np.testing.assert_allclose(test_fn(conf, params), ref_fn(conf, params), rtol=1e-10)
+
+            ref_grads = jax.grad(ref_fn, argnums=(0, 1))(conf, params)
+            test_grads = jax.grad(test_fn, argnums=(0, 1))(conf, params)
+            for r, t in zip(ref_grads, test_grads):
+                np.testing.assert_allclose(t, r, rtol=1e-9, atol=1e-9)
+
+            ref_hess = jax.hessian(ref_fn, argnums=(0, 1))(conf, params)
+            test_hess = jax.hessian(test_fn, argnums=(0, 1))(conf, params)
+            for r, t in zip(jax.tree_util.tree_leaves(ref_hess), jax.tree_util.tree_leaves(test_hess)):
+                np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+        # periods outside of the recurrence are evaluated directly rather than rounded or clipped
+        assert np.any(param_idxs[:, 2] == 11)
+        for bad_period in [2.5, 9.0]:
+            bad_params = params.copy()
+            bad_params[11] = bad_period
+            for conf in [x0, x0*0.5]:
+                np.testing.assert_allclose(test_fn(conf, bad_params), ref_fn(conf, bad_params), rtol=1e-10)
+                ref_grads = jax.grad(ref_fn, argnums=(0, 1))(conf, bad_params)
+                test_grads = jax.grad(test_fn, argnums=(0, 1))(conf, bad_params)
+                for r, t in zip(ref_grads, test_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-9, atol=1e-9)
+
+
+class TestBondedTerms(unittest.TestCase):
+
+    def test_bonded_terms(self):
+        """
+        Test that the fused bonded potential agrees with the sum of the individual terms.
+        """
+        np.random.seed(2020)
+        num_atoms = 12
+        x0 = np.random.rand(num_atoms, 3)*2.0
+
+        params = np.array([
+            100.0, 0.15, 0.12, # bond constant and lengths
+            75.0, 1.91, 2.05,  # angle constant and ideal angles
+            2.3, 5.4, 0.0, 3.0, 1.0, 2.0 # torsion constants, phases and periods
+        ], dtype=np.float64)
+
+        bond_idxs = np.stack([np.arange(num_atoms - 1), np.arange(1, num_atoms)], axis=-1)
+        bond_param_idxs = np.stack([np.zeros(num_atoms - 1), np.random.randint(1, 3, size=num_atoms - 1)], axis=-1).astype(np.int32)
+        angle_idxs = np.stack([np.arange(num_atoms - 2), np.arange(1, num_atoms - 1), np.arange(2, num_atoms)], axis=-1)
+        angle_param_idxs = np.stack([np.zeros(num_atoms - 2) + 3, np.random.randint(4, 6, size=num_atoms - 2)], axis=-1).astype(np.int32)
+        torsion_idxs = np.stack([np.arange(num_atoms - 3), np.arange(1, num_atoms - 2), np.arange(2, num_atoms - 1), np.arange(3, num_atoms)], axis=-1)
+        torsion_param_idxs = np.array([[6, 8, 10], [7, 9, 11]])[np.random.randint(0, 2, size=num_atoms - 3)]
+
+        box = np.eye(3)*3.0
+
+        for b in [None, box]:
+            for cos_angles in [True, False]:
+
+                bond_fn = functools.partial(bonded.harmonic_bond, box=b, bond_idxs=bond_idxs, param_idxs=bond_param_idxs)
+                angle_fn = functools.partial(bonded.harmonic_angle, box=b, angle_idxs=angle_idxs, param_idxs=angle_param_idxs, cos_angles=cos_angles)
+                torsion_fn = functools.partial(bonded.periodic_torsion, box=b, torsion_idxs=torsion_idxs, param_idxs=torsion_param_idxs)
+
+                def ref_fn(conf, params):
+                    return bond_fn(conf, params) + angle_fn(conf, params) + torsion_fn(conf, params)
+
+                test_fn = functools.partial(bonded.bonded_terms,
+                    box=b,
+                    bond_idxs=bond_idxs,
+                    bond_param_idxs=bond_param_idxs,
+                    angle_idxs=angle_idxs,
+                    angle_param_idxs=angle_param_idxs,
+                    torsion_idxs=torsion_idxs,
+                    torsion_param_idxs=torsion_param_idxs,
+                    cos_angles=cos_angles)
+
+                np.testing.assert_allclose(test_fn(x0, params), ref_fn(x0, params), rtol=1e-10)
+
+                ref_grads = jax.grad(ref_fn, argnums=(0, 1))(x0, params)
+                test_grads = jax.grad(test_fn, argnums=(0, 1))(x0, params)
+                for r, t in zip(ref_grads, test_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-10, atol=1e-10)
+
+                check_grads(test_fn, (x0, params), order=1, eps=1e-5)
+
+        # terms may be absent altogether
+        test_fn = functools.partial(bonded.bonded_terms,
+            box=None,
+            bond_idxs=bond_idxs,
+            bond_param_idxs=bond_param_idxs,
+            angle_idxs=np.zeros((0, 3), dtype=np.int32),
+            angle_param_idxs=np.zeros((0, 2), dtype=np.int32),
+            torsion_idxs=np.zeros((0, 4), dtype=np.int32),
+            torsion_param_idxs=np.zeros((0, 3), dtype=np.int32))
+
+        np.testing.assert_allclose(
+            test_fn(x0, params),
+            bonded.harmonic_bond(x0, params, None, bond_idxs, bond_param_idxs),
+            rtol=1e-10)
+
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -0,0 +1,102 @@
+import unittest
+import numpy as np
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+
+from timemachine.constants import ONE_4PI_EPS0
+from timemachine.potentials import nonbonded, ewald_tuning
+
+
+class TestEwaldPlan(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2020)
+        self.num_atoms = 100
+        self.box = np.eye(3)*2.2
+        self.conf = np.random.rand(self.num_atoms, 3)*2.2
+        charges = np.random.rand(self.num_atoms) - 0.5
+        self.charges = charges - np.mean(charges)
+
+        self.param_idxs = np.arange(self.num_atoms)
+        self.exclusion_idxs = np.zeros((0, 2), dtype=np.int32)
+        self.exclusion_scales = np.zeros((0,), dtype=np.float64)
+        self.pair_idxs = np.stack(np.triu_indices(self.num_atoms, k=1), axis=-1)
+
+    def rms_force_error(self, kwargs, ref_kwargs):
+        def force_fn(kwargs):
+            energy_fn = lambda conf: nonbonded.electrostatics(conf, self.charges, self.box, self.param_idxs,
+                self.exclusion_idxs, self.exclusion_scales, pair_idxs=self.pair_idxs, **kwargs)
+            return jax.grad(energy_fn)(self.conf)
+
+        df = force_fn(kwargs) - force_fn(ref_kwargs)
+        return np.sqrt(np.mean(np.sum(df*df, axis=-1)))/ONE_4PI_EPS0
+
+    def test_error_estimates(self):
+        q2 = np.sum(self.charges**2)
+        box_lengths = np.diag(self.box)
+        volume = np.prod(box_lengths)
+
+        real_errors = [ewald_tuning.real_space_error(q2, self.num_atoms, rc, 3.0, volume) for rc in [0.6, 0.8, 1.0]]
+        self.assertTrue(np.all(np.diff(real_errors) < 0))
+
+        recip_errors = [ewald_tuning.reciprocal_space_error(q2, self.num_atoms, 3.0, box_lengths, k) for k in [2, 4, 8]]
+        self.assertTrue(np.all(np.diff(recip_errors) < 0))
+        self.assertEqual(ewald_tuning.reciprocal_space_error(q2, self.num_atoms, 3.0, box_lengths, 1), np.inf)
+
+        pme_errors = [ewald_tuning.pme_error(q2, self.num_atoms, 3.0, box_lengths, (k, k, k), 5) for k in [8, 16, 32]]
+        self.assertTrue(np.all(np.diff(pme_errors) < 0))
+
+    def test_ewald_plan(self):
+        ref_kwargs = dict(cutoff=1.1, alpha=3.5, kmax=14)
+        for tolerance in [1e-2, 1e-3]:
+            plan = ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, tolerance)
+            self.assertIsNotNone(plan.kmax)
+            self.assertLessEqual(plan.error, tolerance)
+            self.assertLessEqual(plan.cutoff, 1.1)
+            self.assertLess(self.rms_force_error(plan.electrostatics_kwargs(), ref_kwargs), 2*tolerance)
+
+        # tighter tolerances cost more
+        loose = ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, 1e-2)
+        tight = ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, 1e-5)
+        self.assertGreater(tight.cost, loose.cost)
+
+        with self.assertRaises(ValueError):
+            ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, 1e-12, max_kmax=3)
+
+    def test_pme_plan(self):
+        ref_kwargs = dict(cutoff=1.1, alpha=3.5, kmax=14)
+        tolerance = 1e-3
+        plan = ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, tolerance, method="pme")
+        self.assertIsNone(plan.kmax)
+        self.assertLessEqual(plan.error, tolerance)
+        _, grid_size = nonbonded.ewald_parameters(self.box, **plan.electrostatics_kwargs())
+        self.assertEqual(grid_size, plan.grid_size)
+        self.assertLess(self.rms_force_error(plan.electrostatics_kwargs(), ref_kwargs), 5*tolerance)
+
+        # there are only error estimates for orders 2 to 7
+        for pme_order in [1, 8]:
+            with self.assertRaises(ValueError):
+                ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, tolerance, method="pme", pme_order=pme_order)
+
+    def test_cutoffs(self):
+        with self.assertRaises(ValueError):
+            ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, 1e-3, cutoffs=[0.8, 1.2])
+
+        # in a skewed box the cutoff sphere holds more than the volume's worth of atoms,
+        # but the real space cost never exceeds that of every pair
+        box = np.array([[2.2, 0.0, 0.0], [2.1, 0.5, 0.0], [0.0, 0.0, 2.2]])
+        plan = ewald_tuning.ewald_plan(box, self.num_atoms, self.charges, 1e-3, cutoffs=[1.0])
+        num_kvecs = ((2*plan.kmax - 1)**3 - 1)//2
+        real_cost = plan.cost - ewald_tuning.KVEC_COST*self.num_atoms*num_kvecs
+        self.assertLessEqual(real_cost, ewald_tuning.PAIR_COST*self.num_atoms*(self.num_atoms - 1)/2)
+
+    def test_profile(self):
+        plan = ewald_tuning.ewald_plan(self.box, self.num_atoms, self.charges, 1e-3)
+        report = plan.profile(self.conf, self.box, self.charges, num_repeats=2)
+        self.assertEqual(report['error'], plan.error)
+        self.assertGreater(report['wall_time'], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,15 +3,17 @@ import numpy as np
 
 import functools
 from jax.config import config; config.update("jax_enable_x64", True)
+import jax
 from jax.test_util import check_grads
 
-from timemachine.potentials import implicit
+from timemachine.potentials import implicit, neighborlist
 from tests.invariances import assert_potential_invariance
 
 class TestGBSA(unittest.TestCase):
 
     def test_gbsa(self):
         """ Testing the GBSA OBC model. """
+        np.random.seed(2020)
         conf = np.array([
             [ 0.0637,   0.0126,   0.2203],
             [ 1.0573,  -0.2011,   1.2864],
@@ -41,5 +43,173 @@ class TestGBSA(unittest.TestCase):
 
         assert_potential_invariance(energy_fn, conf, params)
 
+    def test_gbsa_tiled(self):
+        np.random.seed(2021)
+        num_atoms = 13
+        conf = np.random.rand(num_atoms, 3)*1.5
+
+        params = np.array([
+            .1984, .115, .85, # H
+            -0.0221, .19, .72  # C
+        ])
+        param_idxs = np.array([[0, 1, 2], [3, 4, 5]])[np.random.randint(2, size=num_atoms)]
+
+        ref_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs)
+        ref_nrg = ref_fn(conf, params)
+
+        # reference sum over i <= j, with halved self energies
+        charges = params[param_idxs[:, 0]]
+        br = implicit.born_radii(conf, params[param_idxs[:, 1]], params[param_idxs[:, 2]], 0.009, 1.0, 0.8, 4.85)
+        prefactor = 2.0*-69.467728*(1.0 - 1.0/78.3)
+        gpol = 0
+        for i in range(num_atoms):
+            for j in range(i, num_atoms):
+                r2 = np.sum((conf[i] - conf[j])**2)
+                a2 = br[i]*br[j]
+                nrg = prefactor*charges[i]*charges[j]/np.sqrt(r2 + a2*np.exp(-r2/(4*a2)))
+                gpol += nrg/2 if i == j else nrg
+        nonpolar = implicit.non_polar_ace(br, params[param_idxs[:, 1]], 0.14, 4*np.pi*2.25936)
+        np.testing.assert_allclose(ref_nrg, gpol + nonpolar, rtol=1e-10)
+
+        for tile_size in [4, 8, 32]:
+            test_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, tile_size=tile_size)
+            np.testing.assert_allclose(test_fn(conf, params), ref_nrg, rtol=1e-10)
+
+            test_br = implicit.born_radii(conf, params[param_idxs[:, 1]], params[param_idxs[:, 2]],
+                0.009, 1.0, 0.8, 4.85, tile_size=tile_size)
+            np.testing.assert_allclose(test_br, br, rtol=1e-10)
+
+        # the dense path has singular derivatives along the diagonal, so only
+        # the tiled path is checked
+        check_grads(test_fn, (conf, params), order=2, eps=1e-5)
+        self.assertTrue(np.all(np.isfinite(jax.hessian(test_fn)(conf, params))))
+
+    def test_gbsa_cutoff(self):
+        np.random.seed(2022)
+        num_atoms = 40
+        conf = np.random.rand(num_atoms, 3)*3.0
+        cutoff = 1.2
+
+        params = np.array([
+            .1984, .115, .85, # H
+            -0.0221, .19, .72  # C
+        ])
+        param_idxs = np.array([[0, 1, 2], [3, 4, 5]])[np.random.randint(2, size=num_atoms)]
+        charges = params[param_idxs[:, 0]]
+        atomic_radii = params[param_idxs[:, 1]]
+        scale_factors = params[param_idxs[:, 2]]
+
+        # reference that only descreens and interacts atoms within the cutoff
+        oR = atomic_radii - 0.009
+        sR = oR*scale_factors
+        dij = np.linalg.norm(np.expand_dims(conf, 0) - np.expand_dims(conf, 1), axis=-1)
+        keep = np.logical_and(dij < cutoff, np.logical_not(np.eye(num_atoms, dtype=bool)))
+        safe_dij = np.where(keep, dij, 1.0)
+        terms = implicit.descreening_term(safe_dij, 1/safe_dij, np.expand_dims(oR, 1), np.expand_dims(sR, 0), keep)
+        psi = 0.5*oR*np.sum(terms, axis=-1)
+        ref_br = 1/(1/oR - np.tanh(psi - 0.8*psi**2 + 4.85*psi**3)/atomic_radii)
+
+        prefactor = 2.0*-69.467728*(1.0 - 1.0/78.3)
+        gpol = 0
+        for i in range(num_atoms):
+            for j in range(i, num_atoms):
+                if i != j and dij[i, j] >= cutoff:
+                    continue
+                r2 = dij[i, j]**2
+                a2 = ref_br[i]*ref_br[j]
+                nrg = prefactor*charges[i]*charges[j]/np.sqrt(r2 + a2*np.exp(-r2/(4*a2)))
+                gpol += nrg/2 if i == j else nrg
+        nonpolar = implicit.non_polar_ace(ref_br, atomic_radii, 0.14, 4*np.pi*2.25936)
+        ref_nrg = gpol + nonpolar
+
+        ref_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff)
+        np.testing.assert_allclose(ref_fn(conf, params), ref_nrg, rtol=1e-10)
+        np.testing.assert_allclose(
+            implicit.born_radii(conf, atomic_radii, scale_factors, 0.009, 1.0, 0.8, 4.85, cutoff=cutoff),
+            ref_br,
+            rtol=1e-10)
+
+        # the cutoff does change the energy
+        assert np.abs(implicit.gbsa(conf, params, None, param_idxs) - ref_nrg) > 1e-3
+
+        tiled_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff, tile_size=16)
+        np.testing.assert_allclose(tiled_fn(conf, params), ref_nrg, rtol=1e-10)
+
+        nblist = neighborlist.NeighborList(cutoff=cutoff, skin=0.2)
+        pair_idxs = nblist.update(conf)
+        assert nblist.num_pairs < num_atoms*(num_atoms - 1)//2
+        nblist_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff, pair_idxs=pair_idxs)
+        np.testing.assert_allclose(nblist_fn(conf, params), ref_nrg, rtol=1e-10)
+
+        ref_grads = jax.grad(tiled_fn, argnums=(0, 1))(conf, params)
+        test_grads = jax.grad(nblist_fn, argnums=(0, 1))(conf, params)
+        for r, t in zip(ref_grads, test_grads):
+            np.testing.assert_allclose(t, r, rtol=1e-9, atol=1e-9)
+
+        check_grads(nblist_fn, (conf, params), order=1, eps=1e-6)
+
+
+    def test_gbsa_custom_derivatives(self):
+        # the pair paths use hand written jvps, the tiled path is differentiated by jax
+        np.random.seed(2023)
+        num_atoms = 24
+        conf = np.random.rand(num_atoms, 3)*2.0
+
+        params = np.array([
+            .1984, .115, .85, # H
+            -0.0221, .19, .72  # C
+        ])
+        param_idxs = np.array([[0, 1, 2], [3, 4, 5]])[np.random.randint(2, size=num_atoms)]
+
+        for cutoff in [None, 1.2]:
+            ref_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff, tile_size=8)
+            test_fns = [functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff)]
+            if cutoff is not None:
+                pair_idxs = neighborlist.NeighborList(cutoff=cutoff, skin=0.1).update(conf)
+                test_fns.append(functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff, pair_idxs=pair_idxs))
+
+            for test_fn in test_fns:
+                for ref, test in [
+                    (jax.grad(ref_fn, argnums=(0, 1)), jax.grad(test_fn, argnums=(0, 1))),
+                    (jax.jacfwd(jax.grad(ref_fn, argnums=1), argnums=0), jax.jacfwd(jax.grad(test_fn, argnums=1), argnums=0)),
+                    (jax.hessian(ref_fn), jax.hessian(test_fn))]:
+                    for r, t in zip(jax.tree_util.tree_leaves(ref(conf, params)), jax.tree_util.tree_leaves(test(conf, params))):
+                        np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+    def test_gbsa_state(self):
+        np.random.seed(2024)
+        num_atoms = 60
+        conf = np.random.rand(num_atoms, 3)*3.0
+
+        params = np.array([
+            .1984, .115, .85, # H
+            -0.0221, .19, .72  # C
+        ])
+        param_idxs = np.array([[0, 1, 2], [3, 4, 5]])[np.random.randint(2, size=num_atoms)]
+
+        for cutoff in [None, 1.0]:
+            energy_fn = functools.partial(implicit.gbsa, box=None, param_idxs=param_idxs, cutoff=cutoff)
+            state = implicit.GBSAState(conf, params, param_idxs, cutoff=cutoff)
+            x = conf.copy()
+            np.testing.assert_allclose(state.energy, energy_fn(x, params), rtol=1e-10)
+
+            for step in range(10):
+                num_moved = np.random.randint(1, 5)
+                moved_idxs = np.random.choice(num_atoms, size=num_moved, replace=False)
+                moved_conf = x[moved_idxs] + np.random.randn(num_moved, 3)*0.1
+                x_new = x.copy()
+                x_new[moved_idxs] = moved_conf
+
+                delta = state.propose(moved_idxs, moved_conf)
+                np.testing.assert_allclose(delta, energy_fn(x_new, params) - energy_fn(x, params), rtol=1e-7, atol=1e-9)
+
+                if step % 2 == 0:
+                    state.accept()
+                    x = x_new
+
+            np.testing.assert_allclose(state.energy, energy_fn(x, params), rtol=1e-10)
+            ref_br = implicit.born_radii(x, params[param_idxs[:, 1]], params[param_idxs[:, 2]], 0.009, 1.0, 0.8, 4.85, cutoff=cutoff)
+            np.testing.assert_allclose(state.born_radii, ref_br, rtol=1e-10)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
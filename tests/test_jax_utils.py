@@ -112,5 +112,25 @@ class TestJaxUtils(unittest.TestCase):
                 expected = reference_periodic_distance(conf[i], conf[j], box)
                 np.testing.assert_array_almost_equal(dij[i][j], expected)
 
+    def test_upper_triangle_pairs(self):
+        num_atoms = 7
+        pair_idxs = jax_utils.upper_triangle_pair_idxs(num_atoms)
+        src_idxs, dst_idxs = np.triu_indices(num_atoms, k=1)
+        np.testing.assert_array_equal(pair_idxs[:, 0], src_idxs)
+        np.testing.assert_array_equal(pair_idxs[:, 1], dst_idxs)
+
+        # cached per topology
+        assert jax_utils.upper_triangle_pair_idxs(num_atoms) is pair_idxs
+        assert not pair_idxs.flags.writeable
+
+        exclusion_idxs = np.array([[0, 1], [4, 2], [6, 5], [0, 6]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5, 0.2, 0.8333])
+        pair_scales = jax_utils.upper_triangle_pair_scales(num_atoms, exclusion_idxs, exclusion_scales)
+
+        ref_scales = np.ones((num_atoms, num_atoms))
+        ref_scales[exclusion_idxs[:, 0], exclusion_idxs[:, 1]] = exclusion_scales
+        ref_scales[exclusion_idxs[:, 1], exclusion_idxs[:, 0]] = exclusion_scales
+        np.testing.assert_allclose(pair_scales, ref_scales[src_idxs, dst_idxs], rtol=1e-6)
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
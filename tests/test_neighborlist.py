@@ -0,0 +1,123 @@
+import unittest
+import numpy as np
+import functools
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+from jax.test_util import check_grads
+
+from timemachine.potentials import nonbonded
+from timemachine.potentials import neighborlist
+
+
+def reference_pairs(conf, box, cutoff):
+    pairs = []
+    for i in range(conf.shape[0]):
+        for j in range(i+1, conf.shape[0]):
+            diff = conf[i] - conf[j]
+            if box is not None:
+                diff = neighborlist.minimum_image(diff, np.diag(box))
+            if np.linalg.norm(diff) < cutoff:
+                pairs.append([i, j])
+    return np.array(pairs, dtype=np.int32).reshape(-1, 2)
+
+
+class TestNeighborList(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2019)
+        self.box = np.diag([3.1, 2.7, 2.9]).astype(np.float64)
+        self.conf = np.random.rand(200, 3)*np.diag(self.box) - 0.5
+
+    def test_cell_list_pairs(self):
+        for box in [self.box, None]:
+            for cutoff in [0.4, 0.9, 1.3]:
+                test_pairs = neighborlist.cell_list_pairs(self.conf, box, cutoff)
+                ref_pairs = reference_pairs(self.conf, box, cutoff)
+                np.testing.assert_array_equal(test_pairs, ref_pairs)
+
+    def test_triclinic_box(self):
+        box = np.array([
+            [2.0, 0.0, 0.0],
+            [0.6, 1.6, 0.0],
+            [0.4, 0.7, 1.1]
+        ], dtype=np.float64)
+        with self.assertRaises(ValueError):
+            neighborlist.cell_list_pairs(self.conf, box, 0.5)
+
+    def test_skin(self):
+        nblist = neighborlist.NeighborList(cutoff=0.8, skin=0.2)
+        pair_idxs = nblist.update(self.conf, self.box)
+        self.assertEqual(nblist.num_builds, 1)
+        self.assertEqual(pair_idxs.shape, (nblist.capacity, 2))
+        np.testing.assert_array_equal(pair_idxs[nblist.num_pairs:], -1)
+
+        # small displacements keep the existing list
+        x1 = self.conf + 0.05
+        nblist.update(x1, self.box)
+        self.assertEqual(nblist.num_builds, 1)
+
+        # displacing one atom by more than half the skin triggers a rebuild
+        x2 = np.array(self.conf)
+        x2[17] += 0.11
+        nblist.update(x2, self.box)
+        self.assertEqual(nblist.num_builds, 2)
+
+    def test_lennard_jones(self):
+        num_atoms = self.conf.shape[0]
+        params = np.array([0.3, 0.25, 1.2, 0.4], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms, 2))
+        exclusion_idxs = np.array([[3, 4], [5, 9]], dtype=np.int32)
+        exclusion_scales = np.array([0.5, 0.0], dtype=np.float64)
+
+        cutoff = 0.9
+        nblist = neighborlist.NeighborList(cutoff=cutoff, skin=0.1)
+
+        for box in [self.box, None]:
+            pair_idxs = nblist.update(self.conf, box)
+
+            ref_fn = functools.partial(nonbonded.lennard_jones,
+                param_idxs=param_idxs,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
+                cutoff=cutoff)
+
+            test_fn = functools.partial(ref_fn, pair_idxs=pair_idxs)
+
+            np.testing.assert_allclose(test_fn(self.conf, params, box), ref_fn(self.conf, params, box), rtol=1e-10)
+
+            test_dp = jax.grad(test_fn, argnums=(1,))(self.conf, params, box)[0]
+            ref_dp = jax.grad(ref_fn, argnums=(1,))(self.conf, params, box)[0]
+            np.testing.assert_allclose(test_dp, ref_dp, rtol=1e-8)
+
+            check_grads(test_fn, (self.conf, params, box), order=1, eps=1e-5)
+
+    def test_electrostatics(self):
+        num_atoms = self.conf.shape[0]
+        params = np.array([0.3, -0.2, 0.1], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms,))
+        exclusion_idxs = np.array([[0, 1], [2, 7]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5], dtype=np.float64)
+
+        cutoff = 0.9
+        nblist = neighborlist.NeighborList(cutoff=cutoff, skin=0.1)
+
+        for box in [self.box, None]:
+            pair_idxs = nblist.update(self.conf, box)
+
+            ref_fn = functools.partial(nonbonded.electrostatics,
+                param_idxs=param_idxs,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
+                cutoff=cutoff,
+                alpha=2.0,
+                kmax=4)
+
+            test_fn = functools.partial(ref_fn, pair_idxs=pair_idxs)
+
+            np.testing.assert_allclose(test_fn(self.conf, params, box), ref_fn(self.conf, params, box), rtol=1e-10)
+            check_grads(test_fn, (self.conf, params, box), order=1, eps=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -7,14 +7,18 @@ import jax
 from jax.test_util import check_grads
 
 from tests.invariances import assert_potential_invariance
+from timemachine.constants import ONE_4PI_EPS0
 from timemachine.potentials import nonbonded
 
 class ReferenceLJEnergy():
 
-    def __init__(self, params, param_idxs, scale_matrix, cutoff=None):
+    def __init__(self, params, param_idxs, exclusion_idxs, exclusion_scales, cutoff=None):
         self.params = params
         self.param_idxs = param_idxs
-        self.scale_matrix = scale_matrix
+        self.scales = {}
+        for (i, j), s in zip(exclusion_idxs, exclusion_scales):
+            self.scales[(i, j)] = s
+            self.scales[(j, i)] = s
         self.cutoff = cutoff
 
     def energy(self, conf):
@@ -36,7 +40,7 @@ class ReferenceLJEnergy():
                 sig2 = sig/r
                 sig2 *= sig2
                 sig6 = sig2*sig2*sig2
-                eps = self.scale_matrix[i, j]*np.sqrt(eps_i * eps_j)
+                eps = self.scales.get((i, j), 1.0)*np.sqrt(eps_i * eps_j)
                 vdwEnergy = 4*eps*(sig6-1.0)*sig6
                 ref_nrg += vdwEnergy
 
@@ -56,16 +60,10 @@ class TestElectrostatics(unittest.TestCase):
 
         params = np.array([1.3, 0.3], dtype=np.float64)
         param_idxs = np.array([0, 1, 1, 1, 1], dtype=np.int32)
-        scale_matrix = np.array([
-            [  0,  1,  1,  1,0.5],
-            [  1,  0,  0,  1,  1],
-            [  1,  0,  0,  0,0.2],
-            [  1,  1,  0,  0,  1],
-            [0.5,  1,0.2,  1,  0],
-        ], dtype=np.float64)
+        exclusion_idxs = np.array([[0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.5, 0.0, 0.0, 0.2], dtype=np.float64)
 
         # warning: non net-neutral cell
-        # ref_nrg = nonbonded.electrostatic(param_idxs, scale_matrix)
 
         box = np.array([
             [2.0, 0.0, 0.0],
@@ -76,13 +74,142 @@ class TestElectrostatics(unittest.TestCase):
         energy_fn = functools.partial(
             nonbonded.electrostatics,
             param_idxs=param_idxs,
-            scale_matrix=scale_matrix,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
             cutoff=0.5,
             alpha=1.0,
             kmax=10)
 
         assert_potential_invariance(energy_fn, conf, params, box)
 
+    def test_nonperiodic_exclusions(self):
+        np.random.seed(2020)
+        num_atoms = 12
+        conf = np.random.rand(num_atoms, 3)*2
+        params = np.array([0.3, -0.5, 0.1], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms,))
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+
+        scales = np.ones((num_atoms, num_atoms))
+        scales[exclusion_idxs[:, 0], exclusion_idxs[:, 1]] = exclusion_scales
+        scales[exclusion_idxs[:, 1], exclusion_idxs[:, 0]] = exclusion_scales
+
+        for cutoff in [None, 1.0]:
+            ref_nrg = 0
+            for i in range(num_atoms):
+                for j in range(i+1, num_atoms):
+                    r = np.linalg.norm(conf[i] - conf[j])
+                    if cutoff is not None and r > cutoff:
+                        continue
+                    qi = params[param_idxs[i]]
+                    qj = params[param_idxs[j]]
+                    ref_nrg += scales[i, j]*ONE_4PI_EPS0*qi*qj/r
+
+            test_nrg = nonbonded.electrostatics(conf, params, None, param_idxs, exclusion_idxs, exclusion_scales, cutoff=cutoff)
+            np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+
+    def test_tiled_electrostatics(self):
+        np.random.seed(2021)
+        num_atoms = 23
+        conf = np.random.rand(num_atoms, 3)*2.5
+        params = np.array([0.3, -0.5, 0.1, 0.4], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms,))
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+        pair_idxs = np.stack(np.triu_indices(num_atoms, k=1), axis=-1)
+        box = np.eye(3)*2.5
+
+        kwargs_list = [
+            dict(box=None, cutoff=None),
+            dict(box=None, cutoff=1.0),
+            dict(box=box, cutoff=1.0, alpha=2.0, kmax=5)
+        ]
+
+        for kwargs in kwargs_list:
+            box_ = kwargs.pop('box')
+            ref_fn = lambda conf, params: nonbonded.electrostatics(conf, params, box_, param_idxs,
+                exclusion_idxs, exclusion_scales, pair_idxs=pair_idxs, **kwargs)
+            ref_nrg, ref_grads = jax.value_and_grad(ref_fn, argnums=(0, 1))(conf, params)
+            for tile_size in [4, 8, 64]:
+                test_fn = lambda conf, params: nonbonded.electrostatics(conf, params, box_, param_idxs,
+                    exclusion_idxs, exclusion_scales, tile_size=tile_size, **kwargs)
+                test_nrg, test_grads = jax.value_and_grad(test_fn, argnums=(0, 1))(conf, params)
+                np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+                for t, r in zip(test_grads, ref_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+            np.testing.assert_allclose(
+                jax.hessian(test_fn)(conf, params),
+                jax.hessian(ref_fn)(conf, params),
+                rtol=1e-8, atol=1e-8)
+
+    def test_reaction_field(self):
+        np.random.seed(2022)
+        num_atoms = 17
+        conf = np.random.rand(num_atoms, 3)*2.4
+        params = np.array([0.3, -0.5, 0.1, 0.4], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms,))
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+        pair_idxs = np.stack(np.triu_indices(num_atoms, k=1), axis=-1)
+        box = np.eye(3)*2.5
+        cutoff = 1.1
+        rf_dielectric = 78.5
+
+        charges = params[param_idxs]
+        scales = np.ones((num_atoms, num_atoms))
+        for (i, j), s in zip(exclusion_idxs, exclusion_scales):
+            scales[i, j] = scales[j, i] = s
+        k_rf = (rf_dielectric - 1)/((2*rf_dielectric + 1)*cutoff**3)
+        c_rf = 1/cutoff + k_rf*cutoff**2
+
+        for box_ in [None, box]:
+            ref_nrg = 0
+            for i in range(num_atoms):
+                for j in range(i+1, num_atoms):
+                    dx = conf[i] - conf[j]
+                    if box_ is not None:
+                        dx = dx - np.diag(box_)*np.floor(dx/np.diag(box_) + 0.5)
+                    dij = np.linalg.norm(dx)
+                    if dij < cutoff:
+                        ref_nrg += scales[i, j]*charges[i]*charges[j]*(1/dij + k_rf*dij*dij - c_rf)
+            ref_nrg *= ONE_4PI_EPS0
+
+            energy_fn = functools.partial(nonbonded.electrostatics,
+                param_idxs=param_idxs,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
+                cutoff=cutoff,
+                rf_dielectric=rf_dielectric)
+
+            for kwargs in [dict(), dict(pair_idxs=pair_idxs), dict(tile_size=8)]:
+                test_nrg = energy_fn(conf, params, box_, **kwargs)
+                np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+
+            check_grads(lambda conf, params: energy_fn(conf, params, box_), (conf, params), order=2, eps=1e-6)
+
+        # the energy and, for conducting boundaries, the force vanish at the cutoff
+        x0 = np.array([[0.0, 0.0, 0.0], [cutoff - 1e-8, 0.0, 0.0]])
+        for eps_rf in [78.5, np.inf]:
+            pair_fn = lambda x: nonbonded.electrostatics(x, params, None, np.array([1, 3]),
+                np.zeros((0, 2), dtype=np.int32), np.zeros(0), cutoff=cutoff, rf_dielectric=eps_rf)
+            np.testing.assert_allclose(pair_fn(x0), 0.0, atol=1e-6)
+        np.testing.assert_allclose(jax.grad(pair_fn)(x0), 0.0, atol=1e-6)
+
+        # the fused potential supports the same mode
+        all_params = np.concatenate([params, [0.3, 0.25, 1.2, 0.4]])
+        lj_param_idxs = np.random.randint(len(params), len(all_params), size=(num_atoms, 2))
+        lj_scales = np.zeros_like(exclusion_scales)
+        ref_nrg = energy_fn(conf, all_params, box) + nonbonded.lennard_jones(conf,
+            all_params, box, lj_param_idxs, exclusion_idxs, lj_scales, cutoff=cutoff, pair_idxs=pair_idxs)
+        fused_nrg = nonbonded.nonbonded(conf, all_params, box, lj_param_idxs, param_idxs, exclusion_idxs, lj_scales,
+            exclusion_scales, cutoff=cutoff, rf_dielectric=rf_dielectric, tile_size=8)
+        np.testing.assert_allclose(fused_nrg, ref_nrg, rtol=1e-10)
+
+        with self.assertRaises(ValueError):
+            energy_fn(conf, params, np.eye(3)*2.0)
+
 class TestLennardJones(unittest.TestCase):
 
     # def test_lj612_large(self):
@@ -208,13 +335,8 @@ class TestLennardJones(unittest.TestCase):
             [1, 2],
             [1, 2]], dtype=np.int32)
 
-        scale_matrix = np.array([
-            [  0,  0,  1,0.5,  0],
-            [  0,  0,  0,  1,  1],
-            [  1,  0,  0,  0,0.2],
-            [0.5,  1,  0,  0,  1],
-            [  0,  1,0.2,  1,  0],
-        ], dtype=np.float64)
+        exclusion_idxs = np.array([[0, 1], [0, 3], [0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5, 0.0, 0.0, 0.0, 0.2], dtype=np.float64)
 
         box = np.array([
             [2.0, 0.5, 0.6],
@@ -223,7 +345,8 @@ class TestLennardJones(unittest.TestCase):
         ], dtype=np.float64)
 
         energy_fn = functools.partial(nonbonded.lennard_jones,
-            scale_matrix=scale_matrix,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
             param_idxs=param_idxs,
             cutoff=None)
 
@@ -249,13 +372,8 @@ class TestLennardJones(unittest.TestCase):
             [1, 2],
             [1, 2]], dtype=np.int32)
 
-        scale_matrix = np.array([
-            [  0,  0,  1,0.5,  0],
-            [  0,  0,  0,  1,  1],
-            [  1,  0,  0,  0,0.2],
-            [0.5,  1,  0,  0,  1],
-            [  0,  1,0.2,  1,  0],
-        ], dtype=np.float64)
+        exclusion_idxs = np.array([[0, 1], [0, 3], [0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5, 0.0, 0.0, 0.0, 0.2], dtype=np.float64)
 
         box = np.array([
             [2.0, 0.5, 0.6],
@@ -264,12 +382,27 @@ class TestLennardJones(unittest.TestCase):
         ], dtype=np.float64)
 
         energy_fn = functools.partial(nonbonded.lennard_jones,
-            scale_matrix=scale_matrix,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
             param_idxs=param_idxs,
             cutoff=None)
 
         assert_potential_invariance(energy_fn, x0, params, box)
 
+    def test_lj612_exclusions(self):
+        np.random.seed(2020)
+        num_atoms = 12
+        x0 = np.random.rand(num_atoms, 3)*2
+        params = np.array([0.3, 0.25, 1.2, 0.4], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms, 2))
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+
+        for cutoff in [None, 1.0]:
+            ref = ReferenceLJEnergy(params, param_idxs, exclusion_idxs, exclusion_scales, cutoff=cutoff)
+            test_nrg = nonbonded.lennard_jones(x0, params, None, param_idxs, exclusion_idxs, exclusion_scales, cutoff=cutoff)
+            np.testing.assert_allclose(test_nrg, ref.energy(x0), rtol=1e-10)
+
         # check_grads(ref.energy, (x0, params), order=1)
         # check_grads(ref.energy, (x0, params), order=2)
 
@@ -277,6 +410,199 @@ class TestLennardJones(unittest.TestCase):
         # check_grads(ref.energy, (x0, params, box), order=1, eps=1e-5)
         # check_grads(ref.energy, (x0, params, box), order=2, eps=1e-7)
 
+    def test_lj612_tiled(self):
+        np.random.seed(2021)
+        num_atoms = 23
+        x0 = np.random.rand(num_atoms, 3)*2.5
+        params = np.array([0.3, 0.25, 1.2, 0.4], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms, 2))
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+        pair_idxs = np.stack(np.triu_indices(num_atoms, k=1), axis=-1)
+
+        for box, cutoff in [(None, None), (None, 1.0), (np.eye(3)*2.5, 1.0)]:
+            ref_fn = functools.partial(nonbonded.lennard_jones, box=box, param_idxs=param_idxs,
+                exclusion_idxs=exclusion_idxs, exclusion_scales=exclusion_scales, cutoff=cutoff,
+                pair_idxs=pair_idxs)
+            ref_nrg, ref_grads = jax.value_and_grad(ref_fn, argnums=(0, 1))(x0, params)
+            for tile_size in [5, 8, 64]:
+                test_fn = functools.partial(nonbonded.lennard_jones, box=box, param_idxs=param_idxs,
+                    exclusion_idxs=exclusion_idxs, exclusion_scales=exclusion_scales, cutoff=cutoff,
+                    tile_size=tile_size)
+                test_nrg, test_grads = jax.value_and_grad(test_fn, argnums=(0, 1))(x0, params)
+                np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+                for t, r in zip(test_grads, ref_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+            np.testing.assert_allclose(jax.hessian(test_fn)(x0, params), jax.hessian(ref_fn)(x0, params), rtol=1e-8, atol=1e-6)
+
+    def test_lj612_type_tables(self):
+        np.random.seed(2021)
+        num_atoms = 23
+        x0 = np.random.rand(num_atoms, 3)*2.5
+        params = np.array([0.3, 0.25, 0.35, 1.2, 0.4, 0.7], dtype=np.float64)
+        param_idxs = np.stack([np.random.randint(3, size=num_atoms), np.random.randint(3, 6, size=num_atoms)], axis=-1)
+        exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.0, 0.5, 0.8333, 0.0], dtype=np.float64)
+        pair_idxs = np.stack(np.triu_indices(num_atoms, k=1), axis=-1)
+
+        atom_types, sig_table, eps_table = nonbonded.lj_type_tables(params, param_idxs)
+        num_types = sig_table.shape[0]
+        assert num_types <= 9
+        assert atom_types.shape == (num_atoms,)
+        for i, j in pair_idxs:
+            sig_ij = (params[param_idxs[i, 0]] + params[param_idxs[j, 0]])/2
+            eps_ij = np.sqrt(params[param_idxs[i, 1]]*params[param_idxs[j, 1]])
+            np.testing.assert_allclose(sig_table[atom_types[i], atom_types[j]], sig_ij)
+            np.testing.assert_allclose(eps_table[atom_types[i], atom_types[j]], eps_ij)
+
+        for box, cutoff in [(None, None), (np.eye(3)*2.5, 1.0)]:
+            kwargs = dict(box=box, param_idxs=param_idxs, exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales, cutoff=cutoff)
+            ref_fn = functools.partial(nonbonded.lennard_jones, **kwargs)
+            ref_nrg, ref_grads = jax.value_and_grad(ref_fn, argnums=(0, 1))(x0, params)
+            for path_kwargs in [dict(), dict(pair_idxs=pair_idxs), dict(tile_size=8)]:
+                # the tables are rebuilt from params so that dE/dp flows through them
+                test_fn = lambda conf, params: nonbonded.lennard_jones(conf, params, **kwargs, **path_kwargs,
+                    type_tables=nonbonded.lj_type_tables(params, param_idxs))
+                test_nrg, test_grads = jax.value_and_grad(test_fn, argnums=(0, 1))(x0, params)
+                np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+                for t, r in zip(test_grads, ref_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+
+class TestNonbonded(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2022)
+        self.num_atoms = 19
+        self.conf = np.random.rand(self.num_atoms, 3)*2.5
+        # sig, eps, then charges
+        self.params = np.array([0.3, 0.25, 0.4, 1.2, 0.4, 0.3, -0.5, 0.1, 0.4], dtype=np.float64)
+        self.lj_param_idxs = np.random.randint(4, size=(self.num_atoms, 2))
+        self.charge_param_idxs = np.random.randint(4, 9, size=(self.num_atoms,))
+        self.exclusion_idxs = np.array([[0, 1], [1, 2], [0, 2], [5, 9], [11, 3]], dtype=np.int32)
+        self.lj_scales = np.array([0.0, 0.0, 0.5, 0.5, 0.0], dtype=np.float64)
+        self.es_scales = np.array([0.0, 0.0, 0.8333, 0.8333, 0.0], dtype=np.float64)
+
+    def reference_energy(self, conf, params, box, **kwargs):
+        # the pair list paths subtract the exclusions rather than scaling them in place
+        pair_idxs = np.stack(np.triu_indices(self.num_atoms, k=1), axis=-1)
+        lj_kwargs = dict(cutoff=kwargs.get('cutoff'))
+        lj_nrg = nonbonded.lennard_jones(conf, params, box, self.lj_param_idxs, self.exclusion_idxs,
+            self.lj_scales, pair_idxs=pair_idxs, **lj_kwargs)
+        es_nrg = nonbonded.electrostatics(conf, params, box, self.charge_param_idxs, self.exclusion_idxs,
+            self.es_scales, pair_idxs=pair_idxs, **kwargs)
+        return lj_nrg + es_nrg
+
+    def test_fused(self):
+        box = np.eye(3)*2.5
+        cases = [
+            (None, dict()),
+            (None, dict(cutoff=1.0)),
+            (box, dict(cutoff=1.0, alpha=2.0, kmax=5)),
+            (box, dict(cutoff=1.0, tolerance=1e-4))
+        ]
+
+        pair_idxs = np.stack(np.triu_indices(self.num_atoms, k=1), axis=-1)
+
+        for box, kwargs in cases:
+            ref_fn = lambda conf, params: self.reference_energy(conf, params, box, **kwargs)
+            ref_nrg, ref_grads = jax.value_and_grad(ref_fn, argnums=(0, 1))(self.conf, self.params)
+
+            for path_kwargs in [dict(), dict(pair_idxs=pair_idxs), dict(tile_size=8)]:
+                test_fn = lambda conf, params: nonbonded.nonbonded(conf, params, box,
+                    self.lj_param_idxs, self.charge_param_idxs, self.exclusion_idxs,
+                    self.lj_scales, self.es_scales, **kwargs, **path_kwargs)
+                test_nrg, test_grads = jax.value_and_grad(test_fn, argnums=(0, 1))(self.conf, self.params)
+                np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+                for t, r in zip(test_grads, ref_grads):
+                    np.testing.assert_allclose(t, r, rtol=1e-8, atol=1e-8)
+
+    def test_fused_derivatives(self):
+        box = np.eye(3)*2.5
+        for box, kwargs in [(None, dict()), (box, dict(cutoff=1.0, alpha=2.0, kmax=4))]:
+            energy_fn = lambda conf, params: nonbonded.nonbonded(conf, params, box,
+                self.lj_param_idxs, self.charge_param_idxs, self.exclusion_idxs,
+                self.lj_scales, self.es_scales, **kwargs)
+            check_grads(energy_fn, (self.conf, self.params), order=2, eps=1e-6, rtol=1e-4)
+
+
+class TestSoftcore(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(1)
+        self.num_atoms = 15
+        self.conf = np.random.rand(self.num_atoms, 3)*2.0
+        # sig, eps, then charges
+        self.params = np.array([0.3, 0.25, 1.2, 0.4, -0.5, 0.7, 0.2], dtype=np.float64)
+        self.lj_param_idxs = np.random.randint(4, size=(self.num_atoms, 2))
+        self.charge_param_idxs = np.random.randint(4, 7, size=(self.num_atoms,))
+        self.exclusion_idxs = np.array([[0, 1], [2, 5], [3, 11], [10, 12]], dtype=np.int32)
+        self.lj_scales = np.array([0.0, 0.5, 0.2, 0.0], dtype=np.float64)
+        self.es_scales = np.array([0.0, 0.3, 0.8, 0.5], dtype=np.float64)
+        self.alchemical_flags = np.arange(self.num_atoms) >= 10
+        self.lambdas = np.array([0.0, 0.3, 0.7, 1.0])
+
+    def softcore_energy(self, conf, params, lambdas, **kwargs):
+        return nonbonded.softcore_nonbonded(conf, params, None, self.lj_param_idxs, self.charge_param_idxs,
+            self.exclusion_idxs, self.lj_scales, self.es_scales, lambdas, self.alchemical_flags, **kwargs)
+
+    def reference_energy(self, atom_idxs):
+        # plain lennard jones and electrostatics of a subset of the atoms
+        remap = {a: b for b, a in enumerate(atom_idxs)}
+        kept = [k for k, (i, j) in enumerate(self.exclusion_idxs) if i in remap and j in remap]
+        exclusion_idxs = np.array([[remap[i], remap[j]] for i, j in self.exclusion_idxs[kept]], dtype=np.int32).reshape(-1, 2)
+        pair_idxs = np.stack(np.triu_indices(len(atom_idxs), k=1), axis=-1)
+        conf = self.conf[atom_idxs]
+        lj_nrg = nonbonded.lennard_jones(conf, self.params, None, self.lj_param_idxs[atom_idxs], exclusion_idxs,
+            self.lj_scales[kept], pair_idxs=pair_idxs)
+        es_nrg = nonbonded.electrostatics(conf, self.params, None, self.charge_param_idxs[atom_idxs], exclusion_idxs,
+            self.es_scales[kept], pair_idxs=pair_idxs)
+        return lj_nrg + es_nrg
+
+    def test_end_states(self):
+        energies = self.softcore_energy(self.conf, self.params, self.lambdas)
+        assert energies.shape == self.lambdas.shape
+
+        # fully coupled at lambda=0
+        ref_coupled = self.reference_energy(np.arange(self.num_atoms))
+        np.testing.assert_allclose(energies[0], ref_coupled, rtol=1e-10)
+
+        # the alchemical atoms no longer see the rest of the system at lambda=1
+        host_idxs = np.where(~self.alchemical_flags)[0]
+        guest_idxs = np.where(self.alchemical_flags)[0]
+        ref_decoupled = self.reference_energy(host_idxs) + self.reference_energy(guest_idxs)
+        np.testing.assert_allclose(energies[-1], ref_decoupled, rtol=1e-10)
+
+    def test_vectorized_lambdas(self):
+        energies = self.softcore_energy(self.conf, self.params, self.lambdas)
+        for lamb, nrg in zip(self.lambdas, energies):
+            np.testing.assert_allclose(self.softcore_energy(self.conf, self.params, lamb), nrg, rtol=1e-10)
+
+        # the separate potentials sum to the fused one
+        lj_nrg = nonbonded.softcore_lennard_jones(self.conf, self.params, None, self.lj_param_idxs,
+            self.exclusion_idxs, self.lj_scales, self.lambdas, self.alchemical_flags)
+        es_nrg = nonbonded.softcore_electrostatics(self.conf, self.params, None, self.charge_param_idxs,
+            self.exclusion_idxs, self.es_scales, self.lambdas, self.alchemical_flags)
+        np.testing.assert_allclose(lj_nrg + es_nrg, energies, rtol=1e-10)
+
+    def test_softcore_derivatives(self):
+        energy_fn = lambda conf, params: self.softcore_energy(conf, params, self.lambdas)
+        check_grads(energy_fn, (self.conf, self.params), order=1, eps=1e-6)
+        lambda_fn = lambda lambdas: self.softcore_energy(self.conf, self.params, lambdas)
+        check_grads(lambda_fn, (self.lambdas,), order=1, eps=1e-6)
+
+    def test_periodic_requires_reaction_field(self):
+        box = np.eye(3)*3.0
+        with self.assertRaises(ValueError):
+            nonbonded.softcore_nonbonded(self.conf, self.params, box, self.lj_param_idxs, self.charge_param_idxs,
+                self.exclusion_idxs, self.lj_scales, self.es_scales, self.lambdas, self.alchemical_flags, cutoff=1.0)
+        energies = nonbonded.softcore_nonbonded(self.conf, self.params, box, self.lj_param_idxs, self.charge_param_idxs,
+            self.exclusion_idxs, self.lj_scales, self.es_scales, self.lambdas, self.alchemical_flags, cutoff=1.0,
+            rf_dielectric=78.5)
+        assert np.all(np.isfinite(energies))
+
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
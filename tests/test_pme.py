@@ -0,0 +1,209 @@
+import itertools
+import unittest
+import numpy as np
+import functools
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+from jax.test_util import check_grads
+
+from timemachine.constants import ONE_4PI_EPS0
+from timemachine.potentials import nonbonded, pme
+
+
+def reference_reciprocal_energy(conf, box, charges, alpha, kmax):
+    # direct structure factor sum over the full lattice, valid for triclinic boxes
+    recip = np.linalg.inv(box)
+    volume = np.abs(np.linalg.det(box))
+    energy = 0
+    for m in itertools.product(range(-kmax, kmax+1), repeat=3):
+        if m == (0, 0, 0):
+            continue
+        mv = np.matmul(recip, np.array(m))
+        m2 = np.sum(mv*mv)
+        Sm = np.sum(charges*np.exp(2j*np.pi*np.matmul(conf, mv)))
+        energy += np.exp(-np.pi*np.pi*m2/(alpha*alpha))/m2*np.abs(Sm)**2
+
+    return ONE_4PI_EPS0*energy/(2*np.pi*volume)
+
+
+def loop_reciprocal_energy(conf, box, charges, alpha, kmax):
+    # one pair of trig calls per lattice vector, orthorhombic boxes only
+    box_lengths = np.diag(box)
+    energy = 0
+    for mx in range(kmax):
+        for my in range(1-kmax, kmax):
+            for mz in range(1-kmax, kmax):
+                if mx == 0 and (my < 0 or (my == 0 and mz <= 0)):
+                    continue
+                k = 2*np.pi*np.array([mx, my, mz])/box_lengths
+                k2 = np.sum(k*k)
+                kr = np.matmul(conf, k)
+                Sk2 = np.sum(charges*np.cos(kr))**2 + np.sum(charges*np.sin(kr))**2
+                energy += np.exp(-k2/(4*alpha*alpha))/k2*Sk2
+
+    return ONE_4PI_EPS0*4*np.pi*energy/np.prod(box_lengths)
+
+
+class TestPME(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2020)
+        self.num_atoms = 12
+        self.conf = np.random.rand(self.num_atoms, 3)*2.0
+        charges = np.random.rand(self.num_atoms) - 0.5
+        self.charges = charges - np.mean(charges)
+
+    def test_bspline_weights(self):
+        w = np.random.rand(10)
+        for order in [2, 4, 5, 6]:
+            theta = pme.bspline_weights(w, order)
+            np.testing.assert_allclose(np.sum(theta, axis=-1), 1.0, rtol=1e-12)
+            self.assertTrue(np.all(np.asarray(theta) >= 0))
+
+        np.testing.assert_allclose(pme.bspline_weights(np.zeros(()), 4), [0, 1/6, 4/6, 1/6], atol=1e-12)
+
+    def test_orthorhombic(self):
+        box = np.eye(3)*2.2
+        alpha = 3.0
+        ref_nrg = nonbonded.reciprocal_energy(self.conf, box, self.charges, alpha, 12)
+        test_nrg = pme.reciprocal_energy(self.conf, box, self.charges, alpha, (40, 40, 40))
+        np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-6)
+
+        # coarse grids are less accurate
+        coarse_nrg = pme.reciprocal_energy(self.conf, box, self.charges, alpha, (16, 16, 16))
+        self.assertGreater(np.abs(coarse_nrg - ref_nrg), np.abs(test_nrg - ref_nrg))
+
+    def test_triclinic(self):
+        box = np.array([
+            [2.0, 0.0, 0.0],
+            [0.6, 1.9, 0.0],
+            [-0.4, 0.7, 2.1]
+        ], dtype=np.float64)
+        alpha = 2.5
+        ref_nrg = reference_reciprocal_energy(self.conf, box, self.charges, alpha, 10)
+        test_nrg = pme.reciprocal_energy(self.conf, box, self.charges, alpha, (40, 40, 40))
+        np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-6)
+
+    def test_derivatives(self):
+        box = np.eye(3)*2.2
+        alpha = 3.0
+
+        energy_fn = lambda conf, charges: pme.reciprocal_energy(conf, box, charges, alpha, (24, 24, 24))
+        check_grads(energy_fn, (self.conf, self.charges), order=1, eps=1e-5)
+
+        # forces and charge derivatives approach those of the direct sum
+        ref_fn = lambda conf, charges: nonbonded.reciprocal_energy(conf, box, charges, alpha, 12)
+        test_fn = lambda conf, charges: pme.reciprocal_energy(conf, box, charges, alpha, (40, 40, 40))
+        ref_dx, ref_dq = jax.grad(ref_fn, argnums=(0, 1))(self.conf, self.charges)
+        test_dx, test_dq = jax.grad(test_fn, argnums=(0, 1))(self.conf, self.charges)
+        np.testing.assert_allclose(test_dx, ref_dx, rtol=1e-3, atol=1e-3)
+        np.testing.assert_allclose(test_dq, ref_dq, rtol=1e-5)
+
+    def test_electrostatics(self):
+        box = np.eye(3)*2.2
+        params = self.charges
+        param_idxs = np.arange(self.num_atoms)
+        exclusion_idxs = np.array([[0, 1], [2, 5], [7, 3]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5, 0.0], dtype=np.float64)
+        cutoff = 1.0
+        tolerance = 1e-5
+        alpha = pme.alpha_from_tolerance(cutoff, tolerance)
+
+        energy_fn = functools.partial(nonbonded.electrostatics,
+            param_idxs=param_idxs,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
+            cutoff=cutoff)
+
+        ref_nrg = energy_fn(self.conf, params, box, alpha=alpha, kmax=14)
+
+        test_nrg = energy_fn(self.conf, params, box, tolerance=tolerance)
+        np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-4)
+
+        test_nrg = energy_fn(self.conf, params, box, alpha=alpha, grid_spacing=0.05)
+        np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-5)
+
+        # all pairs, avoids the singular diagonal of the dense direct space
+        pair_idxs = np.stack(np.triu_indices(self.num_atoms, k=1), axis=-1)
+        test_fn = functools.partial(energy_fn, tolerance=tolerance, pair_idxs=pair_idxs)
+        np.testing.assert_allclose(test_fn(self.conf, params, box), energy_fn(self.conf, params, box, tolerance=tolerance), rtol=1e-10)
+        check_grads(lambda conf, params: test_fn(conf, params, box), (self.conf, params), order=1, eps=1e-5)
+
+        # grid sizes determine array shapes, and cannot depend on a traced box
+        with self.assertRaises(Exception):
+            jax.jit(test_fn)(self.conf, params, box)
+
+
+class TestReciprocalPlan(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2021)
+        self.num_atoms = 10
+        self.conf = np.random.rand(self.num_atoms, 3)*2.0
+        charges = np.random.rand(self.num_atoms) - 0.5
+        self.charges = charges - np.mean(charges)
+
+    def test_half_space_lattice(self):
+        kmax = 4
+        lattice = nonbonded.half_space_lattice(kmax)
+        self.assertEqual(lattice.shape, (((2*kmax-1)**3 - 1)//2, 3))
+        vecs = set(map(tuple, lattice))
+        # no duplicates, no origin, and m and -m are never both present
+        self.assertEqual(len(vecs), lattice.shape[0])
+        self.assertNotIn((0, 0, 0), vecs)
+        for m in vecs:
+            self.assertNotIn(tuple(-x for x in m), vecs)
+
+    def test_orthorhombic(self):
+        box = np.diag([2.1, 2.3, 1.9])
+        for kmax in [1, 2, 5]:
+            ref_nrg = loop_reciprocal_energy(self.conf, box, self.charges, 3.0, kmax)
+            test_nrg = nonbonded.reciprocal_energy(self.conf, box, self.charges, 3.0, kmax)
+            np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+
+    def test_triclinic(self):
+        box = np.array([
+            [2.0, 0.0, 0.0],
+            [0.6, 1.9, 0.0],
+            [-0.4, 0.7, 2.1]
+        ], dtype=np.float64)
+        alpha = 2.5
+        ref_nrg = reference_reciprocal_energy(self.conf, box, self.charges, alpha, 6)
+        test_nrg = nonbonded.reciprocal_energy(self.conf, box, self.charges, alpha, 7)
+        np.testing.assert_allclose(test_nrg, ref_nrg, rtol=1e-10)
+
+    def test_plan_cache(self):
+        box = np.eye(3)*2.2
+        plan = nonbonded.get_reciprocal_plan(box, 3.0, 6)
+        self.assertIs(nonbonded.get_reciprocal_plan(box.copy(), 3.0, 6), plan)
+        self.assertIsNot(nonbonded.get_reciprocal_plan(box*1.01, 3.0, 6), plan)
+        self.assertIsNot(nonbonded.get_reciprocal_plan(box, 3.1, 6), plan)
+        self.assertIsNot(nonbonded.get_reciprocal_plan(box, 3.0, 7), plan)
+
+        # plans built while tracing a concrete box must not capture tracers
+        energy_fn = jax.jit(lambda conf, charges: nonbonded.reciprocal_energy(conf, box*1.1, charges, 3.0, 6))
+        ref_nrg = loop_reciprocal_energy(self.conf, box*1.1, self.charges, 3.0, 6)
+        np.testing.assert_allclose(energy_fn(self.conf, self.charges), ref_nrg, rtol=1e-10)
+        plan = nonbonded.get_reciprocal_plan(box*1.1, 3.0, 6)
+        np.testing.assert_allclose(plan.energy(self.conf, self.charges), ref_nrg, rtol=1e-10)
+
+    def test_derivatives(self):
+        box = np.array([
+            [2.0, 0.0, 0.0],
+            [0.6, 1.9, 0.0],
+            [-0.4, 0.7, 2.1]
+        ], dtype=np.float64)
+        alpha = 2.5
+
+        energy_fn = lambda conf, charges: nonbonded.reciprocal_energy(conf, box, charges, alpha, 5)
+        check_grads(energy_fn, (self.conf, self.charges), order=2, eps=1e-5)
+
+        # traced boxes bypass the cache
+        box_fn = lambda box: nonbonded.reciprocal_energy(self.conf, box, self.charges, alpha, 5)
+        check_grads(box_fn, (box,), order=1, eps=1e-5)
+        check_grads(jax.jit(box_fn), (box,), order=1, eps=1e-5)
+
+
+if __name__ == "__main__":
+    unittest.main()
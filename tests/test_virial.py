@@ -0,0 +1,98 @@
+import unittest
+import numpy as np
+import functools
+
+from jax.config import config; config.update("jax_enable_x64", True)
+import jax
+
+from timemachine.constants import AVOGADRO
+from timemachine.potentials import bonded, implicit, nonbonded, virial
+
+
+def finite_difference_virial(energy_fn, conf, params, box, eps=1e-6):
+    """
+    -dE/de of the strained system E(conf(I + e), box(I + e)) by central differences.
+    """
+    ref = np.zeros((3, 3))
+    for a in range(3):
+        for b in range(3):
+            strain = np.zeros((3, 3))
+            strain[a, b] = eps
+            energies = []
+            for sign in [1, -1]:
+                deform = np.eye(3) + sign*strain
+                strained_box = None if box is None else np.matmul(box, deform)
+                energies.append(energy_fn(np.matmul(conf, deform), params, strained_box))
+            ref[a, b] = -(energies[0] - energies[1])/(2*eps)
+    return ref
+
+
+class TestVirial(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(2020)
+        self.num_atoms = 40
+        self.box = np.diag([2.5, 2.6, 2.7])
+        self.conf = np.random.rand(self.num_atoms, 3)*np.diag(self.box)
+
+        self.params = np.array([0.2, 1.5, 0.3, -0.3, 100.0, 0.15], dtype=np.float64)
+        self.lj_param_idxs = np.stack([np.zeros(self.num_atoms), np.ones(self.num_atoms)], axis=-1).astype(np.int32)
+        self.charge_param_idxs = np.random.randint(2, 4, size=self.num_atoms).astype(np.int32)
+        self.bond_idxs = np.stack([np.arange(0, self.num_atoms, 2), np.arange(1, self.num_atoms, 2)], axis=-1).astype(np.int32)
+        self.bond_param_idxs = np.tile(np.array([[4, 5]], dtype=np.int32), (len(self.bond_idxs), 1))
+        self.exclusion_idxs = self.bond_idxs
+        self.scales = np.zeros(len(self.bond_idxs))
+
+    def energy_fns(self):
+        bond_fn = functools.partial(bonded.harmonic_bond, bond_idxs=self.bond_idxs, param_idxs=self.bond_param_idxs)
+        ewald_fn = lambda conf, params, box: nonbonded.nonbonded(conf, params, box, self.lj_param_idxs,
+            self.charge_param_idxs, self.exclusion_idxs, self.scales, self.scales, cutoff=1.0, alpha=2.0, kmax=5)
+        pme_fn = lambda conf, params, box: nonbonded.electrostatics(conf, params, box, self.charge_param_idxs,
+            self.exclusion_idxs, self.scales, cutoff=1.0, alpha=2.0, grid_spacing=0.12)
+        return [bond_fn, ewald_fn, pme_fn]
+
+    def test_periodic_virial(self):
+        for energy_fn in self.energy_fns():
+            E, dE_dx, test_virial = virial.derivatives_with_virial(energy_fn)(self.conf, self.params, self.box)
+            np.testing.assert_allclose(E, energy_fn(self.conf, self.params, self.box))
+            np.testing.assert_allclose(dE_dx, jax.grad(energy_fn)(self.conf, self.params, self.box))
+            ref_virial = finite_difference_virial(energy_fn, self.conf, self.params, self.box)
+            np.testing.assert_allclose(test_virial, ref_virial, rtol=1e-6, atol=1e-6)
+
+    def test_nonperiodic_virial(self):
+        param_idxs = np.array([[0, 1, 4], [3, 5, 4]])[np.random.randint(2, size=self.num_atoms)]
+        params = np.concatenate([self.params, [0.8]])
+        energy_fns = [
+            lambda conf, params, box: implicit.gbsa(conf, params, box, param_idxs),
+            functools.partial(bonded.harmonic_bond, bond_idxs=self.bond_idxs, param_idxs=self.bond_param_idxs)
+        ]
+        for energy_fn in energy_fns:
+            _, dE_dx, test_virial = virial.derivatives_with_virial(energy_fn)(self.conf, params, None)
+            np.testing.assert_allclose(test_virial, -np.matmul(self.conf.T, dE_dx))
+            ref_virial = finite_difference_virial(energy_fn, self.conf, params, None)
+            np.testing.assert_allclose(test_virial, ref_virial, rtol=1e-6, atol=1e-6)
+
+    def test_pressure(self):
+        masses = np.random.rand(self.num_atoms)*10 + 1
+        v = np.random.randn(self.num_atoms, 3)
+        volume = np.prod(np.diag(self.box))
+
+        # ideal gas, P = sum m v^2/(3V)
+        reporter = virial.PressureReporter(lambda conf, params, box: 0.0*np.sum(conf), self.params, masses)
+        ref_pressure = np.sum(masses*np.sum(v*v, axis=-1))/(3*volume)/(AVOGADRO*1e-25)
+        np.testing.assert_allclose(reporter.pressure(self.conf, v, self.box), ref_pressure)
+
+        # the virial part is -dE/dV under isotropic scaling of the coordinates and box
+        energy_fn = self.energy_fns()[1]
+        reporter = virial.PressureReporter(energy_fn, self.params, masses)
+        eps = 1e-6
+        energies = []
+        for sign in [1, -1]:
+            scale = np.power(1 + sign*eps, 1/3)
+            energies.append(energy_fn(self.conf*scale, self.params, self.box*scale))
+        ref_pressure = -(energies[0] - energies[1])/(2*eps*volume)/(AVOGADRO*1e-25)
+        np.testing.assert_allclose(reporter.pressure(self.conf, np.zeros_like(v), self.box), ref_pressure, rtol=1e-6)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -8,7 +8,11 @@ from simtk import openmm as mm
 from simtk import unit
 
 from timemachine.potentials import bonded, nonbonded
-from timemachine.lib import custom_ops
+try:
+    from timemachine.lib import custom_ops
+except ImportError:
+    # cpu only build, the host potentials share the names and arguments of the gpu ones
+    from timemachine.lib import custom_ops_cpu as custom_ops
 
 from jax.config import config; config.update("jax_enable_x64", True)
 import jax
@@ -161,7 +165,6 @@ def create_system(filepath):
         if isinstance(force, mm.NonbondedForce):
 
             num_atoms = force.getNumParticles()
-            scale_matrix = np.ones((num_atoms, num_atoms)) - np.eye(num_atoms)
 
             charge_param_idxs = []
             lj_param_idxs = []
@@ -186,24 +189,29 @@ def create_system(filepath):
                 charge_param_idxs.append(charge_idx)
                 lj_param_idxs.append([sig_idx, eps_idx])
 
+            exclusion_idxs = []
+
             for a_idx in range(force.getNumExceptions()):
 
                 src, dst, _, _, _ = force.getExceptionParameters(a_idx)
-                scale_matrix[src][dst] = 0
-                scale_matrix[dst][src] = 0
+                exclusion_idxs.append([src, dst])
 
             charge_param_idxs = np.array(charge_param_idxs, dtype=np.int32)
             lj_param_idxs = np.array(lj_param_idxs, dtype=np.int32)
+            exclusion_idxs = np.array(exclusion_idxs, dtype=np.int32).reshape(-1, 2)
+            exclusion_scales = np.zeros(exclusion_idxs.shape[0], dtype=np.float64)
 
             ref_lj = functools.partial(
                 nonbonded.lennard_jones,
-                scale_matrix=scale_matrix,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
                 param_idxs=lj_param_idxs,
                 box=None
             )
 
             test_lj = custom_ops.LennardJones_f64(
-                scale_matrix,
+                exclusion_idxs,
+                exclusion_scales,
                 lj_param_idxs
             )
 
@@ -212,13 +220,15 @@ def create_system(filepath):
 
             ref_es = functools.partial(
                 nonbonded.electrostatics,
-                scale_matrix=scale_matrix,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
                 param_idxs=charge_param_idxs,
                 box=None
             )
 
             test_es = custom_ops.Electrostatics_f64(
-                scale_matrix,
+                exclusion_idxs,
+                exclusion_scales,
                 charge_param_idxs,
             )
 
@@ -288,6 +298,13 @@ def test_energy(ref_e_fn, test_e_fn, coords, params):
         res4 = ref_d2E_dxdp_fn(coords, params)
 
     print("Reference timing:", type(ref_e_fn).__name__, (time.time()-start)/count)
+
+    dp_idxs = np.arange(len(params), dtype=np.int32)
+    start = time.time()
+    for _ in range(count):
+        test_e_fn.derivatives(batched_coords, params, dp_idxs)
+
+    print("Test timing:", type(test_e_fn).__name__, (time.time()-start)/count)
     print("----------")
 
 for ref_e_fn, test_e_fn in zip(all_ref, all_test):
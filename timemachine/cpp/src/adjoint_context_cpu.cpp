@@ -0,0 +1,276 @@
+#include <algorithm>
+#include <stdexcept>
+
+#include "adjoint_context_cpu.hpp"
+
+namespace {
+
+/*
+
+(s + r choose r), the number of steps that s checkpoints can reverse when every step
+is recomputed at most r times, saturating at cap.
+
+*/
+uint64_t binomial_steps(const int s, const int r, const uint64_t cap) {
+    uint64_t b = 1;
+    for(int k=1; k <= r; k++) {
+        // (s + k - 1 choose k - 1)*(s + k) is always divisible by k
+        b = b*(s + k)/k;
+        if(b >= cap) {
+            return cap;
+        }
+    }
+    return b;
+}
+
+}
+
+namespace timemachine {
+
+template<typename RealType>
+AdjointContextCpu<RealType>::AdjointContextCpu(
+    const std::vector<PotentialCpu<RealType>* > system,
+    const OptimizerCpu<RealType> *optimizer,
+    const RealType *h_params,
+    const RealType *h_x0,
+    const RealType *h_v0,
+    const int N,
+    const int P,
+    const int num_checkpoints) : system_(system),
+    optimizer_(optimizer),
+    h_params_(h_params, h_params + P),
+    N_(N),
+    P_(P),
+    num_checkpoints_(num_checkpoints),
+    h_no_gather_idxs_(P, -1),
+    h_dE_dx_(N*3, 0),
+    h_x_adjoint_(N*3, 0),
+    h_v_adjoint_(N*3, 0),
+    h_dE_dx_adjoint_(N*3, 0),
+    h_p_adjoint_(P, 0),
+    h_dL_dx_frames_(nullptr),
+    h_dL_dv_frames_(nullptr) {
+
+    if(num_checkpoints < 0) {
+        throw std::runtime_error("num_checkpoints must be non-negative");
+    }
+
+    initial_.x.assign(h_x0, h_x0 + N*3);
+    initial_.v.assign(h_v0, h_v0 + N*3);
+    initial_.noise_step = optimizer->noise_step();
+
+}
+
+template<typename RealType>
+void AdjointContextCpu<RealType>::advance(Checkpoint &state, const int num_steps) {
+
+    for(int t=0; t < num_steps; t++) {
+        std::fill(h_dE_dx_.begin(), h_dE_dx_.end(), 0);
+        for(auto nrg : system_) {
+            nrg->derivatives_host(
+                1,
+                N_,
+                P_,
+                state.x.data(),
+                h_params_.data(),
+                nullptr,
+                h_dE_dx_.data(),
+                nullptr,
+                0,
+                h_no_gather_idxs_.data(),
+                nullptr,
+                nullptr
+            );
+        }
+        optimizer_->set_noise_step(state.noise_step);
+        optimizer_->step(
+            N_,
+            0,
+            h_dE_dx_.data(),
+            nullptr,
+            nullptr,
+            state.x.data(),
+            state.v.data(),
+            nullptr,
+            nullptr
+        );
+        state.noise_step = optimizer_->noise_step();
+    }
+
+}
+
+template<typename RealType>
+void AdjointContextCpu<RealType>::add_frame_adjoints(const int step) {
+
+    for(int k : step_frames_[step]) {
+        for(int i=0; i < N_*3; i++) {
+            if(h_dL_dx_frames_) {
+                h_x_adjoint_[i] += h_dL_dx_frames_[k*N_*3 + i];
+            }
+            if(h_dL_dv_frames_) {
+                h_v_adjoint_[i] += h_dL_dv_frames_[k*N_*3 + i];
+            }
+        }
+    }
+
+}
+
+template<typename RealType>
+void AdjointContextCpu<RealType>::reverse_step(const Checkpoint &state, const int step) {
+
+    // the adjoints hold those of the state after step + 1 steps, the step is linear in
+    // the forces so only the coordinates it started from are needed
+    optimizer_->step_adjoint(
+        N_,
+        h_x_adjoint_.data(),
+        h_v_adjoint_.data(),
+        h_dE_dx_adjoint_.data()
+    );
+    for(auto nrg : system_) {
+        nrg->derivatives_vjp_host(
+            1,
+            N_,
+            P_,
+            state.x.data(),
+            h_params_.data(),
+            h_dE_dx_adjoint_.data(),
+            h_x_adjoint_.data(),
+            h_p_adjoint_.data()
+        );
+    }
+    add_frame_adjoints(step);
+
+}
+
+/*
+
+Reverse the steps [t0, t1) starting from the state after t0 steps, using at most
+num_checkpoints additional states. A checkpoint is advanced to t0 + m, the steps after
+it are reversed recursively with one checkpoint fewer, and the remaining m steps are
+then reversed from start again, where m splits the binomial reach between the two.
+
+*/
+template<typename RealType>
+void AdjointContextCpu<RealType>::reverse(
+    const Checkpoint &start,
+    const int t0,
+    int t1,
+    const int num_checkpoints) {
+
+    const int s = num_checkpoints;
+
+    while(t1 > t0) {
+
+        const int l = t1 - t0;
+
+        if(l == 1) {
+            reverse_step(start, t0);
+            return;
+        }
+
+        if(s == 0) {
+            // no space left, every step is recomputed from start
+            for(int t=t1-1; t >= t0; t--) {
+                Checkpoint state = start;
+                advance(state, t - t0);
+                reverse_step(state, t);
+            }
+            return;
+        }
+
+        int r = 0;
+        while(binomial_steps(s, r, l) < static_cast<uint64_t>(l)) {
+            r++;
+        }
+        // (s + r choose r) = (s + r - 1 choose r - 1) + (s - 1 + r choose r)
+        const int m = l - static_cast<int>(std::min(binomial_steps(s - 1, r, l), static_cast<uint64_t>(l - 1)));
+
+        {
+            Checkpoint mid = start;
+            advance(mid, m);
+            reverse(mid, t0 + m, t1, s - 1);
+        }
+
+        t1 = t0 + m;
+    }
+
+}
+
+template<typename RealType>
+void AdjointContextCpu<RealType>::forward(
+    const int num_steps,
+    const int num_frames,
+    const int *h_frame_idxs,
+    RealType *h_x_frames,
+    RealType *h_v_frames) {
+
+    std::vector<std::vector<int> > step_frames(num_steps + 1);
+    for(int k=0; k < num_frames; k++) {
+        if(h_frame_idxs[k] < 0 || h_frame_idxs[k] > num_steps) {
+            throw std::runtime_error("frame_idxs must be in [0, num_steps]");
+        }
+        step_frames[h_frame_idxs[k]].push_back(k);
+    }
+
+    Checkpoint state = initial_;
+    for(int t=0; t <= num_steps; t++) {
+        if(t > 0) {
+            advance(state, 1);
+        }
+        for(int k : step_frames[t]) {
+            if(h_x_frames) {
+                std::copy(state.x.begin(), state.x.end(), h_x_frames + k*N_*3);
+            }
+            if(h_v_frames) {
+                std::copy(state.v.begin(), state.v.end(), h_v_frames + k*N_*3);
+            }
+        }
+    }
+
+}
+
+template<typename RealType>
+void AdjointContextCpu<RealType>::backward(
+    const int num_steps,
+    const int num_frames,
+    const int *h_frame_idxs,
+    const RealType *h_dL_dx_frames,
+    const RealType *h_dL_dv_frames,
+    RealType *h_dL_dp,
+    RealType *h_dL_dx0,
+    RealType *h_dL_dv0) {
+
+    step_frames_.assign(num_steps + 1, std::vector<int>());
+    for(int k=0; k < num_frames; k++) {
+        if(h_frame_idxs[k] < 0 || h_frame_idxs[k] > num_steps) {
+            throw std::runtime_error("frame_idxs must be in [0, num_steps]");
+        }
+        step_frames_[h_frame_idxs[k]].push_back(k);
+    }
+    h_dL_dx_frames_ = h_dL_dx_frames;
+    h_dL_dv_frames_ = h_dL_dv_frames;
+
+    std::fill(h_x_adjoint_.begin(), h_x_adjoint_.end(), 0);
+    std::fill(h_v_adjoint_.begin(), h_v_adjoint_.end(), 0);
+    std::fill(h_p_adjoint_.begin(), h_p_adjoint_.end(), 0);
+
+    // replaying steps moves the noise counter, which is put back afterwards
+    const uint64_t noise_step = optimizer_->noise_step();
+
+    add_frame_adjoints(num_steps);
+    reverse(initial_, 0, num_steps, num_checkpoints_);
+
+    optimizer_->set_noise_step(noise_step);
+    h_dL_dx_frames_ = nullptr;
+    h_dL_dv_frames_ = nullptr;
+
+    std::copy(h_p_adjoint_.begin(), h_p_adjoint_.end(), h_dL_dp);
+    std::copy(h_x_adjoint_.begin(), h_x_adjoint_.end(), h_dL_dx0);
+    std::copy(h_v_adjoint_.begin(), h_v_adjoint_.end(), h_dL_dv0);
+
+}
+
+template class AdjointContextCpu<float>;
+template class AdjointContextCpu<double>;
+
+}
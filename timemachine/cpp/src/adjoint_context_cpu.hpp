@@ -0,0 +1,126 @@
+#pragma once
+
+#include <cstdint>
+#include <vector>
+
+#include "optimizer_cpu.hpp"
+#include "potential_cpu.hpp"
+
+namespace timemachine {
+
+/*
+
+Reverse mode counterpart of ContextCpu. Instead of carrying dx_dp and dv_dp forward,
+which costs O(N*DP) memory and a hessian product per parameter per step, the gradient
+of a scalar loss of the trajectory is propagated backwards through the steps, giving
+its derivatives w.r.t. all of the parameters, x0 and v0 at a cost that does not depend
+on the number of parameters.
+
+Each reversed step needs the coordinates it started from, the adjoints are pulled back
+through the optimizer with step_adjoint and through the forces with the potentials'
+derivatives_vjp_host. Rather than storing the trajectory, at most num_checkpoints states
+(x, v and the noise counter of the optimizer) are kept besides x0 and v0 and the steps
+in between are recomputed, with the checkpoints placed on the binomial schedule of
+Griewank's revolve: reversing T steps recomputes each step at most r times, for the
+smallest r with (num_checkpoints + r choose r) >= T. Restoring the noise counter makes
+every recomputed step identical to the original one.
+
+The trajectory starts from x0, v0 and the optimizer's noise counter at construction.
+As with ContextCpu, the potentials and the optimizer are not owned.
+
+*/
+template <typename RealType>
+class AdjointContextCpu {
+
+private:
+
+    struct Checkpoint {
+        std::vector<RealType> x;
+        std::vector<RealType> v;
+        uint64_t noise_step;
+    };
+
+    const std::vector<PotentialCpu<RealType>*> system_;
+    const OptimizerCpu<RealType> *optimizer_;
+
+    std::vector<RealType> h_params_; // these are really immutable
+    Checkpoint initial_;
+
+    int N_;
+    int P_;
+    int num_checkpoints_;
+
+    std::vector<int> h_no_gather_idxs_;
+    std::vector<RealType> h_dE_dx_;
+
+    // adjoints of the state being reversed and of the parameters
+    std::vector<RealType> h_x_adjoint_;
+    std::vector<RealType> h_v_adjoint_;
+    std::vector<RealType> h_dE_dx_adjoint_;
+    std::vector<RealType> h_p_adjoint_;
+
+    // gradients of the loss w.r.t. the frames, looked up by step during backward
+    std::vector<std::vector<int> > step_frames_;
+    const RealType *h_dL_dx_frames_;
+    const RealType *h_dL_dv_frames_;
+
+    void advance(Checkpoint &state, const int num_steps);
+
+    void add_frame_adjoints(const int step);
+
+    void reverse_step(const Checkpoint &state, const int step);
+
+    void reverse(const Checkpoint &start, const int t0, int t1, const int num_checkpoints);
+
+public:
+
+    AdjointContextCpu(
+        const std::vector<PotentialCpu<RealType>* > system,
+        const OptimizerCpu<RealType> *optimizer,
+        const RealType *h_params,
+        const RealType *h_x0,
+        const RealType *h_v0,
+        const int N,
+        const int P,
+        const int num_checkpoints);
+
+    int num_atoms() const { return N_; };
+
+    int num_params() const { return P_; };
+
+    int num_checkpoints() const { return num_checkpoints_; };
+
+    /*
+
+    Integrate num_steps from x0 and v0, writing the coordinates and velocities after
+    frame_idxs[k] steps into h_x_frames[k] and h_v_frames[k], either of which may be null.
+
+    */
+    void forward(
+        const int num_steps,
+        const int num_frames,
+        const int *h_frame_idxs,
+        RealType *h_x_frames,
+        RealType *h_v_frames);
+
+    /*
+
+    Back propagate the [K, N, 3] gradients of the loss w.r.t. the coordinates and the
+    velocities after frame_idxs[k] of num_steps steps, either of which may be null,
+    writing the gradients w.r.t. the parameters h_dL_dp: [P], h_dL_dx0 and h_dL_dv0.
+    The loss may also depend on the parameters directly, that part is left to the caller.
+
+    */
+    void backward(
+        const int num_steps,
+        const int num_frames,
+        const int *h_frame_idxs,
+        const RealType *h_dL_dx_frames,
+        const RealType *h_dL_dv_frames,
+        RealType *h_dL_dp,
+        RealType *h_dL_dx0,
+        RealType *h_dL_dv0);
+
+};
+
+}
@@ -0,0 +1,141 @@
+#include <algorithm>
+
+#include "context_cpu.hpp"
+
+namespace timemachine {
+
+template<typename RealType>
+ContextCpu<RealType>::ContextCpu(
+    const std::vector<PotentialCpu<RealType>* > system,
+    const OptimizerCpu<RealType> *optimizer,
+    const RealType *h_params,
+    const RealType *h_x0,
+    const RealType *h_v0,
+    const int N,
+    const int P,
+    const int *h_gather_param_idxs,
+    const int DP,
+    const bool hessian_free) : system_(system),
+    optimizer_(optimizer),
+    h_params_(h_params, h_params + P),
+    h_gather_param_idxs_(h_gather_param_idxs, h_gather_param_idxs + P),
+    h_x_t_(h_x0, h_x0 + N*3),
+    h_v_t_(h_v0, h_v0 + N*3),
+    h_dx_dp_t_(DP*N*3, 0),
+    h_dv_dp_t_(DP*N*3, 0),
+    h_E_(0),
+    h_dE_dx_(N*3, 0),
+    h_dE_dp_(DP, 0),
+    // the hessian is only needed to propagate dx_dp
+    h_d2E_dx2_(DP > 0 && !hessian_free ? N*N*3*3 : 0, 0),
+    h_d2E_dxdp_(DP*N*3, 0),
+    step_(0),
+    N_(N),
+    P_(P),
+    DP_(DP),
+    hessian_free_(hessian_free) {}
+
+template<typename RealType>
+void ContextCpu<RealType>::step() {
+
+    // reset force buffers
+    h_E_ = 0;
+    std::fill(h_dE_dx_.begin(), h_dE_dx_.end(), 0);
+    std::fill(h_dE_dp_.begin(), h_dE_dp_.end(), 0);
+    std::fill(h_d2E_dx2_.begin(), h_d2E_dx2_.end(), 0);
+    std::fill(h_d2E_dxdp_.begin(), h_d2E_dxdp_.end(), 0);
+
+    RealType *h_d2E_dx2 = DP_ > 0 && !hessian_free_ ? h_d2E_dx2_.data() : nullptr;
+    RealType *h_dE_dp = DP_ > 0 ? h_dE_dp_.data() : nullptr;
+    RealType *h_d2E_dxdp = DP_ > 0 ? h_d2E_dxdp_.data() : nullptr;
+
+    for(auto nrg : system_) {
+        if(hessian_free_ && DP_ > 0) {
+            // H.dx_dp is accumulated into d2E_dxdp alongside the mixed partials
+            nrg->derivatives_hvp_host(
+                1,
+                N_,
+                P_,
+                h_x_t_.data(),
+                h_params_.data(),
+                &h_E_,
+                h_dE_dx_.data(),
+                DP_,
+                h_gather_param_idxs_.data(),
+                h_dx_dp_t_.data(),
+                h_dE_dp,
+                h_d2E_dxdp,
+                h_d2E_dxdp
+            );
+        } else {
+            nrg->derivatives_host(
+                1, // one conformer when doing dynamics
+                N_,
+                P_,
+                h_x_t_.data(),
+                h_params_.data(),
+                &h_E_,
+                h_dE_dx_.data(),
+                h_d2E_dx2,
+                DP_,
+                h_gather_param_idxs_.data(),
+                h_dE_dp,
+                h_d2E_dxdp
+            );
+        }
+    }
+
+    optimizer_->step(
+        N_,
+        DP_,
+        h_dE_dx_.data(),
+        h_d2E_dx2,
+        h_d2E_dxdp,
+        h_x_t_.data(),
+        h_v_t_.data(),
+        DP_ > 0 ? h_dx_dp_t_.data() : nullptr,
+        DP_ > 0 ? h_dv_dp_t_.data() : nullptr
+    );
+    step_++;
+
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_x(RealType *buffer) const {
+    std::copy(h_x_t_.begin(), h_x_t_.end(), buffer);
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_v(RealType *buffer) const {
+    std::copy(h_v_t_.begin(), h_v_t_.end(), buffer);
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_E(RealType *buffer) const {
+    *buffer = h_E_;
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_dE_dx(RealType *buffer) const {
+    std::copy(h_dE_dx_.begin(), h_dE_dx_.end(), buffer);
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_dE_dp(RealType *buffer) const {
+    std::copy(h_dE_dp_.begin(), h_dE_dp_.end(), buffer);
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_dx_dp(RealType *buffer) const {
+    std::copy(h_dx_dp_t_.begin(), h_dx_dp_t_.end(), buffer);
+}
+
+template<typename RealType>
+void ContextCpu<RealType>::get_dv_dp(RealType *buffer) const {
+    std::copy(h_dv_dp_t_.begin(), h_dv_dp_t_.end(), buffer);
+}
+
+template class ContextCpu<float>;
+template class ContextCpu<double>;
+
+}
@@ -0,0 +1,95 @@
+#pragma once
+
+#include <cstdint>
+#include <vector>
+
+#include "optimizer_cpu.hpp"
+#include "potential_cpu.hpp"
+
+namespace timemachine {
+
+/*
+
+Host counterpart of Context, a triple of <System, State, Parameters> whose buffers
+all live in host memory. As with Context it does not take ownership of the potentials
+or the optimizer and is one-shot, nothing may be changed once it is initialized.
+
+The dense [N*3, N*3] hessian and the parameter derivatives are only allocated and
+computed when DP > 0, so plain dynamics costs O(N) memory and can also use potentials
+without hessians. If hessian_free is true then the hessian is never formed, instead
+each potential accumulates its products with dx_dp directly into d2E_dxdp through
+derivatives_hvp_host, so that propagating dx_dp costs O(N*DP) memory.
+
+*/
+template <typename RealType>
+class ContextCpu {
+
+private:
+
+    const std::vector<PotentialCpu<RealType>*> system_;
+    const OptimizerCpu<RealType> *optimizer_;
+
+    std::vector<RealType> h_params_; // these are really immutable
+    std::vector<int> h_gather_param_idxs_; // these are really immutable
+
+    std::vector<RealType> h_x_t_;
+    std::vector<RealType> h_v_t_;
+    std::vector<RealType> h_dx_dp_t_;
+    std::vector<RealType> h_dv_dp_t_;
+
+    RealType h_E_;
+    std::vector<RealType> h_dE_dx_;
+    std::vector<RealType> h_dE_dp_;
+    std::vector<RealType> h_d2E_dx2_;
+    std::vector<RealType> h_d2E_dxdp_;
+
+    int step_;
+    int N_;
+    int P_;
+    int DP_;
+    bool hessian_free_;
+
+public:
+
+    ContextCpu(
+        const std::vector<PotentialCpu<RealType>* > system,
+        const OptimizerCpu<RealType> *optimizer,
+        const RealType *h_params,
+        const RealType *h_x0,
+        const RealType *h_v0,
+        const int N,
+        const int P,
+        const int *h_param_gather_idxs,
+        const int DP,
+        const bool hessian_free=false);
+
+    int num_atoms() const { return N_; };
+
+    int num_params() const { return P_; };
+
+    int num_dparams() const { return DP_; };
+
+    bool hessian_free() const { return hessian_free_; };
+
+    // counter of the optimizer's next noise draw, see OptimizerCpu::noise_step
+    uint64_t noise_step() const { return optimizer_->noise_step(); };
+
+    void step();
+
+    void get_E(RealType *buffer) const;
+
+    void get_dE_dx(RealType *buffer) const;
+
+    void get_dE_dp(RealType *buffer) const;
+
+    void get_x(RealType *buffer) const;
+
+    void get_v(RealType *buffer) const;
+
+    void get_dx_dp(RealType *buffer) const;
+
+    void get_dv_dp(RealType *buffer) const;
+
+};
+
+}
@@ -0,0 +1,1189 @@
+#include <algorithm>
+#include <cmath>
+#include <map>
+#include <stdexcept>
+#include <utility>
+
+#include "custom_bonded_cpu.hpp"
+
+namespace timemachine {
+
+namespace {
+
+template<typename RealType>
+inline RealType dot3(const RealType *a, const RealType *b) {
+    return a[0]*b[0] + a[1]*b[1] + a[2]*b[2];
+}
+
+template<typename RealType>
+inline void cross3(const RealType *a, const RealType *b, RealType *c) {
+    c[0] = a[1]*b[2] - a[2]*b[1];
+    c[1] = a[2]*b[0] - a[0]*b[2];
+    c[2] = a[0]*b[1] - a[1]*b[0];
+}
+
+// 3x3 row major matrix updates, M += s*op
+
+template<typename RealType>
+inline void add_outer(RealType *M, const RealType s, const RealType *u, const RealType *v) {
+    for(int i=0; i < 3; i++) {
+        for(int j=0; j < 3; j++) {
+            M[i*3+j] += s*u[i]*v[j];
+        }
+    }
+}
+
+template<typename RealType>
+inline void add_identity(RealType *M, const RealType s) {
+    M[0*3+0] += s;
+    M[1*3+1] += s;
+    M[2*3+2] += s;
+}
+
+// [v]x, such that [v]x w = v x w
+template<typename RealType>
+inline void add_cross_matrix(RealType *M, const RealType s, const RealType *v) {
+    M[0*3+1] -= s*v[2];
+    M[0*3+2] += s*v[1];
+    M[1*3+0] += s*v[2];
+    M[1*3+2] -= s*v[0];
+    M[2*3+0] -= s*v[1];
+    M[2*3+1] += s*v[0];
+}
+
+/*
+
+Map the hessian of NV internal vectors, hv: [NV, NV, 3, 3] with hv[u][v][i][j] =
+d2f/du_i dv_j, into the [NA*3, NA*3] hessian w.r.t. the atoms, where each vector is
+a linear combination of atoms with coefficients m: [NV, NA].
+
+*/
+template<typename RealType, int NV, int NA>
+inline void vector_to_atom_hessian(const RealType *hv, const int *m, RealType *hess) {
+    for(int i=0; i < NA*3*NA*3; i++) {
+        hess[i] = 0;
+    }
+    for(int u=0; u < NV; u++) {
+        for(int v=0; v < NV; v++) {
+            for(int a=0; a < NA; a++) {
+                for(int b=0; b < NA; b++) {
+                    const int s = m[u*NA+a]*m[v*NA+b];
+                    if(s == 0) {
+                        continue;
+                    }
+                    for(int i=0; i < 3; i++) {
+                        for(int j=0; j < 3; j++) {
+                            hess[(a*3+i)*NA*3 + b*3+j] += s*hv[((u*NV+v)*3+i)*3+j];
+                        }
+                    }
+                }
+            }
+        }
+    }
+}
+
+/*
+
+Each term computes, for the atoms in xs and the parameters in ps:
+
+    energy: E
+    grads: [atoms, 3], dE/dx
+    hess: [atoms*3, atoms*3], d2E/dx2, or null if not required
+    dps: [params], dE/dp
+    dxdps: [params, atoms, 3], d2E/dxdp
+
+*/
+
+template<typename RealType>
+inline RealType harmonic_bond_term(
+    const RealType *xs,
+    const RealType *ps,
+    RealType *grads,
+    RealType *hess,
+    RealType *dps,
+    RealType *dxdps) {
+
+    const RealType kb = ps[0];
+    const RealType b0 = ps[1];
+
+    RealType u[3];
+    for(int d=0; d < 3; d++) {
+        u[d] = xs[0*3+d] - xs[1*3+d];
+    }
+    const RealType dij = std::sqrt(dot3(u, u));
+    for(int d=0; d < 3; d++) {
+        u[d] /= dij;
+    }
+    const RealType db = dij - b0;
+
+    dps[0] = db*db/2;
+    dps[1] = -kb*db;
+
+    for(int d=0; d < 3; d++) {
+        grads[0*3+d] = kb*db*u[d];
+        grads[1*3+d] = -kb*db*u[d];
+        dxdps[0*6+0*3+d] = db*u[d];
+        dxdps[0*6+1*3+d] = -db*u[d];
+        dxdps[1*6+0*3+d] = -kb*u[d];
+        dxdps[1*6+1*3+d] = kb*u[d];
+    }
+
+    if(hess) {
+        // kb*(u u^T + db/dij*(I - u u^T)) on the diagonal blocks, negated off of it
+        RealType h[9] = {0};
+        add_outer(h, kb*(1 - db/dij), u, u);
+        add_identity(h, kb*db/dij);
+        for(int a=0; a < 2; a++) {
+            for(int b=0; b < 2; b++) {
+                const RealType s = a == b ? 1 : -1;
+                for(int i=0; i < 3; i++) {
+                    for(int j=0; j < 3; j++) {
+                        hess[(a*3+i)*6 + b*3+j] = s*h[i*3+j];
+                    }
+                }
+            }
+        }
+    }
+
+    return kb/2*db*db;
+}
+
+template<typename RealType>
+inline RealType harmonic_angle_term(
+    const RealType *xs,
+    const RealType *ps,
+    RealType *grads,
+    RealType *hess,
+    RealType *dps,
+    RealType *dxdps) {
+
+    const RealType ka = ps[0];
+    const RealType a0 = ps[1];
+
+    // vectors from the middle atom
+    RealType vij[3], vkj[3];
+    for(int d=0; d < 3; d++) {
+        vij[d] = xs[0*3+d] - xs[1*3+d];
+        vkj[d] = xs[2*3+d] - xs[1*3+d];
+    }
+    const RealType nij2 = dot3(vij, vij);
+    const RealType nkj2 = dot3(vkj, vkj);
+    const RealType inv_nijk = 1/std::sqrt(nij2*nkj2);
+    const RealType cos_t = dot3(vij, vkj)*inv_nijk;
+    const RealType sin_a0 = std::sin(a0);
+    const RealType delta = cos_t - std::cos(a0);
+
+    // gradient of cos_t
+    RealType dc[9];
+    for(int d=0; d < 3; d++) {
+        dc[0*3+d] = vkj[d]*inv_nijk - cos_t*vij[d]/nij2;
+        dc[2*3+d] = vij[d]*inv_nijk - cos_t*vkj[d]/nkj2;
+        dc[1*3+d] = -dc[0*3+d] - dc[2*3+d];
+    }
+
+    dps[0] = delta*delta/2;
+    dps[1] = ka*delta*sin_a0;
+
+    for(int k=0; k < 9; k++) {
+        grads[k] = ka*delta*dc[k];
+        dxdps[0*9+k] = delta*dc[k];
+        dxdps[1*9+k] = ka*sin_a0*dc[k];
+    }
+
+    if(hess) {
+        // hessian of cos_t w.r.t. the vectors (vij, vkj), then ka*(dc dc^T + delta*d2c)
+        const RealType nij = std::sqrt(nij2);
+        const RealType nkj = std::sqrt(nkj2);
+        const RealType *gb = &dc[2*3];
+        RealType hv[2*2*9] = {0};
+        RealType *haa = &hv[(0*2+0)*9];
+        RealType *hab = &hv[(0*2+1)*9];
+        RealType *hba = &hv[(1*2+0)*9];
+        RealType *hbb = &hv[(1*2+1)*9];
+
+        add_outer(haa, -1/(nij2*nij*nkj), vkj, vij);
+        add_outer(haa, -1/(nij2*nij*nkj), vij, vkj);
+        add_outer(haa, 3*cos_t/(nij2*nij2), vij, vij);
+        add_identity(haa, -cos_t/nij2);
+
+        add_outer(hbb, -1/(nkj2*nkj*nij), vij, vkj);
+        add_outer(hbb, -1/(nkj2*nkj*nij), vkj, vij);
+        add_outer(hbb, 3*cos_t/(nkj2*nkj2), vkj, vkj);
+        add_identity(hbb, -cos_t/nkj2);
+
+        add_identity(hab, inv_nijk);
+        add_outer(hab, -1/(nij*nkj2*nkj), vkj, vkj);
+        add_outer(hab, -1/nij2, vij, gb);
+
+        for(int i=0; i < 3; i++) {
+            for(int j=0; j < 3; j++) {
+                hba[i*3+j] = hab[j*3+i];
+            }
+        }
+
+        // vij = x0 - x1, vkj = x2 - x1
+        const int m[2*3] = {
+            1, -1, 0,
+            0, -1, 1
+        };
+        vector_to_atom_hessian<RealType, 2, 3>(hv, m, hess);
+
+        for(int i=0; i < 9; i++) {
+            for(int j=0; j < 9; j++) {
+                hess[i*9+j] = ka*(dc[i]*dc[j] + delta*hess[i*9+j]);
+            }
+        }
+
+    }
+
+    return ka/2*delta*delta;
+}
+
+template<typename RealType>
+inline RealType periodic_torsion_term(
+    const RealType *xs,
+    const RealType *ps,
+    RealType *grads,
+    RealType *hess,
+    RealType *dps,
+    RealType *dxdps) {
+
+    const RealType k = ps[0];
+    const RealType phase = ps[1];
+    const RealType period = ps[2];
+
+    RealType rij[3], rkj[3], rkl[3];
+    for(int d=0; d < 3; d++) {
+        rij[d] = xs[1*3+d] - xs[0*3+d];
+        rkj[d] = xs[1*3+d] - xs[2*3+d];
+        rkl[d] = xs[3*3+d] - xs[2*3+d];
+    }
+
+    RealType n1[3], n2[3], n3[3];
+    cross3(rij, rkj, n1);
+    cross3(rkj, rkl, n2);
+    cross3(n1, n2, n3);
+
+    const RealType rkj_norm_square = dot3(rkj, rkj);
+    const RealType rkj_norm = std::sqrt(rkj_norm_square);
+    const RealType n1_norm_square = dot3(n1, n1);
+    const RealType n2_norm_square = dot3(n2, n2);
+
+    const RealType angle = std::atan2(dot3(n3, rkj)/rkj_norm, dot3(n1, n2));
+
+    // gradient of the torsion angle
+    const RealType fij = dot3(rij, rkj)/rkj_norm_square;
+    const RealType fkl = dot3(rkl, rkj)/rkj_norm_square;
+    RealType dangle[12];
+    for(int d=0; d < 3; d++) {
+        dangle[0*3+d] = -rkj_norm/n1_norm_square*n1[d];
+        dangle[3*3+d] = rkj_norm/n2_norm_square*n2[d];
+        dangle[1*3+d] = (fij - 1)*dangle[0*3+d] - fkl*dangle[3*3+d];
+        dangle[2*3+d] = (fkl - 1)*dangle[3*3+d] - fij*dangle[0*3+d];
+    }
+
+    const RealType arg = period*angle - phase;
+    const RealType cos_arg = std::cos(arg);
+    const RealType sin_arg = std::sin(arg);
+
+    dps[0] = 1 + cos_arg;
+    dps[1] = k*sin_arg;
+    dps[2] = -k*sin_arg*angle;
+
+    for(int i=0; i < 12; i++) {
+        grads[i] = -k*period*sin_arg*dangle[i];
+        dxdps[0*12+i] = -period*sin_arg*dangle[i];
+        dxdps[1*12+i] = k*period*cos_arg*dangle[i];
+        dxdps[2*12+i] = -k*(sin_arg + period*angle*cos_arg)*dangle[i];
+    }
+
+    if(hess) {
+        // hessian of the torsion angle w.r.t. the vectors F = x0 - x1, G = x1 - x2 and
+        // H = x3 - x2, whose gradients are
+        //
+        //   dF = g*A/alpha
+        //   dG = -p/(g*alpha)*A + q/(g*beta)*B
+        //   dH = -g*B/beta
+        //
+        // with A = F x G, B = H x G, alpha = |A|^2, beta = |B|^2, g = |G|, p = F.G, q = H.G
+        RealType F[3], G[3], H[3];
+        for(int d=0; d < 3; d++) {
+            F[d] = -rij[d];
+            G[d] = rkj[d];
+            H[d] = rkl[d];
+        }
+        RealType A[3], B[3];
+        cross3(F, G, A);
+        cross3(H, G, B);
+        const RealType alpha = dot3(A, A);
+        const RealType beta = dot3(B, B);
+        const RealType g = rkj_norm;
+        const RealType p = dot3(F, G);
+        const RealType q = dot3(H, G);
+        const RealType cA = -p/(g*alpha);
+        const RealType cB = q/(g*beta);
+
+        RealType GxA[3], AxF[3], GxB[3], BxH[3];
+        cross3(G, A, GxA);
+        cross3(A, F, AxF);
+        cross3(G, B, GxB);
+        cross3(B, H, BxH);
+
+        // derivatives of cA and cB
+        RealType dcA_dF[3], dcA_dG[3], dcB_dH[3], dcB_dG[3];
+        for(int d=0; d < 3; d++) {
+            dcA_dF[d] = -G[d]/(g*alpha) + 2*p*GxA[d]/(g*alpha*alpha);
+            dcA_dG[d] = -F[d]/(g*alpha) + p*G[d]/(g*g*g*alpha) + 2*p*AxF[d]/(g*alpha*alpha);
+            dcB_dH[d] = G[d]/(g*beta) - 2*q*GxB[d]/(g*beta*beta);
+            dcB_dG[d] = H[d]/(g*beta) - q*G[d]/(g*g*g*beta) - 2*q*BxH[d]/(g*beta*beta);
+        }
+
+        RealType hv[3*3*9] = {0};
+        RealType *hFF = &hv[(0*3+0)*9];
+        RealType *hFG = &hv[(0*3+1)*9];
+        RealType *hGF = &hv[(1*3+0)*9];
+        RealType *hGG = &hv[(1*3+1)*9];
+        RealType *hGH = &hv[(1*3+2)*9];
+        RealType *hHG = &hv[(2*3+1)*9];
+        RealType *hHH = &hv[(2*3+2)*9];
+
+        add_cross_matrix(hFF, -g/alpha, G);
+        add_outer(hFF, -2*g/(alpha*alpha), A, GxA);
+
+        add_outer(hFG, 1/(g*alpha), A, G);
+        add_cross_matrix(hFG, g/alpha, F);
+        add_outer(hFG, -2*g/(alpha*alpha), A, AxF);
+
+        add_outer(hGF, static_cast<RealType>(1), A, dcA_dF);
+        add_cross_matrix(hGF, -cA, G);
+
+        add_outer(hGG, static_cast<RealType>(1), A, dcA_dG);
+        add_cross_matrix(hGG, cA, F);
+        add_outer(hGG, static_cast<RealType>(1), B, dcB_dG);
+        add_cross_matrix(hGG, cB, H);
+
+        add_outer(hGH, static_cast<RealType>(1), B, dcB_dH);
+        add_cross_matrix(hGH, -cB, G);
+
+        add_outer(hHG, -1/(g*beta), B, G);
+        add_cross_matrix(hHG, -g/beta, H);
+        add_outer(hHG, 2*g/(beta*beta), B, BxH);
+
+        add_cross_matrix(hHH, g/beta, G);
+        add_outer(hHH, 2*g/(beta*beta), B, GxB);
+
+        const int m[3*4] = {
+            1, -1,  0, 0,
+            0,  1, -1, 0,
+            0,  0, -1, 1
+        };
+        vector_to_atom_hessian<RealType, 3, 4>(hv, m, hess);
+
+        const RealType dE_dangle = -k*period*sin_arg;
+        const RealType d2E_dangle2 = -k*period*period*cos_arg;
+        for(int i=0; i < 12; i++) {
+            for(int j=0; j < 12; j++) {
+                hess[i*12+j] = d2E_dangle2*dangle[i]*dangle[j] + dE_dangle*hess[i*12+j];
+            }
+        }
+    }
+
+    return k*(1 + cos_arg);
+}
+
+/*
+
+Evaluate one term of NA atoms and NP parameters and accumulate its contributions
+into the buffers of a single conformation. block_idxs: [NA, NA] maps each pair of
+atoms of the term to its hessian block, or -1 if the transposed block is stored instead.
+If hvp is not null then the products of the term's hessian with the [DP, N, 3] tangents
+dx_dp are accumulated into it. If p_adjoint is not null then the first tangent is taken
+to be the adjoint of the forces and its products with the term's mixed partials are
+accumulated into p_adjoint: [P], which is indexed by parameter rather than gathered.
+
+*/
+template<typename RealType, int NA, int NP, typename TermFn>
+inline void accumulate_term(
+    TermFn term_fn,
+    const int N,
+    const int *atom_idxs,
+    const int *param_idxs,
+    const int *block_idxs,
+    const RealType *coords,
+    const RealType *params,
+    RealType &energy,
+    RealType *dE_dx,
+    RealType *d2E_dx2,
+    RealType *hessian_blocks,
+    const int DP,
+    const int *param_gather_idxs,
+    RealType *dE_dp,
+    RealType *d2E_dxdp,
+    const RealType *dx_dp,
+    RealType *hvp,
+    RealType *p_adjoint) {
+
+    RealType xs[NA*3];
+    RealType ps[NP];
+    RealType grads[NA*3];
+    RealType hess[NA*3*NA*3];
+    RealType dps[NP];
+    RealType dxdps[NP*NA*3];
+
+    for(int i=0; i < NA; i++) {
+        for(int d=0; d < 3; d++) {
+            xs[i*3+d] = coords[atom_idxs[i]*3+d];
+        }
+    }
+    for(int j=0; j < NP; j++) {
+        ps[j] = params[param_idxs[j]];
+    }
+
+    const bool compute_hessian = d2E_dx2 || hessian_blocks || hvp;
+
+    energy += term_fn(xs, ps, grads, compute_hessian ? hess : nullptr, dps, dxdps);
+
+    if(dE_dx) {
+        for(int i=0; i < NA; i++) {
+            for(int d=0; d < 3; d++) {
+                dE_dx[atom_idxs[i]*3+d] += grads[i*3+d];
+            }
+        }
+    }
+
+    if(d2E_dx2) {
+        for(int a=0; a < NA; a++) {
+            for(int b=0; b < NA; b++) {
+                for(int i=0; i < 3; i++) {
+                    for(int j=0; j < 3; j++) {
+                        d2E_dx2[(atom_idxs[a]*3+i)*N*3 + atom_idxs[b]*3+j] += hess[(a*3+i)*NA*3 + b*3+j];
+                    }
+                }
+            }
+        }
+    }
+
+    if(hessian_blocks) {
+        for(int a=0; a < NA; a++) {
+            for(int b=0; b < NA; b++) {
+                const int block_idx = block_idxs[a*NA+b];
+                if(block_idx < 0) {
+                    continue;
+                }
+                for(int i=0; i < 3; i++) {
+                    for(int j=0; j < 3; j++) {
+                        hessian_blocks[block_idx*9 + i*3+j] += hess[(a*3+i)*NA*3 + b*3+j];
+                    }
+                }
+            }
+        }
+    }
+
+    if(hvp) {
+        for(int p=0; p < DP; p++) {
+            RealType vs[NA*3];
+            for(int b=0; b < NA; b++) {
+                for(int d=0; d < 3; d++) {
+                    vs[b*3+d] = dx_dp[p*N*3 + atom_idxs[b]*3+d];
+                }
+            }
+            for(int a=0; a < NA; a++) {
+                for(int i=0; i < 3; i++) {
+                    RealType sum = 0;
+                    for(int k=0; k < NA*3; k++) {
+                        sum += hess[(a*3+i)*NA*3 + k]*vs[k];
+                    }
+                    hvp[p*N*3 + atom_idxs[a]*3+i] += sum;
+                }
+            }
+        }
+    }
+
+    if(p_adjoint) {
+        for(int j=0; j < NP; j++) {
+            RealType sum = 0;
+            for(int i=0; i < NA; i++) {
+                for(int d=0; d < 3; d++) {
+                    sum += dxdps[j*NA*3 + i*3 + d]*dx_dp[atom_idxs[i]*3 + d];
+                }
+            }
+            p_adjoint[param_idxs[j]] += sum;
+        }
+    }
+
+    if(dE_dp || d2E_dxdp) {
+        for(int j=0; j < NP; j++) {
+            const int gp_idx = param_gather_idxs[param_idxs[j]];
+            if(gp_idx < 0) {
+                continue;
+            }
+            if(dE_dp) {
+                dE_dp[gp_idx] += dps[j];
+            }
+            if(d2E_dxdp) {
+                for(int i=0; i < NA; i++) {
+                    for(int d=0; d < 3; d++) {
+                        d2E_dxdp[gp_idx*N*3 + atom_idxs[i]*3 + d] += dxdps[j*NA*3 + i*3 + d];
+                    }
+                }
+            }
+        }
+    }
+
+}
+
+/*
+
+Assign a lower triangular (row >= col) hessian block to every pair of atoms of
+every term, appending new blocks to rows and cols.
+
+*/
+void assign_hessian_blocks(
+    const std::vector<int> &atom_idxs,
+    const int num_atoms_per_term,
+    std::map<std::pair<int, int>, int> &block_map,
+    std::vector<int> &rows,
+    std::vector<int> &cols,
+    std::vector<int> &block_idxs) {
+
+    const int NA = num_atoms_per_term;
+    const int num_terms = atom_idxs.size()/NA;
+    block_idxs.resize(num_terms*NA*NA);
+    for(int t=0; t < num_terms; t++) {
+        for(int a=0; a < NA; a++) {
+            for(int b=0; b < NA; b++) {
+                const int row = atom_idxs[t*NA+a];
+                const int col = atom_idxs[t*NA+b];
+                int block_idx = -1;
+                if(row >= col) {
+                    auto key = std::make_pair(row, col);
+                    auto it = block_map.find(key);
+                    if(it == block_map.end()) {
+                        block_idx = rows.size();
+                        block_map[key] = block_idx;
+                        rows.push_back(row);
+                        cols.push_back(col);
+                    } else {
+                        block_idx = it->second;
+                    }
+                }
+                block_idxs[t*NA*NA + a*NA + b] = block_idx;
+            }
+        }
+    }
+}
+
+/*
+
+Evaluate every term of a single kind, splitting each conformation over the terms.
+Threads accumulate into private force, parameter derivative, hessian vector product and
+parameter adjoint buffers that are summed once at the end, while the hessian of each term is stored in its
+own slot and scattered into the dense hessian afterwards, since terms that share atoms
+would otherwise race.
+
+*/
+template<typename RealType, int NA, int NP, typename TermFn>
+void threaded_terms(
+    TermFn term_fn,
+    const std::vector<int> &atom_idxs,
+    const std::vector<int> &param_idxs,
+    const int num_confs,
+    const int N,
+    const RealType *h_coords,
+    const RealType *h_params,
+    RealType *h_E,
+    RealType *h_dE_dx,
+    RealType *h_d2E_dx2,
+    const int DP,
+    const int *h_param_gather_idxs,
+    RealType *h_dE_dp,
+    RealType *h_d2E_dxdp,
+    const RealType *h_dx_dp,
+    RealType *h_hvp,
+    const int P,
+    RealType *h_p_adjoint) {
+
+    const int T = atom_idxs.size()/NA;
+
+    // every pair of atoms of a term gets its own block
+    int block_idxs[NA*NA];
+    for(int b=0; b < NA*NA; b++) {
+        block_idxs[b] = b;
+    }
+    std::vector<RealType> term_hessians(h_d2E_dx2 ? T*NA*NA*9 : 0);
+
+    for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+        const RealType *coords = h_coords + conf_idx*N*3;
+        RealType *dE_dx = h_dE_dx ? h_dE_dx + conf_idx*N*3 : nullptr;
+        RealType *d2E_dx2 = h_d2E_dx2 ? h_d2E_dx2 + conf_idx*N*3*N*3 : nullptr;
+        RealType *dE_dp = h_dE_dp ? h_dE_dp + conf_idx*DP : nullptr;
+        RealType *d2E_dxdp = h_d2E_dxdp ? h_d2E_dxdp + conf_idx*DP*N*3 : nullptr;
+        const RealType *dx_dp = h_dx_dp ? h_dx_dp + conf_idx*DP*N*3 : nullptr;
+        RealType *hvp = h_hvp ? h_hvp + conf_idx*DP*N*3 : nullptr;
+        RealType *p_adjoint = h_p_adjoint ? h_p_adjoint + conf_idx*P : nullptr;
+
+        RealType energy = 0;
+        std::fill(term_hessians.begin(), term_hessians.end(), 0);
+
+        #pragma omp parallel
+        {
+            RealType local_energy = 0;
+            std::vector<RealType> local_dE_dx(dE_dx ? N*3 : 0, 0);
+            std::vector<RealType> local_dE_dp(dE_dp ? DP : 0, 0);
+            std::vector<RealType> local_d2E_dxdp(d2E_dxdp ? DP*N*3 : 0, 0);
+            std::vector<RealType> local_hvp(hvp ? DP*N*3 : 0, 0);
+            std::vector<RealType> local_p_adjoint(p_adjoint ? P : 0, 0);
+
+            #pragma omp for schedule(static)
+            for(int t=0; t < T; t++) {
+                accumulate_term<RealType, NA, NP>(term_fn, N,
+                    &atom_idxs[t*NA], &param_idxs[t*NP], block_idxs, coords, h_params,
+                    local_energy,
+                    dE_dx ? local_dE_dx.data() : nullptr,
+                    nullptr,
+                    d2E_dx2 ? &term_hessians[t*NA*NA*9] : nullptr,
+                    DP, h_param_gather_idxs,
+                    dE_dp ? local_dE_dp.data() : nullptr,
+                    d2E_dxdp ? local_d2E_dxdp.data() : nullptr,
+                    dx_dp,
+                    hvp ? local_hvp.data() : nullptr,
+                    p_adjoint ? local_p_adjoint.data() : nullptr);
+            }
+
+            #pragma omp critical
+            {
+                energy += local_energy;
+                for(size_t i=0; i < local_dE_dx.size(); i++) {
+                    dE_dx[i] += local_dE_dx[i];
+                }
+                for(size_t i=0; i < local_dE_dp.size(); i++) {
+                    dE_dp[i] += local_dE_dp[i];
+                }
+                for(size_t i=0; i < local_d2E_dxdp.size(); i++) {
+                    d2E_dxdp[i] += local_d2E_dxdp[i];
+                }
+                for(size_t i=0; i < local_hvp.size(); i++) {
+                    hvp[i] += local_hvp[i];
+                }
+                for(size_t i=0; i < local_p_adjoint.size(); i++) {
+                    p_adjoint[i] += local_p_adjoint[i];
+                }
+            }
+        }
+
+        if(d2E_dx2) {
+            for(int t=0; t < T; t++) {
+                for(int a=0; a < NA; a++) {
+                    for(int b=0; b < NA; b++) {
+                        const int row = atom_idxs[t*NA+a];
+                        const int col = atom_idxs[t*NA+b];
+                        const RealType *block = &term_hessians[(t*NA*NA + a*NA + b)*9];
+                        for(int i=0; i < 3; i++) {
+                            for(int j=0; j < 3; j++) {
+                                d2E_dx2[(row*3+i)*N*3 + col*3+j] += block[i*3+j];
+                            }
+                        }
+                    }
+                }
+            }
+        }
+
+        if(h_E) {
+            h_E[conf_idx] += energy;
+        }
+
+    }
+
+}
+
+}
+
+template <typename RealType>
+BondedTerms<RealType>::BondedTerms(
+    std::vector<int> bond_idxs,
+    std::vector<int> bond_param_idxs,
+    std::vector<int> angle_idxs,
+    std::vector<int> angle_param_idxs,
+    std::vector<int> torsion_idxs,
+    std::vector<int> torsion_param_idxs
+) : bond_idxs_(bond_idxs),
+    bond_param_idxs_(bond_param_idxs),
+    angle_idxs_(angle_idxs),
+    angle_param_idxs_(angle_param_idxs),
+    torsion_idxs_(torsion_idxs),
+    torsion_param_idxs_(torsion_param_idxs),
+    n_bonds_(bond_idxs.size()/2),
+    n_angles_(angle_idxs.size()/3),
+    n_torsions_(torsion_idxs.size()/4) {
+
+    if(bond_idxs.size() % 2 != 0 || bond_param_idxs.size() != bond_idxs.size()) {
+        throw std::runtime_error("bond_idxs and bond_param_idxs must both be of shape [B, 2]");
+    }
+    if(angle_idxs.size() % 3 != 0 || angle_param_idxs.size() != angle_idxs.size()/3*2) {
+        throw std::runtime_error("angle_idxs must be of shape [A, 3] and angle_param_idxs of shape [A, 2]");
+    }
+    if(torsion_idxs.size() % 4 != 0 || torsion_param_idxs.size() != torsion_idxs.size()/4*3) {
+        throw std::runtime_error("torsion_idxs must be of shape [T, 4] and torsion_param_idxs of shape [T, 3]");
+    }
+
+    std::map<std::pair<int, int>, int> block_map;
+    assign_hessian_blocks(bond_idxs_, 2, block_map, hessian_block_rows_, hessian_block_cols_, bond_block_idxs_);
+    assign_hessian_blocks(angle_idxs_, 3, block_map, hessian_block_rows_, hessian_block_cols_, angle_block_idxs_);
+    assign_hessian_blocks(torsion_idxs_, 4, block_map, hessian_block_rows_, hessian_block_cols_, torsion_block_idxs_);
+
+};
+
+template <typename RealType>
+void BondedTerms<RealType>::derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        h_d2E_dx2,
+        nullptr,
+        num_dp,
+        h_param_gather_idxs,
+        h_dE_dp,
+        h_d2E_dxdp,
+        nullptr,
+        nullptr,
+        0,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void BondedTerms<RealType>::derivatives_sparse_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_hessian_blocks,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        nullptr,
+        h_hessian_blocks,
+        num_dp,
+        h_param_gather_idxs,
+        h_dE_dp,
+        h_d2E_dxdp,
+        nullptr,
+        nullptr,
+        0,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void BondedTerms<RealType>::derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        nullptr,
+        nullptr,
+        num_dp,
+        h_param_gather_idxs,
+        h_dE_dp,
+        h_d2E_dxdp,
+        h_dx_dp,
+        h_hvp,
+        0,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void BondedTerms<RealType>::derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+    // a single tangent, the adjoint, and no gathered parameters
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        nullptr,
+        nullptr,
+        nullptr,
+        nullptr,
+        1,
+        nullptr,
+        nullptr,
+        nullptr,
+        h_adjoint,
+        h_x_adjoint,
+        num_params,
+        h_p_adjoint
+    );
+
+};
+
+template <typename RealType>
+void BondedTerms<RealType>::derivatives(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        RealType *h_hessian_blocks,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        const RealType *h_dx_dp,
+        RealType *h_hvp,
+        const int num_params,
+        RealType *h_p_adjoint) const {
+
+    const int N = num_atoms;
+    const int P = num_params;
+    const int DP = num_dp;
+    const int NB = hessian_block_rows_.size();
+
+    // conformations are independent, so each thread owns its slice of the outputs
+    #pragma omp parallel for schedule(static)
+    for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+        const RealType *coords = h_coords + conf_idx*N*3;
+        RealType *dE_dx = h_dE_dx ? h_dE_dx + conf_idx*N*3 : nullptr;
+        RealType *d2E_dx2 = h_d2E_dx2 ? h_d2E_dx2 + conf_idx*N*3*N*3 : nullptr;
+        RealType *hessian_blocks = h_hessian_blocks ? h_hessian_blocks + conf_idx*NB*9 : nullptr;
+        RealType *dE_dp = h_dE_dp ? h_dE_dp + conf_idx*DP : nullptr;
+        RealType *d2E_dxdp = h_d2E_dxdp ? h_d2E_dxdp + conf_idx*DP*N*3 : nullptr;
+        const RealType *dx_dp = h_dx_dp ? h_dx_dp + conf_idx*DP*N*3 : nullptr;
+        RealType *hvp = h_hvp ? h_hvp + conf_idx*DP*N*3 : nullptr;
+        RealType *p_adjoint = h_p_adjoint ? h_p_adjoint + conf_idx*P : nullptr;
+
+        RealType energy = 0;
+
+        for(int b=0; b < n_bonds_; b++) {
+            accumulate_term<RealType, 2, 2>(harmonic_bond_term<RealType>, N,
+                &bond_idxs_[b*2], &bond_param_idxs_[b*2], &bond_block_idxs_[b*4], coords, h_params,
+                energy, dE_dx, d2E_dx2, hessian_blocks, DP, h_param_gather_idxs, dE_dp, d2E_dxdp,
+                dx_dp, hvp, p_adjoint);
+        }
+
+        for(int a=0; a < n_angles_; a++) {
+            accumulate_term<RealType, 3, 2>(harmonic_angle_term<RealType>, N,
+                &angle_idxs_[a*3], &angle_param_idxs_[a*2], &angle_block_idxs_[a*9], coords, h_params,
+                energy, dE_dx, d2E_dx2, hessian_blocks, DP, h_param_gather_idxs, dE_dp, d2E_dxdp,
+                dx_dp, hvp, p_adjoint);
+        }
+
+        for(int t=0; t < n_torsions_; t++) {
+            accumulate_term<RealType, 4, 3>(periodic_torsion_term<RealType>, N,
+                &torsion_idxs_[t*4], &torsion_param_idxs_[t*3], &torsion_block_idxs_[t*16], coords, h_params,
+                energy, dE_dx, d2E_dx2, hessian_blocks, DP, h_param_gather_idxs, dE_dp, d2E_dxdp,
+                dx_dp, hvp, p_adjoint);
+        }
+
+        if(h_E) {
+            h_E[conf_idx] += energy;
+        }
+
+    }
+
+};
+
+template class BondedTerms<float>;
+template class BondedTerms<double>;
+
+template <typename RealType>
+HarmonicBondCpu<RealType>::HarmonicBondCpu(
+    std::vector<int> bond_idxs,
+    std::vector<int> param_idxs
+) : bond_idxs_(bond_idxs),
+    param_idxs_(param_idxs) {
+
+    if(bond_idxs.size() % 2 != 0 || param_idxs.size() != bond_idxs.size()/2*2) {
+        throw std::runtime_error("bond_idxs must be of shape [B, 2] and param_idxs of shape [B, 2]");
+    }
+
+};
+
+template <typename RealType>
+void HarmonicBondCpu<RealType>::derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    threaded_terms<RealType, 2, 2>(harmonic_bond_term<RealType>, bond_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, h_d2E_dx2,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, nullptr, nullptr, 0, nullptr);
+
+};
+
+template <typename RealType>
+void HarmonicBondCpu<RealType>::derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+    threaded_terms<RealType, 2, 2>(harmonic_bond_term<RealType>, bond_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, nullptr,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, h_dx_dp, h_hvp, 0, nullptr);
+
+};
+
+template <typename RealType>
+void HarmonicBondCpu<RealType>::derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+    threaded_terms<RealType, 2, 2>(harmonic_bond_term<RealType>, bond_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, nullptr, nullptr, nullptr,
+        1, nullptr, nullptr, nullptr, h_adjoint, h_x_adjoint, num_params, h_p_adjoint);
+
+};
+
+template class HarmonicBondCpu<float>;
+template class HarmonicBondCpu<double>;
+
+template <typename RealType>
+HarmonicAngleCpu<RealType>::HarmonicAngleCpu(
+    std::vector<int> angle_idxs,
+    std::vector<int> param_idxs
+) : angle_idxs_(angle_idxs),
+    param_idxs_(param_idxs) {
+
+    if(angle_idxs.size() % 3 != 0 || param_idxs.size() != angle_idxs.size()/3*2) {
+        throw std::runtime_error("angle_idxs must be of shape [A, 3] and param_idxs of shape [A, 2]");
+    }
+
+};
+
+template <typename RealType>
+void HarmonicAngleCpu<RealType>::derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    threaded_terms<RealType, 3, 2>(harmonic_angle_term<RealType>, angle_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, h_d2E_dx2,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, nullptr, nullptr, 0, nullptr);
+
+};
+
+template <typename RealType>
+void HarmonicAngleCpu<RealType>::derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+    threaded_terms<RealType, 3, 2>(harmonic_angle_term<RealType>, angle_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, nullptr,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, h_dx_dp, h_hvp, 0, nullptr);
+
+};
+
+template <typename RealType>
+void HarmonicAngleCpu<RealType>::derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+    threaded_terms<RealType, 3, 2>(harmonic_angle_term<RealType>, angle_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, nullptr, nullptr, nullptr,
+        1, nullptr, nullptr, nullptr, h_adjoint, h_x_adjoint, num_params, h_p_adjoint);
+
+};
+
+template class HarmonicAngleCpu<float>;
+template class HarmonicAngleCpu<double>;
+
+template <typename RealType>
+PeriodicTorsionCpu<RealType>::PeriodicTorsionCpu(
+    std::vector<int> torsion_idxs,
+    std::vector<int> param_idxs
+) : torsion_idxs_(torsion_idxs),
+    param_idxs_(param_idxs) {
+
+    if(torsion_idxs.size() % 4 != 0 || param_idxs.size() != torsion_idxs.size()/4*3) {
+        throw std::runtime_error("torsion_idxs must be of shape [T, 4] and param_idxs of shape [T, 3]");
+    }
+
+};
+
+template <typename RealType>
+void PeriodicTorsionCpu<RealType>::derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    threaded_terms<RealType, 4, 3>(periodic_torsion_term<RealType>, torsion_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, h_d2E_dx2,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, nullptr, nullptr, 0, nullptr);
+
+};
+
+template <typename RealType>
+void PeriodicTorsionCpu<RealType>::derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+    threaded_terms<RealType, 4, 3>(periodic_torsion_term<RealType>, torsion_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, h_E, h_dE_dx, nullptr,
+        num_dp, h_param_gather_idxs, h_dE_dp, h_d2E_dxdp, h_dx_dp, h_hvp, 0, nullptr);
+
+};
+
+template <typename RealType>
+void PeriodicTorsionCpu<RealType>::derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+    threaded_terms<RealType, 4, 3>(periodic_torsion_term<RealType>, torsion_idxs_, param_idxs_,
+        num_confs, num_atoms, h_coords, h_params, nullptr, nullptr, nullptr,
+        1, nullptr, nullptr, nullptr, h_adjoint, h_x_adjoint, num_params, h_p_adjoint);
+
+};
+
+template class PeriodicTorsionCpu<float>;
+template class PeriodicTorsionCpu<double>;
+
+} // namespace timemachine
@@ -0,0 +1,352 @@
+#pragma once
+
+#include "potential_cpu.hpp"
+#include <vector>
+
+namespace timemachine {
+
+/*
+
+Harmonic bonds, harmonic (cosine) angles and periodic torsions evaluated together
+in a single pass over each conformation. Every term gathers its coordinates and
+parameters once and computes its energy, forces, dE_dp and d2E_dxdp analytically
+from the same intermediates before a single accumulation into the output buffers.
+
+Hessians are closed form as well, and derivatives_hvp_host multiplies each term's
+hessian into the tangents directly, as derivatives_vjp_host does with the adjoint, which
+also contracts each term's mixed partials with it. Since each term only couples 2-4 atoms they are
+also available as sparse 3x3 blocks: block b is d2E/dx_i dx_j for the atom pair
+(i, j) = (hessian_block_rows()[b], hessian_block_cols()[b]) with i >= j, the blocks
+above the diagonal being their transposes.
+
+*/
+template <typename RealType>
+class BondedTerms : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> bond_idxs_;          // [B, 2]
+    std::vector<int> bond_param_idxs_;    // [B, 2]
+    std::vector<int> angle_idxs_;         // [A, 3]
+    std::vector<int> angle_param_idxs_;   // [A, 2]
+    std::vector<int> torsion_idxs_;       // [T, 4]
+    std::vector<int> torsion_param_idxs_; // [T, 3]
+
+    int n_bonds_;
+    int n_angles_;
+    int n_torsions_;
+
+    // lower triangular hessian blocks and the block of each pair of atoms of each term
+    std::vector<int> hessian_block_rows_;
+    std::vector<int> hessian_block_cols_;
+    std::vector<int> bond_block_idxs_;    // [B, 2, 2]
+    std::vector<int> angle_block_idxs_;   // [A, 3, 3]
+    std::vector<int> torsion_block_idxs_; // [T, 4, 4]
+
+    void derivatives(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        RealType *h_hessian_blocks,
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        const RealType *h_dx_dp,
+        RealType *h_hvp,
+        const int num_params,
+        RealType *h_p_adjoint) const;
+
+public:
+
+    BondedTerms(
+        std::vector<int> bond_idxs,
+        std::vector<int> bond_param_idxs,
+        std::vector<int> angle_idxs,
+        std::vector<int> angle_param_idxs,
+        std::vector<int> torsion_idxs,
+        std::vector<int> torsion_param_idxs
+    );
+
+    int num_bonds() const { return n_bonds_; }
+
+    int num_angles() const { return n_angles_; }
+
+    int num_torsions() const { return n_torsions_; }
+
+    int num_hessian_blocks() const { return hessian_block_rows_.size(); }
+
+    const std::vector<int> &hessian_block_rows() const { return hessian_block_rows_; }
+
+    const std::vector<int> &hessian_block_cols() const { return hessian_block_cols_; }
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+    /*
+
+    Identical to derivatives_host, except that the hessian is accumulated into
+    h_hessian_blocks: [C, num_hessian_blocks(), 3, 3] instead of a dense [C, N, 3, N, 3].
+
+    */
+    void derivatives_sparse_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_hessian_blocks,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const;
+
+};
+
+/*
+
+HarmonicBondCpu, HarmonicAngleCpu and PeriodicTorsionCpu evaluate a single kind of
+term each, as drop in replacements of the potentials in custom_bonded_gpu.hpp. Each
+conformation is split over the terms with OpenMP, where every thread accumulates the
+forces and parameter derivatives into its own buffers that are summed once at the end.
+Since terms share atoms, the hessian of every term is kept separately and scattered
+into the dense hessian after the parallel loop. The dense hessian is full, ie. both
+of its triangles are filled.
+
+*/
+
+/*
+
+Host counterpart of HarmonicBond, with the same harmonic bonds as BondedTerms.
+
+*/
+template <typename RealType>
+class HarmonicBondCpu : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> bond_idxs_; // [B, 2]
+    std::vector<int> param_idxs_; // [B, 2]
+
+public:
+
+    HarmonicBondCpu(
+        std::vector<int> bond_idxs,
+        std::vector<int> param_idxs
+    );
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+};
+
+/*
+
+Host counterpart of HarmonicAngle, with the same harmonic (cosine) angles as BondedTerms.
+
+*/
+template <typename RealType>
+class HarmonicAngleCpu : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> angle_idxs_; // [A, 3]
+    std::vector<int> param_idxs_; // [A, 2]
+
+public:
+
+    HarmonicAngleCpu(
+        std::vector<int> angle_idxs,
+        std::vector<int> param_idxs
+    );
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+};
+
+/*
+
+Host counterpart of PeriodicTorsion, with the same periodic torsions as BondedTerms.
+
+*/
+template <typename RealType>
+class PeriodicTorsionCpu : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> torsion_idxs_; // [T, 4]
+    std::vector<int> param_idxs_; // [T, 3]
+
+public:
+
+    PeriodicTorsionCpu(
+        std::vector<int> torsion_idxs,
+        std::vector<int> param_idxs
+    );
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+};
+
+}
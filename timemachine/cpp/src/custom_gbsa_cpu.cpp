@@ -0,0 +1,475 @@
+#include <cmath>
+#include <stdexcept>
+
+#include "custom_gbsa_cpu.hpp"
+#include "dual_cpu.hpp"
+#include "neighborlist_cpu.hpp"
+
+namespace timemachine {
+
+namespace {
+
+/*
+
+OBC descreening of atom i (offset radius oRI) by atom j (scaled radius sRJ) at
+distance d, along with its partial derivatives w.r.t. d, oRI and sRJ. Matches
+implicit.descreening_term, including which of the two lower bounds is active.
+
+*/
+template<typename RealType, typename S>
+S descreening_term(
+    const S &d,
+    const S &oRI,
+    const S &sRJ,
+    S &dH_dd,
+    S &dH_doRI,
+    S &dH_dsRJ) {
+
+    using std::fabs;
+    using std::log;
+
+    dH_dd = 0;
+    dH_doRI = 0;
+    dH_dsRJ = 0;
+
+    if(!(real_part(oRI) < real_part(d + sRJ))) {
+        return 0;
+    }
+
+    const RealType half = 0.5;
+    const RealType quarter = 0.25;
+    S d_inv = 1/d;
+
+    S rfs = fabs(d - sRJ);
+    const bool oRI_bound = real_part(oRI) >= real_part(rfs);
+    S L = 1/(oRI_bound ? oRI : rfs);
+    S U = 1/(d + sRJ);
+    S L2 = L*L;
+    S U2 = U*U;
+    S sRJ2 = sRJ*sRJ;
+    S ratio = log(U/L);
+
+    S H = L - U + quarter*d*(U2 - L2) + half*d_inv*ratio + quarter*sRJ2*d_inv*(L2 - U2);
+
+    S dH_dL = 1 - half*d*L - half*d_inv/L + half*sRJ2*d_inv*L;
+    S dH_dU = -1 + half*d*U + half*d_inv/U - half*sRJ2*d_inv*U;
+
+    // explicit dependencies first, then through U = 1/(d + sRJ)
+    dH_dd = quarter*(U2 - L2) - half*d_inv*d_inv*ratio - quarter*sRJ2*d_inv*d_inv*(L2 - U2) - dH_dU*U2;
+    dH_dsRJ = half*sRJ*d_inv*(L2 - U2) - dH_dU*U2;
+
+    // and through L = 1/max(oRI, |d - sRJ|)
+    if(oRI_bound) {
+        dH_doRI = -dH_dL*L2;
+    } else {
+        const RealType sign = real_part(d - sRJ) >= 0 ? 1 : -1;
+        dH_dd -= dH_dL*L2*sign;
+        dH_dsRJ += dH_dL*L2*sign;
+    }
+
+    return H;
+}
+
+}
+
+template <typename RealType>
+GBSA<RealType>::GBSA(
+    std::vector<int> param_idxs,
+    RealType dielectric_offset,
+    RealType cutoff,
+    RealType alpha_obc,
+    RealType beta_obc,
+    RealType gamma_obc,
+    RealType solute_dielectric,
+    RealType solvent_dielectric,
+    RealType electric_constant,
+    RealType probe_radius,
+    RealType surface_area_energy) :
+    param_idxs_(param_idxs),
+    dielectric_offset_(dielectric_offset),
+    cutoff_(cutoff),
+    alpha_obc_(alpha_obc),
+    beta_obc_(beta_obc),
+    gamma_obc_(gamma_obc),
+    probe_radius_(probe_radius),
+    pi4Asolv_(4*M_PI*surface_area_energy) {
+
+    if(param_idxs.size() % 3 != 0) {
+        throw std::runtime_error("param_idxs must be of shape [N, 3]");
+    }
+    if(!(cutoff > 0)) {
+        throw std::runtime_error("cutoff must be positive");
+    }
+
+    if(solute_dielectric != 0 && solvent_dielectric != 0) {
+        prefactor_ = 2*electric_constant*(1/solute_dielectric - 1/solvent_dielectric);
+    } else {
+        prefactor_ = 0;
+    }
+
+};
+
+/*
+
+Energy of a single conformation over the given pairs, accumulating dE_dx: [N, 3]
+and, if not null, dE_dp: [P] over all of the parameters. S is either RealType or
+a Dual<RealType>, in which case the dual parts are the directional derivatives
+along whichever parameters or coordinates were seeded.
+
+*/
+template <typename RealType>
+template <typename S>
+S GBSA<RealType>::derivatives_conf(
+    const int num_atoms,
+    const S *x,
+    const S *params,
+    const std::vector<int> &pairs,
+    S *dE_dx,
+    S *dE_dp) const {
+
+    using std::exp;
+    using std::sqrt;
+    using std::tanh;
+
+    const int N = num_atoms;
+    const int num_pairs = pairs.size()/2;
+    const RealType half = 0.5;
+
+    std::vector<S> q(N), rho(N), scale(N), oR(N), sR(N);
+    for(int i=0; i < N; i++) {
+        q[i] = params[param_idxs_[i*3+0]];
+        rho[i] = params[param_idxs_[i*3+1]];
+        scale[i] = params[param_idxs_[i*3+2]];
+        oR[i] = rho[i] - dielectric_offset_;
+        sR[i] = oR[i]*scale[i];
+    }
+
+    std::vector<S> dij(num_pairs);
+    for(int p=0; p < num_pairs; p++) {
+        const int i = pairs[p*2+0];
+        const int j = pairs[p*2+1];
+        S d2 = 0;
+        for(int k=0; k < 3; k++) {
+            S dx = x[i*3+k] - x[j*3+k];
+            d2 += dx*dx;
+        }
+        dij[p] = sqrt(d2);
+    }
+
+    // 1. born radii
+    S unused_dd, unused_doR, unused_dsR;
+    std::vector<S> H_sum(N, 0);
+    for(int p=0; p < num_pairs; p++) {
+        const int i = pairs[p*2+0];
+        const int j = pairs[p*2+1];
+        H_sum[i] += descreening_term<RealType>(dij[p], oR[i], sR[j], unused_dd, unused_doR, unused_dsR);
+        H_sum[j] += descreening_term<RealType>(dij[p], oR[j], sR[i], unused_dd, unused_doR, unused_dsR);
+    }
+
+    std::vector<S> R(N), dR_dpsi(N), dR_drho(N);
+    for(int i=0; i < N; i++) {
+        S psi = half*oR[i]*H_sum[i];
+        S t = tanh(alpha_obc_*psi - beta_obc_*psi*psi + gamma_obc_*psi*psi*psi);
+        R[i] = 1/(1/oR[i] - t/rho[i]);
+        dR_dpsi[i] = R[i]*R[i]*(1 - t*t)*(alpha_obc_ - 2*beta_obc_*psi + 3*gamma_obc_*psi*psi)/rho[i];
+        dR_drho[i] = R[i]*R[i]*(1/(oR[i]*oR[i]) - t/(rho[i]*rho[i]));
+    }
+
+    // 2. generalized born pair energies
+    S E = 0;
+    std::vector<S> dE_dR(N, 0), dE_dq(N, 0), dE_drho(N, 0), dE_doR(N, 0), dE_dsR(N, 0);
+    for(int p=0; p < num_pairs; p++) {
+        const int i = pairs[p*2+0];
+        const int j = pairs[p*2+1];
+        S r2 = dij[p]*dij[p];
+        S A = R[i]*R[j];
+        S D = r2/(4*A);
+        S expD = exp(-D);
+        S f2 = r2 + A*expD;
+        S f = sqrt(f2);
+        S e = prefactor_*q[i]*q[j]/f;
+        E += e;
+
+        S c = -e/(2*f2);
+        S de_dr2 = c*(1 - expD/4);
+        S de_dA = c*expD*(1 + D);
+        for(int k=0; k < 3; k++) {
+            S g = 2*de_dr2*(x[i*3+k] - x[j*3+k]);
+            dE_dx[i*3+k] += g;
+            dE_dx[j*3+k] -= g;
+        }
+        dE_dR[i] += de_dA*R[j];
+        dE_dR[j] += de_dA*R[i];
+        dE_dq[i] += prefactor_*q[j]/f;
+        dE_dq[j] += prefactor_*q[i]/f;
+    }
+
+    // self and non-polar energies
+    for(int i=0; i < N; i++) {
+        E += half*prefactor_*q[i]*q[i]/R[i];
+        dE_dq[i] += prefactor_*q[i]/R[i];
+        dE_dR[i] -= half*prefactor_*q[i]*q[i]/(R[i]*R[i]);
+
+        S r = rho[i] + probe_radius_;
+        S ratio2 = (rho[i]/R[i])*(rho[i]/R[i]);
+        S ratio6 = ratio2*ratio2*ratio2;
+        S sa = pi4Asolv_*r*r*ratio6;
+        E += sa;
+        dE_dR[i] -= 6*sa/R[i];
+        dE_drho[i] += 2*pi4Asolv_*r*ratio6 + 6*sa/rho[i];
+    }
+
+    // 3. chain the born radii back through the descreening sums
+    std::vector<S> dE_dH(N);
+    for(int i=0; i < N; i++) {
+        S dE_dpsi = dE_dR[i]*dR_dpsi[i];
+        dE_drho[i] += dE_dR[i]*dR_drho[i];
+        dE_doR[i] += half*dE_dpsi*H_sum[i];
+        dE_dH[i] = half*dE_dpsi*oR[i];
+    }
+
+    S dH_dd, dH_doR, dH_dsR;
+    for(int p=0; p < num_pairs; p++) {
+        const int i = pairs[p*2+0];
+        const int j = pairs[p*2+1];
+
+        descreening_term<RealType>(dij[p], oR[i], sR[j], dH_dd, dH_doR, dH_dsR);
+        S dE_dd = dE_dH[i]*dH_dd;
+        dE_doR[i] += dE_dH[i]*dH_doR;
+        dE_dsR[j] += dE_dH[i]*dH_dsR;
+
+        descreening_term<RealType>(dij[p], oR[j], sR[i], dH_dd, dH_doR, dH_dsR);
+        dE_dd += dE_dH[j]*dH_dd;
+        dE_doR[j] += dE_dH[j]*dH_doR;
+        dE_dsR[i] += dE_dH[j]*dH_dsR;
+
+        S d_inv = 1/dij[p];
+        for(int k=0; k < 3; k++) {
+            S g = dE_dd*(x[i*3+k] - x[j*3+k])*d_inv;
+            dE_dx[i*3+k] += g;
+            dE_dx[j*3+k] -= g;
+        }
+    }
+
+    if(dE_dp) {
+        for(int i=0; i < N; i++) {
+            // oR = rho - offset, sR = oR*scale
+            dE_dp[param_idxs_[i*3+0]] += dE_dq[i];
+            dE_dp[param_idxs_[i*3+1]] += dE_drho[i] + dE_doR[i] + dE_dsR[i]*scale[i];
+            dE_dp[param_idxs_[i*3+2]] += dE_dsR[i]*oR[i];
+        }
+    }
+
+    return E;
+
+}
+
+template <typename RealType>
+void GBSA<RealType>::derivatives_host(
+    const int num_confs,
+    const int num_atoms,
+    const int num_params,
+    const RealType *h_coords,
+    const RealType *h_params,
+    RealType *h_E,
+    RealType *h_dE_dx,
+    RealType *h_d2E_dx2,
+    // parameter derivatives
+    const int num_dp,
+    const int *h_param_gather_idxs,
+    RealType *h_dE_dp,
+    RealType *h_d2E_dxdp) const {
+
+    if(h_d2E_dx2) {
+        throw std::runtime_error("GBSA does not support hessians");
+    }
+
+    this->derivatives_hvp_host(
+        num_confs,
+        num_atoms,
+        num_params,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        num_dp,
+        h_param_gather_idxs,
+        nullptr,
+        h_dE_dp,
+        h_d2E_dxdp,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void GBSA<RealType>::derivatives_hvp_host(
+    const int num_confs,
+    const int num_atoms,
+    const int num_params,
+    const RealType *h_coords,
+    const RealType *h_params,
+    RealType *h_E,
+    RealType *h_dE_dx,
+    // parameter derivatives
+    const int num_dp,
+    const int *h_param_gather_idxs,
+    const RealType *h_dx_dp,
+    RealType *h_dE_dp,
+    RealType *h_d2E_dxdp,
+    RealType *h_hvp) const {
+
+    if(num_atoms != this->num_atoms()) {
+        throw std::runtime_error("num_atoms does not match the number of atoms in param_idxs");
+    }
+    for(size_t i=0; i < param_idxs_.size(); i++) {
+        if(param_idxs_[i] < 0 || param_idxs_[i] >= num_params) {
+            throw std::runtime_error("param_idxs out of bounds");
+        }
+    }
+
+    const int N = num_atoms;
+    const int P = num_params;
+    const int DP = num_dp;
+
+    #pragma omp parallel for schedule(dynamic)
+    for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+        const RealType *x = h_coords + conf_idx*N*3;
+
+        std::vector<int> pairs;
+        cell_list_pairs(N, x, static_cast<const RealType *>(nullptr), cutoff_, pairs);
+
+        if(h_E || h_dE_dx || h_dE_dp) {
+            std::vector<RealType> dE_dx(N*3, 0);
+            std::vector<RealType> dE_dp(P, 0);
+            RealType E = derivatives_conf(N, x, h_params, pairs, &dE_dx[0], &dE_dp[0]);
+            if(h_E) {
+                h_E[conf_idx] += E;
+            }
+            if(h_dE_dx) {
+                for(int i=0; i < N*3; i++) {
+                    h_dE_dx[conf_idx*N*3+i] += dE_dx[i];
+                }
+            }
+            if(h_dE_dp) {
+                for(int p=0; p < P; p++) {
+                    if(h_param_gather_idxs[p] >= 0) {
+                        h_dE_dp[conf_idx*DP+h_param_gather_idxs[p]] += dE_dp[p];
+                    }
+                }
+            }
+        }
+
+        if(!h_d2E_dxdp && !h_hvp) {
+            continue;
+        }
+
+        std::vector<Dual<RealType> > xs(x, x+N*3);
+        std::vector<Dual<RealType> > params(h_params, h_params+P);
+        std::vector<Dual<RealType> > dE_dx(N*3);
+
+        if(h_d2E_dxdp) {
+            // one forward mode pass per parameter, parameters not in param_idxs_ are skipped
+            // since their columns are zero.
+            std::vector<bool> used(P, false);
+            for(size_t i=0; i < param_idxs_.size(); i++) {
+                used[param_idxs_[i]] = true;
+            }
+            for(int p=0; p < P; p++) {
+                const int dp_idx = h_param_gather_idxs[p];
+                if(dp_idx < 0 || !used[p]) {
+                    continue;
+                }
+                std::fill(dE_dx.begin(), dE_dx.end(), Dual<RealType>(0));
+                params[p].dual = 1;
+                derivatives_conf(N, &xs[0], &params[0], pairs, &dE_dx[0], static_cast<Dual<RealType> *>(nullptr));
+                params[p].dual = 0;
+                for(int i=0; i < N*3; i++) {
+                    h_d2E_dxdp[(conf_idx*DP+dp_idx)*N*3+i] += dE_dx[i].dual;
+                }
+            }
+        }
+
+        if(h_hvp) {
+            // one forward mode pass per tangent, seeding the coordinates instead
+            for(int dp_idx=0; dp_idx < DP; dp_idx++) {
+                const RealType *v = h_dx_dp + (conf_idx*DP+dp_idx)*N*3;
+                for(int i=0; i < N*3; i++) {
+                    xs[i].dual = v[i];
+                }
+                std::fill(dE_dx.begin(), dE_dx.end(), Dual<RealType>(0));
+                derivatives_conf(N, &xs[0], &params[0], pairs, &dE_dx[0], static_cast<Dual<RealType> *>(nullptr));
+                for(int i=0; i < N*3; i++) {
+                    h_hvp[(conf_idx*DP+dp_idx)*N*3+i] += dE_dx[i].dual;
+                }
+            }
+        }
+
+    }
+
+};
+
+template <typename RealType>
+void GBSA<RealType>::derivatives_vjp_host(
+    const int num_confs,
+    const int num_atoms,
+    const int num_params,
+    const RealType *h_coords,
+    const RealType *h_params,
+    const RealType *h_adjoint,
+    RealType *h_x_adjoint,
+    RealType *h_p_adjoint) const {
+
+    if(num_atoms != this->num_atoms()) {
+        throw std::runtime_error("num_atoms does not match the number of atoms in param_idxs");
+    }
+    for(size_t i=0; i < param_idxs_.size(); i++) {
+        if(param_idxs_[i] < 0 || param_idxs_[i] >= num_params) {
+            throw std::runtime_error("param_idxs out of bounds");
+        }
+    }
+
+    const int N = num_atoms;
+    const int P = num_params;
+
+    #pragma omp parallel for schedule(dynamic)
+    for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+        const RealType *x = h_coords + conf_idx*N*3;
+        const RealType *adjoint = h_adjoint + conf_idx*N*3;
+
+        std::vector<int> pairs;
+        cell_list_pairs(N, x, static_cast<const RealType *>(nullptr), cutoff_, pairs);
+
+        // second derivatives commute, so the tangent of dE_dp along the adjoint is the
+        // product of the adjoint with d2E_dxdp
+        std::vector<Dual<RealType> > xs(N*3);
+        for(int i=0; i < N*3; i++) {
+            xs[i] = Dual<RealType>(x[i], adjoint[i]);
+        }
+        std::vector<Dual<RealType> > params(h_params, h_params+P);
+        std::vector<Dual<RealType> > dE_dx(N*3, Dual<RealType>(0));
+        std::vector<Dual<RealType> > dE_dp(P, Dual<RealType>(0));
+
+        derivatives_conf(N, &xs[0], &params[0], pairs, &dE_dx[0], &dE_dp[0]);
+
+        if(h_x_adjoint) {
+            for(int i=0; i < N*3; i++) {
+                h_x_adjoint[conf_idx*N*3+i] += dE_dx[i].dual;
+            }
+        }
+        if(h_p_adjoint) {
+            for(int p=0; p < P; p++) {
+                h_p_adjoint[conf_idx*P+p] += dE_dp[p].dual;
+            }
+        }
+
+    }
+
+};
+
+template class GBSA<float>;
+template class GBSA<double>;
+
+}
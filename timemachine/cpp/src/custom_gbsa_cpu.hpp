@@ -0,0 +1,111 @@
+#pragma once
+
+#include "potential_cpu.hpp"
+#include <vector>
+
+namespace timemachine {
+
+/*
+
+Non-periodic OBC generalized Born with the ACE non-polar term, matching
+timemachine.potentials.implicit.gbsa. Both the descreening sums of the Born radii
+and the generalized Born pair energies only include the pairs of atoms closer
+than cutoff, which are found with a cell list, so the cost of each conformation
+grows linearly with the number of atoms. An infinite cutoff includes every pair.
+
+The forces and dE_dp are analytic, chaining the pair energies back through the
+Born radii in a second pass over the same pairs. Each column of d2E_dxdp is the
+same computation carried out in forward mode dual numbers, as is each hessian
+vector product of derivatives_hvp_host, with the coordinates seeded instead.
+derivatives_vjp_host seeds the coordinates with the adjoint, so that a single pass
+yields both of its products as the dual parts of dE_dx and dE_dp. The dense hessian
+is not supported.
+
+*/
+template <typename RealType>
+class GBSA : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> param_idxs_; // [N, 3] charge, atomic radius and scale factor
+
+    RealType dielectric_offset_;
+    RealType cutoff_;
+    RealType alpha_obc_;
+    RealType beta_obc_;
+    RealType gamma_obc_;
+    RealType prefactor_;
+    RealType probe_radius_;
+    RealType pi4Asolv_;
+
+    template <typename S>
+    S derivatives_conf(
+        const int num_atoms,
+        const S *x,
+        const S *params,
+        const std::vector<int> &pairs,
+        S *dE_dx,
+        S *dE_dp) const;
+
+public:
+
+    GBSA(
+        std::vector<int> param_idxs,
+        RealType dielectric_offset,
+        RealType cutoff,
+        RealType alpha_obc,
+        RealType beta_obc,
+        RealType gamma_obc,
+        RealType solute_dielectric,
+        RealType solvent_dielectric,
+        RealType electric_constant,
+        RealType probe_radius,
+        RealType surface_area_energy
+    );
+
+    int num_atoms() const { return param_idxs_.size()/3; }
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+};
+
+}
@@ -0,0 +1,566 @@
+#include <algorithm>
+#include <cmath>
+#include <stdexcept>
+
+#include "custom_nonbonded_cpu.hpp"
+#include "neighborlist_cpu.hpp"
+
+namespace timemachine {
+
+namespace {
+
+const double ONE_4PI_EPS0 = 138.935456;
+
+const int MAX_PAIR_PARAMS = 6;
+
+// derivatives of the energy of a single pair w.r.t. its distance and parameters
+template<typename RealType>
+struct PairDerivatives {
+    RealType E;
+    RealType dE_dr;
+    RealType d2E_dr2;
+    int num_params;
+    int param_idxs[MAX_PAIR_PARAMS]; // into params
+    RealType dE_dp[MAX_PAIR_PARAMS];
+    RealType d2E_drdp[MAX_PAIR_PARAMS];
+};
+
+template<typename RealType>
+inline void add_pair_param(PairDerivatives<RealType> &pd, int param_idx, RealType dE_dp, RealType d2E_drdp) {
+    pd.param_idxs[pd.num_params] = param_idx;
+    pd.dE_dp[pd.num_params] = dE_dp;
+    pd.d2E_drdp[pd.num_params] = d2E_drdp;
+    pd.num_params++;
+}
+
+/*
+
+Lennard-Jones energy 4*eps_ij*((sig_ij/r)^12 - (sig_ij/r)^6) of the pair (i, j) scaled
+by weight, where sig_ij = (sig_i + sig_j)/2 and eps_ij = sqrt(eps_i*eps_j).
+
+*/
+template<typename RealType>
+void lj_pair(
+    const int i,
+    const int j,
+    const RealType r,
+    const RealType weight,
+    const RealType *params,
+    const int *lj_param_idxs,
+    PairDerivatives<RealType> &pd) {
+
+    const int sig_i_idx = lj_param_idxs[i*2+0];
+    const int sig_j_idx = lj_param_idxs[j*2+0];
+    const int eps_i_idx = lj_param_idxs[i*2+1];
+    const int eps_j_idx = lj_param_idxs[j*2+1];
+
+    const RealType eps_i = params[eps_i_idx];
+    const RealType eps_j = params[eps_j_idx];
+    const RealType sig = (params[sig_i_idx] + params[sig_j_idx])/2;
+    const RealType eps = weight*std::sqrt(eps_i*eps_j);
+
+    const RealType sr = sig/r;
+    const RealType sr2 = sr*sr;
+    const RealType sr5 = sr2*sr2*sr;
+    const RealType sr6 = sr5*sr;
+    const RealType sr11 = sr6*sr5;
+    const RealType sr12 = sr6*sr6;
+
+    const RealType E = 4*eps*(sr12 - sr6);
+    const RealType dE_dr = 4*eps*(6*sr6 - 12*sr12)/r;
+
+    pd.E += E;
+    pd.dE_dr += dE_dr;
+    pd.d2E_dr2 += 4*eps*(156*sr12 - 42*sr6)/(r*r);
+
+    // each sigma contributes half of sig_ij, while eps_ij is the geometric mean
+    const RealType dE_dsig = 2*eps*(12*sr11 - 6*sr5)/r;
+    const RealType d2E_drdsig = 2*eps*(36*sr5 - 144*sr11)/(r*r);
+    add_pair_param(pd, sig_i_idx, dE_dsig, d2E_drdsig);
+    add_pair_param(pd, sig_j_idx, dE_dsig, d2E_drdsig);
+    add_pair_param(pd, eps_i_idx, E/(2*eps_i), dE_dr/(2*eps_i));
+    add_pair_param(pd, eps_j_idx, E/(2*eps_j), dE_dr/(2*eps_j));
+
+}
+
+/*
+
+Coulomb energy qi*qj/r of the pair (i, j) scaled by weight. If krf is non-zero then
+the reaction field qi*qj*(krf*r^2 - crf) is added.
+
+*/
+template<typename RealType>
+void es_pair(
+    const int i,
+    const int j,
+    const RealType r,
+    const RealType weight,
+    const RealType krf,
+    const RealType crf,
+    const RealType *params,
+    const int *charge_param_idxs,
+    PairDerivatives<RealType> &pd) {
+
+    const int q_i_idx = charge_param_idxs[i];
+    const int q_j_idx = charge_param_idxs[j];
+    const RealType q_i = params[q_i_idx];
+    const RealType q_j = params[q_j_idx];
+
+    const RealType inv_r = 1/r;
+    const RealType prefactor = weight*ONE_4PI_EPS0;
+    const RealType e = inv_r + krf*r*r - crf;
+    const RealType de_dr = 2*krf*r - inv_r*inv_r;
+
+    pd.E += prefactor*q_i*q_j*e;
+    pd.dE_dr += prefactor*q_i*q_j*de_dr;
+    pd.d2E_dr2 += prefactor*q_i*q_j*(2*inv_r*inv_r*inv_r + 2*krf);
+
+    add_pair_param(pd, q_i_idx, prefactor*q_j*e, prefactor*q_j*de_dr);
+    add_pair_param(pd, q_j_idx, prefactor*q_i*e, prefactor*q_i*de_dr);
+
+}
+
+}
+
+template <typename RealType>
+NonbondedCpu<RealType>::NonbondedCpu(
+    std::vector<int> exclusion_idxs,
+    std::vector<RealType> lj_scales,
+    std::vector<RealType> es_scales,
+    std::vector<int> lj_param_idxs,
+    std::vector<int> charge_param_idxs,
+    RealType cutoff,
+    RealType rf_dielectric
+) : exclusion_idxs_(exclusion_idxs),
+    lj_scales_(lj_scales),
+    es_scales_(es_scales),
+    lj_param_idxs_(lj_param_idxs),
+    charge_param_idxs_(charge_param_idxs),
+    cutoff_(cutoff),
+    krf_(0),
+    crf_(0) {
+
+    const size_t E = exclusion_idxs.size()/2;
+    if(exclusion_idxs.size() % 2 != 0) {
+        throw std::runtime_error("exclusion_idxs must be of shape [E, 2]");
+    }
+    if(lj_param_idxs.empty() && charge_param_idxs.empty()) {
+        throw std::runtime_error("at least one of lj_param_idxs and charge_param_idxs must be non-empty");
+    }
+    if(!lj_param_idxs.empty() && (lj_param_idxs.size() % 2 != 0 || lj_scales.size() != E)) {
+        throw std::runtime_error("lj_param_idxs must be of shape [N, 2] and lj_scales of shape [E]");
+    }
+    if(!charge_param_idxs.empty() && es_scales.size() != E) {
+        throw std::runtime_error("es_scales must be of shape [E]");
+    }
+    if(!lj_param_idxs.empty() && !charge_param_idxs.empty() && lj_param_idxs.size() != charge_param_idxs.size()*2) {
+        throw std::runtime_error("lj_param_idxs and charge_param_idxs must have the same number of atoms");
+    }
+
+    if(cutoff_ > 0) {
+        if(!(rf_dielectric >= 1)) {
+            throw std::runtime_error("rf_dielectric must be at least 1");
+        }
+        double rc = cutoff_;
+        double eps = rf_dielectric;
+        double krf = std::isinf(eps) ? 1/(2*rc*rc*rc) : (eps - 1)/((2*eps + 1)*rc*rc*rc);
+        krf_ = krf;
+        crf_ = 1/rc + krf*rc*rc;
+    }
+
+};
+
+template <typename RealType>
+void NonbondedCpu<RealType>::derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const {
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        h_d2E_dx2,
+        num_dp,
+        h_param_gather_idxs,
+        h_dE_dp,
+        h_d2E_dxdp,
+        nullptr,
+        nullptr,
+        0,
+        nullptr,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void NonbondedCpu<RealType>::derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        nullptr,
+        num_dp,
+        h_param_gather_idxs,
+        h_dE_dp,
+        h_d2E_dxdp,
+        h_dx_dp,
+        h_hvp,
+        0,
+        nullptr,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void NonbondedCpu<RealType>::derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+    // a single tangent, the adjoint, and no gathered parameters
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        nullptr,
+        nullptr,
+        nullptr,
+        1,
+        nullptr,
+        nullptr,
+        nullptr,
+        h_adjoint,
+        h_x_adjoint,
+        num_params,
+        h_p_adjoint,
+        nullptr
+    );
+
+};
+
+template <typename RealType>
+void NonbondedCpu<RealType>::derivatives_virial_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_virial) const {
+
+    std::vector<int> param_gather_idxs(num_params, -1);
+
+    this->derivatives(
+        num_confs,
+        num_atoms,
+        h_coords,
+        h_params,
+        h_E,
+        h_dE_dx,
+        nullptr,
+        0,
+        param_gather_idxs.data(),
+        nullptr,
+        nullptr,
+        nullptr,
+        nullptr,
+        0,
+        nullptr,
+        h_virial
+    );
+
+};
+
+template <typename RealType>
+void NonbondedCpu<RealType>::derivatives(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        const RealType *h_dx_dp,
+        RealType *h_hvp,
+        const int num_params,
+        RealType *h_p_adjoint,
+        RealType *h_virial) const {
+
+    const int N = num_atoms;
+    const int P = num_params;
+    const int DP = num_dp;
+    const int E = exclusion_idxs_.size()/2;
+
+    if(N != this->num_atoms()) {
+        throw std::runtime_error("num_atoms does not match the number of atoms of the parameter indices");
+    }
+
+    const bool use_lj = !lj_param_idxs_.empty();
+    const bool use_es = !charge_param_idxs_.empty();
+
+    std::vector<int> pairs;
+
+    for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+        const RealType *coords = h_coords + conf_idx*N*3;
+        RealType *dE_dx = h_dE_dx ? h_dE_dx + conf_idx*N*3 : nullptr;
+        RealType *d2E_dx2 = h_d2E_dx2 ? h_d2E_dx2 + conf_idx*N*3*N*3 : nullptr;
+        RealType *dE_dp = h_dE_dp ? h_dE_dp + conf_idx*DP : nullptr;
+        RealType *d2E_dxdp = h_d2E_dxdp ? h_d2E_dxdp + conf_idx*DP*N*3 : nullptr;
+        const RealType *dx_dp = h_dx_dp ? h_dx_dp + conf_idx*DP*N*3 : nullptr;
+        RealType *hvp = h_hvp ? h_hvp + conf_idx*DP*N*3 : nullptr;
+        RealType *p_adjoint = h_p_adjoint ? h_p_adjoint + conf_idx*P : nullptr;
+        RealType *virial = h_virial ? h_virial + conf_idx*9 : nullptr;
+
+        const bool use_cutoff = cutoff_ > 0;
+        if(use_cutoff) {
+            pairs.clear();
+            cell_list_pairs(N, coords, static_cast<const RealType *>(nullptr), cutoff_, pairs);
+        }
+        const int num_pairs = pairs.size()/2;
+
+        RealType energy = 0;
+
+        #pragma omp parallel
+        {
+            RealType local_energy = 0;
+            std::vector<RealType> local_dE_dx(dE_dx ? N*3 : 0, 0);
+            std::vector<RealType> local_hessian_diag(d2E_dx2 ? N*9 : 0, 0);
+            std::vector<RealType> local_dE_dp(dE_dp ? DP : 0, 0);
+            std::vector<RealType> local_d2E_dxdp(d2E_dxdp ? DP*N*3 : 0, 0);
+            std::vector<RealType> local_hvp(hvp ? DP*N*3 : 0, 0);
+            std::vector<RealType> local_p_adjoint(p_adjoint ? P : 0, 0);
+            RealType local_virial[9] = {0};
+
+            auto accumulate_pair = [&](int i, int j, RealType lj_weight, RealType es_weight) {
+
+                RealType dx[3];
+                RealType r2 = 0;
+                for(int d=0; d < 3; d++) {
+                    dx[d] = coords[i*3+d] - coords[j*3+d];
+                    r2 += dx[d]*dx[d];
+                }
+                if(use_cutoff && r2 >= cutoff_*cutoff_) {
+                    return;
+                }
+                const RealType r = std::sqrt(r2);
+
+                PairDerivatives<RealType> pd;
+                pd.E = 0;
+                pd.dE_dr = 0;
+                pd.d2E_dr2 = 0;
+                pd.num_params = 0;
+                if(use_lj) {
+                    lj_pair(i, j, r, lj_weight, h_params, lj_param_idxs_.data(), pd);
+                }
+                if(use_es) {
+                    es_pair(i, j, r, es_weight, krf_, crf_, h_params, charge_param_idxs_.data(), pd);
+                }
+
+                RealType u[3];
+                for(int d=0; d < 3; d++) {
+                    u[d] = dx[d]/r;
+                }
+
+                local_energy += pd.E;
+
+                if(dE_dx) {
+                    for(int d=0; d < 3; d++) {
+                        local_dE_dx[i*3+d] += pd.dE_dr*u[d];
+                        local_dE_dx[j*3+d] -= pd.dE_dr*u[d];
+                    }
+                }
+
+                if(virial) {
+                    // -r_ij (x) dE/dr_ij of the pair vector, which stays correct once dx is a minimum image
+                    for(int a=0; a < 3; a++) {
+                        for(int b=0; b < 3; b++) {
+                            local_virial[a*3+b] -= dx[a]*pd.dE_dr*u[b];
+                        }
+                    }
+                }
+
+                if(d2E_dx2 || hvp) {
+                    // d2E/dxi dxi = d2E_dr2 u u^T + dE_dr/r (I - u u^T), and the cross terms are its negation
+                    RealType K[9];
+                    for(int a=0; a < 3; a++) {
+                        for(int b=0; b < 3; b++) {
+                            K[a*3+b] = (pd.d2E_dr2 - pd.dE_dr/r)*u[a]*u[b];
+                        }
+                        K[a*3+a] += pd.dE_dr/r;
+                    }
+                    if(d2E_dx2) {
+                        for(int a=0; a < 3; a++) {
+                            for(int b=0; b < 3; b++) {
+                                local_hessian_diag[i*9 + a*3+b] += K[a*3+b];
+                                local_hessian_diag[j*9 + a*3+b] += K[a*3+b];
+                                d2E_dx2[(i*3+a)*N*3 + j*3+b] -= K[a*3+b];
+                                d2E_dx2[(j*3+a)*N*3 + i*3+b] -= K[a*3+b];
+                            }
+                        }
+                    }
+                    if(hvp) {
+                        // the pair only sees the relative displacement v_i - v_j of the tangents
+                        for(int p=0; p < DP; p++) {
+                            const RealType *v = dx_dp + p*N*3;
+                            RealType dv[3];
+                            for(int d=0; d < 3; d++) {
+                                dv[d] = v[i*3+d] - v[j*3+d];
+                            }
+                            for(int a=0; a < 3; a++) {
+                                const RealType Kdv = K[a*3+0]*dv[0] + K[a*3+1]*dv[1] + K[a*3+2]*dv[2];
+                                local_hvp[p*N*3 + i*3+a] += Kdv;
+                                local_hvp[p*N*3 + j*3+a] -= Kdv;
+                            }
+                        }
+                    }
+                }
+
+                if(p_adjoint) {
+                    // the mixed partials of x_i and x_j are d2E_drdp*u and its negation
+                    RealType u_dw = 0;
+                    for(int d=0; d < 3; d++) {
+                        u_dw += u[d]*(dx_dp[i*3+d] - dx_dp[j*3+d]);
+                    }
+                    for(int k=0; k < pd.num_params; k++) {
+                        local_p_adjoint[pd.param_idxs[k]] += pd.d2E_drdp[k]*u_dw;
+                    }
+                }
+
+                if(dE_dp || d2E_dxdp) {
+                    for(int k=0; k < pd.num_params; k++) {
+                        const int gp_idx = h_param_gather_idxs[pd.param_idxs[k]];
+                        if(gp_idx < 0) {
+                            continue;
+                        }
+                        if(dE_dp) {
+                            local_dE_dp[gp_idx] += pd.dE_dp[k];
+                        }
+                        if(d2E_dxdp) {
+                            for(int d=0; d < 3; d++) {
+                                local_d2E_dxdp[gp_idx*N*3 + i*3+d] += pd.d2E_drdp[k]*u[d];
+                                local_d2E_dxdp[gp_idx*N*3 + j*3+d] -= pd.d2E_drdp[k]*u[d];
+                            }
+                        }
+                    }
+                }
+
+            };
+
+            if(use_cutoff) {
+                #pragma omp for schedule(static)
+                for(int p=0; p < num_pairs; p++) {
+                    accumulate_pair(pairs[p*2+0], pairs[p*2+1], 1, 1);
+                }
+            } else {
+                // rows get longer with i, so they are handed out dynamically
+                #pragma omp for schedule(dynamic, 16)
+                for(int i=0; i < N; i++) {
+                    for(int j=0; j < i; j++) {
+                        accumulate_pair(i, j, 1, 1);
+                    }
+                }
+            }
+
+            // remove the over-counted part of the excluded pairs, this is a separate pass so
+            // that no two threads write to the same off diagonal hessian block
+            #pragma omp for schedule(static)
+            for(int e=0; e < E; e++) {
+                accumulate_pair(
+                    exclusion_idxs_[e*2+0],
+                    exclusion_idxs_[e*2+1],
+                    use_lj ? lj_scales_[e] - 1 : 0,
+                    use_es ? es_scales_[e] - 1 : 0
+                );
+            }
+
+            #pragma omp critical
+            {
+                energy += local_energy;
+                for(size_t k=0; k < local_dE_dx.size(); k++) {
+                    dE_dx[k] += local_dE_dx[k];
+                }
+                for(int i=0; i < static_cast<int>(local_hessian_diag.size())/9; i++) {
+                    for(int a=0; a < 3; a++) {
+                        for(int b=0; b < 3; b++) {
+                            d2E_dx2[(i*3+a)*N*3 + i*3+b] += local_hessian_diag[i*9 + a*3+b];
+                        }
+                    }
+                }
+                for(size_t k=0; k < local_dE_dp.size(); k++) {
+                    dE_dp[k] += local_dE_dp[k];
+                }
+                for(size_t k=0; k < local_d2E_dxdp.size(); k++) {
+                    d2E_dxdp[k] += local_d2E_dxdp[k];
+                }
+                for(size_t k=0; k < local_hvp.size(); k++) {
+                    hvp[k] += local_hvp[k];
+                }
+                for(size_t k=0; k < local_p_adjoint.size(); k++) {
+                    p_adjoint[k] += local_p_adjoint[k];
+                }
+                if(virial) {
+                    for(int k=0; k < 9; k++) {
+                        virial[k] += local_virial[k];
+                    }
+                }
+            }
+        }
+
+        if(h_E) {
+            h_E[conf_idx] += energy;
+        }
+
+    }
+
+};
+
+template class NonbondedCpu<float>;
+template class NonbondedCpu<double>;
+
+} // namespace timemachine
@@ -0,0 +1,176 @@
+#pragma once
+
+#include "potential_cpu.hpp"
+#include <vector>
+
+namespace timemachine {
+
+/*
+
+Host counterpart of Nonbonded, the sum of the Lennard-Jones and the electrostatic
+pair energies of timemachine.potentials.nonbonded. Either part is disabled by passing
+empty parameter indices for it, which is how LennardJonesCpu and ElectrostaticsCpu
+below are implemented.
+
+Every unique pair is evaluated, after which (1 - scale) of each excluded pair is
+subtracted. If cutoff > 0 then pairs at or beyond the cutoff are dropped, the pairs
+are found with a cell list, and the electrostatics use the reaction field with
+dielectric rf_dielectric.
+
+Pairs are split over OpenMP threads, with private force, parameter derivative and
+diagonal hessian block buffers per thread that are summed once at the end, so no
+atomics are needed. Since every pair is visited once per pass, the off diagonal
+hessian blocks are written in place. The dense hessian is full, ie. both of its
+triangles are filled. derivatives_hvp_host applies the 3x3 hessian block of each
+pair to the tangents instead, so that no O(N^2) buffer is needed, and
+derivatives_vjp_host does the same with the adjoint while contracting the mixed
+partials of each pair with it. derivatives_virial_host accumulates -r_ij (x) dE/dr_ij
+of each pair in the same pass as the forces.
+
+*/
+template <typename RealType>
+class NonbondedCpu : public PotentialCpu<RealType> {
+
+private:
+
+    std::vector<int> exclusion_idxs_; // [E, 2]
+    std::vector<RealType> lj_scales_; // [E], or empty
+    std::vector<RealType> es_scales_; // [E], or empty
+    std::vector<int> lj_param_idxs_; // [N, 2] sig eps, or empty
+    std::vector<int> charge_param_idxs_; // [N], or empty
+
+    // reaction field, disabled if cutoff_ <= 0
+    RealType cutoff_;
+    RealType krf_;
+    RealType crf_;
+
+    void derivatives(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        const RealType *h_dx_dp,
+        RealType *h_hvp,
+        const int num_params,
+        RealType *h_p_adjoint,
+        RealType *h_virial) const;
+
+public:
+
+    NonbondedCpu(
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> lj_scales,
+        std::vector<RealType> es_scales,
+        std::vector<int> lj_param_idxs,
+        std::vector<int> charge_param_idxs,
+        RealType cutoff = 0,
+        RealType rf_dielectric = 1
+    );
+
+    int num_atoms() const {
+        return charge_param_idxs_.empty() ? lj_param_idxs_.size()/2 : charge_param_idxs_.size();
+    }
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const override;
+
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const override;
+
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const override;
+
+    virtual void derivatives_virial_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_virial) const override;
+
+};
+
+// Host counterpart of LennardJones.
+template <typename RealType>
+class LennardJonesCpu : public NonbondedCpu<RealType> {
+
+public:
+
+    LennardJonesCpu(
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> exclusion_scales,
+        std::vector<int> param_idxs
+    ) : NonbondedCpu<RealType>(
+        exclusion_idxs,
+        exclusion_scales,
+        std::vector<RealType>(),
+        param_idxs,
+        std::vector<int>()) {}
+
+};
+
+// Host counterpart of Electrostatics.
+template <typename RealType>
+class ElectrostaticsCpu : public NonbondedCpu<RealType> {
+
+public:
+
+    ElectrostaticsCpu(
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> exclusion_scales,
+        std::vector<int> param_idxs,
+        RealType cutoff = 0,
+        RealType rf_dielectric = 1
+    ) : NonbondedCpu<RealType>(
+        exclusion_idxs,
+        std::vector<RealType>(),
+        exclusion_scales,
+        std::vector<int>(),
+        param_idxs,
+        cutoff,
+        rf_dielectric) {}
+
+};
+
+}
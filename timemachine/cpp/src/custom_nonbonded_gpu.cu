@@ -1,9 +1,12 @@
+#include <cmath>
 #include <stdexcept>
 
 #include "potential.hpp"
 #include "custom_nonbonded_gpu.hpp"
 #include "k_lennard_jones.cuh"
 #include "k_electrostatics.cuh"
+#include "k_nonbonded.cuh"
+#include "k_softcore_nonbonded.cuh"
 #include "kernel_utils.cuh"
 
 #include <chrono>  // for high_resolution_clock
@@ -12,21 +15,30 @@ namespace timemachine {
 
 template <typename RealType>
 LennardJones<RealType>::LennardJones(
-    std::vector<RealType> scale_matrix,
+    std::vector<int> exclusion_idxs,
+    std::vector<RealType> exclusion_scales,
     std::vector<int> param_idxs
-) {
+) : E_(exclusion_scales.size()) {
+
+    if(exclusion_idxs.size() != exclusion_scales.size()*2) {
+        throw std::runtime_error("exclusion_idxs must have shape [E, 2] matching exclusion_scales [E]");
+    }
 
     gpuErrchk(cudaMalloc((void**)&d_param_idxs_, param_idxs.size()*sizeof(*d_param_idxs_)));
-    gpuErrchk(cudaMalloc((void**)&d_scale_matrix_, scale_matrix.size()*sizeof(*d_scale_matrix_)));
     gpuErrchk(cudaMemcpy(d_param_idxs_, &param_idxs[0], param_idxs.size()*sizeof(*d_param_idxs_), cudaMemcpyHostToDevice));
-    gpuErrchk(cudaMemcpy(d_scale_matrix_, &scale_matrix[0], scale_matrix.size()*sizeof(*d_scale_matrix_), cudaMemcpyHostToDevice));
+
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_idxs_, E_*2*sizeof(*d_exclusion_idxs_)));
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_scales_, E_*sizeof(*d_exclusion_scales_)));
+    gpuErrchk(cudaMemcpy(d_exclusion_idxs_, exclusion_idxs.data(), E_*2*sizeof(*d_exclusion_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_exclusion_scales_, exclusion_scales.data(), E_*sizeof(*d_exclusion_scales_), cudaMemcpyHostToDevice));
 
 };
 
 template <typename RealType>
 LennardJones<RealType>::~LennardJones() {
     gpuErrchk(cudaFree(d_param_idxs_));
-    gpuErrchk(cudaFree(d_scale_matrix_));
+    gpuErrchk(cudaFree(d_exclusion_idxs_));
+    gpuErrchk(cudaFree(d_exclusion_scales_));
 };
 
 
@@ -60,7 +72,6 @@ void LennardJones<RealType>::derivatives_device(
         N,
         d_coords,
         d_params,
-        d_scale_matrix_,
         d_param_idxs_,
         d_E,
         d_dE_dx,
@@ -71,6 +82,31 @@ void LennardJones<RealType>::derivatives_device(
         d_dE_dp,
         d_d2E_dxdp
     );
+
+    gpuErrchk(cudaPeekAtLastError());
+
+    if(E_ > 0) {
+        int n_exclusion_blocks = (E_ + tpb - 1) / tpb;
+        dim3 dimGridExclusions(n_exclusion_blocks, dim_y, C);
+
+        k_lennard_jones_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_exclusion_scales_,
+            d_param_idxs_,
+            d_E,
+            d_dE_dx,
+            d_d2E_dx2,
+            // parameter derivatives
+            num_dp,
+            d_param_gather_idxs,
+            d_dE_dp,
+            d_d2E_dxdp
+        );
+    }
     // cudaDeviceSynchronize();
     // auto finish = std::chrono::high_resolution_clock::now();
     // std::chrono::duration<double> elapsed = finish - start;
@@ -86,21 +122,43 @@ template class LennardJones<double>;
 
 template <typename RealType>
 Electrostatics<RealType>::Electrostatics(
-    std::vector<RealType> scale_matrix,
-    std::vector<int> param_idxs
-) {
+    std::vector<int> exclusion_idxs,
+    std::vector<RealType> exclusion_scales,
+    std::vector<int> param_idxs,
+    RealType cutoff,
+    RealType rf_dielectric
+) : E_(exclusion_scales.size()), cutoff_(cutoff), krf_(0), crf_(0) {
+
+    if(exclusion_idxs.size() != exclusion_scales.size()*2) {
+        throw std::runtime_error("exclusion_idxs must have shape [E, 2] matching exclusion_scales [E]");
+    }
+
+    if(cutoff_ > 0) {
+        if(!(rf_dielectric >= 1)) {
+            throw std::runtime_error("rf_dielectric must be at least 1");
+        }
+        double rc = cutoff_;
+        double eps = rf_dielectric;
+        double krf = std::isinf(eps) ? 1/(2*rc*rc*rc) : (eps - 1)/((2*eps + 1)*rc*rc*rc);
+        krf_ = krf;
+        crf_ = 1/rc + krf*rc*rc;
+    }
 
     gpuErrchk(cudaMalloc((void**)&d_param_idxs_, param_idxs.size()*sizeof(*d_param_idxs_)));
-    gpuErrchk(cudaMalloc((void**)&d_scale_matrix_, scale_matrix.size()*sizeof(*d_scale_matrix_)));
     gpuErrchk(cudaMemcpy(d_param_idxs_, &param_idxs[0], param_idxs.size()*sizeof(*d_param_idxs_), cudaMemcpyHostToDevice));
-    gpuErrchk(cudaMemcpy(d_scale_matrix_, &scale_matrix[0], scale_matrix.size()*sizeof(*d_scale_matrix_), cudaMemcpyHostToDevice));
+
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_idxs_, E_*2*sizeof(*d_exclusion_idxs_)));
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_scales_, E_*sizeof(*d_exclusion_scales_)));
+    gpuErrchk(cudaMemcpy(d_exclusion_idxs_, exclusion_idxs.data(), E_*2*sizeof(*d_exclusion_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_exclusion_scales_, exclusion_scales.data(), E_*sizeof(*d_exclusion_scales_), cudaMemcpyHostToDevice));
 
 };
 
 template <typename RealType>
 Electrostatics<RealType>::~Electrostatics() {
     gpuErrchk(cudaFree(d_param_idxs_));
-    gpuErrchk(cudaFree(d_scale_matrix_));
+    gpuErrchk(cudaFree(d_exclusion_idxs_));
+    gpuErrchk(cudaFree(d_exclusion_scales_));
 };
 
 
@@ -134,8 +192,10 @@ void Electrostatics<RealType>::derivatives_device(
         N,
         d_coords,
         d_params,
-        d_scale_matrix_,
         d_param_idxs_,
+        cutoff_,
+        krf_,
+        crf_,
         d_E,
         d_dE_dx,
         d_d2E_dx2,
@@ -145,6 +205,34 @@ void Electrostatics<RealType>::derivatives_device(
         d_dE_dp,
         d_d2E_dxdp
     );
+
+    gpuErrchk(cudaPeekAtLastError());
+
+    if(E_ > 0) {
+        int n_exclusion_blocks = (E_ + tpb - 1) / tpb;
+        dim3 dimGridExclusions(n_exclusion_blocks, dim_y, C);
+
+        k_electrostatics_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_exclusion_scales_,
+            d_param_idxs_,
+            cutoff_,
+            krf_,
+            crf_,
+            d_E,
+            d_dE_dx,
+            d_d2E_dx2,
+            // parameter derivatives
+            num_dp,
+            d_param_gather_idxs,
+            d_dE_dp,
+            d_d2E_dxdp
+        );
+    }
     // cudaDeviceSynchronize();
     // auto finish = std::chrono::high_resolution_clock::now();
     // std::chrono::duration<double> elapsed = finish - start;
@@ -157,4 +245,400 @@ void Electrostatics<RealType>::derivatives_device(
 template class Electrostatics<float>;
 template class Electrostatics<double>;
 
+template <typename RealType>
+Nonbonded<RealType>::Nonbonded(
+    std::vector<int> exclusion_idxs,
+    std::vector<RealType> lj_scales,
+    std::vector<RealType> es_scales,
+    std::vector<int> lj_param_idxs,
+    std::vector<int> charge_param_idxs
+) : E_(lj_scales.size()) {
+
+    if(exclusion_idxs.size() != lj_scales.size()*2 || es_scales.size() != lj_scales.size()) {
+        throw std::runtime_error("exclusion_idxs must have shape [E, 2] matching lj_scales [E] and es_scales [E]");
+    }
+
+    if(lj_param_idxs.size() != charge_param_idxs.size()*2) {
+        throw std::runtime_error("lj_param_idxs must have shape [N, 2] matching charge_param_idxs [N]");
+    }
+
+    gpuErrchk(cudaMalloc((void**)&d_lj_param_idxs_, lj_param_idxs.size()*sizeof(*d_lj_param_idxs_)));
+    gpuErrchk(cudaMemcpy(d_lj_param_idxs_, &lj_param_idxs[0], lj_param_idxs.size()*sizeof(*d_lj_param_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMalloc((void**)&d_charge_param_idxs_, charge_param_idxs.size()*sizeof(*d_charge_param_idxs_)));
+    gpuErrchk(cudaMemcpy(d_charge_param_idxs_, &charge_param_idxs[0], charge_param_idxs.size()*sizeof(*d_charge_param_idxs_), cudaMemcpyHostToDevice));
+
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_idxs_, E_*2*sizeof(*d_exclusion_idxs_)));
+    gpuErrchk(cudaMalloc((void**)&d_lj_scales_, E_*sizeof(*d_lj_scales_)));
+    gpuErrchk(cudaMalloc((void**)&d_es_scales_, E_*sizeof(*d_es_scales_)));
+    gpuErrchk(cudaMemcpy(d_exclusion_idxs_, exclusion_idxs.data(), E_*2*sizeof(*d_exclusion_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_lj_scales_, lj_scales.data(), E_*sizeof(*d_lj_scales_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_es_scales_, es_scales.data(), E_*sizeof(*d_es_scales_), cudaMemcpyHostToDevice));
+
+};
+
+template <typename RealType>
+Nonbonded<RealType>::~Nonbonded() {
+    gpuErrchk(cudaFree(d_lj_param_idxs_));
+    gpuErrchk(cudaFree(d_charge_param_idxs_));
+    gpuErrchk(cudaFree(d_exclusion_idxs_));
+    gpuErrchk(cudaFree(d_lj_scales_));
+    gpuErrchk(cudaFree(d_es_scales_));
+};
+
+
+template <typename RealType>
+void Nonbonded<RealType>::derivatives_device(
+    const int num_confs,
+    const int num_atoms,
+    const RealType *d_coords,
+    const RealType *d_params,
+    RealType *d_E,
+    RealType *d_dE_dx,
+    RealType *d_d2E_dx2,
+    // parameter derivatives
+    const int num_dp,
+    const int *d_param_gather_idxs,
+    RealType *d_dE_dp,
+    RealType *d_d2E_dxdp) const {
+
+    const auto C = num_confs;
+    const auto N = num_atoms;
+
+    int tpb = 32;
+    int n_blocks = (num_atoms + tpb - 1) / tpb;
+    int dim_y = 1;
+
+    dim3 dimBlock(tpb);
+    dim3 dimGrid(n_blocks, dim_y, C); // x, y, z dims
+
+    k_nonbonded<<<dimGrid, dimBlock>>>(
+        N,
+        d_coords,
+        d_params,
+        d_lj_param_idxs_,
+        d_charge_param_idxs_,
+        d_E,
+        d_dE_dx,
+        d_d2E_dx2,
+        // parameter derivatives
+        num_dp,
+        d_param_gather_idxs,
+        d_dE_dp,
+        d_d2E_dxdp
+    );
+
+    gpuErrchk(cudaPeekAtLastError());
+
+    // the exclusions are sparse, so they are corrected by the same per-pair
+    // kernels used by LennardJones and Electrostatics
+    if(E_ > 0) {
+        int n_exclusion_blocks = (E_ + tpb - 1) / tpb;
+        dim3 dimGridExclusions(n_exclusion_blocks, dim_y, C);
+
+        k_lennard_jones_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_lj_scales_,
+            d_lj_param_idxs_,
+            d_E,
+            d_dE_dx,
+            d_d2E_dx2,
+            // parameter derivatives
+            num_dp,
+            d_param_gather_idxs,
+            d_dE_dp,
+            d_d2E_dxdp
+        );
+
+        gpuErrchk(cudaPeekAtLastError());
+
+        k_electrostatics_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_es_scales_,
+            d_charge_param_idxs_,
+            static_cast<RealType>(0), // no reaction field
+            static_cast<RealType>(0),
+            static_cast<RealType>(0),
+            d_E,
+            d_dE_dx,
+            d_d2E_dx2,
+            // parameter derivatives
+            num_dp,
+            d_param_gather_idxs,
+            d_dE_dp,
+            d_d2E_dxdp
+        );
+    }
+
+    gpuErrchk(cudaPeekAtLastError());
+
+};
+
+template class Nonbonded<float>;
+template class Nonbonded<double>;
+
+template <typename RealType>
+SoftcoreNonbonded<RealType>::SoftcoreNonbonded(
+    std::vector<int> exclusion_idxs,
+    std::vector<RealType> lj_scales,
+    std::vector<RealType> es_scales,
+    std::vector<int> lj_param_idxs,
+    std::vector<int> charge_param_idxs,
+    std::vector<int> alchemical_flags,
+    RealType lambda,
+    RealType sc_alpha,
+    RealType sc_beta
+) : E_(lj_scales.size()), lambda_(lambda), sc_alpha_(sc_alpha), sc_beta_(sc_beta) {
+
+    if(exclusion_idxs.size() != lj_scales.size()*2) {
+        throw std::runtime_error("exclusion_idxs must have shape [E, 2] matching lj_scales [E]");
+    }
+
+    if(es_scales.size() != lj_scales.size()) {
+        throw std::runtime_error("es_scales must have the same shape as lj_scales");
+    }
+
+    const int N = charge_param_idxs.size();
+
+    if(lj_param_idxs.size() != N*2) {
+        throw std::runtime_error("lj_param_idxs must have shape [N, 2] matching charge_param_idxs [N]");
+    }
+
+    if(alchemical_flags.size() != N) {
+        throw std::runtime_error("alchemical_flags must have shape [N] matching charge_param_idxs [N]");
+    }
+
+    gpuErrchk(cudaMalloc((void**)&d_lj_param_idxs_, N*2*sizeof(*d_lj_param_idxs_)));
+    gpuErrchk(cudaMemcpy(d_lj_param_idxs_, lj_param_idxs.data(), N*2*sizeof(*d_lj_param_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMalloc((void**)&d_charge_param_idxs_, N*sizeof(*d_charge_param_idxs_)));
+    gpuErrchk(cudaMemcpy(d_charge_param_idxs_, charge_param_idxs.data(), N*sizeof(*d_charge_param_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMalloc((void**)&d_alchemical_flags_, N*sizeof(*d_alchemical_flags_)));
+    gpuErrchk(cudaMemcpy(d_alchemical_flags_, alchemical_flags.data(), N*sizeof(*d_alchemical_flags_), cudaMemcpyHostToDevice));
+
+    gpuErrchk(cudaMalloc((void**)&d_exclusion_idxs_, E_*2*sizeof(*d_exclusion_idxs_)));
+    gpuErrchk(cudaMalloc((void**)&d_lj_scales_, E_*sizeof(*d_lj_scales_)));
+    gpuErrchk(cudaMalloc((void**)&d_es_scales_, E_*sizeof(*d_es_scales_)));
+    gpuErrchk(cudaMemcpy(d_exclusion_idxs_, exclusion_idxs.data(), E_*2*sizeof(*d_exclusion_idxs_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_lj_scales_, lj_scales.data(), E_*sizeof(*d_lj_scales_), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_es_scales_, es_scales.data(), E_*sizeof(*d_es_scales_), cudaMemcpyHostToDevice));
+
+    gpuErrchk(cudaMalloc((void**)&d_lambda_, sizeof(*d_lambda_)));
+    gpuErrchk(cudaMemcpy(d_lambda_, &lambda_, sizeof(*d_lambda_), cudaMemcpyHostToDevice));
+
+};
+
+template <typename RealType>
+SoftcoreNonbonded<RealType>::~SoftcoreNonbonded() {
+    gpuErrchk(cudaFree(d_lj_param_idxs_));
+    gpuErrchk(cudaFree(d_charge_param_idxs_));
+    gpuErrchk(cudaFree(d_alchemical_flags_));
+    gpuErrchk(cudaFree(d_exclusion_idxs_));
+    gpuErrchk(cudaFree(d_lj_scales_));
+    gpuErrchk(cudaFree(d_es_scales_));
+    gpuErrchk(cudaFree(d_lambda_));
+};
+
+template <typename RealType>
+void SoftcoreNonbonded<RealType>::set_lambda(RealType lambda) {
+    lambda_ = lambda;
+    gpuErrchk(cudaMemcpy(d_lambda_, &lambda_, sizeof(*d_lambda_), cudaMemcpyHostToDevice));
+};
+
+template <typename RealType>
+void SoftcoreNonbonded<RealType>::derivatives_device(
+    const int num_confs,
+    const int num_atoms,
+    const RealType *d_coords,
+    const RealType *d_params,
+    RealType *d_E,
+    RealType *d_dE_dx,
+    RealType *d_d2E_dx2,
+    // parameter derivatives
+    const int num_dp,
+    const int *d_param_gather_idxs,
+    RealType *d_dE_dp,
+    RealType *d_d2E_dxdp) const {
+
+    // the softcore kernels only accumulate energies and forces, so fail loudly rather
+    // than return zeros for the parameter derivatives. The dense hessian buffer is
+    // always handed over by Context and the python wrapper and is left untouched.
+    if(num_dp > 0) {
+        throw std::runtime_error("SoftcoreNonbonded does not support parameter derivatives, dp_idxs must be empty");
+    }
+
+    const auto C = num_confs;
+    const auto N = num_atoms;
+
+    int tpb = 32;
+    int n_blocks = (num_atoms + tpb - 1) / tpb;
+    int dim_y = 1;
+
+    dim3 dimBlock(tpb);
+    dim3 dimGrid(n_blocks, dim_y, C); // x, y, z dims
+
+    // a single lambda window, so d_E is [C, 1]
+    k_softcore_nonbonded<<<dimGrid, dimBlock>>>(
+        N,
+        d_coords,
+        d_params,
+        d_lj_param_idxs_,
+        d_charge_param_idxs_,
+        d_alchemical_flags_,
+        1,
+        d_lambda_,
+        sc_alpha_,
+        sc_beta_,
+        d_E,
+        d_dE_dx
+    );
+
+    gpuErrchk(cudaPeekAtLastError());
+
+    if(E_ > 0) {
+        int n_exclusion_blocks = (E_ + tpb - 1) / tpb;
+        dim3 dimGridExclusions(n_exclusion_blocks, dim_y, C);
+
+        k_softcore_nonbonded_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_lj_scales_,
+            d_es_scales_,
+            d_lj_param_idxs_,
+            d_charge_param_idxs_,
+            d_alchemical_flags_,
+            1,
+            d_lambda_,
+            sc_alpha_,
+            sc_beta_,
+            d_E,
+            d_dE_dx
+        );
+    }
+
+    gpuErrchk(cudaPeekAtLastError());
+
+};
+
+template <typename RealType>
+void SoftcoreNonbonded<RealType>::lambda_energies_device(
+    const int num_confs,
+    const int num_atoms,
+    const RealType *d_coords,
+    const RealType *d_params,
+    const int num_lambdas,
+    const RealType *d_lambdas,
+    RealType *d_E) const {
+
+    const auto C = num_confs;
+    const auto N = num_atoms;
+    const auto K = num_lambdas;
+
+    int tpb = 32;
+    int n_blocks = (num_atoms + tpb - 1) / tpb;
+    int dim_y = 1;
+
+    dim3 dimBlock(tpb);
+    dim3 dimGrid(n_blocks, dim_y, C); // x, y, z dims
+
+    k_softcore_nonbonded<<<dimGrid, dimBlock>>>(
+        N,
+        d_coords,
+        d_params,
+        d_lj_param_idxs_,
+        d_charge_param_idxs_,
+        d_alchemical_flags_,
+        K,
+        d_lambdas,
+        sc_alpha_,
+        sc_beta_,
+        d_E,
+        static_cast<RealType*>(nullptr)
+    );
+
+    gpuErrchk(cudaPeekAtLastError());
+
+    if(E_ > 0) {
+        int n_exclusion_blocks = (E_ + tpb - 1) / tpb;
+        dim3 dimGridExclusions(n_exclusion_blocks, dim_y, C);
+
+        k_softcore_nonbonded_exclusion<<<dimGridExclusions, dimBlock>>>(
+            N,
+            d_coords,
+            d_params,
+            E_,
+            d_exclusion_idxs_,
+            d_lj_scales_,
+            d_es_scales_,
+            d_lj_param_idxs_,
+            d_charge_param_idxs_,
+            d_alchemical_flags_,
+            K,
+            d_lambdas,
+            sc_alpha_,
+            sc_beta_,
+            d_E,
+            static_cast<RealType*>(nullptr)
+        );
+    }
+
+    gpuErrchk(cudaPeekAtLastError());
+
+};
+
+template <typename RealType>
+void SoftcoreNonbonded<RealType>::lambda_energies_host(
+    const int num_confs,
+    const int num_atoms,
+    const int num_params,
+    const RealType *h_coords,
+    const RealType *h_params,
+    const int num_lambdas,
+    const RealType *h_lambdas,
+    RealType *h_E) const {
+
+    const auto C = num_confs;
+    const auto N = num_atoms;
+    const auto P = num_params;
+    const auto K = num_lambdas;
+
+    RealType* d_coords = nullptr;
+    RealType* d_params = nullptr;
+    RealType* d_lambdas = nullptr;
+    RealType* d_E = nullptr;
+
+    gpuErrchk(cudaMalloc((void**)&d_coords, C*N*3*sizeof(RealType)));
+    gpuErrchk(cudaMalloc((void**)&d_params, P*sizeof(RealType)));
+    gpuErrchk(cudaMalloc((void**)&d_lambdas, K*sizeof(RealType)));
+    gpuErrchk(cudaMalloc((void**)&d_E, C*K*sizeof(RealType)));
+
+    gpuErrchk(cudaMemcpy(d_coords, h_coords, C*N*3*sizeof(RealType), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_params, h_params, P*sizeof(RealType), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemcpy(d_lambdas, h_lambdas, K*sizeof(RealType), cudaMemcpyHostToDevice));
+    gpuErrchk(cudaMemset(d_E, 0, C*K*sizeof(RealType)));
+
+    this->lambda_energies_device(C, N, d_coords, d_params, K, d_lambdas, d_E);
+
+    gpuErrchk(cudaMemcpy(h_E, d_E, C*K*sizeof(RealType), cudaMemcpyDeviceToHost));
+
+    gpuErrchk(cudaFree(d_coords));
+    gpuErrchk(cudaFree(d_params));
+    gpuErrchk(cudaFree(d_lambdas));
+    gpuErrchk(cudaFree(d_E));
+
+};
+
+template class SoftcoreNonbonded<float>;
+template class SoftcoreNonbonded<double>;
+
+
 }
\ No newline at end of file
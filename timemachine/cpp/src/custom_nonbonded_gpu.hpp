@@ -11,13 +11,17 @@ class LennardJones : public Potential<RealType> {
 
 private:
 
-    RealType* d_scale_matrix_;
+    const int E_;
+
+    int* d_exclusion_idxs_; // [E, 2]
+    RealType* d_exclusion_scales_; // [E]
     int* d_param_idxs_;
 
 public:
 
     LennardJones(
-        std::vector<RealType> scale_matrix,
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> exclusion_scales,
         std::vector<int> param_idxs
     );
 
@@ -46,14 +50,27 @@ class Electrostatics : public Potential<RealType> {
 
 private:
 
-    RealType* d_scale_matrix_;
+    const int E_;
+
+    int* d_exclusion_idxs_; // [E, 2]
+    RealType* d_exclusion_scales_; // [E]
     int* d_param_idxs_;
 
+    // reaction field, disabled if cutoff_ <= 0
+    RealType cutoff_;
+    RealType krf_;
+    RealType crf_;
+
 public:
 
+    // if cutoff > 0 then pairs beyond the cutoff are discarded and the reaction field
+    // approximation with dielectric rf_dielectric is used.
     Electrostatics(
-        std::vector<RealType> scale_matrix,
-        std::vector<int> param_idxs
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> exclusion_scales,
+        std::vector<int> param_idxs,
+        RealType cutoff = 0,
+        RealType rf_dielectric = 1
     );
 
     ~Electrostatics();
@@ -75,5 +92,130 @@ public:
 
 };
 
+template <typename RealType>
+class Nonbonded : public Potential<RealType> {
+
+private:
+
+    const int E_;
+
+    int* d_exclusion_idxs_; // [E, 2]
+    RealType* d_lj_scales_; // [E]
+    RealType* d_es_scales_; // [E]
+    int* d_lj_param_idxs_; // [N, 2]
+    int* d_charge_param_idxs_; // [N]
+
+public:
+
+    Nonbonded(
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> lj_scales,
+        std::vector<RealType> es_scales,
+        std::vector<int> lj_param_idxs,
+        std::vector<int> charge_param_idxs
+    );
+
+    ~Nonbonded();
+
+    virtual void derivatives_device(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *d_coords,
+        const RealType *d_params,
+        RealType *d_E,
+        RealType *d_dE_dx,
+        RealType *d_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *d_param_gather_idxs,
+        RealType *d_dE_dp,
+        RealType *d_d2E_dxdp) const override;
+
+
+};
+
+
+// Soft-core Lennard-Jones and electrostatics that decouple the alchemical atoms from the
+// rest of the system as lambda goes from 0 to 1, see nonbonded.softcore_nonbonded.
+// derivatives_device computes the energy and forces at the current lambda and throws if
+// any parameter derivatives are requested. The Hessian is not computed and is left untouched.
+// lambda_energies computes the energies of many lambda windows from one pass over the pairs.
+template <typename RealType>
+class SoftcoreNonbonded : public Potential<RealType> {
+
+private:
+
+    const int E_;
+
+    int* d_exclusion_idxs_; // [E, 2]
+    RealType* d_lj_scales_; // [E]
+    RealType* d_es_scales_; // [E]
+    int* d_lj_param_idxs_; // [N, 2]
+    int* d_charge_param_idxs_; // [N]
+    int* d_alchemical_flags_; // [N]
+    RealType* d_lambda_; // [1]
+
+    RealType lambda_;
+    const RealType sc_alpha_;
+    const RealType sc_beta_;
+
+public:
+
+    SoftcoreNonbonded(
+        std::vector<int> exclusion_idxs,
+        std::vector<RealType> lj_scales,
+        std::vector<RealType> es_scales,
+        std::vector<int> lj_param_idxs,
+        std::vector<int> charge_param_idxs,
+        std::vector<int> alchemical_flags,
+        RealType lambda,
+        RealType sc_alpha,
+        RealType sc_beta
+    );
+
+    ~SoftcoreNonbonded();
+
+    RealType get_lambda() const {
+        return lambda_;
+    }
+
+    void set_lambda(RealType lambda);
+
+    virtual void derivatives_device(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *d_coords,
+        const RealType *d_params,
+        RealType *d_E,
+        RealType *d_dE_dx,
+        RealType *d_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *d_param_gather_idxs,
+        RealType *d_dE_dp,
+        RealType *d_d2E_dxdp) const override;
+
+    // accumulates the energies of each conformation at each lambda into d_E [C, K]
+    void lambda_energies_device(
+        const int num_confs,
+        const int num_atoms,
+        const RealType *d_coords,
+        const RealType *d_params,
+        const int num_lambdas,
+        const RealType *d_lambdas,
+        RealType *d_E) const;
+
+    void lambda_energies_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const int num_lambdas,
+        const RealType *h_lambdas,
+        RealType *h_E) const;
+
+};
+
 
 }
\ No newline at end of file
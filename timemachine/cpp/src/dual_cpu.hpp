@@ -0,0 +1,75 @@
+#pragma once
+
+#include <cmath>
+
+namespace timemachine {
+
+/*
+
+Host forward mode dual number, the CPU counterpart of Surreal. Templated code
+that is written against a generic scalar type can be instantiated with Dual to
+get a single directional derivative alongside the value, eg. one column of
+d2E_dxdp from the analytic dE_dx by seeding the dual part of one parameter.
+
+*/
+template<typename RealType>
+struct Dual {
+
+    RealType real, dual;
+
+    Dual(const RealType &v=0, const RealType &d=0) : real(v), dual(d) {}
+
+    Dual &operator+=(const Dual &z) { real += z.real; dual += z.dual; return *this; }
+    Dual &operator-=(const Dual &z) { real -= z.real; dual -= z.dual; return *this; }
+    Dual &operator*=(const Dual &z) { *this = *this*z; return *this; }
+    Dual &operator/=(const Dual &z) { *this = *this/z; return *this; }
+
+    Dual operator-() const { return Dual(-real, -dual); }
+
+    friend Dual operator+(const Dual &a, const Dual &b) { return Dual(a.real+b.real, a.dual+b.dual); }
+    friend Dual operator-(const Dual &a, const Dual &b) { return Dual(a.real-b.real, a.dual-b.dual); }
+    friend Dual operator*(const Dual &a, const Dual &b) { return Dual(a.real*b.real, a.dual*b.real + a.real*b.dual); }
+    friend Dual operator/(const Dual &a, const Dual &b) {
+        return Dual(a.real/b.real, (a.dual*b.real - a.real*b.dual)/(b.real*b.real));
+    }
+
+    friend Dual operator+(const Dual &a, const RealType &b) { return Dual(a.real+b, a.dual); }
+    friend Dual operator+(const RealType &a, const Dual &b) { return Dual(a+b.real, b.dual); }
+    friend Dual operator-(const Dual &a, const RealType &b) { return Dual(a.real-b, a.dual); }
+    friend Dual operator-(const RealType &a, const Dual &b) { return Dual(a-b.real, -b.dual); }
+    friend Dual operator*(const Dual &a, const RealType &b) { return Dual(a.real*b, a.dual*b); }
+    friend Dual operator*(const RealType &a, const Dual &b) { return Dual(a*b.real, a*b.dual); }
+    friend Dual operator/(const Dual &a, const RealType &b) { return Dual(a.real/b, a.dual/b); }
+    friend Dual operator/(const RealType &a, const Dual &b) {
+        return Dual(a/b.real, -a*b.dual/(b.real*b.real));
+    }
+
+    friend Dual sqrt(const Dual &a) {
+        const RealType s = std::sqrt(a.real);
+        return Dual(s, a.dual/(2*s));
+    }
+
+    friend Dual exp(const Dual &a) {
+        const RealType e = std::exp(a.real);
+        return Dual(e, e*a.dual);
+    }
+
+    friend Dual log(const Dual &a) { return Dual(std::log(a.real), a.dual/a.real); }
+
+    friend Dual tanh(const Dual &a) {
+        const RealType t = std::tanh(a.real);
+        return Dual(t, (1-t*t)*a.dual);
+    }
+
+    friend Dual fabs(const Dual &a) { return a.real < 0 ? -a : a; }
+
+};
+
+// value of a scalar without its derivative parts, for branching in generic code
+inline float real_part(const float &x) { return x; }
+inline double real_part(const double &x) { return x; }
+
+template<typename RealType>
+inline RealType real_part(const Dual<RealType> &x) { return x.real; }
+
+}
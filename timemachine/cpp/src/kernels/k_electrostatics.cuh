@@ -7,8 +7,10 @@ void __global__ k_electrostatics(
     const int num_atoms,    // n
     const RealType *coords, // [n, 3]
     const RealType *params, // [p,]
-    const RealType *scale_matrix, // [n, n]
     const int *param_idxs,  // [n, 1] charge
+    const RealType cutoff,   // reaction field cutoff, all pairs interact if <= 0
+    const RealType krf,      // reaction field constants, zero for plain coulomb
+    const RealType crf,
     RealType *E,             // [,] or null
     RealType *dE_dx,         // [n,3] or null
     RealType *d2E_dx2,       // [C, n, 3, n, 3] or null, hessian
@@ -128,31 +130,33 @@ void __global__ k_electrostatics(
                 RealType d2ij = d2x + d2y + d2z;
                 RealType dij = sqrt(d2ij);
                 RealType d3ij = d2ij*dij;
-                RealType inv_d3ij = 1/d3ij;
+                RealType grad_dij = 1/d3ij - 2*krf;
                 RealType d5ij = d3ij*d2ij;
 
-                RealType sij = scale_matrix[h_i_idx*N + h_j_idx];
-                RealType so4eq01 = sij*ONE_4PI_EPS0*qi*q1;
-                RealType hess_prefactor = so4eq01/d5ij;
+                // pairs beyond the cutoff do not interact
+                RealType o4e = (cutoff > 0 && d2ij >= cutoff*cutoff) ? 0 : ONE_4PI_EPS0;
+                RealType o4eq01 = o4e*qi*q1;
+                RealType hess_prefactor = o4eq01/d5ij;
+                RealType hess_rf = 2*krf*o4eq01;
 
                 if(d2E_dx2) {
                     // don't need atomic adds because these are unique diagonals
-                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 0, 0)] += hess_prefactor*(d2ij - 3*d2x);
+                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 0, 0)] += (hess_prefactor*(d2ij - 3*d2x) - hess_rf);
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 0, 1)] += -3*hess_prefactor*dx*dy;
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 0, 2)] += -3*hess_prefactor*dx*dz;
 
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 1, 0)] += -3*hess_prefactor*dx*dy;
-                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 1, 1)] += hess_prefactor*(d2ij - 3*d2y);
+                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 1, 1)] += (hess_prefactor*(d2ij - 3*d2y) - hess_rf);
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 1, 2)] += -3*hess_prefactor*dy*dz;
 
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 2, 0)] += -3*hess_prefactor*dx*dz;
                     d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 2, 1)] += -3*hess_prefactor*dy*dz;
-                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 2, 2)] += hess_prefactor*(d2ij - 3*d2z);
+                    d2E_dx2[conf_idx*N*3*N*3+HESS_IDX(h_i_idx, h_j_idx, N, 2, 2)] += (hess_prefactor*(d2ij - 3*d2z) - hess_rf);
                 }
 
                 if(d2E_dxdp) {
 
-                    RealType mp_prefactor = sij*ONE_4PI_EPS0*inv_d3ij;
+                    RealType mp_prefactor = o4e*grad_dij;
 
                     RealType PREFACTOR_QI_GRAD = mp_prefactor*q1;
                     RealType PREFACTOR_QJ_GRAD = mp_prefactor*qi;
@@ -192,21 +196,24 @@ void __global__ k_electrostatics(
                 RealType d2ij = d2x + d2y + d2z;
                 RealType dij = sqrt(d2ij);
                 RealType d3ij = d2ij*dij;
-                RealType inv_d3ij = 1/d3ij;
+                RealType grad_dij = 1/d3ij - 2*krf;
                 RealType d5ij = d3ij*d2ij;
+                RealType e_dij = 1/dij + krf*d2ij - crf;
 
-                RealType sij = scale_matrix[i_idx*N + j_idx];
-                RealType so4eq01 = sij*ONE_4PI_EPS0*q0*q1;
-                RealType grad_prefactor = so4eq01*inv_d3ij;
-                RealType hess_prefactor = so4eq01/d5ij;
+                // pairs beyond the cutoff do not interact
+                RealType o4e = (cutoff > 0 && d2ij >= cutoff*cutoff) ? 0 : ONE_4PI_EPS0;
+                RealType o4eq01 = o4e*q0*q1;
+                RealType grad_prefactor = o4eq01*grad_dij;
+                RealType hess_prefactor = o4eq01/d5ij;
+                RealType hess_rf = 2*krf*o4eq01;
 
                 if(E) {
-                    energy += (sij*ONE_4PI_EPS0*q0*q1)/dij;
+                    energy += o4eq01*e_dij;
                 }
 
                 if(dE_dp) {
-                    dE_dp_q += (sij*ONE_4PI_EPS0*q1)/dij;
-                    shfl_dE_dp_q += (sij*ONE_4PI_EPS0*q0)/dij;
+                    dE_dp_q += o4e*q1*e_dij;
+                    shfl_dE_dp_q += o4e*q0*e_dij;
                 }
 
                 grad_dx -= grad_prefactor*dx;
@@ -220,7 +227,7 @@ void __global__ k_electrostatics(
                 // (ytz) todo: optimize for individual dxdps
                 if(d2E_dxdp) {
 
-                    RealType mp_prefactor = sij*ONE_4PI_EPS0*inv_d3ij;
+                    RealType mp_prefactor = o4e*grad_dij;
 
                     RealType PREFACTOR_QI_GRAD = mp_prefactor*q1;
                     RealType PREFACTOR_QJ_GRAD = mp_prefactor*q0;
@@ -238,19 +245,19 @@ void __global__ k_electrostatics(
 
                 // hessians
                 if(d2E_dx2) {
-                    hess_xx += hess_prefactor*(-d2ij + 3*d2x);
+                    hess_xx += (hess_prefactor*(-d2ij + 3*d2x) + hess_rf);
                     hess_yx += 3*hess_prefactor*dx*dy;
-                    hess_yy += hess_prefactor*(-d2ij + 3*d2y);
+                    hess_yy += (hess_prefactor*(-d2ij + 3*d2y) + hess_rf);
                     hess_zx += 3*hess_prefactor*dx*dz;
                     hess_zy += 3*hess_prefactor*dy*dz;
-                    hess_zz += hess_prefactor*(-d2ij + 3*d2z);
+                    hess_zz += (hess_prefactor*(-d2ij + 3*d2z) + hess_rf);
 
-                    shfl_hess_xx += hess_prefactor*(-d2ij + 3*d2x);
+                    shfl_hess_xx += (hess_prefactor*(-d2ij + 3*d2x) + hess_rf);
                     shfl_hess_yx += 3*hess_prefactor*dx*dy;
-                    shfl_hess_yy += hess_prefactor*(-d2ij + 3*d2y);
+                    shfl_hess_yy += (hess_prefactor*(-d2ij + 3*d2y) + hess_rf);
                     shfl_hess_zx += 3*hess_prefactor*dx*dz;
                     shfl_hess_zy += 3*hess_prefactor*dy*dz;
-                    shfl_hess_zz += hess_prefactor*(-d2ij + 3*d2z);
+                    shfl_hess_zz += (hess_prefactor*(-d2ij + 3*d2z) + hess_rf);
 
                 }
 
@@ -367,4 +374,168 @@ void __global__ k_electrostatics(
         }
     }
 
-}
\ No newline at end of file
+}
+
+template<typename RealType>
+void __global__ k_electrostatics_exclusion(
+    const int num_atoms,    // n
+    const RealType *coords, // [n, 3]
+    const RealType *params, // [p,]
+    const int num_exclusions, // e
+    const int *exclusion_idxs, // [e, 2]
+    const RealType *exclusion_scales, // [e,]
+    const int *param_idxs,  // [n, 1] charge
+    const RealType cutoff,   // reaction field cutoff, all pairs interact if <= 0
+    const RealType krf,      // reaction field constants, zero for plain coulomb
+    const RealType crf,
+    RealType *E,             // [,] or null
+    RealType *dE_dx,         // [n,3] or null
+    RealType *d2E_dx2,       // [C, n, 3, n, 3] or null, hessian
+    // parameters used for computing derivatives
+    const int num_dp,        // dp, number of parameters we're differentiating w.r.t. 
+    const int *param_gather_idxs, // [p,] if -1, then we discard
+    RealType *dE_dp,         // [C, dp,] or null
+    RealType *d2E_dxdp       // [C, dp, n, 3] or null
+) {
+
+    // k_electrostatics computes every pair at full strength, this removes (1-s)
+    // of each excluded pair's interaction.
+
+    const auto conf_idx = blockIdx.z;
+    const int N = num_atoms;
+    const int DP = num_dp;
+    const auto e_idx = blockDim.x*blockIdx.x + threadIdx.x;
+
+    if(e_idx >= num_exclusions) {
+        return;
+    }
+
+    int i_idx = exclusion_idxs[e_idx*2+0];
+    int j_idx = exclusion_idxs[e_idx*2+1];
+
+    RealType sij = exclusion_scales[e_idx] - 1;
+
+    RealType x0 = coords[conf_idx*N*3+i_idx*3+0];
+    RealType y0 = coords[conf_idx*N*3+i_idx*3+1];
+    RealType z0 = coords[conf_idx*N*3+i_idx*3+2];
+    RealType x1 = coords[conf_idx*N*3+j_idx*3+0];
+    RealType y1 = coords[conf_idx*N*3+j_idx*3+1];
+    RealType z1 = coords[conf_idx*N*3+j_idx*3+2];
+
+    RealType q0 = params[param_idxs[i_idx]];
+    RealType q1 = params[param_idxs[j_idx]];
+    int q0_g_idx = param_gather_idxs[param_idxs[i_idx]]; // may be -1
+    int q1_g_idx = param_gather_idxs[param_idxs[j_idx]]; // may be -1
+
+    RealType dx = x0 - x1;
+    RealType dy = y0 - y1;
+    RealType dz = z0 - z1;
+    RealType d2x = dx*dx;
+    RealType d2y = dy*dy;
+    RealType d2z = dz*dz;
+
+    RealType d2ij = d2x + d2y + d2z;
+    RealType dij = sqrt(d2ij);
+    RealType d3ij = d2ij*dij;
+    RealType grad_dij = 1/d3ij - 2*krf;
+    RealType d5ij = d3ij*d2ij;
+    RealType e_dij = 1/dij + krf*d2ij - crf;
+
+    // pairs beyond the cutoff were never included
+    RealType o4e = (cutoff > 0 && d2ij >= cutoff*cutoff) ? 0 : ONE_4PI_EPS0;
+    RealType so4eq01 = sij*o4e*q0*q1;
+
+    if(E) {
+        atomicAdd(E + conf_idx, so4eq01*e_dij);
+    }
+
+    if(dE_dx) {
+        RealType grad_prefactor = so4eq01*grad_dij;
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 0, -grad_prefactor*dx);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 1, -grad_prefactor*dy);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 2, -grad_prefactor*dz);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 0,  grad_prefactor*dx);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 1,  grad_prefactor*dy);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 2,  grad_prefactor*dz);
+    }
+
+    if(d2E_dx2) {
+        RealType hess_prefactor = so4eq01/d5ij;
+        RealType hess_rf = 2*krf*so4eq01;
+
+        RealType hess_xx = (hess_prefactor*(-d2ij + 3*d2x) + hess_rf);
+        RealType hess_yx = 3*hess_prefactor*dx*dy;
+        RealType hess_yy = (hess_prefactor*(-d2ij + 3*d2y) + hess_rf);
+        RealType hess_zx = 3*hess_prefactor*dx*dz;
+        RealType hess_zy = 3*hess_prefactor*dy*dz;
+        RealType hess_zz = (hess_prefactor*(-d2ij + 3*d2z) + hess_rf);
+
+        // diagonal blocks, lower triangle only
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 0, 0), hess_xx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 1, 0), hess_yx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 1, 1), hess_yy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 0), hess_zx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 1), hess_zy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 2), hess_zz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 0, 0), hess_xx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 1, 0), hess_yx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 1, 1), hess_yy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 0), hess_zx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 1), hess_zy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 2), hess_zz);
+
+        // off diagonal block, stored in the lower triangle
+        int h_i_idx = i_idx > j_idx ? i_idx : j_idx;
+        int h_j_idx = i_idx > j_idx ? j_idx : i_idx;
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 0), (hess_prefactor*(d2ij - 3*d2x) - hess_rf));
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 1), -3*hess_prefactor*dx*dy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 2), -3*hess_prefactor*dx*dz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 0), -3*hess_prefactor*dx*dy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 1), (hess_prefactor*(d2ij - 3*d2y) - hess_rf));
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 2), -3*hess_prefactor*dy*dz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 0), -3*hess_prefactor*dx*dz);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 1), -3*hess_prefactor*dy*dz);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 2), (hess_prefactor*(d2ij - 3*d2z) - hess_rf));
+    }
+
+    if(dE_dp) {
+        if(q0_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + q0_g_idx, sij*o4e*q1*e_dij);
+        }
+        if(q1_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + q1_g_idx, sij*o4e*q0*e_dij);
+        }
+    }
+
+    if(d2E_dxdp) {
+        RealType mp_prefactor = sij*o4e*grad_dij;
+
+        RealType PREFACTOR_QI_GRAD = mp_prefactor*q1;
+        RealType PREFACTOR_QJ_GRAD = mp_prefactor*q0;
+
+        if(q0_g_idx >= 0) {
+            RealType *mp_out_q0 = d2E_dxdp + conf_idx*DP*N*3 + q0_g_idx*N*3;
+            atomicAdd(mp_out_q0 + i_idx*3 + 0, PREFACTOR_QI_GRAD * (-dx));
+            atomicAdd(mp_out_q0 + i_idx*3 + 1, PREFACTOR_QI_GRAD * (-dy));
+            atomicAdd(mp_out_q0 + i_idx*3 + 2, PREFACTOR_QI_GRAD * (-dz));
+            atomicAdd(mp_out_q0 + j_idx*3 + 0, PREFACTOR_QI_GRAD * dx);
+            atomicAdd(mp_out_q0 + j_idx*3 + 1, PREFACTOR_QI_GRAD * dy);
+            atomicAdd(mp_out_q0 + j_idx*3 + 2, PREFACTOR_QI_GRAD * dz);
+        }
+
+        if(q1_g_idx >= 0) {
+            RealType *mp_out_q1 = d2E_dxdp + conf_idx*DP*N*3 + q1_g_idx*N*3;
+            atomicAdd(mp_out_q1 + i_idx*3 + 0, PREFACTOR_QJ_GRAD * (-dx));
+            atomicAdd(mp_out_q1 + i_idx*3 + 1, PREFACTOR_QJ_GRAD * (-dy));
+            atomicAdd(mp_out_q1 + i_idx*3 + 2, PREFACTOR_QJ_GRAD * (-dz));
+            atomicAdd(mp_out_q1 + j_idx*3 + 0, PREFACTOR_QJ_GRAD * dx);
+            atomicAdd(mp_out_q1 + j_idx*3 + 1, PREFACTOR_QJ_GRAD * dy);
+            atomicAdd(mp_out_q1 + j_idx*3 + 2, PREFACTOR_QJ_GRAD * dz);
+        }
+    }
+
+}
@@ -7,7 +7,6 @@ void __global__ k_lennard_jones(
     const int num_atoms,    // n
     const RealType *coords, // [n, 3]
     const RealType *params, // [p,]
-    const RealType *scale_matrix, // [n, n]
     const int *param_idxs,  // [n, 2] sig eps
     RealType *E,             // [,] or null
     RealType *dE_dx,         // [n,3] or null
@@ -147,8 +146,6 @@ void __global__ k_lennard_jones(
                 RealType d2y = dy*dy;
                 RealType d2z = dz*dz;
 
-                RealType sij = scale_matrix[h_i_idx*N + h_j_idx];
-
                 RealType eps = sqrt(epsi * eps1);
                 RealType sig = (sigi + sig1)/2;
 
@@ -163,7 +160,7 @@ void __global__ k_lennard_jones(
                 RealType sig2 = sig*sig;
                 RealType sig3 = sig2*sig;
                 RealType sig6 = sig3*sig3;
-                RealType prefactor = sij*eps*sig6;
+                RealType prefactor = eps*sig6;
 
                 RealType common = prefactor*96*(2*d6ij - 7*sig6)*inv_d16ij;
 
@@ -196,8 +193,8 @@ void __global__ k_lennard_jones(
                     RealType sig5rij4 = sig*sig4rij4;
                     RealType sig6rij4 = sig*sig5rij4;
 
-                    RealType EPS_PREFACTOR = sij*12/eps*(sig6rij4)*(2*sig6rij3 - 1);
-                    RealType SIG_PREFACTOR = sij*24*eps*(sig5/rij4)*(12*sig6rij3 - 3);
+                    RealType EPS_PREFACTOR = 12/eps*(sig6rij4)*(2*sig6rij3 - 1);
+                    RealType SIG_PREFACTOR = 24*eps*(sig5/rij4)*(12*sig6rij3 - 3);
 
                     if(sigi_g_idx >= 0) {
                         RealType *mp_out_sig_h_i = d2E_dxdp + conf_idx*DP*N*3 + sigi_g_idx*N*3;
@@ -244,7 +241,6 @@ void __global__ k_lennard_jones(
                 RealType d2y = dy*dy;
                 RealType d2z = dz*dz;
 
-                RealType sij = scale_matrix[i_idx*N + j_idx];
                 RealType d2ij = d2x + d2y + d2z;
                 RealType dij = sqrt(d2ij);
                 RealType d4ij = d2ij*d2ij;
@@ -268,14 +264,14 @@ void __global__ k_lennard_jones(
                 RealType rij7 = rij4 * rij3;
 
                 if(E) {
-                    energy += sij*4*eps*(sig6/d6ij-1.0)*sig6/d6ij;
+                    energy += 4*eps*(sig6/d6ij-1.0)*sig6/d6ij;
                 }
 
                 if(dE_dp) {
-                    RealType dE_deps = sij*4*(sig6/d6ij-1.0)*sig6/d6ij;
+                    RealType dE_deps = 4*(sig6/d6ij-1.0)*sig6/d6ij;
                     dE_dp_eps += dE_deps*eps1/(2*eps);
                     shfl_dE_dp_eps += dE_deps*eps0/(2*eps);
-                    RealType dE_dsig = sij*24*eps*(2*sig6/d6ij-1)*(sig5/d6ij);
+                    RealType dE_dsig = 24*eps*(2*sig6/d6ij-1)*(sig5/d6ij);
                     dE_dp_sig += dE_dsig/2;
                     shfl_dE_dp_sig += dE_dsig/2;
                 }
@@ -294,20 +290,18 @@ void __global__ k_lennard_jones(
                 RealType dEdy = 24*eps*dy*(sig12rij7*2 - sig6rij4);
                 RealType dEdz = 24*eps*dz*(sig12rij7*2 - sig6rij4);
 
-                // TODO: multiply by sij when atomic adding (But this is trivial relative to cost
-                // of hessians.
-                grad_dx -= sij*dEdx;
-                grad_dy -= sij*dEdy;
-                grad_dz -= sij*dEdz;
+                grad_dx -= dEdx;
+                grad_dy -= dEdy;
+                grad_dz -= dEdz;
 
-                shfl_grad_dx += sij*dEdx;
-                shfl_grad_dy += sij*dEdy;
-                shfl_grad_dz += sij*dEdz;
+                shfl_grad_dx += dEdx;
+                shfl_grad_dy += dEdy;
+                shfl_grad_dz += dEdz;
 
                 // (ytz) todo: optimize for individual dxdps
                 if(d2E_dxdp) {
 
-                    RealType EPS_PREFACTOR = sij*12/eps*(sig6rij4)*(2*sig6rij3 - 1);
+                    RealType EPS_PREFACTOR = 12/eps*(sig6rij4)*(2*sig6rij3 - 1);
 
                     mixed_dx_eps += -EPS_PREFACTOR*eps1*dx;
                     mixed_dy_eps += -EPS_PREFACTOR*eps1*dy;
@@ -317,7 +311,7 @@ void __global__ k_lennard_jones(
                     shfl_mixed_dy_eps += EPS_PREFACTOR*eps0*dy;
                     shfl_mixed_dz_eps += EPS_PREFACTOR*eps0*dz;
 
-                    RealType SIG_PREFACTOR = sij*24*eps*(sig5/rij4)*(12*sig6rij3 - 3);
+                    RealType SIG_PREFACTOR = 24*eps*(sig5/rij4)*(12*sig6rij3 - 3);
 
                     mixed_dx_sig += -SIG_PREFACTOR*dx;
                     mixed_dy_sig += -SIG_PREFACTOR*dy;
@@ -331,7 +325,7 @@ void __global__ k_lennard_jones(
 
                 // hessians
                 if(d2E_dx2) {
-                    RealType prefactor = sij*eps*sig6;
+                    RealType prefactor = eps*sig6;
                     RealType diagonal_prefactor = prefactor*-96*(2*d6ij - 7*sig6)*inv_d16ij;
 
                     hess_xx += prefactor*24*(d8ij - 8*d6ij*d2x - 2*d2ij*sig6 + 28*d2x*sig6)*inv_d16ij;
@@ -491,4 +485,221 @@ void __global__ k_lennard_jones(
 
     }
 
-}
\ No newline at end of file
+}
+
+template<typename RealType>
+void __global__ k_lennard_jones_exclusion(
+    const int num_atoms,    // n
+    const RealType *coords, // [n, 3]
+    const RealType *params, // [p,]
+    const int num_exclusions, // e
+    const int *exclusion_idxs, // [e, 2]
+    const RealType *exclusion_scales, // [e,]
+    const int *param_idxs,  // [n, 2] sig eps
+    RealType *E,             // [,] or null
+    RealType *dE_dx,         // [n,3] or null
+    RealType *d2E_dx2,       // [C, n, 3, n, 3] or null, hessian
+    // parameters used for computing derivatives
+    const int num_dp,        // dp, number of parameters we're differentiating w.r.t. 
+    const int *param_gather_idxs, // [p,] if -1, then we discard
+    RealType *dE_dp,         // [C, dp,] or null
+    RealType *d2E_dxdp       // [C, dp, n, 3] or null
+) {
+
+    // k_lennard_jones computes every pair at full strength, this removes (1-s)
+    // of each excluded pair's interaction.
+
+    const auto conf_idx = blockIdx.z;
+    const int N = num_atoms;
+    const int DP = num_dp;
+    const auto e_idx = blockDim.x*blockIdx.x + threadIdx.x;
+
+    if(e_idx >= num_exclusions) {
+        return;
+    }
+
+    int i_idx = exclusion_idxs[e_idx*2+0];
+    int j_idx = exclusion_idxs[e_idx*2+1];
+
+    RealType sij = exclusion_scales[e_idx] - 1;
+
+    RealType x0 = coords[conf_idx*N*3+i_idx*3+0];
+    RealType y0 = coords[conf_idx*N*3+i_idx*3+1];
+    RealType z0 = coords[conf_idx*N*3+i_idx*3+2];
+    RealType x1 = coords[conf_idx*N*3+j_idx*3+0];
+    RealType y1 = coords[conf_idx*N*3+j_idx*3+1];
+    RealType z1 = coords[conf_idx*N*3+j_idx*3+2];
+
+    RealType sig0 = params[param_idxs[i_idx*2+0]];
+    RealType eps0 = params[param_idxs[i_idx*2+1]];
+    RealType sig1 = params[param_idxs[j_idx*2+0]];
+    RealType eps1 = params[param_idxs[j_idx*2+1]];
+
+    int sig0_g_idx = param_gather_idxs[param_idxs[i_idx*2+0]]; // may be -1
+    int eps0_g_idx = param_gather_idxs[param_idxs[i_idx*2+1]]; // may be -1
+    int sig1_g_idx = param_gather_idxs[param_idxs[j_idx*2+0]]; // may be -1
+    int eps1_g_idx = param_gather_idxs[param_idxs[j_idx*2+1]]; // may be -1
+
+    RealType dx = x0 - x1;
+    RealType dy = y0 - y1;
+    RealType dz = z0 - z1;
+    RealType d2x = dx*dx;
+    RealType d2y = dy*dy;
+    RealType d2z = dz*dz;
+
+    RealType d2ij = d2x + d2y + d2z;
+    RealType d4ij = d2ij*d2ij;
+    RealType d6ij = d4ij*d2ij;
+    RealType d8ij = d4ij*d4ij;
+    RealType d16ij = d8ij*d8ij;
+    RealType inv_d16ij = 1.0/d16ij;
+
+    RealType eps = sqrt(eps0*eps1);
+    RealType sig = (sig0 + sig1)/2;
+
+    RealType sig2 = sig*sig;
+    RealType sig3 = sig2*sig;
+    RealType sig5 = sig3*sig2;
+    RealType sig6 = sig3*sig3;
+    RealType sig12 = sig6*sig6;
+
+    RealType rij = d2ij;
+    RealType rij3 = d6ij;
+    RealType rij4 = d8ij;
+    RealType rij7 = rij4 * rij3;
+
+    RealType sig1rij1 = sig/rij;
+    RealType sig3rij3 = sig1rij1*sig1rij1*sig1rij1;
+    RealType sig6rij3 = sig3*sig3rij3;
+    RealType sig4rij4 = sig3rij3*sig1rij1;
+    RealType sig5rij4 = sig*sig4rij4;
+    RealType sig6rij4 = sig*sig5rij4;
+
+    RealType sig12rij7 = sig12/rij7;
+
+    if(E) {
+        atomicAdd(E + conf_idx, sij*4*eps*(sig6/d6ij-1.0)*sig6/d6ij);
+    }
+
+    if(dE_dx) {
+        RealType dEdx = sij*24*eps*dx*(sig12rij7*2 - sig6rij4);
+        RealType dEdy = sij*24*eps*dy*(sig12rij7*2 - sig6rij4);
+        RealType dEdz = sij*24*eps*dz*(sig12rij7*2 - sig6rij4);
+
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 0, -dEdx);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 1, -dEdy);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 2, -dEdz);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 0,  dEdx);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 1,  dEdy);
+        atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 2,  dEdz);
+    }
+
+    if(d2E_dx2) {
+        RealType prefactor = sij*eps*sig6;
+        RealType diagonal_prefactor = prefactor*-96*(2*d6ij - 7*sig6)*inv_d16ij;
+
+        RealType hess_xx = prefactor*24*(d8ij - 8*d6ij*d2x - 2*d2ij*sig6 + 28*d2x*sig6)*inv_d16ij;
+        RealType hess_yx = diagonal_prefactor*dx*dy;
+        RealType hess_yy = prefactor*24*(d8ij - 8*d6ij*d2y - 2*d2ij*sig6 + 28*d2y*sig6)*inv_d16ij;
+        RealType hess_zx = diagonal_prefactor*dx*dz;
+        RealType hess_zy = diagonal_prefactor*dy*dz;
+        RealType hess_zz = prefactor*24*(d8ij - 8*d6ij*d2z - 2*d2ij*sig6 + 28*d2z*sig6)*inv_d16ij;
+
+        // diagonal blocks, lower triangle only
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 0, 0), hess_xx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 1, 0), hess_yx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 1, 1), hess_yy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 0), hess_zx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 1), hess_zy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(i_idx, i_idx, N, 2, 2), hess_zz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 0, 0), hess_xx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 1, 0), hess_yx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 1, 1), hess_yy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 0), hess_zx);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 1), hess_zy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(j_idx, j_idx, N, 2, 2), hess_zz);
+
+        // off diagonal block, stored in the lower triangle
+        int h_i_idx = i_idx > j_idx ? i_idx : j_idx;
+        int h_j_idx = i_idx > j_idx ? j_idx : i_idx;
+
+        RealType common = prefactor*96*(2*d6ij - 7*sig6)*inv_d16ij;
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 0), prefactor*-24*inv_d16ij*(d8ij- 2*d2ij*sig6 + d2x*(28*sig6 - 8*d6ij)));
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 1), common*dx*dy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 0, 2), common*dx*dz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 0), common*dx*dy);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 1), prefactor*-24*inv_d16ij*(d8ij- 2*d2ij*sig6 + d2y*(28*sig6 - 8*d6ij)));
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 1, 2), common*dy*dz);
+
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 0), common*dx*dz);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 1), common*dy*dz);
+        atomicAdd(d2E_dx2 + conf_idx*N*3*N*3 + HESS_IDX(h_i_idx, h_j_idx, N, 2, 2), prefactor*-24*inv_d16ij*(d8ij- 2*d2ij*sig6 + d2z*(28*sig6 - 8*d6ij)));
+    }
+
+    if(dE_dp) {
+        RealType dE_deps = sij*4*(sig6/d6ij-1.0)*sig6/d6ij;
+        RealType dE_dsig = sij*24*eps*(2*sig6/d6ij-1)*(sig5/d6ij);
+
+        if(sig0_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + sig0_g_idx, dE_dsig/2);
+        }
+        if(sig1_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + sig1_g_idx, dE_dsig/2);
+        }
+        if(eps0_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + eps0_g_idx, dE_deps*eps1/(2*eps));
+        }
+        if(eps1_g_idx >= 0) {
+            atomicAdd(dE_dp + conf_idx*DP + eps1_g_idx, dE_deps*eps0/(2*eps));
+        }
+    }
+
+    if(d2E_dxdp) {
+        RealType EPS_PREFACTOR = sij*12/eps*(sig6rij4)*(2*sig6rij3 - 1);
+        RealType SIG_PREFACTOR = sij*24*eps*(sig5/rij4)*(12*sig6rij3 - 3);
+
+        if(sig0_g_idx >= 0) {
+            RealType *mp_out_sig0 = d2E_dxdp + conf_idx*DP*N*3 + sig0_g_idx*N*3;
+            atomicAdd(mp_out_sig0 + i_idx*3 + 0, -SIG_PREFACTOR*dx);
+            atomicAdd(mp_out_sig0 + i_idx*3 + 1, -SIG_PREFACTOR*dy);
+            atomicAdd(mp_out_sig0 + i_idx*3 + 2, -SIG_PREFACTOR*dz);
+            atomicAdd(mp_out_sig0 + j_idx*3 + 0,  SIG_PREFACTOR*dx);
+            atomicAdd(mp_out_sig0 + j_idx*3 + 1,  SIG_PREFACTOR*dy);
+            atomicAdd(mp_out_sig0 + j_idx*3 + 2,  SIG_PREFACTOR*dz);
+        }
+
+        if(sig1_g_idx >= 0) {
+            RealType *mp_out_sig1 = d2E_dxdp + conf_idx*DP*N*3 + sig1_g_idx*N*3;
+            atomicAdd(mp_out_sig1 + i_idx*3 + 0, -SIG_PREFACTOR*dx);
+            atomicAdd(mp_out_sig1 + i_idx*3 + 1, -SIG_PREFACTOR*dy);
+            atomicAdd(mp_out_sig1 + i_idx*3 + 2, -SIG_PREFACTOR*dz);
+            atomicAdd(mp_out_sig1 + j_idx*3 + 0,  SIG_PREFACTOR*dx);
+            atomicAdd(mp_out_sig1 + j_idx*3 + 1,  SIG_PREFACTOR*dy);
+            atomicAdd(mp_out_sig1 + j_idx*3 + 2,  SIG_PREFACTOR*dz);
+        }
+
+        if(eps0_g_idx >= 0) {
+            RealType *mp_out_eps0 = d2E_dxdp + conf_idx*DP*N*3 + eps0_g_idx*N*3;
+            atomicAdd(mp_out_eps0 + i_idx*3 + 0, -EPS_PREFACTOR*eps1*dx);
+            atomicAdd(mp_out_eps0 + i_idx*3 + 1, -EPS_PREFACTOR*eps1*dy);
+            atomicAdd(mp_out_eps0 + i_idx*3 + 2, -EPS_PREFACTOR*eps1*dz);
+            atomicAdd(mp_out_eps0 + j_idx*3 + 0,  EPS_PREFACTOR*eps1*dx);
+            atomicAdd(mp_out_eps0 + j_idx*3 + 1,  EPS_PREFACTOR*eps1*dy);
+            atomicAdd(mp_out_eps0 + j_idx*3 + 2,  EPS_PREFACTOR*eps1*dz);
+        }
+
+        if(eps1_g_idx >= 0) {
+            RealType *mp_out_eps1 = d2E_dxdp + conf_idx*DP*N*3 + eps1_g_idx*N*3;
+            atomicAdd(mp_out_eps1 + i_idx*3 + 0, -EPS_PREFACTOR*eps0*dx);
+            atomicAdd(mp_out_eps1 + i_idx*3 + 1, -EPS_PREFACTOR*eps0*dy);
+            atomicAdd(mp_out_eps1 + i_idx*3 + 2, -EPS_PREFACTOR*eps0*dz);
+            atomicAdd(mp_out_eps1 + j_idx*3 + 0,  EPS_PREFACTOR*eps0*dx);
+            atomicAdd(mp_out_eps1 + j_idx*3 + 1,  EPS_PREFACTOR*eps0*dy);
+            atomicAdd(mp_out_eps1 + j_idx*3 + 2,  EPS_PREFACTOR*eps0*dz);
+        }
+    }
+
+}
@@ -0,0 +1,215 @@
+#pragma once
+
+#include "kernel_utils.cuh"
+
+// Soft-core Lennard-Jones and electrostatics used to decouple the alchemical atoms from the
+// rest of the system, see nonbonded.softcore_nonbonded. Energies are computed for K lambda
+// windows at once: each pair's distance and parameters are loaded once per tile of
+// SOFTCORE_LAMBDA_TILE windows, whose energies are accumulated in registers.
+
+#define SOFTCORE_LAMBDA_TILE 8
+
+template<typename RealType>
+inline __device__ void softcore_pair(
+    const RealType d2ij,
+    const RealType sig,
+    const RealType eps,
+    const RealType qij,
+    const RealType lamb,
+    const RealType sc_alpha,
+    const RealType sc_beta,
+    RealType &energy,
+    RealType &dE_dd2ij) {
+
+    RealType one_minus_lamb = 1 - lamb;
+
+    energy = 0;
+    dE_dd2ij = 0;
+
+    if(sig > 0) {
+        RealType sig2 = sig*sig;
+        RealType r2 = d2ij/sig2;
+        RealType x = sc_alpha*lamb + r2*r2*r2;
+        RealType inv_x = 1/x;
+        RealType lj_prefactor = 4*eps*one_minus_lamb;
+        energy += lj_prefactor*inv_x*(inv_x - 1);
+        // dx/dd2ij = 3*r2^2/sig2
+        dE_dd2ij += lj_prefactor*inv_x*inv_x*(1 - 2*inv_x)*3*r2*r2/sig2;
+    }
+
+    RealType inv_dij_sc = 1/gpuSqrt(sc_beta*lamb + d2ij);
+    RealType es_energy = ONE_4PI_EPS0*qij*one_minus_lamb*inv_dij_sc;
+    energy += es_energy;
+    dE_dd2ij -= es_energy*inv_dij_sc*inv_dij_sc/2;
+
+}
+
+template<typename RealType>
+void __global__ k_softcore_nonbonded(
+    const int num_atoms,    // n
+    const RealType *coords, // [C, n, 3]
+    const RealType *params, // [p,]
+    const int *lj_param_idxs, // [n, 2] sig, eps
+    const int *charge_param_idxs, // [n,] charge
+    const int *alchemical_flags, // [n,] 1 if the atom is decoupled
+    const int num_lambdas, // K
+    const RealType *lambdas, // [K,]
+    const RealType sc_alpha,
+    const RealType sc_beta,
+    RealType *E, // [C, K] or null
+    RealType *dE_dx // [C, n, 3] or null, evaluated at lambdas[0]
+) {
+
+    const auto conf_idx = blockIdx.z;
+    const int N = num_atoms;
+    const int K = num_lambdas;
+    const int i_idx = blockDim.x*blockIdx.x + threadIdx.x;
+
+    if(i_idx >= N) {
+        return;
+    }
+
+    RealType xi = coords[conf_idx*N*3+i_idx*3+0];
+    RealType yi = coords[conf_idx*N*3+i_idx*3+1];
+    RealType zi = coords[conf_idx*N*3+i_idx*3+2];
+    RealType sig_i = params[lj_param_idxs[i_idx*2+0]];
+    RealType eps_i = params[lj_param_idxs[i_idx*2+1]];
+    RealType q_i = params[charge_param_idxs[i_idx]];
+    int alch_i = alchemical_flags[i_idx];
+
+    RealType grad_dx = 0;
+    RealType grad_dy = 0;
+    RealType grad_dz = 0;
+
+    for(int k_start = 0; k_start < K; k_start += SOFTCORE_LAMBDA_TILE) {
+
+        // the gradient is only needed at lambdas[0]
+        bool compute_grad = dE_dx && k_start == 0;
+
+        if(!E && !compute_grad) {
+            break;
+        }
+
+        RealType energy[SOFTCORE_LAMBDA_TILE];
+        for(int t=0; t < SOFTCORE_LAMBDA_TILE; t++) {
+            energy[t] = 0;
+        }
+
+        for(int j_idx = i_idx + 1; j_idx < N; j_idx++) {
+
+            RealType dx = xi - coords[conf_idx*N*3+j_idx*3+0];
+            RealType dy = yi - coords[conf_idx*N*3+j_idx*3+1];
+            RealType dz = zi - coords[conf_idx*N*3+j_idx*3+2];
+            RealType d2ij = dx*dx + dy*dy + dz*dz;
+
+            RealType sig = (sig_i + params[lj_param_idxs[j_idx*2+0]])/2;
+            RealType eps = gpuSqrt(eps_i*params[lj_param_idxs[j_idx*2+1]]);
+            RealType qij = q_i*params[charge_param_idxs[j_idx]];
+            bool is_alchemical = alch_i != alchemical_flags[j_idx];
+
+            for(int t=0; t < SOFTCORE_LAMBDA_TILE; t++) {
+                int k = k_start + t;
+                if(k >= K) {
+                    break;
+                }
+                RealType lamb = is_alchemical ? lambdas[k] : 0;
+                RealType pair_energy, dE_dd2ij;
+                softcore_pair(d2ij, sig, eps, qij, lamb, sc_alpha, sc_beta, pair_energy, dE_dd2ij);
+                energy[t] += pair_energy;
+
+                if(compute_grad && t == 0) {
+                    RealType grad_prefactor = 2*dE_dd2ij;
+                    grad_dx += grad_prefactor*dx;
+                    grad_dy += grad_prefactor*dy;
+                    grad_dz += grad_prefactor*dz;
+                    atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 0, -grad_prefactor*dx);
+                    atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 1, -grad_prefactor*dy);
+                    atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 2, -grad_prefactor*dz);
+                }
+            }
+        }
+
+        if(E) {
+            for(int t=0; t < SOFTCORE_LAMBDA_TILE && k_start + t < K; t++) {
+                atomicAdd(E + conf_idx*K + k_start + t, energy[t]);
+            }
+        }
+    }
+
+    if(dE_dx) {
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 0, grad_dx);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 1, grad_dy);
+        atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 2, grad_dz);
+    }
+
+}
+
+template<typename RealType>
+void __global__ k_softcore_nonbonded_exclusion(
+    const int num_atoms,    // n
+    const RealType *coords, // [C, n, 3]
+    const RealType *params, // [p,]
+    const int num_exclusions, // e
+    const int *exclusion_idxs, // [e, 2]
+    const RealType *lj_scales, // [e,]
+    const RealType *es_scales, // [e,]
+    const int *lj_param_idxs, // [n, 2] sig, eps
+    const int *charge_param_idxs, // [n,] charge
+    const int *alchemical_flags, // [n,]
+    const int num_lambdas, // K
+    const RealType *lambdas, // [K,]
+    const RealType sc_alpha,
+    const RealType sc_beta,
+    RealType *E, // [C, K] or null
+    RealType *dE_dx // [C, n, 3] or null, evaluated at lambdas[0]
+) {
+
+    // k_softcore_nonbonded computes every pair at full strength, this removes (1-s)
+    // of each excluded pair's interaction.
+
+    const auto conf_idx = blockIdx.z;
+    const int N = num_atoms;
+    const int K = num_lambdas;
+    const int e_idx = blockDim.x*blockIdx.x + threadIdx.x;
+
+    if(e_idx >= num_exclusions) {
+        return;
+    }
+
+    int i_idx = exclusion_idxs[e_idx*2+0];
+    int j_idx = exclusion_idxs[e_idx*2+1];
+
+    RealType dx = coords[conf_idx*N*3+i_idx*3+0] - coords[conf_idx*N*3+j_idx*3+0];
+    RealType dy = coords[conf_idx*N*3+i_idx*3+1] - coords[conf_idx*N*3+j_idx*3+1];
+    RealType dz = coords[conf_idx*N*3+i_idx*3+2] - coords[conf_idx*N*3+j_idx*3+2];
+    RealType d2ij = dx*dx + dy*dy + dz*dz;
+
+    RealType sig = (params[lj_param_idxs[i_idx*2+0]] + params[lj_param_idxs[j_idx*2+0]])/2;
+    RealType eps = (lj_scales[e_idx] - 1)*gpuSqrt(params[lj_param_idxs[i_idx*2+1]]*params[lj_param_idxs[j_idx*2+1]]);
+    RealType qij = (es_scales[e_idx] - 1)*params[charge_param_idxs[i_idx]]*params[charge_param_idxs[j_idx]];
+    bool is_alchemical = alchemical_flags[i_idx] != alchemical_flags[j_idx];
+
+    for(int k=0; k < K; k++) {
+        if(!E && k > 0) {
+            break;
+        }
+        RealType lamb = is_alchemical ? lambdas[k] : 0;
+        RealType pair_energy, dE_dd2ij;
+        softcore_pair(d2ij, sig, eps, qij, lamb, sc_alpha, sc_beta, pair_energy, dE_dd2ij);
+
+        if(E) {
+            atomicAdd(E + conf_idx*K + k, pair_energy);
+        }
+
+        if(dE_dx && k == 0) {
+            RealType grad_prefactor = 2*dE_dd2ij;
+            atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 0,  grad_prefactor*dx);
+            atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 1,  grad_prefactor*dy);
+            atomicAdd(dE_dx + conf_idx*N*3 + i_idx*3 + 2,  grad_prefactor*dz);
+            atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 0, -grad_prefactor*dx);
+            atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 1, -grad_prefactor*dy);
+            atomicAdd(dE_dx + conf_idx*N*3 + j_idx*3 + 2, -grad_prefactor*dz);
+        }
+    }
+
+}
@@ -1,5 +1,4 @@
 #include "cublas_v2.h"
-#include "curand.h"
 
 #include <iostream>
 #include <vector>
@@ -8,11 +7,17 @@
 
 #include "langevin.hpp"
 #include "gpu_utils.cuh"
+#include "rng_cpu.hpp"
 
 
+// one thread per atom, the three components share a single Philox block. If noise is
+// null it is generated from (seed, replica, step, atom) exactly as on the host
 template <typename RealType>
 __global__ void update_positions(
     const RealType *noise,
+    const uint64_t seed,
+    const uint32_t replica,
+    const uint64_t step,
     const RealType coeff_a,
     const RealType *coeff_bs, // N x 3, not P x N x 3, but we could just pass in the first index
     const RealType *coeff_cs,
@@ -27,11 +32,17 @@ __global__ void update_positions(
         return;
     }
 
-    int d_idx = blockIdx.y;
-    int local_idx = atom_idx*3 + d_idx;
+    double normals[4];
+    if(noise == nullptr) {
+        timemachine::philox_normal4(seed, replica, step, atom_idx, normals);
+    }
 
-    v_t[local_idx] = coeff_a*v_t[local_idx] - coeff_bs[atom_idx]*dE_dx[local_idx] + coeff_cs[atom_idx]*noise[local_idx];
-    x_t[local_idx] += v_t[local_idx]*d_t;
+    for(int d_idx=0; d_idx < 3; d_idx++) {
+        int local_idx = atom_idx*3 + d_idx;
+        RealType z = noise == nullptr ? static_cast<RealType>(normals[d_idx]) : noise[local_idx];
+        v_t[local_idx] = coeff_a*v_t[local_idx] - coeff_bs[atom_idx]*dE_dx[local_idx] + coeff_cs[atom_idx]*z;
+        x_t[local_idx] += v_t[local_idx]*d_t;
+    }
 
 }
 
@@ -71,10 +82,14 @@ LangevinOptimizer<RealType>::LangevinOptimizer(
     RealType dt,
     const RealType coeff_a,
     const std::vector<RealType> &coeff_bs,
-    const std::vector<RealType> &coeff_cs) :
+    const std::vector<RealType> &coeff_cs,
+    const uint64_t seed,
+    const uint32_t replica) :
     dt_(dt),
-    coeff_a_(coeff_a),
-    d_rng_buffer_(nullptr) {
+    seed_(seed),
+    replica_(replica),
+    noise_step_(0),
+    coeff_a_(coeff_a) {
 
     gpuErrchk(cudaMalloc((void**)&d_coeff_bs_, coeff_bs.size()*sizeof(RealType)));
     gpuErrchk(cudaMalloc((void**)&d_coeff_cs_, coeff_cs.size()*sizeof(RealType)));
@@ -83,11 +98,6 @@ LangevinOptimizer<RealType>::LangevinOptimizer(
     gpuErrchk(cudaMemcpy(d_coeff_cs_, &coeff_cs[0], coeff_cs.size()*sizeof(RealType), cudaMemcpyHostToDevice));
 
     cublasErrchk(cublasCreate(&cb_handle_));
-    curandErrchk(curandCreateGenerator(&cr_rng_, CURAND_RNG_PSEUDO_PHILOX4_32_10));
-
-    gpuErrchk(cudaMalloc((void**)&d_rng_buffer_, coeff_bs.size()*3*sizeof(RealType)));
-
-    curandSetPseudoRandomGeneratorSeed(cr_rng_, time(NULL));
 
 }
 
@@ -96,10 +106,8 @@ template<typename RealType>
 LangevinOptimizer<RealType>::~LangevinOptimizer() {
     gpuErrchk(cudaFree(d_coeff_bs_));
     gpuErrchk(cudaFree(d_coeff_cs_));
-    gpuErrchk(cudaFree(d_rng_buffer_));
 
     cublasErrchk(cublasDestroy(cb_handle_));
-    curandErrchk(curandDestroyGenerator(cr_rng_));
 }
 
 template<typename RealType> 
@@ -133,18 +141,18 @@ void LangevinOptimizer<RealType>::step(
         gpuErrchk(cudaPeekAtLastError());
     }
 
-    const RealType* d_noise_buf = nullptr;
-
+    // only draws from the stream advance the counter, as on the host
+    const uint64_t step = noise_step_;
     if(d_input_noise_buffer == nullptr) {
-        curandErrchk(templateCurandNormal(cr_rng_, d_rng_buffer_, N*3, 0.0, 1.0));
-        d_noise_buf = d_rng_buffer_;
-    } else {
-        d_noise_buf = d_input_noise_buffer;
+        noise_step_++;
     }
 
-    dim3 dimGrid_dx(n_blocks, 3);
-    update_positions<RealType><<<dimGrid_dx, tpb>>>(
-        d_noise_buf,
+    size_t n_atom_blocks = (N + tpb - 1) / tpb;
+    update_positions<RealType><<<n_atom_blocks, tpb>>>(
+        d_input_noise_buffer,
+        seed_,
+        replica_,
+        step,
         coeff_a_,
         d_coeff_bs_,
         d_coeff_cs_,
@@ -1,5 +1,7 @@
 #pragma once
 
+#include <cstdint>
+
 #include "optimizer.hpp"
 
 namespace timemachine {
@@ -14,9 +16,12 @@ private:
     RealType dt_;
 
     cublasHandle_t cb_handle_;
-    curandGenerator_t  cr_rng_;
 
-    RealType *d_rng_buffer_;
+    // the noise is generated inline from a counter based Philox stream, see rng_cpu.hpp
+    uint64_t seed_;
+    uint32_t replica_;
+    mutable uint64_t noise_step_;
+
     RealType coeff_a_;
     RealType *d_coeff_bs_;
     RealType *d_coeff_cs_;
@@ -37,9 +42,20 @@ public:
         RealType dt,
         const RealType coeff_a,
         const std::vector<RealType> &coeff_bs,
-        const std::vector<RealType> &coeff_cs
+        const std::vector<RealType> &coeff_cs,
+        const uint64_t seed,
+        const uint32_t replica=0
     );
 
+    uint64_t seed() const { return seed_; }
+
+    uint32_t replica() const { return replica_; }
+
+    // counter of the next noise draw, restore it to replay a trajectory exactly
+    uint64_t noise_step() const { return noise_step_; }
+
+    void set_noise_step(const uint64_t step) const { noise_step_ = step; }
+
     void set_coeff_a(RealType a);
 
     void set_coeff_b(int num_atoms, const RealType *cb);
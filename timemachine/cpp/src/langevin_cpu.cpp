@@ -0,0 +1,164 @@
+#include <stdexcept>
+#include <vector>
+
+#include <cblas.h>
+
+#include "langevin_cpu.hpp"
+#include "rng_cpu.hpp"
+
+namespace {
+
+// C += B.A for a row major symmetric A: [N, N] and B, C: [M, N]
+void symm(const int M, const int N, const float *A, const float *B, float *C) {
+    cblas_ssymm(CblasRowMajor, CblasRight, CblasLower, M, N, 1.0f, A, N, B, N, 1.0f, C, N);
+}
+
+void symm(const int M, const int N, const double *A, const double *B, double *C) {
+    cblas_dsymm(CblasRowMajor, CblasRight, CblasLower, M, N, 1.0, A, N, B, N, 1.0, C, N);
+}
+
+}
+
+namespace timemachine {
+
+template<typename RealType>
+LangevinOptimizerCpu<RealType>::LangevinOptimizerCpu(
+    RealType dt,
+    const RealType coeff_a,
+    const std::vector<RealType> &coeff_bs,
+    const std::vector<RealType> &coeff_cs,
+    const uint64_t seed,
+    const uint32_t replica) :
+    dt_(dt),
+    coeff_a_(coeff_a),
+    coeff_bs_(coeff_bs),
+    coeff_cs_(coeff_cs),
+    seed_(seed),
+    replica_(replica),
+    noise_step_(0),
+    rng_buffer_(coeff_bs.size()*3) {
+
+    if(coeff_bs.size() != coeff_cs.size()) {
+        throw std::runtime_error("coeff_bs and coeff_cs must have the same number of atoms");
+    }
+
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::step(
+    const int N,
+    const int DP,
+    const RealType *h_dE_dx,
+    const RealType *h_d2E_dx2,
+    RealType *h_d2E_dxdp, // this is modified in place
+    RealType *h_x_t,
+    RealType *h_v_t,
+    RealType *h_dx_dp_t,
+    RealType *h_dv_dp_t,
+    const RealType *h_input_noise_buffer) const {
+
+    if(N != static_cast<int>(coeff_bs_.size())) {
+        throw std::runtime_error("num_atoms does not match the number of langevin coefficients");
+    }
+
+    if(h_d2E_dxdp != nullptr) {
+        // without a hessian d2E_dxdp already holds the products, see derivatives_hvp_host
+        if(h_d2E_dx2 != nullptr) {
+            hessian_vector_product(N, DP, h_d2E_dx2, h_dx_dp_t, h_d2E_dxdp);
+        }
+
+        // derivative of the velocity and position updates below
+        #pragma omp parallel for schedule(static)
+        for(int p=0; p < DP; p++) {
+            for(int i=0; i < N*3; i++) {
+                const int local_idx = p*N*3 + i;
+                RealType tmp = coeff_a_*h_dv_dp_t[local_idx] - coeff_bs_[i/3]*h_d2E_dxdp[local_idx];
+                h_dv_dp_t[local_idx] = tmp;
+                h_dx_dp_t[local_idx] += dt_*tmp;
+            }
+        }
+    }
+
+    const RealType *h_noise_buf = h_input_noise_buffer;
+    if(h_noise_buf == nullptr) {
+        gaussian_noise(seed_, replica_, noise_step_, N, rng_buffer_.data());
+        noise_step_++;
+        h_noise_buf = rng_buffer_.data();
+    }
+
+    #pragma omp parallel for schedule(static)
+    for(int i=0; i < N*3; i++) {
+        const int atom_idx = i/3;
+        h_v_t[i] = coeff_a_*h_v_t[i] - coeff_bs_[atom_idx]*h_dE_dx[i] + coeff_cs_[atom_idx]*h_noise_buf[i];
+        h_x_t[i] += h_v_t[i]*dt_;
+    }
+
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::step_adjoint(
+    const int N,
+    RealType *h_x_adjoint,
+    RealType *h_v_adjoint,
+    RealType *h_dE_dx_adjoint) const {
+
+    if(N != static_cast<int>(coeff_bs_.size())) {
+        throw std::runtime_error("num_atoms does not match the number of langevin coefficients");
+    }
+
+    // v' = a*v - b*dE_dx + c*noise and x' = x + dt*v', so v' collects the adjoint of x'
+    #pragma omp parallel for schedule(static)
+    for(int i=0; i < N*3; i++) {
+        const RealType v_adjoint = h_v_adjoint[i] + dt_*h_x_adjoint[i];
+        h_v_adjoint[i] = coeff_a_*v_adjoint;
+        h_dE_dx_adjoint[i] = -coeff_bs_[i/3]*v_adjoint;
+    }
+
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::hessian_vector_product(
+    const int N,
+    const int DP,
+    const RealType *h_A,
+    const RealType *h_B,
+    RealType *h_C) const {
+
+    if(DP == 0) {
+        return;
+    }
+    // h_C[p] += h_A.h_B[p] for each of the DP rows of h_B
+    symm(DP, N*3, h_A, h_B, h_C);
+
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::set_coeff_a(RealType a) {
+    coeff_a_ = a;
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::set_coeff_b(int num_atoms, const RealType *cb) {
+    if(num_atoms != static_cast<int>(coeff_bs_.size())) {
+        throw std::runtime_error("coeff_b must have one coefficient per atom");
+    }
+    coeff_bs_.assign(cb, cb + num_atoms);
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::set_coeff_c(int num_atoms, const RealType *cc) {
+    if(num_atoms != static_cast<int>(coeff_cs_.size())) {
+        throw std::runtime_error("coeff_c must have one coefficient per atom");
+    }
+    coeff_cs_.assign(cc, cc + num_atoms);
+}
+
+template<typename RealType>
+void LangevinOptimizerCpu<RealType>::set_dt(RealType ndt) {
+    dt_ = ndt;
+}
+
+}
+
+template class timemachine::LangevinOptimizerCpu<double>;
+template class timemachine::LangevinOptimizerCpu<float>;
@@ -0,0 +1,91 @@
+#pragma once
+
+#include <cstdint>
+#include <vector>
+
+#include "optimizer_cpu.hpp"
+
+namespace timemachine {
+
+/*
+
+Host counterpart of LangevinOptimizer. The element-wise updates are threaded with
+OpenMP, the hessian product H.dx_dp uses BLAS symm and the noise is drawn from a
+counter based Philox stream, see rng_cpu.hpp. The noise of a step is a function of
+(seed, replica, noise_step) only, so optimizers with the same seed and different
+replicas give independent trajectories, and restoring noise_step replays any step.
+
+*/
+template <typename RealType>
+class LangevinOptimizerCpu : public OptimizerCpu<RealType> {
+
+private:
+
+    RealType dt_;
+    RealType coeff_a_;
+    std::vector<RealType> coeff_bs_;
+    std::vector<RealType> coeff_cs_;
+
+    uint64_t seed_;
+    uint32_t replica_;
+    // number of noise buffers drawn so far, the counter of the next draw
+    mutable uint64_t noise_step_;
+    mutable std::vector<RealType> rng_buffer_;
+
+    void hessian_vector_product(
+        const int N,
+        const int DP,
+        const RealType *h_A,
+        const RealType *h_B,
+        RealType *h_C) const;
+
+public:
+
+    LangevinOptimizerCpu(
+        RealType dt,
+        const RealType coeff_a,
+        const std::vector<RealType> &coeff_bs,
+        const std::vector<RealType> &coeff_cs,
+        const uint64_t seed,
+        const uint32_t replica=0
+    );
+
+    uint64_t seed() const { return seed_; }
+
+    uint32_t replica() const { return replica_; }
+
+    void set_coeff_a(RealType a);
+
+    void set_coeff_b(int num_atoms, const RealType *cb);
+
+    void set_coeff_c(int num_atoms, const RealType *cc);
+
+    void set_dt(RealType ndt);
+
+    virtual void step(
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_dE_dx,
+        const RealType *h_d2E_dx2,
+        RealType *h_d2E_dxdp, // this is modified in place
+        RealType *h_x_t, // mutable
+        RealType *h_v_t, // mutable
+        RealType *h_dx_dp_t, // mutable
+        RealType *h_dv_dp_t, // mutable
+        const RealType *h_input_noise_buffer=nullptr
+    ) const override;
+
+    virtual void step_adjoint(
+        const int num_atoms,
+        RealType *h_x_adjoint, // mutable
+        RealType *h_v_adjoint, // mutable
+        RealType *h_dE_dx_adjoint
+    ) const override;
+
+    virtual uint64_t noise_step() const override { return noise_step_; }
+
+    virtual void set_noise_step(const uint64_t step) const override { noise_step_ = step; }
+
+};
+
+}
@@ -6,3 +6,6 @@ nvcc -std=c++11 --ptxas-options=-v -lineinfo -O2 -arch=sm_61 -Xcompiler -fPIC -I
 
 
 g++ -O3 -march=native -Wall -shared -std=c++11 -fPIC $PLATFORM_FLAGS `python3 -m pybind11 --includes` -I gpu/ -I optimizers/ -L/usr/local/cuda/lib64/ -I/usr/local/cuda/include/ wrap_kernels.cpp custom_bonded_gpu.o custom_nonbonded_gpu.o langevin.o optimizer.o potential.o gpu_utils.o context.o -o custom_ops`python3-config --extension-suffix` -lcurand -lcublas -lcudart
+
+# cpu only potentials, these do not require nvcc
+g++ -O3 -march=native -Wall -shared -std=c++11 -fPIC -fopenmp $PLATFORM_FLAGS `python3 -m pybind11 --includes` wrap_kernels_cpu.cpp context_cpu.cpp adjoint_context_cpu.cpp langevin_cpu.cpp custom_bonded_cpu.cpp custom_nonbonded_cpu.cpp custom_gbsa_cpu.cpp -o custom_ops_cpu`python3-config --extension-suffix` -lblas
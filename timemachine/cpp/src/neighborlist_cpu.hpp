@@ -0,0 +1,140 @@
+#pragma once
+
+#include <algorithm>
+#include <cmath>
+#include <vector>
+
+namespace timemachine {
+
+/*
+
+Find all unique pairs (i, j), i < j, of atoms closer than cutoff using a cell list,
+appending them to pairs as [P, 2]. Atoms are binned into cells at least cutoff
+wide so that only the 27 neighbouring cells of each atom need to be searched.
+
+If h_box is not null then it is a [3, 3] orthorhombic box, the coordinates are
+wrapped into it and distances follow the minimum image convention. Boxes with
+fewer than three cells along any dimension fall back to the all pairs search so
+that no pair is visited twice.
+
+*/
+template<typename RealType>
+void cell_list_pairs(
+    const int num_atoms,
+    const RealType *h_coords,
+    const RealType *h_box,
+    const RealType cutoff,
+    std::vector<int> &pairs) {
+
+    const RealType cutoff2 = cutoff*cutoff;
+
+    RealType lo[3], width[3];
+    int num_cells[3];
+    for(int d=0; d < 3; d++) {
+        if(h_box) {
+            lo[d] = 0;
+            width[d] = h_box[d*3+d];
+        } else {
+            RealType lo_d = h_coords[d];
+            RealType hi_d = h_coords[d];
+            for(int i=1; i < num_atoms; i++) {
+                lo_d = std::min(lo_d, h_coords[i*3+d]);
+                hi_d = std::max(hi_d, h_coords[i*3+d]);
+            }
+            lo[d] = lo_d;
+            width[d] = hi_d - lo_d;
+        }
+        num_cells[d] = std::max(1, static_cast<int>(std::floor(width[d]/cutoff)));
+    }
+
+    auto dist2 = [&](int i, int j) -> RealType {
+        RealType r2 = 0;
+        for(int d=0; d < 3; d++) {
+            RealType dx = h_coords[i*3+d] - h_coords[j*3+d];
+            if(h_box) {
+                dx -= width[d]*std::floor(dx/width[d] + static_cast<RealType>(0.5));
+            }
+            r2 += dx*dx;
+        }
+        return r2;
+    };
+
+    const bool small_box = h_box && (num_cells[0] < 3 || num_cells[1] < 3 || num_cells[2] < 3);
+    if(small_box || num_cells[0]*num_cells[1]*num_cells[2] == 1) {
+        for(int i=0; i < num_atoms; i++) {
+            for(int j=i+1; j < num_atoms; j++) {
+                if(dist2(i, j) < cutoff2) {
+                    pairs.push_back(i);
+                    pairs.push_back(j);
+                }
+            }
+        }
+        return;
+    }
+
+    // counting sort of the atoms by cell
+    const int total_cells = num_cells[0]*num_cells[1]*num_cells[2];
+    std::vector<int> atom_cells(num_atoms);
+    std::vector<int> cell_starts(total_cells+1, 0);
+    for(int i=0; i < num_atoms; i++) {
+        int c[3];
+        for(int d=0; d < 3; d++) {
+            if(num_cells[d] == 1) {
+                c[d] = 0;
+                continue;
+            }
+            RealType s = (h_coords[i*3+d] - lo[d])/width[d];
+            if(h_box) {
+                s -= std::floor(s);
+            }
+            c[d] = std::min(num_cells[d]-1, std::max(0, static_cast<int>(s*num_cells[d])));
+        }
+        atom_cells[i] = (c[0]*num_cells[1] + c[1])*num_cells[2] + c[2];
+        cell_starts[atom_cells[i]+1]++;
+    }
+    for(int c=0; c < total_cells; c++) {
+        cell_starts[c+1] += cell_starts[c];
+    }
+    std::vector<int> cell_atoms(num_atoms);
+    std::vector<int> offsets(cell_starts.begin(), cell_starts.end()-1);
+    for(int i=0; i < num_atoms; i++) {
+        cell_atoms[offsets[atom_cells[i]]++] = i;
+    }
+
+    for(int i=0; i < num_atoms; i++) {
+        const int ci[3] = {
+            atom_cells[i]/(num_cells[1]*num_cells[2]),
+            (atom_cells[i]/num_cells[2]) % num_cells[1],
+            atom_cells[i] % num_cells[2]
+        };
+        for(int dx=-1; dx <= 1; dx++) {
+            for(int dy=-1; dy <= 1; dy++) {
+                for(int dz=-1; dz <= 1; dz++) {
+                    int cj[3] = {ci[0]+dx, ci[1]+dy, ci[2]+dz};
+                    bool valid = true;
+                    for(int d=0; d < 3; d++) {
+                        if(h_box) {
+                            cj[d] = (cj[d] + num_cells[d]) % num_cells[d];
+                        } else if(cj[d] < 0 || cj[d] >= num_cells[d]) {
+                            valid = false;
+                        }
+                    }
+                    if(!valid) {
+                        continue;
+                    }
+                    const int c = (cj[0]*num_cells[1] + cj[1])*num_cells[2] + cj[2];
+                    for(int k=cell_starts[c]; k < cell_starts[c+1]; k++) {
+                        const int j = cell_atoms[k];
+                        if(j > i && dist2(i, j) < cutoff2) {
+                            pairs.push_back(i);
+                            pairs.push_back(j);
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+}
+
+}
@@ -0,0 +1,60 @@
+#pragma once
+
+#include <cstdint>
+
+namespace timemachine {
+
+/*
+
+Host counterpart of Optimizer. All buffers live in host memory and have the same
+layout as Optimizer::step, ie. [N, 3] for the coordinates and forces, [N*3, N*3]
+for the hessian and [DP, N, 3] for the parameter derivatives.
+
+The hessian may be null, in which case h_d2E_dxdp must already include the hessian
+vector products H.dx_dp, as accumulated by PotentialCpu::derivatives_hvp_host.
+
+*/
+template<typename RealType>
+class OptimizerCpu {
+
+public:
+
+    virtual ~OptimizerCpu() {};
+
+    virtual void step(
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_dE_dx,
+        const RealType *h_d2E_dx2,
+        RealType *h_d2E_dxdp, // this is modified in place
+        RealType *h_x_t, // mutable
+        RealType *h_v_t, // mutable
+        RealType *h_dx_dp_t, // mutable
+        RealType *h_dv_dp_t, // mutable
+        const RealType *h_noise_buffer=nullptr // optional
+    ) const = 0;
+
+    /*
+
+    Adjoint of a step without parameter derivatives. On entry h_x_adjoint and h_v_adjoint
+    hold the adjoints of the updated coordinates and velocities, on exit those of the
+    coordinates and velocities before the step, except for the part that flows through
+    the forces, whose adjoint is written to h_dE_dx_adjoint. The caller completes
+    h_x_adjoint with the vector jacobian product of the forces.
+
+    */
+    virtual void step_adjoint(
+        const int num_atoms,
+        RealType *h_x_adjoint, // mutable
+        RealType *h_v_adjoint, // mutable
+        RealType *h_dE_dx_adjoint
+    ) const = 0;
+
+    // counter of the next noise draw, saved and restored to replay steps exactly
+    virtual uint64_t noise_step() const = 0;
+
+    virtual void set_noise_step(const uint64_t step) const = 0;
+
+};
+
+}
@@ -2,6 +2,8 @@
 
 #include<vector>
 
+#include "virial.hpp"
+
 namespace timemachine {
 
 template <typename RealType>
@@ -34,6 +36,53 @@ public:
 
     /*
 
+    Energies, forces and the [C, 3, 3] virials of each conformation, accumulated into
+    the (caller zeroed) h_E, h_dE_dx and h_virial, any of which may be null. The virial
+    is derived from this potential's forces, see accumulate_virial. This is only exact
+    because none of the device potentials are periodic, a periodic potential must
+    instead accumulate the minimum image pair vectors as NonbondedCpu does.
+
+    */
+    void derivatives_virial_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_virial) const {
+
+        std::vector<RealType> dE_dx(num_confs*num_atoms*3, 0);
+        std::vector<int> param_gather_idxs(num_params, -1);
+
+        this->derivatives_host(
+            num_confs,
+            num_atoms,
+            num_params,
+            h_coords,
+            h_params,
+            h_E,
+            &dE_dx[0],
+            nullptr,
+            0,
+            &param_gather_idxs[0],
+            nullptr,
+            nullptr
+        );
+
+        if(h_dE_dx) {
+            for(int i=0; i < num_confs*num_atoms*3; i++) {
+                h_dE_dx[i] += dE_dx[i];
+            }
+        }
+        if(h_virial) {
+            accumulate_virial(num_confs, num_atoms, h_coords, &dE_dx[0], h_virial);
+        }
+    }
+
+    /*
+
     Computes the various derivatives of the energy with respect to the arguments.
 
     */
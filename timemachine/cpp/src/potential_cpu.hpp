@@ -0,0 +1,240 @@
+#pragma once
+
+#include <algorithm>
+#include <vector>
+
+#include "virial.hpp"
+
+namespace timemachine {
+
+/*
+
+Host counterpart of Potential, for potentials that run directly on the CPU
+and can be built without a CUDA toolchain. All buffers live in host memory and
+follow the same layout and accumulation semantics as Potential::derivatives_device,
+ie. results are added into the (caller zeroed) output buffers and any of the
+outputs may be null.
+
+*/
+template <typename RealType>
+class PotentialCpu {
+
+public:
+
+    virtual ~PotentialCpu() {};
+
+    virtual void derivatives_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_d2E_dx2,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp) const = 0;
+
+    /*
+
+    Same as derivatives_host, except that the dense hessian is replaced by its products
+    with the [C, DP, N, 3] tangents h_dx_dp, ie. h_hvp[c][p] += H[c].h_dx_dp[c][p], so
+    that dx_dp can be propagated in O(N*DP) memory. h_hvp may be the same buffer as
+    h_d2E_dxdp, in which case it accumulates the total derivative of the forces.
+
+    The default forms the dense hessian of one conformation at a time with
+    derivatives_host, potentials override this to never form it.
+
+    */
+    virtual void derivatives_hvp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        // parameter derivatives
+        const int num_dp,
+        const int *h_param_gather_idxs,
+        const RealType *h_dx_dp,
+        RealType *h_dE_dp,
+        RealType *h_d2E_dxdp,
+        RealType *h_hvp) const {
+
+        const int N3 = num_atoms*3;
+        const int DP = num_dp;
+        std::vector<RealType> hessian(h_hvp ? N3*N3 : 0);
+
+        for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+            std::fill(hessian.begin(), hessian.end(), 0);
+
+            this->derivatives_host(
+                1,
+                num_atoms,
+                num_params,
+                h_coords + conf_idx*N3,
+                h_params,
+                h_E ? h_E + conf_idx : nullptr,
+                h_dE_dx ? h_dE_dx + conf_idx*N3 : nullptr,
+                h_hvp ? hessian.data() : nullptr,
+                num_dp,
+                h_param_gather_idxs,
+                h_dE_dp ? h_dE_dp + conf_idx*DP : nullptr,
+                h_d2E_dxdp ? h_d2E_dxdp + conf_idx*DP*N3 : nullptr
+            );
+
+            if(h_hvp) {
+                for(int p=0; p < DP; p++) {
+                    const RealType *v = h_dx_dp + (conf_idx*DP + p)*N3;
+                    RealType *hv = h_hvp + (conf_idx*DP + p)*N3;
+                    for(int i=0; i < N3; i++) {
+                        RealType sum = 0;
+                        for(int j=0; j < N3; j++) {
+                            sum += hessian[i*N3+j]*v[j];
+                        }
+                        hv[i] += sum;
+                    }
+                }
+            }
+
+        }
+    }
+
+    /*
+
+    Vector jacobian products of the forces dE_dx with the [C, N, 3] adjoints h_adjoint,
+    ie. h_x_adjoint[c] += H[c].h_adjoint[c] (the hessian is symmetric) and, for every one
+    of the P parameters, h_p_adjoint[c][k] += h_adjoint[c].d2E/dxdp_k. This is what
+    reverse mode integration needs per step, and unlike derivatives_hvp_host its cost
+    does not depend on the number of parameters.
+
+    The default builds the [P, N, 3] mixed partials of one conformation at a time with
+    derivatives_host, potentials override this to contract them term by term.
+
+    */
+    virtual void derivatives_vjp_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        const RealType *h_adjoint,
+        RealType *h_x_adjoint,
+        RealType *h_p_adjoint) const {
+
+        const int N3 = num_atoms*3;
+        const int P = num_params;
+        std::vector<int> no_params(P, -1);
+        std::vector<int> all_params(P);
+        for(int k=0; k < P; k++) {
+            all_params[k] = k;
+        }
+        std::vector<RealType> d2E_dxdp(h_p_adjoint ? P*N3 : 0);
+
+        for(int conf_idx=0; conf_idx < num_confs; conf_idx++) {
+
+            const RealType *adjoint = h_adjoint + conf_idx*N3;
+
+            if(h_x_adjoint) {
+                this->derivatives_hvp_host(
+                    1,
+                    num_atoms,
+                    num_params,
+                    h_coords + conf_idx*N3,
+                    h_params,
+                    nullptr,
+                    nullptr,
+                    1,
+                    no_params.data(),
+                    adjoint,
+                    nullptr,
+                    nullptr,
+                    h_x_adjoint + conf_idx*N3
+                );
+            }
+
+            if(h_p_adjoint) {
+                std::fill(d2E_dxdp.begin(), d2E_dxdp.end(), 0);
+                this->derivatives_host(
+                    1,
+                    num_atoms,
+                    num_params,
+                    h_coords + conf_idx*N3,
+                    h_params,
+                    nullptr,
+                    nullptr,
+                    nullptr,
+                    P,
+                    all_params.data(),
+                    nullptr,
+                    d2E_dxdp.data()
+                );
+                for(int k=0; k < P; k++) {
+                    RealType sum = 0;
+                    for(int i=0; i < N3; i++) {
+                        sum += d2E_dxdp[k*N3+i]*adjoint[i];
+                    }
+                    h_p_adjoint[conf_idx*P+k] += sum;
+                }
+            }
+
+        }
+    }
+
+    /*
+
+    Energies, forces and the [C, 3, 3] virials of each conformation, accumulated into
+    the (caller zeroed) h_E, h_dE_dx and h_virial, any of which may be null.
+
+    The default derives the virial from this potential's forces, see accumulate_virial,
+    which is exact for the non-periodic potentials here but not once pairs interact
+    through periodic images. Pair potentials override this to accumulate the virial of
+    each pair vector in the same pass as the forces.
+
+    */
+    virtual void derivatives_virial_host(
+        const int num_confs,
+        const int num_atoms,
+        const int num_params,
+        const RealType *h_coords,
+        const RealType *h_params,
+        RealType *h_E,
+        RealType *h_dE_dx,
+        RealType *h_virial) const {
+
+        std::vector<RealType> dE_dx(num_confs*num_atoms*3, 0);
+        std::vector<int> param_gather_idxs(num_params, -1);
+
+        this->derivatives_host(
+            num_confs,
+            num_atoms,
+            num_params,
+            h_coords,
+            h_params,
+            h_E,
+            &dE_dx[0],
+            nullptr,
+            0,
+            &param_gather_idxs[0],
+            nullptr,
+            nullptr
+        );
+
+        if(h_dE_dx) {
+            for(int i=0; i < num_confs*num_atoms*3; i++) {
+                h_dE_dx[i] += dE_dx[i];
+            }
+        }
+        if(h_virial) {
+            accumulate_virial(num_confs, num_atoms, h_coords, &dE_dx[0], h_virial);
+        }
+    }
+
+};
+
+}
@@ -0,0 +1,113 @@
+#pragma once
+
+#include <cmath>
+#include <cstdint>
+
+// the generator is also compiled into device code, see langevin.cu
+#ifdef __CUDACC__
+#define RNG_HOST_DEVICE __host__ __device__
+#else
+#define RNG_HOST_DEVICE
+#endif
+
+namespace timemachine {
+
+/*
+
+Philox4x32-10 counter based generator (Salmon et al., "Parallel random numbers:
+as easy as 1, 2, 3"), the same generator as cuRAND's PHILOX4_32_10. Every draw is
+a pure function of a 128 bit counter and a 64 bit key, so there is no generator
+state to share between threads and any draw can be regenerated on demand.
+
+*/
+RNG_HOST_DEVICE inline void philox4x32_10(uint32_t ctr[4], const uint32_t key[2]) {
+
+    const uint32_t M0 = 0xD2511F53;
+    const uint32_t M1 = 0xCD9E8D57;
+    const uint32_t W0 = 0x9E3779B9;
+    const uint32_t W1 = 0xBB67AE85;
+
+    uint32_t k0 = key[0];
+    uint32_t k1 = key[1];
+
+    for(int round=0; round < 10; round++) {
+        const uint64_t p0 = static_cast<uint64_t>(M0)*ctr[0];
+        const uint64_t p1 = static_cast<uint64_t>(M1)*ctr[2];
+        const uint32_t hi0 = p0 >> 32, lo0 = static_cast<uint32_t>(p0);
+        const uint32_t hi1 = p1 >> 32, lo1 = static_cast<uint32_t>(p1);
+        ctr[0] = hi1 ^ ctr[1] ^ k0;
+        ctr[1] = lo1;
+        ctr[2] = hi0 ^ ctr[3] ^ k1;
+        ctr[3] = lo0;
+        k0 += W0;
+        k1 += W1;
+    }
+
+}
+
+/*
+
+Four independent standard normals for the counter (replica, step, idx) of the stream
+seed, from a single Philox block and two Box-Muller transforms. Replicas sharing a
+seed draw from disjoint counters and hence independent streams.
+
+*/
+RNG_HOST_DEVICE inline void philox_normal4(
+    const uint64_t seed,
+    const uint32_t replica,
+    const uint64_t step,
+    const uint32_t idx,
+    double *out) {
+
+    uint32_t ctr[4] = {
+        idx,
+        replica,
+        static_cast<uint32_t>(step),
+        static_cast<uint32_t>(step >> 32)
+    };
+    const uint32_t key[2] = {
+        static_cast<uint32_t>(seed),
+        static_cast<uint32_t>(seed >> 32)
+    };
+
+    philox4x32_10(ctr, key);
+
+    const double two_pi = 6.283185307179586;
+    for(int i=0; i < 2; i++) {
+        // uniforms in the open interval (0, 1)
+        const double u0 = (ctr[2*i+0] + 0.5)*2.3283064365386963e-10;
+        const double u1 = (ctr[2*i+1] + 0.5)*2.3283064365386963e-10;
+        const double r = std::sqrt(-2*std::log(u0));
+        out[2*i+0] = r*std::cos(two_pi*u1);
+        out[2*i+1] = r*std::sin(two_pi*u1);
+    }
+
+}
+
+/*
+
+Fill h_noise: [N, 3] with the standard normals of draw number step. Component d of
+atom i comes from the Philox block (replica, step, i), so the noise of any (seed,
+replica, step, atom, dim) is reproducible regardless of the number of threads.
+
+*/
+template<typename RealType>
+void gaussian_noise(
+    const uint64_t seed,
+    const uint32_t replica,
+    const uint64_t step,
+    const int num_atoms,
+    RealType *h_noise) {
+
+    #pragma omp parallel for schedule(static)
+    for(int i=0; i < num_atoms; i++) {
+        double normals[4];
+        philox_normal4(seed, replica, step, i, normals);
+        for(int d=0; d < 3; d++) {
+            h_noise[i*3+d] = normals[d];
+        }
+    }
+
+}
+
+}
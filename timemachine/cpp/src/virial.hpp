@@ -0,0 +1,37 @@
+#pragma once
+
+namespace timemachine {
+
+/*
+
+Accumulate the virial of non-periodic, translation invariant potentials from their
+forces, h_virial[c] += -sum_i x_i (x) dE/dx_i, where h_coords and h_dE_dx are
+[C, N, 3] and h_virial is [C, 3, 3]. This equals the sum of -r_ij (x) dE/dr_ij over
+the interacting pairs only as long as no pair interacts through a periodic image, for
+which the JAX potentials use timemachine.potentials.virial. All of the C++ potentials
+are non-periodic.
+
+*/
+template<typename RealType>
+void accumulate_virial(
+    const int num_confs,
+    const int num_atoms,
+    const RealType *h_coords,
+    const RealType *h_dE_dx,
+    RealType *h_virial) {
+
+    for(int c=0; c < num_confs; c++) {
+        for(int i=0; i < num_atoms; i++) {
+            const RealType *x = h_coords + (c*num_atoms+i)*3;
+            const RealType *g = h_dE_dx + (c*num_atoms+i)*3;
+            for(int a=0; a < 3; a++) {
+                for(int b=0; b < 3; b++) {
+                    h_virial[c*9+a*3+b] -= x[a]*g[b];
+                }
+            }
+        }
+    }
+
+}
+
+}
@@ -10,6 +10,7 @@
 #include "custom_nonbonded_gpu.hpp"
 
 #include <iostream>
+#include <random>
 
 namespace py = pybind11;
 
@@ -161,18 +162,35 @@ void declare_langevin_optimizer(py::module &m, const char *typestr) {
         const RealType dt,
         const RealType ca,
         const py::array_t<RealType, py::array::c_style> &cb, // bond_idxs
-        const py::array_t<RealType, py::array::c_style> &cc  // param_idxs
+        const py::array_t<RealType, py::array::c_style> &cc, // param_idxs
+        py::object seed,
+        const uint32_t replica
     ) {
         std::vector<RealType> coeff_bs(cb.size());
         std::memcpy(coeff_bs.data(), cb.data(), cb.size()*sizeof(RealType));
         std::vector<RealType> coeff_cs(cc.size());
         std::memcpy(coeff_cs.data(), cc.data(), cc.size()*sizeof(RealType));
-        return new timemachine::LangevinOptimizer<RealType>(dt, ca, coeff_bs, coeff_cs);
+        uint64_t seed_value;
+        if(seed.is_none()) {
+            std::random_device rd;
+            seed_value = (static_cast<uint64_t>(rd()) << 32) | rd();
+        } else {
+            seed_value = seed.cast<uint64_t>();
+        }
+        return new timemachine::LangevinOptimizer<RealType>(dt, ca, coeff_bs, coeff_cs, seed_value, replica);
     }),
         py::arg("dt").none(false),
         py::arg("ca").none(false),
         py::arg("cb").none(false),
-        py::arg("cc").none(false)
+        py::arg("cc").none(false),
+        py::arg("seed")=py::none(),
+        py::arg("replica")=0
+    )
+    .def_property_readonly("seed", &timemachine::LangevinOptimizer<RealType>::seed)
+    .def_property_readonly("replica", &timemachine::LangevinOptimizer<RealType>::replica)
+    .def_property("noise_step",
+        &timemachine::LangevinOptimizer<RealType>::noise_step,
+        &timemachine::LangevinOptimizer<RealType>::set_noise_step
     )
     .def("set_dt", [](timemachine::LangevinOptimizer<RealType> &lo,
         const RealType dt) {
@@ -204,6 +222,39 @@ void declare_potential(py::module &m, const char *typestr) {
         pyclass_name.c_str(),
         py::buffer_protocol(),
         py::dynamic_attr())
+    .def("derivatives_virial", [](timemachine::Potential<RealType> &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs});
+            py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_virial({num_confs, 3ul, 3ul});
+
+            memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+            memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_virial.mutable_data(), 0.0, sizeof(RealType)*num_confs*9);
+
+            nrg.derivatives_virial_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                py_E.mutable_data(),
+                py_dE_dx.mutable_data(),
+                py_virial.mutable_data()
+            );
+
+            return py::make_tuple(py_E, py_dE_dx, py_virial);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false)
+        )
     .def("derivatives", [](timemachine::Potential<RealType> &nrg,
         const py::array_t<RealType, py::array::c_style> &coords,
         const py::array_t<RealType, py::array::c_style> &params,
@@ -354,16 +405,19 @@ void declare_lennard_jones(py::module &m, const char *typestr) {
         py::dynamic_attr()
     )
     .def(py::init([](
-        const py::array_t<RealType, py::array::c_style> &sm, // scale_matrix
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &es, // exclusion_scales
         const py::array_t<int, py::array::c_style> &pi  // param_idxs
     ) {
 
-        std::vector<RealType> scale_matrix(sm.size());
-        std::memcpy(scale_matrix.data(), sm.data(), sm.size()*sizeof(RealType));
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> exclusion_scales(es.size());
+        std::memcpy(exclusion_scales.data(), es.data(), es.size()*sizeof(RealType));
         std::vector<int> param_idxs(pi.size());
         std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
 
-        return new timemachine::LennardJones<RealType>(scale_matrix, param_idxs);
+        return new timemachine::LennardJones<RealType>(exclusion_idxs, exclusion_scales, param_idxs);
     }));
 
 }
@@ -380,20 +434,167 @@ void declare_electrostatics(py::module &m, const char *typestr) {
         py::dynamic_attr()
     )
     .def(py::init([](
-        const py::array_t<RealType, py::array::c_style> &sm, // scale_matrix
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &es, // exclusion_scales
         const py::array_t<int, py::array::c_style> &pi  // param_idxs
     ) {
 
-        std::vector<RealType> scale_matrix(sm.size());
-        std::memcpy(scale_matrix.data(), sm.data(), sm.size()*sizeof(RealType));
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> exclusion_scales(es.size());
+        std::memcpy(exclusion_scales.data(), es.data(), es.size()*sizeof(RealType));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+
+        return new timemachine::Electrostatics<RealType>(exclusion_idxs, exclusion_scales, param_idxs);
+    }))
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &es, // exclusion_scales
+        const py::array_t<int, py::array::c_style> &pi, // param_idxs
+        double cutoff,
+        double rf_dielectric
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> exclusion_scales(es.size());
+        std::memcpy(exclusion_scales.data(), es.data(), es.size()*sizeof(RealType));
         std::vector<int> param_idxs(pi.size());
         std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
 
-        return new timemachine::Electrostatics<RealType>(scale_matrix, param_idxs);
+        return new timemachine::Electrostatics<RealType>(exclusion_idxs, exclusion_scales, param_idxs, cutoff, rf_dielectric);
+    }));
+
+}
+
+template<typename RealType>
+void declare_nonbonded(py::module &m, const char *typestr) {
+
+    using Class = timemachine::Nonbonded<RealType>;
+    std::string pyclass_name = std::string("Nonbonded_") + typestr;
+    py::class_<Class, timemachine::Potential<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &ljs, // lj_scales
+        const py::array_t<RealType, py::array::c_style> &ess, // es_scales
+        const py::array_t<int, py::array::c_style> &ljpi,  // lj_param_idxs
+        const py::array_t<int, py::array::c_style> &qpi  // charge_param_idxs
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> lj_scales(ljs.size());
+        std::memcpy(lj_scales.data(), ljs.data(), ljs.size()*sizeof(RealType));
+        std::vector<RealType> es_scales(ess.size());
+        std::memcpy(es_scales.data(), ess.data(), ess.size()*sizeof(RealType));
+        std::vector<int> lj_param_idxs(ljpi.size());
+        std::memcpy(lj_param_idxs.data(), ljpi.data(), ljpi.size()*sizeof(int));
+        std::vector<int> charge_param_idxs(qpi.size());
+        std::memcpy(charge_param_idxs.data(), qpi.data(), qpi.size()*sizeof(int));
+
+        return new timemachine::Nonbonded<RealType>(exclusion_idxs, lj_scales, es_scales, lj_param_idxs, charge_param_idxs);
     }));
 
 }
 
+template <typename RealType>
+void declare_softcore_nonbonded(py::module &m, const char *typestr) {
+
+    using Class = timemachine::SoftcoreNonbonded<RealType>;
+    std::string pyclass_name = std::string("SoftcoreNonbonded_") + typestr;
+    py::class_<Class, timemachine::Potential<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &ljs, // lj_scales
+        const py::array_t<RealType, py::array::c_style> &ess, // es_scales
+        const py::array_t<int, py::array::c_style> &ljpi,  // lj_param_idxs
+        const py::array_t<int, py::array::c_style> &qpi,  // charge_param_idxs
+        const py::array_t<int, py::array::c_style> &af,  // alchemical_flags
+        RealType lambda,
+        RealType sc_alpha,
+        RealType sc_beta
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> lj_scales(ljs.size());
+        std::memcpy(lj_scales.data(), ljs.data(), ljs.size()*sizeof(RealType));
+        std::vector<RealType> es_scales(ess.size());
+        std::memcpy(es_scales.data(), ess.data(), ess.size()*sizeof(RealType));
+        std::vector<int> lj_param_idxs(ljpi.size());
+        std::memcpy(lj_param_idxs.data(), ljpi.data(), ljpi.size()*sizeof(int));
+        std::vector<int> charge_param_idxs(qpi.size());
+        std::memcpy(charge_param_idxs.data(), qpi.data(), qpi.size()*sizeof(int));
+        std::vector<int> alchemical_flags(af.size());
+        std::memcpy(alchemical_flags.data(), af.data(), af.size()*sizeof(int));
+
+        return new timemachine::SoftcoreNonbonded<RealType>(
+            exclusion_idxs,
+            lj_scales,
+            es_scales,
+            lj_param_idxs,
+            charge_param_idxs,
+            alchemical_flags,
+            lambda,
+            sc_alpha,
+            sc_beta
+        );
+    }),
+        py::arg("exclusion_idxs"),
+        py::arg("lj_scales"),
+        py::arg("es_scales"),
+        py::arg("lj_param_idxs"),
+        py::arg("charge_param_idxs"),
+        py::arg("alchemical_flags"),
+        py::arg("lambda"),
+        py::arg("sc_alpha") = 0.5,
+        py::arg("sc_beta") = 0.12
+    )
+    .def("get_lambda", &Class::get_lambda)
+    .def("set_lambda", &Class::set_lambda)
+    .def("lambda_energies", [](Class &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<RealType, py::array::c_style> &lambdas) -> py::array_t<RealType, py::array::c_style> {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_params = params.shape()[0];
+            const long unsigned int num_lambdas = lambdas.size();
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs, num_lambdas});
+
+            nrg.lambda_energies_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                num_lambdas,
+                lambdas.data(),
+                py_E.mutable_data()
+            );
+
+            return py_E;
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false),
+            py::arg("lambdas").none(false)
+        );
+
+}
+
 PYBIND11_MODULE(custom_ops, m) {
 
     // context
@@ -429,4 +630,10 @@ PYBIND11_MODULE(custom_ops, m) {
     declare_electrostatics<float>(m, "f32");
     declare_electrostatics<double>(m, "f64");
 
+    declare_nonbonded<float>(m, "f32");
+    declare_nonbonded<double>(m, "f64");
+
+    declare_softcore_nonbonded<float>(m, "f32");
+    declare_softcore_nonbonded<double>(m, "f64");
+
 }
\ No newline at end of file
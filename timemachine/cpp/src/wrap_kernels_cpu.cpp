@@ -0,0 +1,1064 @@
+#include <pybind11/pybind11.h>
+#include <pybind11/stl.h>
+#include <pybind11/numpy.h>
+
+#include "context_cpu.hpp"
+#include "adjoint_context_cpu.hpp"
+#include "optimizer_cpu.hpp"
+#include "langevin_cpu.hpp"
+#include "potential_cpu.hpp"
+#include "custom_bonded_cpu.hpp"
+#include "custom_gbsa_cpu.hpp"
+#include "custom_nonbonded_cpu.hpp"
+
+#include <limits>
+#include <random>
+
+#include <cstring>
+
+namespace py = pybind11;
+
+template <typename RealType>
+void declare_context_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::ContextCpu<RealType>;
+    std::string pyclass_name = std::string("Context_cpu_") + typestr;
+    py::class_<Class>(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const std::vector<timemachine::PotentialCpu<RealType> *> system,
+        const timemachine::OptimizerCpu<RealType> *optimizer,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<RealType, py::array::c_style> &x0,
+        const py::array_t<RealType, py::array::c_style> &v0,
+        const py::array_t<int, py::array::c_style> &dp_idxs,
+        bool hessian_free,
+        py::object noise_step
+    ) {
+        const int N = x0.shape()[0];
+        const int P = params.shape()[0];
+        const int DP = dp_idxs.size();
+
+        std::vector<int> gather_param_idxs(P, -1);
+        for(int i=0; i < DP; i++) {
+            if(gather_param_idxs[dp_idxs.data()[i]] != -1) {
+                throw std::runtime_error("dp_idxs must contain only unique indices.");
+            }
+            gather_param_idxs[dp_idxs.data()[i]] = i;
+        }
+
+        // resume the noise stream of a restarted trajectory
+        if(!noise_step.is_none()) {
+            optimizer->set_noise_step(noise_step.cast<uint64_t>());
+        }
+
+        return new timemachine::ContextCpu<RealType>(
+            system,
+            optimizer,
+            params.data(),
+            x0.data(),
+            v0.data(),
+            N,
+            P,
+            gather_param_idxs.data(),
+            DP,
+            hessian_free
+        );
+
+    }),
+        py::arg("system").none(false),
+        py::arg("optimizer").none(false),
+        py::arg("params").none(false),
+        py::arg("x0").none(false),
+        py::arg("v0").none(false),
+        py::arg("dp_idxs").none(false),
+        py::arg("hessian_free")=false,
+        py::arg("noise_step")=py::none()
+    )
+    .def("step", &timemachine::ContextCpu<RealType>::step)
+    .def_property_readonly("hessian_free", &timemachine::ContextCpu<RealType>::hessian_free)
+    .def_property_readonly("noise_step", &timemachine::ContextCpu<RealType>::noise_step)
+    .def("get_E", [](timemachine::ContextCpu<RealType> &ctxt) -> RealType {
+        RealType E;
+        ctxt.get_E(&E);
+        return E;
+    })
+    .def("get_dE_dx", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        auto N = ctxt.num_atoms();
+        py::array_t<RealType, py::array::c_style> buffer({N, 3});
+        ctxt.get_dE_dx(buffer.mutable_data());
+        return buffer;
+    })
+    .def("get_dE_dp", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        unsigned int DP = ctxt.num_dparams();
+        py::array_t<RealType, py::array::c_style> buffer({DP});
+        ctxt.get_dE_dp(buffer.mutable_data());
+        return buffer;
+    })
+    .def("get_x", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        auto N = ctxt.num_atoms();
+        py::array_t<RealType, py::array::c_style> buffer({N, 3});
+        ctxt.get_x(buffer.mutable_data());
+        return buffer;
+    })
+    .def("get_v", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        auto N = ctxt.num_atoms();
+        py::array_t<RealType, py::array::c_style> buffer({N, 3});
+        ctxt.get_v(buffer.mutable_data());
+        return buffer;
+    })
+    .def("get_dx_dp", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        auto DP = ctxt.num_dparams();
+        auto N = ctxt.num_atoms();
+        py::array_t<RealType, py::array::c_style> buffer({DP, N, 3});
+        ctxt.get_dx_dp(buffer.mutable_data());
+        return buffer;
+    })
+    .def("get_dv_dp", [](timemachine::ContextCpu<RealType> &ctxt) -> py::array_t<RealType, py::array::c_style> {
+        auto DP = ctxt.num_dparams();
+        auto N = ctxt.num_atoms();
+        py::array_t<RealType, py::array::c_style> buffer({DP, N, 3});
+        ctxt.get_dv_dp(buffer.mutable_data());
+        return buffer;
+    });
+
+}
+
+
+template <typename RealType>
+void declare_adjoint_context_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::AdjointContextCpu<RealType>;
+    std::string pyclass_name = std::string("AdjointContext_cpu_") + typestr;
+    py::class_<Class>(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const std::vector<timemachine::PotentialCpu<RealType> *> system,
+        const timemachine::OptimizerCpu<RealType> *optimizer,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<RealType, py::array::c_style> &x0,
+        const py::array_t<RealType, py::array::c_style> &v0,
+        const int num_checkpoints
+    ) {
+        const int N = x0.shape()[0];
+        const int P = params.shape()[0];
+
+        return new timemachine::AdjointContextCpu<RealType>(
+            system,
+            optimizer,
+            params.data(),
+            x0.data(),
+            v0.data(),
+            N,
+            P,
+            num_checkpoints
+        );
+
+    }),
+        py::arg("system").none(false),
+        py::arg("optimizer").none(false),
+        py::arg("params").none(false),
+        py::arg("x0").none(false),
+        py::arg("v0").none(false),
+        py::arg("num_checkpoints")=16
+    )
+    .def_property_readonly("num_checkpoints", &Class::num_checkpoints)
+    .def("forward", [](Class &ctxt,
+        const int num_steps,
+        const py::array_t<int, py::array::c_style> &frame_idxs) -> py::tuple {
+
+            const long unsigned int K = frame_idxs.size();
+            const long unsigned int N = ctxt.num_atoms();
+
+            py::array_t<RealType, py::array::c_style> py_xs({K, N, 3ul});
+            py::array_t<RealType, py::array::c_style> py_vs({K, N, 3ul});
+
+            ctxt.forward(
+                num_steps,
+                K,
+                frame_idxs.data(),
+                py_xs.mutable_data(),
+                py_vs.mutable_data()
+            );
+
+            return py::make_tuple(py_xs, py_vs);
+        },
+            py::arg("num_steps"),
+            py::arg("frame_idxs").none(false)
+        )
+    .def("backward", [](Class &ctxt,
+        const int num_steps,
+        const py::array_t<int, py::array::c_style> &frame_idxs,
+        const py::object &dL_dx,
+        const py::object &dL_dv) -> py::tuple {
+
+            const long unsigned int K = frame_idxs.size();
+            const long unsigned int N = ctxt.num_atoms();
+            const long unsigned int P = ctxt.num_params();
+
+            py::array_t<RealType, py::array::c_style> dL_dx_frames;
+            py::array_t<RealType, py::array::c_style> dL_dv_frames;
+            if(!dL_dx.is_none()) {
+                dL_dx_frames = dL_dx.cast<py::array_t<RealType, py::array::c_style> >();
+                if(dL_dx_frames.size() != K*N*3) {
+                    throw std::runtime_error("dL_dx must be of shape [K, N, 3]");
+                }
+            }
+            if(!dL_dv.is_none()) {
+                dL_dv_frames = dL_dv.cast<py::array_t<RealType, py::array::c_style> >();
+                if(dL_dv_frames.size() != K*N*3) {
+                    throw std::runtime_error("dL_dv must be of shape [K, N, 3]");
+                }
+            }
+
+            py::array_t<RealType, py::array::c_style> py_dL_dp({P});
+            py::array_t<RealType, py::array::c_style> py_dL_dx0({N, 3ul});
+            py::array_t<RealType, py::array::c_style> py_dL_dv0({N, 3ul});
+
+            ctxt.backward(
+                num_steps,
+                K,
+                frame_idxs.data(),
+                dL_dx.is_none() ? nullptr : dL_dx_frames.data(),
+                dL_dv.is_none() ? nullptr : dL_dv_frames.data(),
+                py_dL_dp.mutable_data(),
+                py_dL_dx0.mutable_data(),
+                py_dL_dv0.mutable_data()
+            );
+
+            return py::make_tuple(py_dL_dp, py_dL_dx0, py_dL_dv0);
+        },
+            py::arg("num_steps"),
+            py::arg("frame_idxs").none(false),
+            py::arg("dL_dx")=py::none(),
+            py::arg("dL_dv")=py::none()
+        );
+
+}
+
+template <typename RealType>
+void declare_optimizer_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::OptimizerCpu<RealType>;
+    std::string pyclass_name = std::string("Optimizer_cpu_") + typestr;
+    py::class_<Class>(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr())
+    .def("step", [](timemachine::OptimizerCpu<RealType> &opt,
+        const py::array_t<RealType, py::array::c_style> &dE_dx,
+        const py::array_t<RealType, py::array::c_style> &d2E_dx2,
+        const py::array_t<RealType, py::array::c_style> &d2E_dxdp,
+        py::array_t<RealType, py::array::c_style> &x_t,
+        py::array_t<RealType, py::array::c_style> &v_t,
+        py::array_t<RealType, py::array::c_style> &dx_dp_t,
+        py::array_t<RealType, py::array::c_style> &dv_dp_t,
+        const py::array_t<RealType, py::array::c_style> &noise_buffer) {
+
+            const long unsigned int num_atoms = dE_dx.shape()[0];
+            const long unsigned int num_params = d2E_dxdp.shape()[0];
+
+            // step() accumulates the hessian product into d2E_dxdp, which is left untouched
+            // here to match the host interface of the gpu optimizer
+            std::vector<RealType> d2E_dxdp_copy(d2E_dxdp.data(), d2E_dxdp.data() + d2E_dxdp.size());
+
+            opt.step(
+                num_atoms,
+                num_params,
+                dE_dx.data(),
+                d2E_dx2.data(),
+                d2E_dxdp_copy.data(),
+                x_t.mutable_data(),
+                v_t.mutable_data(),
+                dx_dp_t.mutable_data(),
+                dv_dp_t.mutable_data(),
+                noise_buffer.data()
+            );
+        })
+    .def("step_adjoint", [](timemachine::OptimizerCpu<RealType> &opt,
+        const py::array_t<RealType, py::array::c_style> &x_adjoint,
+        const py::array_t<RealType, py::array::c_style> &v_adjoint) -> py::tuple {
+
+            const long unsigned int num_atoms = x_adjoint.shape()[0];
+
+            py::array_t<RealType, py::array::c_style> py_x_adjoint({num_atoms, 3ul});
+            py::array_t<RealType, py::array::c_style> py_v_adjoint({num_atoms, 3ul});
+            py::array_t<RealType, py::array::c_style> py_dE_dx_adjoint({num_atoms, 3ul});
+            std::memcpy(py_x_adjoint.mutable_data(), x_adjoint.data(), sizeof(RealType)*num_atoms*3);
+            std::memcpy(py_v_adjoint.mutable_data(), v_adjoint.data(), sizeof(RealType)*num_atoms*3);
+
+            opt.step_adjoint(
+                num_atoms,
+                py_x_adjoint.mutable_data(),
+                py_v_adjoint.mutable_data(),
+                py_dE_dx_adjoint.mutable_data()
+            );
+
+            return py::make_tuple(py_x_adjoint, py_v_adjoint, py_dE_dx_adjoint);
+        },
+            py::arg("x_adjoint").none(false),
+            py::arg("v_adjoint").none(false)
+        )
+    .def_property("noise_step",
+        &timemachine::OptimizerCpu<RealType>::noise_step,
+        &timemachine::OptimizerCpu<RealType>::set_noise_step
+    );
+
+}
+
+
+template<typename RealType>
+void declare_langevin_optimizer_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::LangevinOptimizerCpu<RealType>;
+    std::string pyclass_name = std::string("LangevinOptimizer_cpu_") + typestr;
+    py::class_<Class, timemachine::OptimizerCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const RealType dt,
+        const RealType ca,
+        const py::array_t<RealType, py::array::c_style> &cb,
+        const py::array_t<RealType, py::array::c_style> &cc,
+        py::object seed,
+        const uint32_t replica
+    ) {
+        std::vector<RealType> coeff_bs(cb.size());
+        std::memcpy(coeff_bs.data(), cb.data(), cb.size()*sizeof(RealType));
+        std::vector<RealType> coeff_cs(cc.size());
+        std::memcpy(coeff_cs.data(), cc.data(), cc.size()*sizeof(RealType));
+        uint64_t seed_value;
+        if(seed.is_none()) {
+            std::random_device rd;
+            seed_value = (static_cast<uint64_t>(rd()) << 32) | rd();
+        } else {
+            seed_value = seed.cast<uint64_t>();
+        }
+        return new timemachine::LangevinOptimizerCpu<RealType>(dt, ca, coeff_bs, coeff_cs, seed_value, replica);
+    }),
+        py::arg("dt").none(false),
+        py::arg("ca").none(false),
+        py::arg("cb").none(false),
+        py::arg("cc").none(false),
+        py::arg("seed")=py::none(),
+        py::arg("replica")=0
+    )
+    .def_property_readonly("seed", &timemachine::LangevinOptimizerCpu<RealType>::seed)
+    .def_property_readonly("replica", &timemachine::LangevinOptimizerCpu<RealType>::replica)
+    .def("set_dt", [](timemachine::LangevinOptimizerCpu<RealType> &lo,
+        const RealType dt) {
+        lo.set_dt(dt);
+    })
+    .def("set_coeff_a", [](timemachine::LangevinOptimizerCpu<RealType> &lo,
+        const RealType ca) {
+        lo.set_coeff_a(ca);
+    })
+    .def("set_coeff_b", [](timemachine::LangevinOptimizerCpu<RealType> &lo,
+        const py::array_t<RealType, py::array::c_style> &cb) {
+        lo.set_coeff_b(cb.shape()[0], cb.data());
+    })
+    .def("set_coeff_c", [](timemachine::LangevinOptimizerCpu<RealType> &lo,
+        const py::array_t<RealType, py::array::c_style> &cc) {
+        lo.set_coeff_c(cc.shape()[0], cc.data());
+    });
+
+}
+
+
+template <typename RealType>
+void declare_potential_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::PotentialCpu<RealType>;
+    std::string pyclass_name = std::string("PotentialCpu_") + typestr;
+    py::class_<Class>(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr())
+    .def("derivatives_virial", [](timemachine::PotentialCpu<RealType> &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs});
+            py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_virial({num_confs, 3ul, 3ul});
+
+            memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+            memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_virial.mutable_data(), 0.0, sizeof(RealType)*num_confs*9);
+
+            nrg.derivatives_virial_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                py_E.mutable_data(),
+                py_dE_dx.mutable_data(),
+                py_virial.mutable_data()
+            );
+
+            return py::make_tuple(py_E, py_dE_dx, py_virial);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false)
+        )
+    .def("derivatives", [](timemachine::PotentialCpu<RealType> &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<int, py::array::c_style> &dp_idxs) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+            const long unsigned int num_dp_idxs = dp_idxs.shape()[0];
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs});
+            py::array_t<RealType, py::array::c_style> py_dE_dp({num_confs, num_dp_idxs});
+            py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_d2E_dxdp({num_confs, num_dp_idxs, num_atoms, num_dims});
+
+            memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+            memset(py_dE_dp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs);
+            memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_d2E_dxdp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs*num_atoms*num_dims);
+
+            std::vector<int> gather_param_idxs(num_params, -1);
+            for(size_t i=0; i < num_dp_idxs; i++) {
+                if(gather_param_idxs[dp_idxs.data()[i]] != -1) {
+                    throw std::runtime_error("dp_idxs must contain only unique indices.");
+                }
+                gather_param_idxs[dp_idxs.data()[i]] = i;
+            }
+
+            // the dense [C, N, 3, N, 3] hessian is skipped, potentials that have one
+            // expose it as sparse blocks through derivatives_sparse instead
+            nrg.derivatives_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                py_E.mutable_data(),
+                py_dE_dx.mutable_data(),
+                nullptr,
+
+                num_dp_idxs,
+                &gather_param_idxs[0],
+                py_dE_dp.mutable_data(),
+                py_d2E_dxdp.mutable_data()
+            );
+
+            return py::make_tuple(py_E, py_dE_dx, py::none(), py_dE_dp, py_d2E_dxdp);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false),
+            py::arg("dp_idxs").none(false)
+        )
+    .def("derivatives_hvp", [](timemachine::PotentialCpu<RealType> &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<int, py::array::c_style> &dp_idxs,
+        const py::array_t<RealType, py::array::c_style> &dx_dp) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+            const long unsigned int num_dp_idxs = dp_idxs.shape()[0];
+
+            if(dx_dp.size() != num_confs*num_dp_idxs*num_atoms*num_dims) {
+                throw std::runtime_error("dx_dp must be of shape [C, DP, N, 3]");
+            }
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs});
+            py::array_t<RealType, py::array::c_style> py_dE_dp({num_confs, num_dp_idxs});
+            py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_hvp({num_confs, num_dp_idxs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_d2E_dxdp({num_confs, num_dp_idxs, num_atoms, num_dims});
+
+            memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+            memset(py_dE_dp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs);
+            memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_hvp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs*num_atoms*num_dims);
+            memset(py_d2E_dxdp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs*num_atoms*num_dims);
+
+            std::vector<int> gather_param_idxs(num_params, -1);
+            for(size_t i=0; i < num_dp_idxs; i++) {
+                if(gather_param_idxs[dp_idxs.data()[i]] != -1) {
+                    throw std::runtime_error("dp_idxs must contain only unique indices.");
+                }
+                gather_param_idxs[dp_idxs.data()[i]] = i;
+            }
+
+            // the products H.dx_dp[p] take the place of the dense hessian
+            nrg.derivatives_hvp_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                py_E.mutable_data(),
+                py_dE_dx.mutable_data(),
+
+                num_dp_idxs,
+                gather_param_idxs.data(),
+                dx_dp.data(),
+                py_dE_dp.mutable_data(),
+                py_d2E_dxdp.mutable_data(),
+                py_hvp.mutable_data()
+            );
+
+            return py::make_tuple(py_E, py_dE_dx, py_hvp, py_dE_dp, py_d2E_dxdp);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false),
+            py::arg("dp_idxs").none(false),
+            py::arg("dx_dp").none(false)
+        )
+    .def("derivatives_vjp", [](timemachine::PotentialCpu<RealType> &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<RealType, py::array::c_style> &adjoint) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+
+            if(adjoint.size() != coords.size()) {
+                throw std::runtime_error("adjoint must be of shape [C, N, 3]");
+            }
+
+            py::array_t<RealType, py::array::c_style> py_x_adjoint({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_p_adjoint({num_confs, num_params});
+
+            memset(py_x_adjoint.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_p_adjoint.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_params);
+
+            nrg.derivatives_vjp_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                adjoint.data(),
+                py_x_adjoint.mutable_data(),
+                py_p_adjoint.mutable_data()
+            );
+
+            return py::make_tuple(py_x_adjoint, py_p_adjoint);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false),
+            py::arg("adjoint").none(false)
+        );
+
+}
+
+
+template<typename RealType>
+void declare_bonded_terms(py::module &m, const char *typestr) {
+
+    using Class = timemachine::BondedTerms<RealType>;
+    std::string pyclass_name = std::string("BondedTerms_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &bi,  // bond_idxs
+        const py::array_t<int, py::array::c_style> &bpi, // bond_param_idxs
+        const py::array_t<int, py::array::c_style> &ai,  // angle_idxs
+        const py::array_t<int, py::array::c_style> &api, // angle_param_idxs
+        const py::array_t<int, py::array::c_style> &ti,  // torsion_idxs
+        const py::array_t<int, py::array::c_style> &tpi  // torsion_param_idxs
+    ) {
+        std::vector<int> bond_idxs(bi.size());
+        std::memcpy(bond_idxs.data(), bi.data(), bi.size()*sizeof(int));
+        std::vector<int> bond_param_idxs(bpi.size());
+        std::memcpy(bond_param_idxs.data(), bpi.data(), bpi.size()*sizeof(int));
+        std::vector<int> angle_idxs(ai.size());
+        std::memcpy(angle_idxs.data(), ai.data(), ai.size()*sizeof(int));
+        std::vector<int> angle_param_idxs(api.size());
+        std::memcpy(angle_param_idxs.data(), api.data(), api.size()*sizeof(int));
+        std::vector<int> torsion_idxs(ti.size());
+        std::memcpy(torsion_idxs.data(), ti.data(), ti.size()*sizeof(int));
+        std::vector<int> torsion_param_idxs(tpi.size());
+        std::memcpy(torsion_param_idxs.data(), tpi.data(), tpi.size()*sizeof(int));
+        return new timemachine::BondedTerms<RealType>(
+            bond_idxs,
+            bond_param_idxs,
+            angle_idxs,
+            angle_param_idxs,
+            torsion_idxs,
+            torsion_param_idxs
+        );
+    }),
+        py::arg("bond_idxs").none(false),
+        py::arg("bond_param_idxs").none(false),
+        py::arg("angle_idxs").none(false),
+        py::arg("angle_param_idxs").none(false),
+        py::arg("torsion_idxs").none(false),
+        py::arg("torsion_param_idxs").none(false)
+    )
+    .def("hessian_block_idxs", [](Class &nrg) -> py::array_t<int, py::array::c_style> {
+        const long unsigned int num_blocks = nrg.num_hessian_blocks();
+        py::array_t<int, py::array::c_style> buffer({num_blocks, 2ul});
+        for(size_t i=0; i < num_blocks; i++) {
+            buffer.mutable_data()[i*2+0] = nrg.hessian_block_rows()[i];
+            buffer.mutable_data()[i*2+1] = nrg.hessian_block_cols()[i];
+        }
+        return buffer;
+    })
+    .def("derivatives_sparse", [](Class &nrg,
+        const py::array_t<RealType, py::array::c_style> &coords,
+        const py::array_t<RealType, py::array::c_style> &params,
+        const py::array_t<int, py::array::c_style> &dp_idxs) -> py::tuple {
+
+            const long unsigned int num_confs = coords.shape()[0];
+            const long unsigned int num_atoms = coords.shape()[1];
+            const long unsigned int num_dims = coords.shape()[2];
+            const long unsigned int num_params = params.shape()[0];
+            const long unsigned int num_dp_idxs = dp_idxs.shape()[0];
+            const long unsigned int num_blocks = nrg.num_hessian_blocks();
+
+            py::array_t<RealType, py::array::c_style> py_E({num_confs});
+            py::array_t<RealType, py::array::c_style> py_dE_dp({num_confs, num_dp_idxs});
+            py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+            py::array_t<RealType, py::array::c_style> py_hessian_blocks({num_confs, num_blocks, 3ul, 3ul});
+            py::array_t<RealType, py::array::c_style> py_d2E_dxdp({num_confs, num_dp_idxs, num_atoms, num_dims});
+
+            memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+            memset(py_dE_dp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs);
+            memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+            memset(py_hessian_blocks.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_blocks*9);
+            memset(py_d2E_dxdp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs*num_atoms*num_dims);
+
+            std::vector<int> gather_param_idxs(num_params, -1);
+            for(size_t i=0; i < num_dp_idxs; i++) {
+                if(gather_param_idxs[dp_idxs.data()[i]] != -1) {
+                    throw std::runtime_error("dp_idxs must contain only unique indices.");
+                }
+                gather_param_idxs[dp_idxs.data()[i]] = i;
+            }
+
+            nrg.derivatives_sparse_host(
+                num_confs,
+                num_atoms,
+                num_params,
+                coords.data(),
+                params.data(),
+                py_E.mutable_data(),
+                py_dE_dx.mutable_data(),
+                py_hessian_blocks.mutable_data(),
+
+                num_dp_idxs,
+                &gather_param_idxs[0],
+                py_dE_dp.mutable_data(),
+                py_d2E_dxdp.mutable_data()
+            );
+
+            return py::make_tuple(py_E, py_dE_dx, py_hessian_blocks, py_dE_dp, py_d2E_dxdp);
+        },
+            py::arg("coords").none(false),
+            py::arg("params").none(false),
+            py::arg("dp_idxs").none(false)
+        );
+
+}
+
+
+template<typename RealType>
+void declare_gbsa(py::module &m, const char *typestr) {
+
+    using Class = timemachine::GBSA<RealType>;
+    std::string pyclass_name = std::string("GBSA_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &pi, // param_idxs
+        double dielectric_offset,
+        py::object cutoff,
+        double alpha_obc,
+        double beta_obc,
+        double gamma_obc,
+        double solute_dielectric,
+        double solvent_dielectric,
+        double electric_constant,
+        double probe_radius,
+        double surface_area_energy
+    ) {
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+        // a cutoff of None includes every pair, as in implicit.gbsa
+        RealType cutoff_value = cutoff.is_none() ? std::numeric_limits<RealType>::infinity() : cutoff.cast<RealType>();
+        return new timemachine::GBSA<RealType>(
+            param_idxs,
+            dielectric_offset,
+            cutoff_value,
+            alpha_obc,
+            beta_obc,
+            gamma_obc,
+            solute_dielectric,
+            solvent_dielectric,
+            electric_constant,
+            probe_radius,
+            surface_area_energy
+        );
+    }),
+        py::arg("param_idxs").none(false),
+        py::arg("dielectric_offset")=0.009,
+        py::arg("cutoff")=py::none(),
+        py::arg("alpha_obc")=1.0,
+        py::arg("beta_obc")=0.8,
+        py::arg("gamma_obc")=4.85,
+        py::arg("solute_dielectric")=1.0,
+        py::arg("solvent_dielectric")=78.3,
+        py::arg("electric_constant")=-69.467728,
+        py::arg("probe_radius")=0.14,
+        py::arg("surface_area_energy")=2.25936
+    );
+
+}
+
+
+// derivatives with the dense [C, N, 3, N, 3] hessian, the same outputs as the derivatives
+// of the gpu potentials so that the host potentials below are drop in replacements
+template <typename RealType>
+py::tuple dense_derivatives(timemachine::PotentialCpu<RealType> &nrg,
+    const py::array_t<RealType, py::array::c_style> &coords,
+    const py::array_t<RealType, py::array::c_style> &params,
+    const py::array_t<int, py::array::c_style> &dp_idxs) {
+
+    const long unsigned int num_confs = coords.shape()[0];
+    const long unsigned int num_atoms = coords.shape()[1];
+    const long unsigned int num_dims = coords.shape()[2];
+    const long unsigned int num_params = params.shape()[0];
+    const long unsigned int num_dp_idxs = dp_idxs.shape()[0];
+
+    py::array_t<RealType, py::array::c_style> py_E({num_confs});
+    py::array_t<RealType, py::array::c_style> py_dE_dp({num_confs, num_dp_idxs});
+    py::array_t<RealType, py::array::c_style> py_dE_dx({num_confs, num_atoms, num_dims});
+    py::array_t<RealType, py::array::c_style> py_d2E_dx2({num_confs, num_atoms, num_dims, num_atoms, num_dims});
+    py::array_t<RealType, py::array::c_style> py_d2E_dxdp({num_confs, num_dp_idxs, num_atoms, num_dims});
+
+    memset(py_E.mutable_data(), 0.0, sizeof(RealType)*num_confs);
+    memset(py_dE_dp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs);
+    memset(py_dE_dx.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims);
+    memset(py_d2E_dx2.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_atoms*num_dims*num_atoms*num_dims);
+    memset(py_d2E_dxdp.mutable_data(), 0.0, sizeof(RealType)*num_confs*num_dp_idxs*num_atoms*num_dims);
+
+    std::vector<int> gather_param_idxs(num_params, -1);
+    for(size_t i=0; i < num_dp_idxs; i++) {
+        if(gather_param_idxs[dp_idxs.data()[i]] != -1) {
+            throw std::runtime_error("dp_idxs must contain only unique indices.");
+        }
+        gather_param_idxs[dp_idxs.data()[i]] = i;
+    }
+
+    nrg.derivatives_host(
+        num_confs,
+        num_atoms,
+        num_params,
+        coords.data(),
+        params.data(),
+        py_E.mutable_data(),
+        py_dE_dx.mutable_data(),
+        py_d2E_dx2.mutable_data(),
+
+        num_dp_idxs,
+        gather_param_idxs.data(),
+        py_dE_dp.mutable_data(),
+        py_d2E_dxdp.mutable_data()
+    );
+
+    return py::make_tuple(py_E, py_dE_dx, py_d2E_dx2, py_dE_dp, py_d2E_dxdp);
+}
+
+
+template<typename RealType>
+void declare_harmonic_bond_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::HarmonicBondCpu<RealType>;
+    std::string pyclass_name = std::string("HarmonicBond_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &bi, // bond_idxs
+        const py::array_t<int, py::array::c_style> &pi  // param_idxs
+    ) {
+        std::vector<int> bond_idxs(bi.size());
+        std::memcpy(bond_idxs.data(), bi.data(), bi.size()*sizeof(int));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+        return new timemachine::HarmonicBondCpu<RealType>(bond_idxs, param_idxs);
+    }))
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+template<typename RealType>
+void declare_harmonic_angle_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::HarmonicAngleCpu<RealType>;
+    std::string pyclass_name = std::string("HarmonicAngle_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ai, // angle_idxs
+        const py::array_t<int, py::array::c_style> &pi  // param_idxs
+    ) {
+        std::vector<int> angle_idxs(ai.size());
+        std::memcpy(angle_idxs.data(), ai.data(), ai.size()*sizeof(int));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+        return new timemachine::HarmonicAngleCpu<RealType>(angle_idxs, param_idxs);
+    }))
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+template<typename RealType>
+void declare_periodic_torsion_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::PeriodicTorsionCpu<RealType>;
+    std::string pyclass_name = std::string("PeriodicTorsion_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ti, // torsion_idxs
+        const py::array_t<int, py::array::c_style> &pi  // param_idxs
+    ) {
+        std::vector<int> torsion_idxs(ti.size());
+        std::memcpy(torsion_idxs.data(), ti.data(), ti.size()*sizeof(int));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+        return new timemachine::PeriodicTorsionCpu<RealType>(torsion_idxs, param_idxs);
+    }))
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+template<typename RealType>
+void declare_lennard_jones_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::LennardJonesCpu<RealType>;
+    std::string pyclass_name = std::string("LennardJones_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &es, // exclusion_scales
+        const py::array_t<int, py::array::c_style> &pi  // param_idxs
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> exclusion_scales(es.size());
+        std::memcpy(exclusion_scales.data(), es.data(), es.size()*sizeof(RealType));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+
+        return new timemachine::LennardJonesCpu<RealType>(exclusion_idxs, exclusion_scales, param_idxs);
+    }))
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+template<typename RealType>
+void declare_electrostatics_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::ElectrostaticsCpu<RealType>;
+    std::string pyclass_name = std::string("Electrostatics_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &es, // exclusion_scales
+        const py::array_t<int, py::array::c_style> &pi, // param_idxs
+        double cutoff,
+        double rf_dielectric
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> exclusion_scales(es.size());
+        std::memcpy(exclusion_scales.data(), es.data(), es.size()*sizeof(RealType));
+        std::vector<int> param_idxs(pi.size());
+        std::memcpy(param_idxs.data(), pi.data(), pi.size()*sizeof(int));
+
+        return new timemachine::ElectrostaticsCpu<RealType>(exclusion_idxs, exclusion_scales, param_idxs, cutoff, rf_dielectric);
+    }),
+        py::arg("exclusion_idxs").none(false),
+        py::arg("exclusion_scales").none(false),
+        py::arg("param_idxs").none(false),
+        py::arg("cutoff")=0.0,
+        py::arg("rf_dielectric")=1.0
+    )
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+template<typename RealType>
+void declare_nonbonded_cpu(py::module &m, const char *typestr) {
+
+    using Class = timemachine::NonbondedCpu<RealType>;
+    std::string pyclass_name = std::string("Nonbonded_") + typestr;
+    py::class_<Class, timemachine::PotentialCpu<RealType> >(
+        m,
+        pyclass_name.c_str(),
+        py::buffer_protocol(),
+        py::dynamic_attr()
+    )
+    .def(py::init([](
+        const py::array_t<int, py::array::c_style> &ei, // exclusion_idxs
+        const py::array_t<RealType, py::array::c_style> &ljs, // lj_scales
+        const py::array_t<RealType, py::array::c_style> &ess, // es_scales
+        const py::array_t<int, py::array::c_style> &ljpi,  // lj_param_idxs
+        const py::array_t<int, py::array::c_style> &qpi,  // charge_param_idxs
+        double cutoff,
+        double rf_dielectric
+    ) {
+
+        std::vector<int> exclusion_idxs(ei.size());
+        std::memcpy(exclusion_idxs.data(), ei.data(), ei.size()*sizeof(int));
+        std::vector<RealType> lj_scales(ljs.size());
+        std::memcpy(lj_scales.data(), ljs.data(), ljs.size()*sizeof(RealType));
+        std::vector<RealType> es_scales(ess.size());
+        std::memcpy(es_scales.data(), ess.data(), ess.size()*sizeof(RealType));
+        std::vector<int> lj_param_idxs(ljpi.size());
+        std::memcpy(lj_param_idxs.data(), ljpi.data(), ljpi.size()*sizeof(int));
+        std::vector<int> charge_param_idxs(qpi.size());
+        std::memcpy(charge_param_idxs.data(), qpi.data(), qpi.size()*sizeof(int));
+
+        return new timemachine::NonbondedCpu<RealType>(exclusion_idxs, lj_scales, es_scales, lj_param_idxs, charge_param_idxs, cutoff, rf_dielectric);
+    }),
+        py::arg("exclusion_idxs").none(false),
+        py::arg("lj_scales").none(false),
+        py::arg("es_scales").none(false),
+        py::arg("lj_param_idxs").none(false),
+        py::arg("charge_param_idxs").none(false),
+        py::arg("cutoff")=0.0,
+        py::arg("rf_dielectric")=1.0
+    )
+    .def("derivatives", &dense_derivatives<RealType>,
+        py::arg("coords").none(false),
+        py::arg("params").none(false),
+        py::arg("dp_idxs").none(false)
+    );
+
+}
+
+
+PYBIND11_MODULE(custom_ops_cpu, m) {
+
+    declare_context_cpu<float>(m, "f32");
+    declare_context_cpu<double>(m, "f64");
+
+    declare_adjoint_context_cpu<float>(m, "f32");
+    declare_adjoint_context_cpu<double>(m, "f64");
+
+    declare_optimizer_cpu<float>(m, "f32");
+    declare_optimizer_cpu<double>(m, "f64");
+
+    declare_langevin_optimizer_cpu<float>(m, "f32");
+    declare_langevin_optimizer_cpu<double>(m, "f64");
+
+    declare_potential_cpu<float>(m, "f32");
+    declare_potential_cpu<double>(m, "f64");
+
+    declare_bonded_terms<float>(m, "f32");
+    declare_bonded_terms<double>(m, "f64");
+
+    declare_gbsa<float>(m, "f32");
+    declare_gbsa<double>(m, "f64");
+
+    declare_harmonic_bond_cpu<float>(m, "f32");
+    declare_harmonic_bond_cpu<double>(m, "f64");
+
+    declare_harmonic_angle_cpu<float>(m, "f32");
+    declare_harmonic_angle_cpu<double>(m, "f64");
+
+    declare_periodic_torsion_cpu<float>(m, "f32");
+    declare_periodic_torsion_cpu<double>(m, "f64");
+
+    declare_lennard_jones_cpu<float>(m, "f32");
+    declare_lennard_jones_cpu<double>(m, "f64");
+
+    declare_electrostatics_cpu<float>(m, "f32");
+    declare_electrostatics_cpu<double>(m, "f64");
+
+    declare_nonbonded_cpu<float>(m, "f32");
+    declare_nonbonded_cpu<double>(m, "f64");
+
+}
@@ -0,0 +1,334 @@
+import functools
+import unittest
+
+import numpy as np
+
+from timemachine import integrator
+from timemachine.lib import custom_ops_cpu
+from timemachine.potentials import bonded
+
+import jax
+from jax.config import config; config.update("jax_enable_x64", True)
+
+
+class TestOptimizersCpu(unittest.TestCase):
+
+    def setup_system(self):
+
+        masses = np.array([1.0, 12.0, 4.0])
+        x0 = np.array([
+            [1.0, 0.5, -0.5],
+            [0.2, 0.1, -0.3],
+            [0.5, 0.4, 0.3],
+        ], dtype=np.float64)
+        x0.setflags(write=False)
+
+        params = np.array([100.0, 2.0, 75.0, 1.81], np.float64)
+        bond_idxs = np.array([[0, 1], [1, 2]], dtype=np.int32)
+        bond_param_idxs = np.array([[0, 1], [0, 1]], dtype=np.int32)
+
+        angle_idxs = np.array([[0,1,2]], dtype=np.int32)
+        angle_param_idxs = np.array([[2,3]], dtype=np.int32)
+
+        torsion_idxs = np.zeros((0, 4), dtype=np.int32)
+        torsion_param_idxs = np.zeros((0, 3), dtype=np.int32)
+
+        total_nrg = functools.partial(bonded.bonded_terms,
+            box=None,
+            bond_idxs=bond_idxs,
+            bond_param_idxs=bond_param_idxs,
+            angle_idxs=angle_idxs,
+            angle_param_idxs=angle_param_idxs,
+            torsion_idxs=torsion_idxs,
+            torsion_param_idxs=torsion_param_idxs
+        )
+
+        test_bt = custom_ops_cpu.BondedTerms_f64(
+            bond_idxs,
+            bond_param_idxs,
+            angle_idxs,
+            angle_param_idxs,
+            torsion_idxs,
+            torsion_param_idxs
+        )
+
+        return total_nrg, x0, params, masses, [test_bt]
+
+    def test_context(self):
+
+        np.random.seed(2020)
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+
+        num_atoms = len(masses)
+        ref_dE_dx_fn = jax.jit(jax.grad(ref_total_nrg_fn, argnums=0))
+
+        dt = 0.002
+        ca = 0.95
+        cb = np.random.rand(num_atoms)
+        cc = np.zeros(num_atoms, dtype=np.float64)
+
+        v0 = np.random.rand(x0.shape[0], x0.shape[1])
+
+        def integrate(x_t, v_t, params):
+            for _ in range(100):
+                v_t = ca*v_t - np.expand_dims(cb, axis=-1)*ref_dE_dx_fn(x_t, params)
+                x_t = x_t + v_t*dt
+            return x_t, v_t
+
+        x_f, v_f = integrate(x0, v0, params)
+        dx_dp_f, dv_dp_f = jax.jacfwd(integrate, argnums=2)(x0, v0, params)
+        dx_dp_f = np.asarray(np.transpose(dx_dp_f, (2,0,1)))
+        dv_dp_f = np.asarray(np.transpose(dv_dp_f, (2,0,1)))
+
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(dt, ca, cb, cc)
+
+        # all, some and none of the parameters, with no dp_idxs no hessians are computed
+        for dp_idxs in [np.arange(len(params)), np.array([3, 1]), np.array([])]:
+
+            dp_idxs = dp_idxs.astype(np.int32)
+
+            # hessian_free propagates dx_dp with hessian vector products
+            for hessian_free in [False, True]:
+
+                ctxt = custom_ops_cpu.Context_cpu_f64(
+                    test_energies,
+                    lo,
+                    params,
+                    x0,
+                    v0,
+                    dp_idxs,
+                    hessian_free=hessian_free
+                )
+                assert ctxt.hessian_free == hessian_free
+
+                for _ in range(100):
+                    ctxt.step()
+
+                np.testing.assert_almost_equal(x_f, ctxt.get_x())
+                np.testing.assert_almost_equal(v_f, ctxt.get_v())
+
+                np.testing.assert_almost_equal(dx_dp_f[dp_idxs], ctxt.get_dx_dp())
+                np.testing.assert_almost_equal(dv_dp_f[dp_idxs], ctxt.get_dv_dp())
+
+    def test_adjoint_context(self):
+
+        np.random.seed(2022)
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+
+        num_atoms = len(masses)
+        ref_dE_dx_fn = jax.jit(jax.grad(ref_total_nrg_fn, argnums=0))
+
+        dt = 0.002
+        ca = 0.95
+        cb = np.random.rand(num_atoms)
+        cc = np.zeros(num_atoms, dtype=np.float64)
+
+        v0 = np.random.rand(x0.shape[0], x0.shape[1])
+
+        num_steps = 50
+        frame_idxs = np.array([0, 7, 31, 50, 50], dtype=np.int32)
+        dL_dx = np.random.rand(len(frame_idxs), num_atoms, 3)
+        dL_dv = np.random.rand(len(frame_idxs), num_atoms, 3)
+
+        def integrate(x_t, v_t, params):
+            xs, vs = [x_t], [v_t]
+            for _ in range(num_steps):
+                v_t = ca*v_t - np.expand_dims(cb, axis=-1)*ref_dE_dx_fn(x_t, params)
+                x_t = x_t + v_t*dt
+                xs.append(x_t)
+                vs.append(v_t)
+            return xs, vs
+
+        def loss(x0, v0, params):
+            xs, vs = integrate(x0, v0, params)
+            return sum(jax.numpy.sum(dL_dx[k]*xs[f] + dL_dv[k]*vs[f]) for k, f in enumerate(frame_idxs))
+
+        ref_xs, ref_vs = integrate(x0, v0, params)
+        ref_dL_dx0, ref_dL_dv0, ref_dL_dp = jax.grad(loss, argnums=(0, 1, 2))(x0, v0, params)
+
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(dt, ca, cb, cc)
+
+        # from recomputing every step to storing all of them
+        for num_checkpoints in [0, 1, 3, num_steps]:
+
+            ctxt = custom_ops_cpu.AdjointContext_cpu_f64(
+                test_energies,
+                lo,
+                params,
+                x0,
+                v0,
+                num_checkpoints
+            )
+
+            xs, vs = ctxt.forward(num_steps, frame_idxs)
+            np.testing.assert_almost_equal(xs, np.array(ref_xs)[frame_idxs])
+            np.testing.assert_almost_equal(vs, np.array(ref_vs)[frame_idxs])
+
+            dL_dp, dL_dx0, dL_dv0 = ctxt.backward(num_steps, frame_idxs, dL_dx, dL_dv)
+            np.testing.assert_almost_equal(dL_dp, ref_dL_dp)
+            np.testing.assert_almost_equal(dL_dx0, ref_dL_dx0)
+            np.testing.assert_almost_equal(dL_dv0, ref_dL_dv0)
+
+    def test_adjoint_noise(self):
+
+        np.random.seed(2023)
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+        num_atoms = len(masses)
+
+        cb = np.random.rand(num_atoms)
+        cc = np.random.rand(num_atoms)
+        v0 = np.random.rand(num_atoms, 3)
+        num_steps = 40
+        dL_dx = np.random.rand(1, num_atoms, 3)
+        dp_idxs = np.arange(len(params), dtype=np.int32)
+
+        # forward mode derivatives of the same noisy trajectory
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.95, cb, cc, seed=2023)
+        ctxt = custom_ops_cpu.Context_cpu_f64(test_energies, lo, params, x0, v0, dp_idxs)
+        for _ in range(num_steps):
+            ctxt.step()
+        ref_dL_dp = np.einsum('kl,mkl->m', dL_dx[0], ctxt.get_dx_dp())
+
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.95, cb, cc, seed=2023)
+        adjoint_ctxt = custom_ops_cpu.AdjointContext_cpu_f64(test_energies, lo, params, x0, v0, num_checkpoints=2)
+
+        xs, vs = adjoint_ctxt.forward(num_steps, np.array([num_steps], dtype=np.int32))
+        np.testing.assert_array_equal(xs[0], ctxt.get_x())
+        np.testing.assert_array_equal(vs[0], ctxt.get_v())
+        assert lo.noise_step == num_steps
+
+        # the recomputed steps replay the same noise, and the counter is restored
+        dL_dp, _, _ = adjoint_ctxt.backward(num_steps, np.array([num_steps], dtype=np.int32), dL_dx)
+        np.testing.assert_almost_equal(dL_dp, ref_dL_dp)
+        assert lo.noise_step == num_steps
+
+    def test_langevin_step(self):
+
+        np.random.seed(2021)
+        num_params = 5
+        num_atoms = 4
+
+        coeff_a = 0.95
+        coeff_bs = np.random.rand(num_atoms)
+        coeff_cs = np.random.rand(num_atoms)
+
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(1e-3, coeff_a, coeff_bs, coeff_cs)
+
+        for _ in range(10):
+
+            dE_dx = np.random.rand(num_atoms, 3)
+            d2E_dx2 = np.random.rand(num_atoms*3, num_atoms*3)
+            d2E_dx2 = np.tril(d2E_dx2) + np.tril(d2E_dx2, -1).T
+            d2E_dx2 = np.reshape(d2E_dx2, (num_atoms, 3, num_atoms, 3))
+            d2E_dxdp = np.random.rand(num_params, num_atoms, 3)
+
+            x_t = np.random.rand(num_atoms, 3)
+            v_t = np.random.rand(num_atoms, 3)
+            dx_dp_t = np.random.rand(num_params, num_atoms, 3)
+            dv_dp_t = np.random.rand(num_params, num_atoms, 3)
+            noise = np.random.rand(num_atoms, 3)
+
+            ref_v_t = coeff_a*v_t - np.expand_dims(coeff_bs, axis=-1)*dE_dx + np.expand_dims(coeff_cs, axis=-1)*noise
+            ref_x_t = x_t + ref_v_t*1e-3
+
+            hmp = np.einsum('ijkl,mkl->mij', d2E_dx2, dx_dp_t) + d2E_dxdp
+            ref_dv_dp_t = coeff_a*dv_dp_t - np.reshape(coeff_bs, (1, -1, 1))*hmp
+            ref_dx_dp_t = dx_dp_t + 1e-3*ref_dv_dp_t
+
+            ref_d2E_dxdp = d2E_dxdp.copy()
+
+            lo.step(dE_dx, d2E_dx2, d2E_dxdp, x_t, v_t, dx_dp_t, dv_dp_t, noise)
+
+            np.testing.assert_array_equal(ref_d2E_dxdp, d2E_dxdp)
+            np.testing.assert_almost_equal(ref_v_t, v_t)
+            np.testing.assert_almost_equal(ref_x_t, x_t)
+            np.testing.assert_almost_equal(ref_dv_dp_t, dv_dp_t)
+            np.testing.assert_almost_equal(ref_dx_dp_t, dx_dp_t)
+
+    def test_noise_stream(self):
+
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+        num_atoms = len(masses)
+
+        def run(seed):
+            lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.0, np.zeros(num_atoms), np.ones(num_atoms), seed=seed)
+            ctxt = custom_ops_cpu.Context_cpu_f64(test_energies, lo, params, x0, np.zeros_like(x0), np.array([], dtype=np.int32))
+            vs = []
+            for _ in range(2000):
+                ctxt.step()
+                # with coeff_a = coeff_b = 0 the velocities are the noise of each step
+                vs.append(ctxt.get_v())
+            return np.array(vs)
+
+        noise = run(2020)
+        np.testing.assert_array_equal(noise, run(2020))
+        assert not np.allclose(noise, run(2021))
+
+        assert np.abs(np.mean(noise)) < 0.05
+        np.testing.assert_allclose(np.std(noise), 1.0, rtol=0.05)
+
+    def test_noise_replicas(self):
+
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+        num_atoms = len(masses)
+        seed = 2**40 + 2020
+        num_steps = 5
+
+        def run(replica, noise_step=0):
+            lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.0, np.zeros(num_atoms), np.ones(num_atoms), seed=seed, replica=replica)
+            assert lo.replica == replica
+            ctxt = custom_ops_cpu.Context_cpu_f64(test_energies, lo, params, x0, np.zeros_like(x0), np.array([], dtype=np.int32), noise_step=noise_step)
+            vs = []
+            for _ in range(num_steps):
+                ctxt.step()
+                vs.append(ctxt.get_v())
+            assert ctxt.noise_step == noise_step + num_steps
+            return np.array(vs)
+
+        # the jax stream regenerates the noise of any (seed, replica, step) on demand
+        noise = {}
+        for replica, noise_step in [(0, 0), (3, 0), (3, 2**32 + 7)]:
+            noise[replica, noise_step] = run(replica, noise_step)
+            for t in range(num_steps):
+                ref_noise = integrator.gaussian_noise(seed, noise_step + t, num_atoms, replica=replica)
+                np.testing.assert_allclose(noise[replica, noise_step][t], ref_noise, rtol=1e-12, atol=1e-12)
+
+        assert not np.allclose(noise[0, 0], noise[3, 0])
+
+    def test_restart(self):
+
+        np.random.seed(2024)
+        ref_total_nrg_fn, x0, params, masses, test_energies = self.setup_system()
+        num_atoms = len(masses)
+
+        cb = np.random.rand(num_atoms)
+        cc = np.random.rand(num_atoms)
+        v0 = np.random.rand(num_atoms, 3)
+        dp_idxs = np.array([], dtype=np.int32)
+
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.95, cb, cc, seed=2024, replica=1)
+        ctxt = custom_ops_cpu.Context_cpu_f64(test_energies, lo, params, x0, v0, dp_idxs)
+        for _ in range(20):
+            ctxt.step()
+        x_t, v_t, noise_step = ctxt.get_x(), ctxt.get_v(), ctxt.noise_step
+        for _ in range(20):
+            ctxt.step()
+
+        # a new context resumed from the saved state and noise counter is bit identical
+        lo = custom_ops_cpu.LangevinOptimizer_cpu_f64(0.002, 0.95, cb, cc, seed=2024, replica=1)
+        restart = custom_ops_cpu.Context_cpu_f64(test_energies, lo, params, x_t, v_t, dp_idxs, noise_step=noise_step)
+        for _ in range(20):
+            restart.step()
+        np.testing.assert_array_equal(restart.get_x(), ctxt.get_x())
+        np.testing.assert_array_equal(restart.get_v(), ctxt.get_v())
+
+        # as is the jax reference integrator
+        ref_dE_dx_fn = jax.jit(jax.grad(ref_total_nrg_fn, argnums=0))
+        for t in range(noise_step, noise_step + 20):
+            x_t, v_t = integrator.langevin_step(x_t, v_t, ref_dE_dx_fn(x_t, params), 0.95, cb, cc, 0.002, 2024, t, replica=1)
+        np.testing.assert_allclose(x_t, ctxt.get_x(), rtol=1e-10)
+        np.testing.assert_allclose(v_t, ctxt.get_v(), rtol=1e-10)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,7 +5,11 @@ import jax
 from jax.config import config; config.update("jax_enable_x64", True)
 import functools
 
-from timemachine.lib import custom_ops
+try:
+    from timemachine.lib import custom_ops
+except ImportError:
+    # cpu only build, the host potentials share the names and arguments of the gpu ones
+    from timemachine.lib import custom_ops_cpu as custom_ops
 from timemachine.potentials import bonded
 from timemachine.potentials import nonbonded
 
@@ -297,13 +301,8 @@ class TestLennardJones(CustomOpsTest):
             [1, 2],
             [1, 2]], dtype=np.int32)
 
-        scale_matrix = np.array([
-            [  0,  0,  1,0.5,  0],
-            [  0,  0,  0,  1,  1],
-            [  1,  0,  0,  0,0.2],
-            [0.5,  1,  0,  0,  1],
-            [  0,  1,0.2,  1,  0],
-        ], dtype=np.float64)
+        exclusion_idxs = np.array([[0, 1], [0, 3], [0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.0, 0.5, 0.0, 0.0, 0.0, 0.2], dtype=np.float64)
 
         # box = np.array([
         #     [2.0, 0.5, 0.6],
@@ -312,13 +311,15 @@ class TestLennardJones(CustomOpsTest):
         # ], dtype=np.float64)
 
         energy_fn = functools.partial(nonbonded.lennard_jones,
-            scale_matrix=scale_matrix,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
             param_idxs=param_idxs,
             box=None,
             cutoff=None)
 
         lj = custom_ops.LennardJones_f64(
-            scale_matrix,
+            exclusion_idxs,
+            exclusion_scales,
             param_idxs
         )
 
@@ -343,33 +344,20 @@ class TestElectrostatics(CustomOpsTest):
 
         params = np.array([1.3, 0.3], dtype=np.float64)
         param_idxs = np.array([0, 1, 1, 1, 1], dtype=np.int32)
-        # scale_matrix = np.array([
-        #     [  0,  1,  1,  1,0.5],
-        #     [  1,  0,  0,  1,  1],
-        #     [  1,  0,  0,  0,0.2],
-        #     [  1,  1,  0,  0,  1],
-        #     [0.5,  1,0.2,  1,  0],
-        # ], dtype=np.float64)
-
-        scale_matrix = np.array([
-            [  0,  1,  1,  1,  1],
-            [  1,  0,  0,  1,  1],
-            [  1,  0,  0,  0,  1],
-            [  1,  1,  0,  0,  1],
-            [  1,  1,  1,  1,  0],
-        ], dtype=np.float64)
+        exclusion_idxs = np.array([[0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.5, 0.0, 0.0, 0.2], dtype=np.float64)
 
         # warning: non net-neutral cell
-        # ref_nrg = nonbonded.electrostatic(param_idxs, scale_matrix)
-
         energy_fn = functools.partial(
             nonbonded.electrostatics,
             param_idxs=param_idxs,
-            scale_matrix=scale_matrix,
+            exclusion_idxs=exclusion_idxs,
+            exclusion_scales=exclusion_scales,
             box=None)
 
         es = custom_ops.Electrostatics_f64(
-            scale_matrix,
+            exclusion_idxs,
+            exclusion_scales,
             param_idxs
         )
 
@@ -378,4 +366,159 @@ class TestElectrostatics(CustomOpsTest):
             params,
             energy_fn,
             es
-        )
\ No newline at end of file
+        )
+
+    def test_reaction_field(self):
+        np.random.seed(2020)
+        num_atoms = 40
+        conf = np.random.rand(num_atoms, 3)*3.0
+
+        params = np.array([0.7, -0.3, 0.5, 0.2], dtype=np.float64)
+        param_idxs = np.random.randint(len(params), size=(num_atoms,)).astype(np.int32)
+        exclusion_idxs = np.array([[0, 4], [1, 2], [33, 3], [2, 4]], dtype=np.int32)
+        exclusion_scales = np.array([0.5, 0.0, 0.0, 0.2], dtype=np.float64)
+        cutoff = 1.2
+
+        for rf_dielectric in [78.5, np.inf]:
+            energy_fn = functools.partial(
+                nonbonded.electrostatics,
+                param_idxs=param_idxs,
+                exclusion_idxs=exclusion_idxs,
+                exclusion_scales=exclusion_scales,
+                box=None,
+                cutoff=cutoff,
+                rf_dielectric=rf_dielectric)
+
+            es = custom_ops.Electrostatics_f64(
+                exclusion_idxs,
+                exclusion_scales,
+                param_idxs,
+                cutoff,
+                rf_dielectric
+            )
+
+            self.assert_derivatives(
+                conf,
+                params,
+                energy_fn,
+                es
+            )
+
+class TestNonbonded(CustomOpsTest):
+
+    def test_derivatives(self):
+        conf = np.array([
+            [ 0.0637,   0.0126,   0.2203],
+            [ 1.0573,  -0.2011,   1.2864],
+            [ 2.3928,   1.2209,  -0.2230],
+            [-0.6891,   1.6983,   0.0780],
+            [-0.6312,  -1.6261,  -0.2601]
+        ], dtype=np.float64)
+
+        params = np.array([3.0, 2.0, 1.0, 1.4, 1.3, 0.3], dtype=np.float64)
+        lj_param_idxs = np.array([
+            [0, 3],
+            [1, 2],
+            [1, 2],
+            [1, 2],
+            [1, 2]], dtype=np.int32)
+        charge_param_idxs = np.array([4, 5, 5, 5, 5], dtype=np.int32)
+
+        exclusion_idxs = np.array([[0, 1], [0, 3], [0, 4], [1, 2], [2, 3], [2, 4]], dtype=np.int32)
+        lj_scales = np.array([0.0, 0.5, 0.0, 0.0, 0.0, 0.2], dtype=np.float64)
+        es_scales = np.array([0.0, 0.8333, 0.0, 0.5, 0.0, 0.2], dtype=np.float64)
+
+        energy_fn = functools.partial(nonbonded.nonbonded,
+            box=None,
+            lj_param_idxs=lj_param_idxs,
+            charge_param_idxs=charge_param_idxs,
+            exclusion_idxs=exclusion_idxs,
+            lj_scales=lj_scales,
+            es_scales=es_scales)
+
+        nb = custom_ops.Nonbonded_f64(
+            exclusion_idxs,
+            lj_scales,
+            es_scales,
+            lj_param_idxs,
+            charge_param_idxs
+        )
+
+        self.assert_derivatives(
+            conf,
+            params,
+            energy_fn,
+            nb
+        )
+
+
+@unittest.skipIf(not hasattr(custom_ops, "SoftcoreNonbonded_f64"), "no host implementation of SoftcoreNonbonded")
+class TestSoftcoreNonbonded(CustomOpsTest):
+
+    def test_lambda_energies(self):
+        conf = np.array([
+            [ 0.0637,   0.0126,   0.2203],
+            [ 1.0573,  -0.2011,   1.2864],
+            [ 2.3928,   1.2209,  -0.2230],
+            [-0.6891,   1.6983,   0.0780],
+            [-0.6312,  -1.6261,  -0.2601]
+        ], dtype=np.float64)
+
+        params = np.array([3.0, 2.0, 1.0, 1.4, 1.3, 0.3], dtype=np.float64)
+        lj_param_idxs = np.array([
+            [0, 3],
+            [1, 2],
+            [1, 2],
+            [1, 2],
+            [1, 2]], dtype=np.int32)
+        charge_param_idxs = np.array([4, 5, 5, 5, 5], dtype=np.int32)
+        alchemical_flags = np.array([0, 0, 0, 1, 1], dtype=np.int32)
+
+        exclusion_idxs = np.array([[0, 1], [0, 3], [1, 2], [3, 4]], dtype=np.int32)
+        lj_scales = np.array([0.0, 0.5, 0.0, 0.2], dtype=np.float64)
+        es_scales = np.array([0.0, 0.8333, 0.5, 0.2], dtype=np.float64)
+
+        lambdas = np.linspace(0, 1, 11)
+        num_confs = 3
+        confs = np.repeat(conf[np.newaxis, :, :], num_confs, axis=0)
+        confs += np.random.rand(*confs.shape)
+
+        def energy_fn(conf, params, lambdas):
+            return nonbonded.softcore_nonbonded(
+                conf,
+                params,
+                None,
+                lj_param_idxs,
+                charge_param_idxs,
+                exclusion_idxs,
+                lj_scales,
+                es_scales,
+                lambdas,
+                alchemical_flags)
+
+        lamb = 0.3
+        nb = custom_ops.SoftcoreNonbonded_f64(
+            exclusion_idxs,
+            lj_scales,
+            es_scales,
+            lj_param_idxs,
+            charge_param_idxs,
+            alchemical_flags,
+            lamb
+        )
+
+        test_E = nb.lambda_energies(confs, params, lambdas)
+        ref_E = np.stack([energy_fn(c, params, lambdas) for c in confs])
+        np.testing.assert_almost_equal(test_E, ref_E)
+
+        # energies and forces at the sampling lambda
+        test_e, test_de_dx, _, _, _ = nb.derivatives(confs, params, dp_idxs=np.array([], dtype=np.int32))
+        ref_e = np.stack([energy_fn(c, params, lamb) for c in confs])
+        ref_de_dx = np.stack([jax.grad(energy_fn)(c, params, lamb) for c in confs])
+        np.testing.assert_almost_equal(test_e, ref_e)
+        np.testing.assert_almost_equal(test_de_dx, ref_de_dx)
+
+        nb.set_lambda(0.8)
+        assert nb.get_lambda() == 0.8
+        test_e, _, _, _, _ = nb.derivatives(confs, params, dp_idxs=np.array([], dtype=np.int32))
+        np.testing.assert_almost_equal(test_e, test_E[:, 8])
@@ -0,0 +1,336 @@
+import unittest
+
+import numpy as np
+import jax
+from jax.config import config; config.update("jax_enable_x64", True)
+import functools
+
+from timemachine.lib import custom_ops_cpu
+from timemachine.potentials import bonded, implicit, nonbonded, virial
+
+
+def generate_derivatives(energy_fn, confs, params):
+    E_fn = jax.vmap(energy_fn, in_axes=(0, None))
+    dE_dx_fn = jax.vmap(jax.grad(energy_fn, argnums=0), in_axes=(0, None))
+    dE_dp_fn = jax.vmap(jax.grad(energy_fn, argnums=1), in_axes=(0, None))
+    d2E_dxdp_fn = jax.vmap(jax.jacfwd(jax.grad(energy_fn, argnums=1), argnums=0), in_axes=(0, None))
+    return E_fn(confs, params), dE_dx_fn(confs, params), dE_dp_fn(confs, params), d2E_dxdp_fn(confs, params)
+
+
+class CustomOpsCpuTest(unittest.TestCase):
+
+    def assert_derivatives(self, confs, params, ref_nrg, test_nrg, dense_hessian=False):
+
+        all_dp_idxs = [
+            np.array([]),
+            np.random.permutation(np.arange(len(params)))[:np.random.randint(len(params))],
+            np.arange(len(params))
+        ]
+
+        ref_e, ref_de_dx, ref_de_dp, ref_d2e_dxdp = generate_derivatives(ref_nrg, confs, params)
+        ref_d2e_dx2 = jax.vmap(jax.hessian(ref_nrg), in_axes=(0, None))(confs, params)
+
+        for dp_idxs in all_dp_idxs:
+
+            dp_idxs = dp_idxs.astype(np.int32)
+            test_e, test_de_dx, test_d2e_dx2, test_de_dp, test_d2e_dxdp = test_nrg.derivatives(
+                confs,
+                params,
+                dp_idxs=dp_idxs
+            )
+
+            if dense_hessian:
+                np.testing.assert_almost_equal(test_d2e_dx2, ref_d2e_dx2)
+            else:
+                assert test_d2e_dx2 is None
+
+            np.testing.assert_almost_equal(test_e, ref_e)
+            np.testing.assert_almost_equal(test_de_dx, ref_de_dx)
+            np.testing.assert_almost_equal(test_de_dp, ref_de_dp[:, dp_idxs])
+            np.testing.assert_almost_equal(test_d2e_dxdp, ref_d2e_dxdp[:, dp_idxs, :, :])
+
+            # hessian vector products against the tangents of each parameter
+            dx_dp = np.random.RandomState(len(dp_idxs)).rand(confs.shape[0], len(dp_idxs), confs.shape[1], 3) - 0.5
+            test_e, test_de_dx, test_hvp, test_de_dp, test_d2e_dxdp = test_nrg.derivatives_hvp(
+                confs,
+                params,
+                dp_idxs=dp_idxs,
+                dx_dp=dx_dp
+            )
+
+            np.testing.assert_almost_equal(test_e, ref_e)
+            np.testing.assert_almost_equal(test_de_dx, ref_de_dx)
+            np.testing.assert_almost_equal(test_hvp, np.einsum('cijkl,cpkl->cpij', ref_d2e_dx2, dx_dp))
+            np.testing.assert_almost_equal(test_de_dp, ref_de_dp[:, dp_idxs])
+            np.testing.assert_almost_equal(test_d2e_dxdp, ref_d2e_dxdp[:, dp_idxs, :, :])
+
+        # vector jacobian products of the forces, over all of the parameters
+        adjoint = np.random.RandomState(2024).rand(*confs.shape) - 0.5
+        test_x_adjoint, test_p_adjoint = test_nrg.derivatives_vjp(confs, params, adjoint)
+        np.testing.assert_almost_equal(test_x_adjoint, np.einsum('cijkl,ckl->cij', ref_d2e_dx2, adjoint))
+        np.testing.assert_almost_equal(test_p_adjoint, np.einsum('cpkl,ckl->cp', ref_d2e_dxdp, adjoint))
+
+
+class TestBondedTerms(CustomOpsCpuTest):
+
+    def test_derivatives(self):
+
+        np.random.seed(2020)
+        num_atoms = 10
+        num_confs = 5
+        confs = np.random.rand(num_confs, num_atoms, 3)*2.0
+
+        params = np.array([
+            100.0, 0.15, 0.12, # bond constant and lengths
+            75.0, 1.91, 2.05,  # angle constant and ideal angles
+            2.3, 5.4, 0.0, 3.0, 1.0, 2.0 # torsion constants, phases and periods
+        ], dtype=np.float64)
+
+        bond_idxs = np.stack([np.arange(num_atoms - 1), np.arange(1, num_atoms)], axis=-1).astype(np.int32)
+        bond_param_idxs = np.stack([np.zeros(num_atoms - 1), np.random.randint(1, 3, size=num_atoms - 1)], axis=-1).astype(np.int32)
+        angle_idxs = np.stack([np.arange(num_atoms - 2), np.arange(1, num_atoms - 1), np.arange(2, num_atoms)], axis=-1).astype(np.int32)
+        angle_param_idxs = np.stack([np.zeros(num_atoms - 2) + 3, np.random.randint(4, 6, size=num_atoms - 2)], axis=-1).astype(np.int32)
+        torsion_idxs = np.stack([np.arange(num_atoms - 3), np.arange(1, num_atoms - 2), np.arange(2, num_atoms - 1), np.arange(3, num_atoms)], axis=-1).astype(np.int32)
+        torsion_param_idxs = np.array([[6, 8, 10], [7, 9, 11]], dtype=np.int32)[np.random.randint(0, 2, size=num_atoms - 3)]
+
+        bt = custom_ops_cpu.BondedTerms_f64(
+            bond_idxs,
+            bond_param_idxs,
+            angle_idxs,
+            angle_param_idxs,
+            torsion_idxs,
+            torsion_param_idxs
+        )
+
+        energy_fn = functools.partial(
+            bonded.bonded_terms,
+            box=None,
+            bond_idxs=bond_idxs,
+            bond_param_idxs=bond_param_idxs,
+            angle_idxs=angle_idxs,
+            angle_param_idxs=angle_param_idxs,
+            torsion_idxs=torsion_idxs,
+            torsion_param_idxs=torsion_param_idxs
+        )
+
+        self.assert_derivatives(
+            confs,
+            params,
+            energy_fn,
+            bt
+        )
+
+        # sparse hessian blocks
+        dp_idxs = np.arange(len(params), dtype=np.int32)
+        block_idxs = bt.hessian_block_idxs()
+        assert np.all(block_idxs[:, 0] >= block_idxs[:, 1])
+        assert len(set(map(tuple, block_idxs))) == len(block_idxs)
+
+        test_e, test_de_dx, test_blocks, test_de_dp, test_d2e_dxdp = bt.derivatives_sparse(confs, params, dp_idxs=dp_idxs)
+        ref_e, ref_de_dx, ref_de_dp, ref_d2e_dxdp = generate_derivatives(energy_fn, confs, params)
+        np.testing.assert_almost_equal(test_e, ref_e)
+        np.testing.assert_almost_equal(test_de_dx, ref_de_dx)
+        np.testing.assert_almost_equal(test_de_dp, ref_de_dp)
+        np.testing.assert_almost_equal(test_d2e_dxdp, ref_d2e_dxdp)
+
+        for conf, blocks in zip(confs, test_blocks):
+            ref_hessian = jax.hessian(energy_fn)(conf, params)
+            test_hessian = np.zeros((num_atoms, 3, num_atoms, 3))
+            for (row, col), block in zip(block_idxs, blocks):
+                test_hessian[row, :, col, :] += block
+                if row != col:
+                    test_hessian[col, :, row, :] += block.T
+            np.testing.assert_almost_equal(test_hessian, ref_hessian)
+
+
+class TestGBSA(CustomOpsCpuTest):
+
+    def test_derivatives(self):
+
+        np.random.seed(2021)
+        num_atoms = 40
+        num_confs = 3
+        confs = np.random.rand(num_confs, num_atoms, 3)*3.0
+
+        params = np.concatenate([
+            np.random.rand(num_atoms) - 0.5, # charges
+            np.random.rand(4)*0.1 + 0.12,    # atomic radii
+            np.random.rand(4)*0.5 + 0.5      # scale factors
+        ])
+
+        param_idxs = np.stack([
+            np.arange(num_atoms),
+            num_atoms + np.random.randint(0, 4, size=num_atoms),
+            num_atoms + 4 + np.random.randint(0, 4, size=num_atoms)
+        ], axis=-1).astype(np.int32)
+
+        for cutoff in [None, 1.0]:
+
+            gbsa = custom_ops_cpu.GBSA_f64(param_idxs, cutoff=cutoff)
+
+            energy_fn = functools.partial(
+                implicit.gbsa,
+                box=None,
+                param_idxs=param_idxs,
+                cutoff=cutoff
+            )
+
+            self.assert_derivatives(
+                confs,
+                params,
+                energy_fn,
+                gbsa
+            )
+
+            # the virial is accumulated alongside the forces
+            test_e, test_de_dx, test_virial = gbsa.derivatives_virial(confs, params)
+            for conf, e, de_dx, w in zip(confs, test_e, test_de_dx, test_virial):
+                ref_e, ref_de_dx, ref_virial = virial.derivatives_with_virial(
+                    lambda conf, params, box: energy_fn(conf, params))(conf, params, None)
+                np.testing.assert_almost_equal(e, ref_e)
+                np.testing.assert_almost_equal(de_dx, ref_de_dx)
+                np.testing.assert_almost_equal(w, ref_virial)
+
+
+class TestBondedPotentials(CustomOpsCpuTest):
+
+    def setUp(self):
+        np.random.seed(2022)
+        self.num_atoms = 12
+        self.confs = np.random.rand(4, self.num_atoms, 3)*2.0
+
+    def test_harmonic_bond(self):
+        params = np.array([100.0, 0.15, 0.12], dtype=np.float64)
+        bond_idxs = np.stack([np.arange(self.num_atoms - 1), np.arange(1, self.num_atoms)], axis=-1).astype(np.int32)
+        # atoms shared by several bonds exercise the reduction over threads
+        bond_idxs = np.concatenate([bond_idxs, [[0, 5], [5, 11]]]).astype(np.int32)
+        param_idxs = np.stack([np.zeros(len(bond_idxs)), np.random.randint(1, 3, size=len(bond_idxs))], axis=-1).astype(np.int32)
+
+        energy_fn = functools.partial(bonded.harmonic_bond, box=None, bond_idxs=bond_idxs, param_idxs=param_idxs)
+        test_nrg = custom_ops_cpu.HarmonicBond_f64(bond_idxs, param_idxs)
+        self.assert_derivatives(self.confs, params, energy_fn, test_nrg, dense_hessian=True)
+
+    def test_harmonic_angle(self):
+        params = np.array([75.0, 1.91, 2.05], dtype=np.float64)
+        angle_idxs = np.stack([np.arange(self.num_atoms - 2), np.arange(1, self.num_atoms - 1), np.arange(2, self.num_atoms)], axis=-1).astype(np.int32)
+        param_idxs = np.stack([np.zeros(self.num_atoms - 2), np.random.randint(1, 3, size=self.num_atoms - 2)], axis=-1).astype(np.int32)
+
+        energy_fn = functools.partial(bonded.harmonic_angle, box=None, angle_idxs=angle_idxs, param_idxs=param_idxs)
+        test_nrg = custom_ops_cpu.HarmonicAngle_f64(angle_idxs, param_idxs)
+        self.assert_derivatives(self.confs, params, energy_fn, test_nrg, dense_hessian=True)
+
+    def test_periodic_torsion(self):
+        params = np.array([2.3, 5.4, 0.0, 3.0, 1.0, 2.0], dtype=np.float64)
+        torsion_idxs = np.stack([np.arange(self.num_atoms - 3), np.arange(1, self.num_atoms - 2), np.arange(2, self.num_atoms - 1), np.arange(3, self.num_atoms)], axis=-1).astype(np.int32)
+        param_idxs = np.array([[0, 2, 4], [1, 3, 5]], dtype=np.int32)[np.random.randint(0, 2, size=self.num_atoms - 3)]
+
+        energy_fn = functools.partial(bonded.periodic_torsion, box=None, torsion_idxs=torsion_idxs, param_idxs=param_idxs)
+        test_nrg = custom_ops_cpu.PeriodicTorsion_f64(torsion_idxs, param_idxs)
+        self.assert_derivatives(self.confs, params, energy_fn, test_nrg, dense_hessian=True)
+
+
+class TestNonbondedPotentials(CustomOpsCpuTest):
+
+    def setUp(self):
+        np.random.seed(2023)
+        num_atoms = 33
+        self.confs = np.random.rand(3, num_atoms, 3)*3.0
+
+        num_types = 4
+        self.params = np.concatenate([
+            np.random.rand(num_types)*0.1 + 0.1, # sigmas
+            np.random.rand(num_types) + 0.5,     # epsilons
+            np.random.rand(num_types) - 0.5      # charges
+        ])
+        self.lj_param_idxs = np.stack([
+            np.random.randint(0, num_types, size=num_atoms),
+            num_types + np.random.randint(0, num_types, size=num_atoms)
+        ], axis=-1).astype(np.int32)
+        self.charge_param_idxs = (2*num_types + np.random.randint(0, num_types, size=num_atoms)).astype(np.int32)
+
+        self.exclusion_idxs = np.stack([np.arange(0, num_atoms - 1, 2), np.arange(1, num_atoms, 2)], axis=-1).astype(np.int32)
+        self.lj_scales = np.random.rand(len(self.exclusion_idxs))
+        self.es_scales = np.random.rand(len(self.exclusion_idxs))
+        # fully excluded pairs
+        self.lj_scales[0] = 0.0
+        self.es_scales[1] = 0.0
+
+    def test_lennard_jones(self):
+        energy_fn = functools.partial(
+            nonbonded.lennard_jones,
+            box=None,
+            param_idxs=self.lj_param_idxs,
+            exclusion_idxs=self.exclusion_idxs,
+            exclusion_scales=self.lj_scales
+        )
+        test_nrg = custom_ops_cpu.LennardJones_f64(self.exclusion_idxs, self.lj_scales, self.lj_param_idxs)
+        self.assert_derivatives(self.confs, self.params, energy_fn, test_nrg, dense_hessian=True)
+
+    def test_electrostatics(self):
+        energy_fn = functools.partial(
+            nonbonded.electrostatics,
+            box=None,
+            param_idxs=self.charge_param_idxs,
+            exclusion_idxs=self.exclusion_idxs,
+            exclusion_scales=self.es_scales
+        )
+        test_nrg = custom_ops_cpu.Electrostatics_f64(self.exclusion_idxs, self.es_scales, self.charge_param_idxs)
+        self.assert_derivatives(self.confs, self.params, energy_fn, test_nrg, dense_hessian=True)
+
+    def test_reaction_field(self):
+        cutoff = 1.2
+        for rf_dielectric in [1.0, 78.5, np.inf]:
+            energy_fn = functools.partial(
+                nonbonded.electrostatics,
+                box=None,
+                param_idxs=self.charge_param_idxs,
+                exclusion_idxs=self.exclusion_idxs,
+                exclusion_scales=self.es_scales,
+                cutoff=cutoff,
+                rf_dielectric=rf_dielectric
+            )
+            test_nrg = custom_ops_cpu.Electrostatics_f64(
+                self.exclusion_idxs,
+                self.es_scales,
+                self.charge_param_idxs,
+                cutoff=cutoff,
+                rf_dielectric=rf_dielectric
+            )
+            self.assert_derivatives(self.confs, self.params, energy_fn, test_nrg, dense_hessian=True)
+
+    def test_nonbonded(self):
+        for cutoff, rf_dielectric in [(None, None), (1.2, 78.5)]:
+            energy_fn = functools.partial(
+                nonbonded.nonbonded,
+                box=None,
+                lj_param_idxs=self.lj_param_idxs,
+                charge_param_idxs=self.charge_param_idxs,
+                exclusion_idxs=self.exclusion_idxs,
+                lj_scales=self.lj_scales,
+                es_scales=self.es_scales,
+                cutoff=cutoff,
+                rf_dielectric=rf_dielectric
+            )
+            kwargs = {} if cutoff is None else {"cutoff": cutoff, "rf_dielectric": rf_dielectric}
+            test_nrg = custom_ops_cpu.Nonbonded_f64(
+                self.exclusion_idxs,
+                self.lj_scales,
+                self.es_scales,
+                self.lj_param_idxs,
+                self.charge_param_idxs,
+                **kwargs
+            )
+            self.assert_derivatives(self.confs, self.params, energy_fn, test_nrg, dense_hessian=True)
+
+            # the virial is accumulated from the pair vectors in the same pass as the forces
+            test_e, test_de_dx, test_virial = test_nrg.derivatives_virial(self.confs, self.params)
+            for conf, e, de_dx, w in zip(self.confs, test_e, test_de_dx, test_virial):
+                ref_e, ref_de_dx, ref_virial = virial.derivatives_with_virial(
+                    lambda conf, params, box: energy_fn(conf, params))(conf, self.params, None)
+                np.testing.assert_almost_equal(e, ref_e)
+                np.testing.assert_almost_equal(de_dx, ref_de_dx)
+                np.testing.assert_almost_equal(w, ref_virial)
+
+
+if __name__ == "__main__":
+    unittest.main()
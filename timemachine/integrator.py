@@ -1,6 +1,9 @@
 from timemachine.constants import BOLTZ
 import numpy as np
 
+import jax
+import jax.numpy as jnp
+
 
 def langevin_coefficients(
     temperature,
@@ -45,4 +48,188 @@ def langevin_coefficients(
     ca = vscale
     cb = fscale*invMasses
     cc = nscale*sqrtInvMasses
-    return ca, cb, cc
\ No newline at end of file
+    return ca, cb, cc
+
+
+_PHILOX_M = (np.uint32(0xD2511F53), np.uint32(0xCD9E8D57))
+_PHILOX_W = (np.uint32(0x9E3779B9), np.uint32(0xBB67AE85))
+
+
+def _mulhilo32(a, b):
+    # high and low words of the 64 bit product, from 16 bit halves so that only uint32 is needed
+    mask = np.uint32(0xFFFF)
+    shift = np.uint32(16)
+    a_lo, a_hi = a & mask, a >> shift
+    b_lo, b_hi = b & mask, b >> shift
+    lo_lo = a_lo*b_lo
+    hi_lo = a_hi*b_lo
+    cross = (lo_lo >> shift) + (hi_lo & mask) + a_lo*b_hi
+    hi = a_hi*b_hi + (hi_lo >> shift) + (cross >> shift)
+    return hi, a*b
+
+
+def philox4x32_10(ctr, key):
+    """
+    Philox4x32-10 counter based generator, identical to the one used by the
+    C++ optimizers (see rng_cpu.hpp).
+
+    Parameters
+    ----------
+    ctr: tuple of four uint32 arrays
+        counter words, broadcast against each other
+
+    key: tuple of two uint32 arrays
+        key words
+
+    Returns
+    -------
+    tuple of four uint32 arrays
+        random words of each counter
+
+    """
+    c0, c1, c2, c3 = [jnp.asarray(c, dtype=jnp.uint32) for c in ctr]
+    k0, k1 = [jnp.asarray(k, dtype=jnp.uint32) for k in key]
+    for _ in range(10):
+        hi0, lo0 = _mulhilo32(_PHILOX_M[0], c0)
+        hi1, lo1 = _mulhilo32(_PHILOX_M[1], c2)
+        c0, c1, c2, c3 = hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0
+        k0 = k0 + _PHILOX_W[0]
+        k1 = k1 + _PHILOX_W[1]
+    return c0, c1, c2, c3
+
+
+def _split64(x):
+    x = int(x)
+    return np.uint32(x & 0xFFFFFFFF), np.uint32(x >> 32)
+
+
+def gaussian_noise(seed, step, num_atoms, replica=0):
+    """
+    Standard normal noise of a Langevin step, keyed by (seed, replica, step, atom, dim).
+
+    This regenerates the noise drawn by LangevinOptimizer (and its _cpu variant) for
+    noise_step == step without storing it, up to the last ulp of the transcendental
+    functions. The results are float64 only when jax_enable_x64 is set.
+
+    Parameters
+    ----------
+    seed: int
+        unsigned 64 bit seed of the stream, a python int
+
+    step: int
+        unsigned 64 bit counter of the draw, a python int
+
+    num_atoms: int
+        number of atoms
+
+    replica: int
+        unsigned 32 bit stream id, replicas sharing a seed are independent
+
+    Returns
+    -------
+    shape [num_atoms, 3] np.array
+        normal noise of each atom and dimension
+
+    """
+    step_lo, step_hi = _split64(step)
+    key = _split64(seed)
+    idxs = jnp.arange(num_atoms, dtype=jnp.uint32)
+    words = philox4x32_10((idxs, np.uint32(replica), step_lo, step_hi), key)
+
+    # uniforms in the open interval (0, 1) and two Box-Muller transforms, as on the host
+    dtype = jnp.float64 if jax.config.jax_enable_x64 else jnp.float32
+    u = [(w.astype(dtype) + 0.5)*2.3283064365386963e-10 for w in words]
+    normals = []
+    for i in range(2):
+        r = jnp.sqrt(-2*jnp.log(u[2*i]))
+        normals += [r*jnp.cos(2*np.pi*u[2*i+1]), r*jnp.sin(2*np.pi*u[2*i+1])]
+    return jnp.stack(normals[:3], axis=-1)
+
+
+def langevin_step(x_t, v_t, dE_dx, ca, cb, cc, dt, seed, step, replica=0):
+    """
+    Reference Langevin step matching LangevinOptimizer.step, where the noise is
+    regenerated from the counter based stream rather than drawn from np.random,
+    so that a trajectory can be replayed, restarted or differentiated exactly.
+
+    Parameters
+    ----------
+    x_t, v_t, dE_dx: shape [N, 3] np.array
+        coordinates, velocities and forces
+
+    ca: float
+        velocity scale
+
+    cb, cc: shape [N,] np.array
+        force and noise scales, see langevin_coefficients()
+
+    dt: float
+        units of picoseconds
+
+    seed, step, replica: int
+        the stream and counter of the noise, see gaussian_noise()
+
+    Returns
+    -------
+    (x_t, v_t)
+        the coordinates and velocities after the step
+
+    """
+    noise = gaussian_noise(seed, step, x_t.shape[0], replica)
+    v_t = ca*v_t - jnp.expand_dims(cb, axis=-1)*dE_dx + jnp.expand_dims(cc, axis=-1)*noise
+    x_t = x_t + v_t*dt
+    return x_t, v_t
+
+
+def simulate(x_t, v_t, box, force_fn, ca, cb, cc, dt, seed, num_steps, start_step=0, replica=0,
+    neighbor_list=None, barostat=None):
+    """
+    Run num_steps of langevin_step(), at constant pressure if a barostat is given.
+
+    Parameters
+    ----------
+    x_t, v_t: shape [N, 3] np.array
+        initial coordinates and velocities
+
+    box: shape [3, 3] np.array or None
+        periodic boundary vectors
+
+    force_fn: function
+        force_fn(conf, box, pair_idxs) returns dE_dx, where pair_idxs is the current
+        list of neighbor_list, or None
+
+    ca, cb, cc, dt:
+        see langevin_step()
+
+    seed: int
+        seed of the noise stream
+
+    num_steps: int
+        number of steps to take
+
+    start_step: int
+        noise counter of the first step, to resume a trajectory
+
+    replica: int
+        stream id of the noise, see gaussian_noise()
+
+    neighbor_list: neighborlist.NeighborList or None
+        pair list passed to force_fn, updated every step
+
+    barostat: jax_barostat.IsotropicMonteCarloBarostat or None
+        whose update() is called after every step
+
+    Returns
+    -------
+    (x_t, v_t, box)
+        the state after num_steps
+
+    """
+    for step in range(start_step, start_step + num_steps):
+        # a changed box always triggers a rebuild, so the list follows accepted volume moves
+        pair_idxs = None if neighbor_list is None else neighbor_list.update(x_t, box)
+        dE_dx = force_fn(x_t, box, pair_idxs)
+        x_t, v_t = langevin_step(x_t, v_t, dE_dx, ca, cb, cc, dt, seed, step, replica)
+        if barostat is not None:
+            x_t, box = barostat.update(x_t, box)
+    return x_t, v_t, box
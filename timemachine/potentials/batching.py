@@ -0,0 +1,94 @@
+import jax
+import jax.numpy as np
+from jax import lax
+
+
+def chunked_vmap(fn, xs, chunk_size=None):
+    """
+    Equivalent of jax.vmap(fn)(xs) that vectorizes over at most chunk_size elements of
+    xs at a time, so that peak memory is bounded independently of the batch size. The
+    chunks are evaluated one after another with lax.map, inside a single computation.
+
+    Parameters
+    ----------
+    fn: callable
+        function of a single element of xs, returning a pytree of arrays
+
+    xs: shape [B, ...] np.array
+        batch of inputs
+
+    chunk_size: int
+        number of elements evaluated together, or None to vectorize over the whole batch
+
+    Returns
+    -------
+    pytree of shape [B, ...] np.arrays
+
+    """
+    batch_size = xs.shape[0]
+    if chunk_size is None or chunk_size >= batch_size:
+        return jax.vmap(fn)(xs)
+
+    assert chunk_size > 0
+    num_chunks = -(-batch_size // chunk_size)
+    num_padded = num_chunks*chunk_size - batch_size
+
+    # the last chunk is padded with copies of the last element, whose results are discarded
+    xs = np.concatenate([xs, np.repeat(xs[-1:], num_padded, axis=0)])
+    xs = np.reshape(xs, (num_chunks, chunk_size) + xs.shape[1:])
+    ys = lax.map(jax.vmap(fn), xs)
+
+    def unchunk(y):
+        return np.reshape(y, (num_chunks*chunk_size,) + y.shape[2:])[:batch_size]
+
+    return jax.tree_util.tree_map(unchunk, ys)
+
+
+def batch_energy(energy_fn, chunk_size=None):
+    """
+    Vectorize a potential over a batch of conformations, such as the frames of a
+    reservoir, so that the whole batch is rescored by one compiled call.
+
+    Parameters
+    ----------
+    energy_fn: callable
+        energy_fn(conf, params) of a single [N, 3] conformation, eg. one of the potentials
+        with its box and topology bound by functools.partial.
+
+    chunk_size: int
+        maximum number of conformations evaluated together, see chunked_vmap.
+
+    Returns
+    -------
+    callable
+        jitted fn(confs, params), mapping shape [B, N, 3] confs to shape [B,] energies.
+        It is differentiable w.r.t. both confs and params.
+
+    """
+    def batched_fn(confs, params):
+        return chunked_vmap(lambda conf: energy_fn(conf, params), confs, chunk_size)
+
+    return jax.jit(batched_fn)
+
+
+def batch_derivatives(energy_fn, chunk_size=None):
+    """
+    Vectorize the energy and its first derivatives over a batch of conformations, see
+    batch_energy.
+
+    Returns
+    -------
+    callable
+        jitted fn(confs, params) returning (E, dE_dx, dE_dp) of shapes [B,], [B, N, 3]
+        and [B, P], where dE_dp is the parameter gradient of each conformation.
+
+    """
+    derivatives_fn = jax.value_and_grad(energy_fn, argnums=(0, 1))
+
+    def batched_fn(confs, params):
+        def conf_fn(conf):
+            energy, (dE_dx, dE_dp) = derivatives_fn(conf, params)
+            return energy, dE_dx, dE_dp
+        return chunked_vmap(conf_fn, confs, chunk_size)
+
+    return jax.jit(batched_fn)
@@ -1,3 +1,7 @@
+import functools
+
+import numpy as onp
+import jax
 import jax.numpy as np
 
 from timemachine.potentials.jax_utils import distance, delta_r
@@ -27,13 +31,15 @@ def harmonic_bond(conf, params, box, bond_idxs, param_idxs):
         each element (k_idx, r_idx) maps into params for bond constants and ideal lengths
 
     """
-    ci = conf[bond_idxs[:, 0]]
-    cj = conf[bond_idxs[:, 1]]
-    dij = distance(ci, cj, box)
-    kbs = params[param_idxs[:, 0]]
-    r0s = params[param_idxs[:, 1]]
-    energy = np.sum(kbs/2 * np.power(dij - r0s, 2.0))
-    return energy
+    return np.sum(_harmonic_bond_energies(conf[bond_idxs], params[param_idxs], box))
+
+
+def _harmonic_bond_energies(xs, ps, box):
+    # xs: [num_bonds, 2, 3] gathered coordinates, ps: [num_bonds, 2] gathered parameters
+    dij = distance(xs[:, 0], xs[:, 1], box)
+    kbs = ps[:, 0]
+    r0s = ps[:, 1]
+    return kbs/2 * np.power(dij - r0s, 2.0)
 
 
 def harmonic_angle(conf, params, box, angle_idxs, param_idxs, cos_angles=True):
@@ -65,12 +71,17 @@ def harmonic_angle(conf, params, box, angle_idxs, param_idxs, cos_angles=True):
         numerically stable when the angle is pi.
 
     """
-    ci = conf[angle_idxs[:, 0]]
-    cj = conf[angle_idxs[:, 1]]
-    ck = conf[angle_idxs[:, 2]]
+    energies = _harmonic_angle_energies(conf[angle_idxs], params[param_idxs], box, cos_angles)
+    return np.sum(energies, -1)  # reduce over all angles
+
+
+def _harmonic_angle_energies(xs, ps, box, cos_angles):
+    ci = xs[:, 0]
+    cj = xs[:, 1]
+    ck = xs[:, 2]
 
-    kas = params[param_idxs[:, 0]]
-    a0s = params[param_idxs[:, 1]]
+    kas = ps[:, 0]
+    a0s = ps[:, 1]
 
     vij = delta_r(ci, cj, box)
     vjk = delta_r(ck, cj, box)
@@ -87,7 +98,7 @@ def harmonic_angle(conf, params, box, angle_idxs, param_idxs, cos_angles=True):
         angle = np.arccos(tb)
         energies = kas/2*np.power(angle - a0s, 2)
 
-    return np.sum(energies, -1)  # reduce over all angles
+    return energies
 
 
 def signed_torsion_angle(ci, cj, ck, cl):
@@ -123,6 +134,12 @@ def signed_torsion_angle(ci, cj, ck, cl):
     # implementation as opposed to the OpenMM energy function to
     # avoid asingularity when the angle is zero.
 
+    y, x = _torsion_atan2_args(ci, cj, ck, cl)
+    return np.arctan2(y, x)
+
+
+def _torsion_atan2_args(ci, cj, ck, cl):
+    # (y, x) such that the torsion angle is arctan2(y, x)
     rij = delta_r(cj, ci)
     rkj = delta_r(cj, ck)
     rkl = delta_r(cl, ck)
@@ -130,14 +147,10 @@ def signed_torsion_angle(ci, cj, ck, cl):
     n1 = np.cross(rij, rkj)
     n2 = np.cross(rkj, rkl)
 
-    lhs = np.linalg.norm(n1, axis=-1)
-    rhs = np.linalg.norm(n2, axis=-1)
-    bot = lhs * rhs
-
     y = np.sum(np.multiply(np.cross(n1, n2), rkj/np.linalg.norm(rkj, axis=-1, keepdims=True)), axis=-1)
     x = np.sum(np.multiply(n1, n2), -1)
 
-    return np.arctan2(y, x)
+    return y, x
 
 
 def periodic_torsion(conf, params, box, torsion_idxs, param_idxs):
@@ -163,16 +176,253 @@ def periodic_torsion(conf, params, box, torsion_idxs, param_idxs):
     
     """
 
+    conf = conf[:, :3] # this is defined only in 3d
+    nrg = _periodic_torsion_energies(conf[torsion_idxs], params[param_idxs])
+    return np.sum(nrg, axis=-1)
+
+
+def _periodic_torsion_energies(xs, ps):
+    ks = ps[:, 0]
+    phase = ps[:, 1]
+    period = ps[:, 2]
+    angle = signed_torsion_angle(xs[:, 0], xs[:, 1], xs[:, 2], xs[:, 3])
+    return ks*(1+np.cos(period * angle - phase))
+
+
+def bonded_terms(
+    conf,
+    params,
+    box,
+    bond_idxs,
+    bond_param_idxs,
+    angle_idxs,
+    angle_param_idxs,
+    torsion_idxs,
+    torsion_param_idxs,
+    cos_angles=True):
+    """
+    Compute the sum of the harmonic bond, harmonic angle and periodic torsion energies
+    in a single pass.
+
+    The atoms and parameters of every term are gathered together with one indexing
+    operation each, so that the backward pass accumulates all of the bonded forces and
+    parameter derivatives with a single scatter-add instead of one per term. The energy
+    is identical to summing harmonic_bond, harmonic_angle and periodic_torsion.
+
+    Parameters:
+    -----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    params: shape [num_params,] np.array
+        unique parameters
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, if not None. Torsions are not imaged, as in
+        periodic_torsion.
+
+    bond_idxs, bond_param_idxs: shape [num_bonds, 2] np.arrays
+        see harmonic_bond
+
+    angle_idxs: shape [num_angles, 3] np.array
+    angle_param_idxs: shape [num_angles, 2] np.array
+        see harmonic_angle
+
+    torsion_idxs: shape [num_torsions, 4] np.array
+    torsion_param_idxs: shape [num_torsions, 3] np.array
+        see periodic_torsion
+
+    cos_angles: True (default)
+        see harmonic_angle
+
+    """
+    num_dims = conf.shape[-1]
+
+    atom_idxs = onp.concatenate([
+        onp.reshape(bond_idxs, -1),
+        onp.reshape(angle_idxs, -1),
+        onp.reshape(torsion_idxs, -1)
+    ]).astype(onp.int32)
+    param_idxs = onp.concatenate([
+        onp.reshape(bond_param_idxs, -1),
+        onp.reshape(angle_param_idxs, -1),
+        onp.reshape(torsion_param_idxs, -1)
+    ]).astype(onp.int32)
+
+    num_bonds = len(bond_idxs)
+    num_angles = len(angle_idxs)
+    num_torsions = len(torsion_idxs)
+
+    xs = conf[atom_idxs]
+    ps = params[param_idxs]
+
+    x_offsets = onp.cumsum([num_bonds*2, num_angles*3])
+    p_offsets = onp.cumsum([num_bonds*2, num_angles*2])
+    bond_xs, angle_xs, torsion_xs = np.split(xs, x_offsets)
+    bond_ps, angle_ps, torsion_ps = np.split(ps, p_offsets)
+
+    nrg = np.sum(_harmonic_bond_energies(
+        np.reshape(bond_xs, (num_bonds, 2, num_dims)),
+        np.reshape(bond_ps, (num_bonds, 2)),
+        box))
+    nrg += np.sum(_harmonic_angle_energies(
+        np.reshape(angle_xs, (num_angles, 3, num_dims)),
+        np.reshape(angle_ps, (num_angles, 2)),
+        box,
+        cos_angles))
+    nrg += np.sum(_periodic_torsion_energies(
+        np.reshape(torsion_xs, (num_torsions, 4, num_dims))[:, :, :3],
+        np.reshape(torsion_ps, (num_torsions, 3))))
+
+    return nrg
+
+
+def group_torsions(torsion_idxs, param_idxs):
+    """
+    Group torsions that share the same four atoms into a single entry.
+
+    Forcefields expand a torsion with K periodicities into K entries that repeat the
+    same atoms. This collects them into one row per unique quad, padded to the largest
+    number of terms found on any quad.
+
+    Parameters
+    ----------
+    torsion_idxs: shape [num_torsions, 4] np.array
+        atoms of each torsion term, as used by periodic_torsion
+
+    param_idxs: shape [num_torsions, 3] np.array
+        (k, phase, period) indices of each torsion term
+
+    Returns
+    -------
+    (grouped_torsion_idxs, grouped_param_idxs)
+        shape [T, 4] unique quads in order of first appearance and shape [T, K, 3]
+        parameter indices of each of their terms, padded with -1.
+
+    """
+    torsion_idxs = onp.asarray(torsion_idxs, dtype=onp.int32).reshape(-1, 4)
+    param_idxs = onp.asarray(param_idxs, dtype=onp.int32).reshape(-1, 3)
+    assert len(torsion_idxs) == len(param_idxs)
+
+    groups = {}
+    for quad, p_idxs in zip(map(tuple, torsion_idxs), param_idxs):
+        groups.setdefault(quad, []).append(p_idxs)
+
+    num_terms = max([len(v) for v in groups.values()], default=1)
+    grouped_torsion_idxs = onp.array(list(groups.keys()), dtype=onp.int32).reshape(-1, 4)
+    grouped_param_idxs = onp.full((len(groups), num_terms, 3), -1, dtype=onp.int32)
+    for t_idx, terms in enumerate(groups.values()):
+        grouped_param_idxs[t_idx, :len(terms)] = terms
+
+    return grouped_torsion_idxs, grouped_param_idxs
+
+
+@functools.partial(jax.custom_jvp, nondiff_argnums=(3,))
+def _multiple_angle_cos_sin(y, x, periods, max_period):
+    """
+    cos(n*t) and sin(n*t) of t = arctan2(y, x) for integer periods n of shape [T, K],
+    from the Chebyshev recurrences of cos(t) and sin(t), without any trigonometric
+    calls. The derivatives are those of the continuous functions, so that the periods
+    remain differentiable. Periods must be integers in [0, max_period], see
+    _direct_cos_sin for the others.
+    """
+    r = np.sqrt(x*x + y*y)
+    cos_t = x/r
+    sin_t = y/r
+
+    cos_n = [np.ones_like(cos_t), cos_t]
+    sin_n = [np.zeros_like(sin_t), sin_t]
+    for _ in range(2, max_period + 1):
+        cos_n.append(2*cos_t*cos_n[-1] - cos_n[-2])
+        sin_n.append(2*cos_t*sin_n[-1] - sin_n[-2])
+
+    cos_n = np.stack(cos_n[:max_period + 1], axis=-1)  # [T, max_period+1]
+    sin_n = np.stack(sin_n[:max_period + 1], axis=-1)
+
+    # the clip only keeps the gather in bounds for padded terms
+    n_idxs = np.clip(np.round(periods), 0, max_period).astype(np.int32)  # [T, K]
+    return np.take_along_axis(cos_n, n_idxs, axis=-1), np.take_along_axis(sin_n, n_idxs, axis=-1)
+
+
+@_multiple_angle_cos_sin.defjvp
+def _multiple_angle_cos_sin_jvp(max_period, primals, tangents):
+    y, x, periods = primals
+    y_dot, x_dot, periods_dot = tangents
+    cos_n, sin_n = _multiple_angle_cos_sin(y, x, periods, max_period)
+    angle = np.arctan2(y, x)
+    angle_dot = (x*y_dot - y*x_dot)/(x*x + y*y)
+    # d(n*t) of every term
+    arg_dot = periods*np.expand_dims(angle_dot, -1) + np.expand_dims(angle, -1)*periods_dot
+    return (cos_n, sin_n), (-sin_n*arg_dot, cos_n*arg_dot)
+
+
+def _direct_cos_sin(y, x, periods):
+    """
+    cos(n*t) and sin(n*t) of t = arctan2(y, x) for arbitrary periods n of shape [T, K].
+    """
+    angle = np.expand_dims(np.arctan2(y, x), -1)
+    return np.cos(periods*angle), np.sin(periods*angle)
+
+
+def grouped_periodic_torsion(conf, params, box, torsion_idxs, param_idxs, max_period=6):
+    """
+    Compute the periodic torsional energy of grouped multi-term torsions, see
+    group_torsions. This is equal to periodic_torsion over the expanded terms,
+    but the torsion angle is computed once per quad and cos(n*t - phase) is expanded as
+    cos(n*t)cos(phase) + sin(n*t)sin(phase), with cos(n*t) and sin(n*t) from the
+    Chebyshev recurrence.
+
+    Parameters:
+    -----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    params: shape [num_params,] np.array
+        unique parameters
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, if not None
+
+    torsion_idxs: shape [T, 4] np.array
+        indices denoting the four atoms of each unique torsion
+
+    param_idxs: shape [T, K, 3] np.array
+        indices into the params array denoting the force constant, phase, and period
+        of each term of a torsion, or -1 for padding.
+
+    max_period: int
+        largest period of the recurrence. If any period is not an integer in
+        [0, max_period] then every term is evaluated with a cos(n*t) call instead.
+
+    """
     conf = conf[:, :3] # this is defined only in 3d
 
-    ci = conf[torsion_idxs[:, 0]]
-    cj = conf[torsion_idxs[:, 1]]
-    ck = conf[torsion_idxs[:, 2]]
-    cl = conf[torsion_idxs[:, 3]]
-
-    ks = params[param_idxs[:, 0]]
-    phase = params[param_idxs[:, 1]]
-    period = params[param_idxs[:, 2]]
-    angle = signed_torsion_angle(ci, cj, ck, cl)
-    nrg = ks*(1+np.cos(period * angle - phase))
-    return np.sum(nrg, axis=-1)
\ No newline at end of file
+    param_idxs = onp.asarray(param_idxs)
+    mask = onp.all(param_idxs >= 0, axis=-1)  # [T, K]
+    safe_idxs = onp.where(param_idxs >= 0, param_idxs, 0)
+    ps = params[safe_idxs]
+
+    ks = np.where(mask, ps[:, :, 0], 0)
+    period = ps[:, :, 2]
+
+    # a force field only has a handful of distinct phases, so their cos and sin are
+    # evaluated once and gathered for every term
+    phase_idxs, phase_inv = onp.unique(safe_idxs[:, :, 1], return_inverse=True)
+    phase_inv = phase_inv.reshape(mask.shape)
+    phases = params[phase_idxs]
+    cos_phase = np.cos(phases)[phase_inv]
+    sin_phase = np.sin(phases)[phase_inv]
+
+    xs = conf[torsion_idxs]
+    y, x = _torsion_atan2_args(xs[:, 0], xs[:, 1], xs[:, 2], xs[:, 3])
+
+    # only one branch is executed, so tables of integer periods never pay for the trigonometry
+    in_range = np.logical_and(period == np.round(period), np.logical_and(period >= 0, period <= max_period))
+    valid = np.all(np.logical_or(in_range, ~mask))
+    cos_n, sin_n = jax.lax.cond(valid,
+        lambda args: _multiple_angle_cos_sin(*args, max_period),
+        lambda args: _direct_cos_sin(*args),
+        (y, x, period))
+
+    nrg = ks*(1 + cos_n*cos_phase + sin_n*sin_phase)
+    return np.sum(nrg)
@@ -0,0 +1,293 @@
+import time
+
+import numpy as onp
+import jax
+
+from timemachine.potentials import nonbonded, pme
+
+# Rough relative costs used to rank candidate plans: one real space pair, one
+# (atom, k-vector) term of the direct reciprocal sum, one (atom, grid point) term of
+# the PME spreading, and one grid point of the FFT per factor of log2(grid points).
+PAIR_COST = 1.0
+KVEC_COST = 1.0
+SPLINE_COST = 1.0
+FFT_COST = 1.0
+
+# coefficients of the PPPM/PME reciprocal space error estimate of Deserno and Holm (1998),
+# indexed by interpolation order
+_PME_ERROR_COEFFS = {
+    2: [1/50, 5/294],
+    3: [1/588, 7/1440, 21/3872],
+    4: [1/4320, 3/1936, 7601/2271360, 143/28800],
+    5: [1/23232, 7601/13628160, 143/69120, 517231/106536960, 106640677/11737571328],
+    6: [691/68140800, 13/57600, 47021/35512320, 9694607/2095994880, 733191589/59609088000,
+        326190917/11700633600],
+    7: [1/345600, 3617/35512320, 745739/838397952, 56399353/12773376000, 25091609/1560084480,
+        1755948832039/36229939200000, 4887769399/37838389248],
+}
+
+
+def real_space_error(q2, num_atoms, cutoff, alpha, volume):
+    """
+    Kolafa-Perram estimate of the RMS real space force error.
+
+    All of the error estimates in this module are relative to the force between two
+    unit charges one nm apart, ie. they are absolute errors divided by ONE_4PI_EPS0.
+
+    Parameters
+    ----------
+    q2: float
+        sum of the squared charges
+
+    num_atoms: int
+        number of charged atoms
+
+    cutoff: float
+        real space cutoff
+
+    alpha: float
+        Ewald splitting parameter
+
+    volume: float
+        volume of the periodic box
+
+    """
+    return 2*q2*onp.exp(-(alpha*cutoff)**2)/onp.sqrt(num_atoms*cutoff*volume)
+
+
+def reciprocal_space_error(q2, num_atoms, alpha, box_lengths, kmax):
+    """
+    Kolafa-Perram estimate of the RMS force error of the direct reciprocal sum, which
+    includes all lattice vectors with |m_d| < kmax along each box vector d.
+    """
+    km = kmax - 1
+    if km < 1:
+        return onp.inf
+    L = onp.asarray(box_lengths, dtype=onp.float64)
+    errors = 2*q2*alpha/L*onp.sqrt(1/(onp.pi*km*num_atoms))*onp.exp(-(onp.pi*km/(alpha*L))**2)
+    return onp.sqrt(onp.sum(errors**2)/3)
+
+
+def check_pme_order(order):
+    """
+    Raise if there is no error estimate for the PME interpolation order.
+    """
+    if order not in _PME_ERROR_COEFFS:
+        raise ValueError("No PME error estimate for pme_order={}, the supported orders are {} to {}.".format(
+            order, min(_PME_ERROR_COEFFS), max(_PME_ERROR_COEFFS)))
+
+
+def pme_error(q2, num_atoms, alpha, box_lengths, grid_size, order):
+    """
+    Estimate of the RMS reciprocal space force error of smooth PME, following the
+    PPPM estimate of Deserno and Holm (1998). That estimate assumes an optimal influence
+    function, so the actual error of smooth PME is typically a few times larger.
+    """
+    check_pme_order(order)
+    coeffs = _PME_ERROR_COEFFS[order]
+    L = onp.asarray(box_lengths, dtype=onp.float64)
+    ha = alpha*L/onp.asarray(grid_size, dtype=onp.float64)
+    sums = sum(c*onp.power(ha, 2*m) for m, c in enumerate(coeffs))
+    errors = q2*onp.power(ha, order)*onp.sqrt(alpha*L*onp.sqrt(2*onp.pi)*sums/num_atoms)/(L*L)
+    return onp.sqrt(onp.sum(errors**2)/3)
+
+
+class EwaldPlan():
+
+    def __init__(self, cutoff, alpha, kmax, grid_spacing, grid_size, pme_order, real_error, recip_error, cost):
+        """
+        Ewald parameters chosen by ewald_plan, together with their estimated errors and
+        relative cost. Exactly one of kmax or grid_spacing is set.
+        """
+        self.cutoff = cutoff
+        self.alpha = alpha
+        self.kmax = kmax
+        self.grid_spacing = grid_spacing
+        self.grid_size = grid_size
+        self.pme_order = pme_order
+        self.real_error = real_error
+        self.recip_error = recip_error
+        self.cost = cost
+
+    @property
+    def error(self):
+        """
+        Estimated total RMS force error.
+        """
+        return onp.sqrt(self.real_error**2 + self.recip_error**2)
+
+    def electrostatics_kwargs(self):
+        """
+        Keyword arguments of nonbonded.electrostatics and nonbonded.nonbonded that
+        reproduce this plan.
+        """
+        kwargs = dict(cutoff=self.cutoff, alpha=self.alpha)
+        if self.kmax is not None:
+            kwargs['kmax'] = self.kmax
+        else:
+            kwargs['grid_spacing'] = self.grid_spacing
+            kwargs['pme_order'] = self.pme_order
+        return kwargs
+
+    def profile(self, conf, box, charges, num_repeats=5):
+        """
+        Measure the wall time of one jitted energy and force evaluation of this plan.
+
+        Parameters
+        ----------
+        conf: shape [num_atoms, 3] np.array
+            atomic coordinates
+
+        box: shape [3, 3] np.array
+            periodic box that the plan was made for
+
+        charges: shape [num_atoms,] np.array
+            atomic charges
+
+        num_repeats: int
+            number of timed evaluations, after one untimed compilation
+
+        Returns
+        -------
+        dict
+            the estimated errors (error, real_error, recip_error) next to the mean
+            wall_time in seconds.
+
+        """
+        num_atoms = conf.shape[0]
+        param_idxs = onp.arange(num_atoms)
+        exclusion_idxs = onp.zeros((0, 2), dtype=onp.int32)
+        exclusion_scales = onp.zeros((0,), dtype=onp.float64)
+        kwargs = self.electrostatics_kwargs()
+
+        def energy_fn(conf, charges):
+            return nonbonded.electrostatics(conf, charges, box, param_idxs, exclusion_idxs, exclusion_scales, **kwargs)
+
+        fn = jax.jit(jax.value_and_grad(energy_fn))
+        jax.block_until_ready(fn(conf, charges))
+
+        start = time.perf_counter()
+        for _ in range(num_repeats):
+            jax.block_until_ready(fn(conf, charges))
+        wall_time = (time.perf_counter() - start)/num_repeats
+
+        return dict(error=self.error, real_error=self.real_error, recip_error=self.recip_error, wall_time=wall_time)
+
+    def __repr__(self):
+        if self.kmax is not None:
+            recip = "kmax={}".format(self.kmax)
+        else:
+            recip = "grid_size={}, pme_order={}".format(self.grid_size, self.pme_order)
+        return "EwaldPlan(cutoff={:.4f}, alpha={:.4f}, {}, error={:.3e})".format(self.cutoff, self.alpha, recip, self.error)
+
+
+def ewald_plan(box, N, charges, tolerance, method="ewald", pme_order=5, cutoffs=None, max_kmax=64, max_grid_size=512):
+    """
+    Choose the Ewald splitting parameter, the real space cutoff, and either kmax or a PME
+    grid so that the estimated RMS force error is at most tolerance, at the lowest
+    estimated cost.
+
+    Each candidate cutoff fixes alpha by making the Kolafa-Perram real space error equal
+    to tolerance/sqrt(2), after which the smallest reciprocal space that also meets
+    tolerance/sqrt(2) is picked. Candidates are ranked by the number of real space
+    pairs, (atom, k-vector) terms, or spline and FFT terms, weighted by the costs
+    defined in this module.
+
+    Parameters
+    ----------
+    box: shape [3, 3] np.array
+        periodic boundary vectors, one per row. This must be concrete.
+
+    N: int
+        number of atoms
+
+    charges: shape [N,] np.array
+        atomic charges
+
+    tolerance: float
+        target RMS force error relative to the force between two unit charges one nm apart
+
+    method: str
+        "ewald" to sum the reciprocal space directly over kmax, or "pme"
+
+    pme_order: int
+        B-spline interpolation order used by PME, between 2 and 7
+
+    cutoffs: iterable of floats
+        candidate cutoffs, defaults to a grid up to half of the shortest box vector,
+        which is also the largest allowed cutoff
+
+    max_kmax: int
+        largest kmax that is considered
+
+    max_grid_size: int
+        largest number of PME grid points along any box vector that is considered
+
+    Returns
+    -------
+    EwaldPlan
+
+    """
+    assert tolerance > 0
+    assert method in ("ewald", "pme")
+    if method == "pme":
+        check_pme_order(pme_order)
+
+    box = onp.asarray(box, dtype=onp.float64)
+    charges = onp.asarray(charges, dtype=onp.float64)
+    assert charges.shape == (N,)
+
+    box_lengths = onp.linalg.norm(box, axis=-1)
+    volume = onp.abs(onp.linalg.det(box))
+    q2 = onp.sum(charges*charges)
+    target = tolerance/onp.sqrt(2)
+
+    if cutoffs is None:
+        cutoffs = onp.linspace(0.05, 0.5, 46)*onp.amin(box_lengths)
+
+    # average number of neighbors of each atom within a unit cutoff, halved for i < j
+    pair_density = (N - 1)/volume*(4/3)*onp.pi/2
+
+    cutoffs = onp.asarray(list(cutoffs), dtype=onp.float64)
+    if onp.any(2*cutoffs > onp.amin(box_lengths)):
+        raise ValueError("Box lengths cannot be smaller than twice the cutoff.")
+
+    best = None
+    for cutoff in cutoffs:
+        # alpha at which the real space error equals the target
+        arg = target*onp.sqrt(N*cutoff*volume)/(2*q2)
+        alpha = onp.sqrt(max(-onp.log(arg), 1.0))/cutoff
+        real_error = real_space_error(q2, N, cutoff, alpha, volume)
+        # a cutoff sphere that spills out of a skewed box cannot hold more than every pair
+        real_cost = PAIR_COST*N*min(pair_density*cutoff**3, (N - 1)/2)
+
+        plan = None
+        if method == "ewald":
+            for kmax in range(2, max_kmax + 1):
+                recip_error = reciprocal_space_error(q2, N, alpha, box_lengths, kmax)
+                if recip_error <= target:
+                    num_kvecs = ((2*kmax - 1)**3 - 1)//2
+                    cost = real_cost + KVEC_COST*N*num_kvecs
+                    plan = EwaldPlan(cutoff, alpha, kmax, None, None, pme_order, real_error, recip_error, cost)
+                    break
+        else:
+            for n in range(pme_order, max_grid_size + 1):
+                # grid sizes are derived from a spacing, exactly as in nonbonded.electrostatics
+                grid_spacing = onp.amin(box_lengths)/n
+                grid_size = tuple(max(k, pme_order) for k in pme.grid_size_from_spacing(box, grid_spacing))
+                if max(grid_size) > max_grid_size:
+                    break
+                recip_error = pme_error(q2, N, alpha, box_lengths, grid_size, pme_order)
+                if recip_error <= target:
+                    num_points = onp.prod(grid_size)
+                    cost = real_cost + SPLINE_COST*N*pme_order**3 + FFT_COST*num_points*onp.log2(num_points)
+                    plan = EwaldPlan(cutoff, alpha, None, grid_spacing, grid_size, pme_order, real_error, recip_error, cost)
+                    break
+
+        if plan is not None and (best is None or plan.cost < best.cost):
+            best = plan
+
+    if best is None:
+        raise ValueError("No candidate plan reaches a tolerance of {}.".format(tolerance))
+
+    return best
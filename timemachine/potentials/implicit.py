@@ -1,9 +1,13 @@
+import functools
+
 import numpy as onp
+import jax
 import jax.numpy as np
 from jax.scipy.special import erf, erfc
 
 from timemachine.constants import ONE_4PI_EPS0
-from timemachine.potentials.jax_utils import delta_r, distance
+from timemachine.potentials import tiling
+from timemachine.potentials.jax_utils import delta_r, distance, pair_distance, upper_triangle_pair_idxs
 
 def non_polar_ace(born_radii, atomic_radii, probe_radius, pi4Asolv):
     """
@@ -35,7 +39,10 @@ def born_radii(
     dielectric_offset,
     alpha_obc,
     beta_obc,
-    gamma_obc):
+    gamma_obc,
+    tile_size=None,
+    cutoff=None,
+    pair_idxs=None):
     """
     Compute the adjusted born radii of each atom. This is the first part of the GBSA calculation.
 
@@ -50,6 +57,18 @@ def born_radii(
     scaled_radius_factor: np.array
         shape [N,] array of adjusted shape factors for each atom.
 
+    tile_size: int
+        If not None, and pair_idxs is None, then the descreening sums are evaluated in
+        blocks of [tile_size, tile_size] so that no [N, N] intermediates are formed.
+
+    cutoff: float
+        If not None, then only atoms within cutoff descreen each other.
+
+    pair_idxs: shape [num_pairs, 2] np.array
+        If not None, then only these unique (i, j) pairs, padded with negative indices,
+        are evaluated. Typically this is a neighborlist.NeighborList built with the
+        same cutoff.
+
     Returns
     -------
     np.array
@@ -58,24 +77,39 @@ def born_radii(
     """
     num_atoms = conf.shape[0]
 
-    r_i = np.expand_dims(conf, axis=0)
-    r_j = np.expand_dims(conf, axis=1)
-    d_ij = distance(r_i, r_j)
-
     oR = atomic_radii - dielectric_offset
-    oRI = np.expand_dims(oR, axis=1) # rows
-    oRJ = np.expand_dims(oR, axis=0) # columns
-    sRJ = oRJ * scaled_radius_factor
-    rSRJ = d_ij + sRJ
+    sR = oR * scaled_radius_factor
+
+    if pair_idxs is None and tile_size is not None:
+        tile_fn = functools.partial(_descreening_tile, cutoff=cutoff)
+        summ = tiling.tiled_row_sum(tile_fn, (conf, oR, sR), num_atoms, tile_size)
+    else:
+        if pair_idxs is None:
+            pair_idxs = upper_triangle_pair_idxs(num_atoms)
+        summ = _descreening_sums(conf, oR, sR, pair_idxs, cutoff)
+
+    return _obc_radii(summ, oR, atomic_radii, alpha_obc, beta_obc, gamma_obc)
 
-    # along the diagonal rSRJ < oRI, resulting in a mask whose
-    # diagonals are strictly false.
-    mask_final = np.less(oRI, rSRJ)
 
-    d_ij_inv = 1/d_ij 
-    # 1/d_ij has NaNs along diagonals so we need to zero it out
-    keep_mask = 1 - np.eye(conf.shape[0])
-    d_ij_inv = np.where(keep_mask, d_ij_inv, np.zeros_like(d_ij_inv))
+def _obc_radii(summ, oR, atomic_radii, alpha_obc, beta_obc, gamma_obc):
+    """
+    Born radii from the raw descreening sums of each atom.
+    """
+    summ = summ * 0.5 * oR
+    sum2 = summ*summ
+    sum3 = summ*sum2
+    tanhSum = np.tanh(alpha_obc*summ - beta_obc*sum2 + gamma_obc*sum3)
+
+    return 1.0/(1.0/oR - tanhSum/atomic_radii)
+
+
+def descreening_term(d_ij, d_ij_inv, oRI, sRJ, keep_mask):
+    """
+    Elementwise contribution of atom j to the descreening sum of atom i, zeroed
+    wherever keep_mask is False or the spheres do not overlap.
+    """
+    rSRJ = d_ij + sRJ
+    mask_final = np.logical_and(keep_mask, np.less(oRI, rSRJ))
 
     rfs = np.abs(d_ij - sRJ)
     l_ij = np.maximum(oRI, rfs)
@@ -85,16 +119,196 @@ def born_radii(
     u_ij2 = u_ij * u_ij
     ratio = np.log(u_ij/l_ij)
     term = l_ij - u_ij + 0.25*d_ij*(u_ij2 - l_ij2)  + (0.5*d_ij_inv*ratio) + (0.25*sRJ*sRJ*d_ij_inv)*(l_ij2 - u_ij2);
-    term_masked = np.where(mask_final, term, np.zeros_like(term))
+    return np.where(mask_final, term, np.zeros_like(term))
 
-    summ = np.sum(term_masked, axis=-1)
 
-    summ *= 0.5 * oR
-    sum2 = summ*summ
-    sum3 = summ*sum2
-    tanhSum = np.tanh(alpha_obc*summ - beta_obc*sum2 + gamma_obc*sum3)
+def _descreening_term_derivatives(d_ij, oRI, sRJ, keep_mask):
+    """
+    descreening_term along with its partial derivatives w.r.t. d_ij, oRI and sRJ,
+    following the same branches for the lower integration bound.
+    """
+    rSRJ = d_ij + sRJ
+    mask_final = np.logical_and(keep_mask, np.less(oRI, rSRJ))
+
+    d_ij_inv = 1/d_ij
+    rfs_signed = d_ij - sRJ
+    rfs = np.abs(rfs_signed)
+    oRI_bound = oRI >= rfs
+    l_ij = 1/np.where(oRI_bound, oRI, rfs)
+    u_ij = 1/rSRJ
+    l_ij2 = l_ij * l_ij
+    u_ij2 = u_ij * u_ij
+    sRJ2 = sRJ*sRJ
+    ratio = np.log(u_ij/l_ij)
+    term = l_ij - u_ij + 0.25*d_ij*(u_ij2 - l_ij2) + (0.5*d_ij_inv*ratio) + (0.25*sRJ2*d_ij_inv)*(l_ij2 - u_ij2)
+
+    dterm_dl = 1 - 0.5*d_ij*l_ij - 0.5*d_ij_inv/l_ij + 0.5*sRJ2*d_ij_inv*l_ij
+    dterm_du = -1 + 0.5*d_ij*u_ij + 0.5*d_ij_inv/u_ij - 0.5*sRJ2*d_ij_inv*u_ij
+
+    # explicit dependencies, then through u_ij = 1/(d_ij + sRJ) and l_ij = 1/max(oRI, |d_ij - sRJ|)
+    dterm_dd = 0.25*(u_ij2 - l_ij2) - 0.5*d_ij_inv*d_ij_inv*ratio - 0.25*sRJ2*d_ij_inv*d_ij_inv*(l_ij2 - u_ij2) - dterm_du*u_ij2
+    dterm_dsRJ = 0.5*sRJ*d_ij_inv*(l_ij2 - u_ij2) - dterm_du*u_ij2
+    dl_drfs = -dterm_dl*l_ij2*np.sign(rfs_signed)
+    dterm_dd = np.where(oRI_bound, dterm_dd, dterm_dd + dl_drfs)
+    dterm_dsRJ = np.where(oRI_bound, dterm_dsRJ, dterm_dsRJ - dl_drfs)
+    dterm_doRI = np.where(oRI_bound, -dterm_dl*l_ij2, np.zeros_like(l_ij2))
+
+    zeros = np.zeros_like(term)
+    return (
+        np.where(mask_final, term, zeros),
+        np.where(mask_final, dterm_dd, zeros),
+        np.where(mask_final, dterm_doRI, zeros),
+        np.where(mask_final, dterm_dsRJ, zeros)
+    )
+
+
+def _cutoff_pair_distance(conf, pair_idxs, cutoff):
+    d_ij, keep_mask = pair_distance(conf, pair_idxs)
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, d_ij < cutoff)
+    return d_ij, keep_mask
+
+
+def _pair_distance_tangent(conf, conf_dot, pair_idxs, d_ij, keep_mask):
+    src_idxs = pair_idxs[:, 0]
+    dst_idxs = pair_idxs[:, 1]
+    dr = conf[src_idxs] - conf[dst_idxs]
+    dr_dot = conf_dot[src_idxs] - conf_dot[dst_idxs]
+    return np.where(keep_mask, np.sum(dr*dr_dot, axis=-1)/d_ij, np.zeros_like(d_ij))
+
+
+@functools.partial(jax.custom_jvp, nondiff_argnums=(4,))
+def _descreening_sums(conf, oR, sR, pair_idxs, cutoff):
+    """
+    Descreening sums of every atom over the unique pairs in pair_idxs. Each pair
+    descreens both of its atoms, so the distances are only computed once for the two
+    (asymmetric) terms.
+
+    The derivatives are hand written so that only the per-pair partial derivatives
+    of the descreening terms, rather than every intermediate of descreening_term, are
+    kept by reverse mode. Transposed, the jvp is the second pairwise pass of the
+    usual generalized Born chain rule.
+    """
+    num_atoms = conf.shape[0]
+    src_idxs = pair_idxs[:, 0]
+    dst_idxs = pair_idxs[:, 1]
+    d_ij, keep_mask = _cutoff_pair_distance(conf, pair_idxs, cutoff)
+    d_ij_inv = 1/d_ij
+
+    term_ij = descreening_term(d_ij, d_ij_inv, oR[src_idxs], sR[dst_idxs], keep_mask)
+    term_ji = descreening_term(d_ij, d_ij_inv, oR[dst_idxs], sR[src_idxs], keep_mask)
+
+    return jax.ops.segment_sum(term_ij, src_idxs, num_atoms) + jax.ops.segment_sum(term_ji, dst_idxs, num_atoms)
+
+
+@_descreening_sums.defjvp
+def _descreening_sums_jvp(cutoff, primals, tangents):
+    conf, oR, sR, pair_idxs = primals
+    conf_dot, oR_dot, sR_dot, _ = tangents
+    num_atoms = conf.shape[0]
+    src_idxs = pair_idxs[:, 0]
+    dst_idxs = pair_idxs[:, 1]
+    d_ij, keep_mask = _cutoff_pair_distance(conf, pair_idxs, cutoff)
+
+    term_ij, dd_ij, doR_ij, dsR_ij = _descreening_term_derivatives(d_ij, oR[src_idxs], sR[dst_idxs], keep_mask)
+    term_ji, dd_ji, doR_ji, dsR_ji = _descreening_term_derivatives(d_ij, oR[dst_idxs], sR[src_idxs], keep_mask)
+
+    summ = jax.ops.segment_sum(term_ij, src_idxs, num_atoms) + jax.ops.segment_sum(term_ji, dst_idxs, num_atoms)
+
+    d_dot = _pair_distance_tangent(conf, conf_dot, pair_idxs, d_ij, keep_mask)
+    term_ij_dot = dd_ij*d_dot + doR_ij*oR_dot[src_idxs] + dsR_ij*sR_dot[dst_idxs]
+    term_ji_dot = dd_ji*d_dot + doR_ji*oR_dot[dst_idxs] + dsR_ji*sR_dot[src_idxs]
+    summ_dot = jax.ops.segment_sum(term_ij_dot, src_idxs, num_atoms) + jax.ops.segment_sum(term_ji_dot, dst_idxs, num_atoms)
+
+    return summ, summ_dot
 
-    return 1.0/(1.0/oR - tanhSum/atomic_radii)
+
+def _descreening_tile(args, i_idxs, j_idxs, keep_mask, cutoff=None):
+    conf, oR, sR = args
+    d_ij = tiling.tile_distance(conf[i_idxs], conf[j_idxs], keep_mask)
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, d_ij < cutoff)
+    oRI = np.expand_dims(oR[i_idxs], axis=1)
+    sRJ = np.expand_dims(sR[j_idxs], axis=0)
+    return descreening_term(d_ij, 1/d_ij, oRI, sRJ, keep_mask)
+
+
+def _gpol_tile(args, i_idxs, j_idxs, keep_mask, cutoff=None):
+    conf, charges, br = args
+    ri = np.expand_dims(conf[i_idxs], 1)
+    rj = np.expand_dims(conf[j_idxs], 0)
+    r2 = np.sum(np.power(ri - rj, 2), axis=-1)
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, r2 < cutoff*cutoff)
+    alpha2_ij = np.expand_dims(br[i_idxs], 1) * np.expand_dims(br[j_idxs], 0)
+    D_ij = r2/(4.0*alpha2_ij)
+    denom = np.sqrt(r2 + alpha2_ij*np.exp(-D_ij))
+    Gpol = np.expand_dims(charges[i_idxs], 1) * np.expand_dims(charges[j_idxs], 0) / denom
+    return np.where(keep_mask, Gpol, np.zeros_like(Gpol))
+
+
+@functools.partial(jax.custom_jvp, nondiff_argnums=(4,))
+def _gpol_pair_sum(conf, charges, br, pair_idxs, cutoff):
+    """
+    Generalized Born energy of the unique pairs in pair_idxs, without the prefactor.
+
+    As with _descreening_sums, the derivatives are hand written so that reverse mode
+    only keeps the per-pair partial derivatives. Transposed, the jvp is the first
+    pairwise pass of the generalized Born chain rule that accumulates dE/dR_i.
+    """
+    src_idxs = pair_idxs[:, 0]
+    dst_idxs = pair_idxs[:, 1]
+    d_ij, keep_mask = _cutoff_pair_distance(conf, pair_idxs, cutoff)
+
+    r2 = d_ij*d_ij
+    alpha2_ij = br[src_idxs] * br[dst_idxs]
+    D_ij = r2/(4.0*alpha2_ij)
+    expTerm = np.exp(-D_ij)
+    denom2 = r2 + alpha2_ij*expTerm
+    denom = np.sqrt(denom2)
+    q_ij = charges[src_idxs]*charges[dst_idxs]
+
+    Gpol = np.where(keep_mask, q_ij/denom, np.zeros_like(denom))
+
+    return np.sum(Gpol)
+
+
+@_gpol_pair_sum.defjvp
+def _gpol_pair_sum_jvp(cutoff, primals, tangents):
+    conf, charges, br, pair_idxs = primals
+    conf_dot, charges_dot, br_dot, _ = tangents
+    src_idxs = pair_idxs[:, 0]
+    dst_idxs = pair_idxs[:, 1]
+    d_ij, keep_mask = _cutoff_pair_distance(conf, pair_idxs, cutoff)
+    zeros = np.zeros_like(d_ij)
+
+    r2 = d_ij*d_ij
+    br_i = br[src_idxs]
+    br_j = br[dst_idxs]
+    alpha2_ij = br_i*br_j
+    D_ij = r2/(4.0*alpha2_ij)
+    expTerm = np.exp(-D_ij)
+    denom2 = r2 + alpha2_ij*expTerm
+    denom_inv = np.where(keep_mask, 1/np.sqrt(denom2), zeros)
+    Gpol = charges[src_idxs]*charges[dst_idxs]*denom_inv
+
+    c = -Gpol/(2*denom2)
+    dG_dr2 = c*(1 - expTerm/4)
+    dG_dalpha2 = c*expTerm*(1 + D_ij)
+
+    d_dot = _pair_distance_tangent(conf, conf_dot, pair_idxs, d_ij, keep_mask)
+    Gpol_dot = 2*dG_dr2*d_ij*d_dot
+    Gpol_dot += dG_dalpha2*(br_dot[src_idxs]*br_j + br_i*br_dot[dst_idxs])
+    Gpol_dot += (charges_dot[src_idxs]*charges[dst_idxs] + charges[src_idxs]*charges_dot[dst_idxs])*denom_inv
+
+    return np.sum(Gpol), np.sum(Gpol_dot)
+
+
+def _gb_prefactor(solute_dielectric, solvent_dielectric, electric_constant):
+    if solute_dielectric != 0.0 and solvent_dielectric != 0.0:
+        return 2.0 * electric_constant * (1.0/solute_dielectric - 1.0/solvent_dielectric)
+    else:
+        return 0.0
 
 
 def gbsa(conf,
@@ -102,7 +316,7 @@ def gbsa(conf,
     box,
     param_idxs, 
     dielectric_offset=0.009,
-    cutoff=2.0,
+    cutoff=None,
     alpha_obc=1.0,
     beta_obc=0.8,
     gamma_obc=4.85,
@@ -110,7 +324,9 @@ def gbsa(conf,
     solvent_dielectric=78.3,
     electric_constant=-69.467728,
     probe_radius=0.14,
-    surface_area_energy=2.25936):
+    surface_area_energy=2.25936,
+    tile_size=None,
+    pair_idxs=None):
     """
     Computes the GBSA energy with support for full OBC style parameters.
 
@@ -135,6 +351,21 @@ def gbsa(conf,
         0th index indicate charges, 1st indicates radii
         and 2nd indicates scale_factors
 
+    cutoff: float
+        If not None, then both the descreening of the born radii and the generalized
+        Born pair energies are truncated at cutoff, as in OpenMM's CutoffNonPeriodic
+        method. Self energies are always included.
+
+    tile_size: int
+        If not None, and pair_idxs is None, then all pairwise terms are evaluated in
+        blocks of [tile_size, tile_size], so that memory use grows linearly with
+        the number of atoms.
+
+    pair_idxs: shape [num_pairs, 2] np.array
+        If not None, then only these unique (i, j) pairs, padded with negative indices,
+        are evaluated, eg. from a neighborlist.NeighborList with the same cutoff. The
+        cost then grows linearly with the number of atoms.
+
     """
 
     if box is not None:
@@ -142,10 +373,7 @@ def gbsa(conf,
 
     num_atoms = conf.shape[0]
 
-    if solute_dielectric != 0.0 and solvent_dielectric != 0.0:
-        prefactor = 2.0 * electric_constant * (1.0/solute_dielectric - 1.0/solvent_dielectric)
-    else:
-        prefactor = 0.0
+    prefactor = _gb_prefactor(solute_dielectric, solvent_dielectric, electric_constant)
 
     # (ytz): The rough sketch of the algorithm is as follows:
     # 1. Compute the adjusted GB radii
@@ -163,28 +391,10 @@ def gbsa(conf,
         dielectric_offset,
         alpha_obc,
         beta_obc,
-        gamma_obc)
-
-    r_i = np.expand_dims(conf, axis=0)
-    r_j = np.expand_dims(conf, axis=1)
-
-    q_i = np.expand_dims(charges, axis=0)
-    q_j = np.expand_dims(charges, axis=1)
-    q_ij = q_i*q_j
-
-    br_i = np.expand_dims(br, axis=0)
-    br_j = np.expand_dims(br, axis=1)
-
-    r2 = np.sum(np.power(r_i - r_j, 2), axis=-1)
-    alpha2_ij = br_i * br_j
-    D_ij = r2/(4.0*alpha2_ij)
-    expTerm = np.exp(-D_ij)
-    denom2 = r2 + alpha2_ij*expTerm
-    denom = np.sqrt(denom2)
-    pq_ij = prefactor*q_ij
-
-    Gpol = pq_ij/denom
-    energy = Gpol
+        gamma_obc,
+        tile_size,
+        cutoff,
+        pair_idxs)
 
     pi4Asolv = 4*np.pi*surface_area_energy
 
@@ -194,5 +404,231 @@ def gbsa(conf,
         probe_radius,
         pi4Asolv)
 
-    # compute using only the upper triangle
-    return np.sum(np.triu(energy)) + np.sum(np.diagonal(energy)/2.0) + nonpolar_nrg
+    if pair_idxs is None and tile_size is not None:
+        tile_fn = functools.partial(_gpol_tile, cutoff=cutoff)
+        pair_nrg = prefactor*tiling.tiled_pair_sum(tile_fn, (conf, charges, br), num_atoms, tile_size)
+        self_nrg = prefactor*np.sum(charges*charges/br)/2.0
+        return pair_nrg + self_nrg + nonpolar_nrg
+
+    # only the unique pairs i < j are evaluated, the diagonal self energies are halved
+    if pair_idxs is None:
+        pair_idxs = upper_triangle_pair_idxs(num_atoms)
+    pair_nrg = prefactor*_gpol_pair_sum(conf, charges, br, pair_idxs, cutoff)
+    self_nrg = prefactor*np.sum(charges*charges/br)/2.0
+
+    return pair_nrg + self_nrg + nonpolar_nrg
+
+
+def _pad_rows(row_idxs, num_atoms):
+    """
+    Pad a set of atom indices with -1 to the next power of two, so that the jitted row
+    kernels below are only compiled for O(log N) distinct shapes. Returns the padded
+    rows and the [N,] position of each atom in them, -1 for atoms that are not rows.
+    """
+    num_rows = len(row_idxs)
+    capacity = 1
+    while capacity < num_rows:
+        capacity *= 2
+    padded = onp.full(min(capacity, max(num_atoms, num_rows)), -1, dtype=onp.int32)
+    padded[:num_rows] = row_idxs
+    row_rank = onp.full(num_atoms, -1, dtype=onp.int32)
+    row_rank[row_idxs] = onp.arange(num_rows)
+    return padded, row_rank
+
+
+def _row_pair_distance(conf, row_idxs, row_rank, cutoff):
+    """
+    [k, N] distances between the row atoms and every atom, along with the mask that
+    selects each unique pair with at least one row atom exactly once.
+    """
+    num_atoms = conf.shape[0]
+    col_idxs = np.arange(num_atoms)
+    rank = np.arange(row_idxs.shape[0])
+    keep_mask = np.logical_and(
+        np.expand_dims(row_idxs >= 0, 1),
+        np.expand_dims(row_idxs, 1) != np.expand_dims(col_idxs, 0)
+    )
+    # pairs of two row atoms are only counted in the row that comes first
+    keep_mask = np.logical_and(keep_mask, np.logical_or(
+        np.expand_dims(row_rank, 0) < 0,
+        np.expand_dims(row_rank, 0) > np.expand_dims(rank, 1)
+    ))
+    dr = np.expand_dims(conf[row_idxs], 1) - np.expand_dims(conf, 0)
+    d2_ij = np.sum(dr*dr, axis=-1)
+    d_ij = np.sqrt(np.where(keep_mask, d2_ij, np.ones_like(d2_ij)))
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, d_ij < cutoff)
+    return d_ij, keep_mask
+
+
+@functools.partial(jax.jit, static_argnums=(6,))
+def _descreening_sums_delta(old_conf, new_conf, oR, sR, row_idxs, row_rank, cutoff):
+    num_atoms = old_conf.shape[0]
+
+    def row_sums(conf):
+        d_ij, keep_mask = _row_pair_distance(conf, row_idxs, row_rank, cutoff)
+        d_ij_inv = 1/d_ij
+        oR_row = np.expand_dims(oR[row_idxs], 1)
+        sR_row = np.expand_dims(sR[row_idxs], 1)
+        # row atom descreened by every atom, and every atom descreened by the row atom
+        term_rj = descreening_term(d_ij, d_ij_inv, oR_row, np.expand_dims(sR, 0), keep_mask)
+        term_jr = descreening_term(d_ij, d_ij_inv, np.expand_dims(oR, 0), sR_row, keep_mask)
+        return jax.ops.segment_sum(np.sum(term_rj, axis=1), row_idxs, num_atoms) + np.sum(term_jr, axis=0)
+
+    return row_sums(new_conf) - row_sums(old_conf)
+
+
+@functools.partial(jax.jit, static_argnums=(5,))
+def _gpol_row_sum(conf, charges, br, row_idxs, row_rank, cutoff):
+    d_ij, keep_mask = _row_pair_distance(conf, row_idxs, row_rank, cutoff)
+    r2 = d_ij*d_ij
+    alpha2_ij = np.expand_dims(br[row_idxs], 1)*np.expand_dims(br, 0)
+    denom = np.sqrt(r2 + alpha2_ij*np.exp(-r2/(4.0*alpha2_ij)))
+    q_ij = np.expand_dims(charges[row_idxs], 1)*np.expand_dims(charges, 0)
+    return np.sum(np.where(keep_mask, q_ij/denom, np.zeros_like(denom)))
+
+
+class GBSAState():
+
+    def __init__(self,
+        conf,
+        params,
+        param_idxs,
+        dielectric_offset=0.009,
+        cutoff=None,
+        alpha_obc=1.0,
+        beta_obc=0.8,
+        gamma_obc=4.85,
+        solute_dielectric=1.0,
+        solvent_dielectric=78.3,
+        electric_constant=-69.467728,
+        probe_radius=0.14,
+        surface_area_energy=2.25936):
+        """
+        Cached GBSA energy of a non-periodic system, for Monte Carlo moves and other local
+        updates that only displace k of the N atoms.
+
+        The raw descreening sum of every atom is cached, so that the Born radii after a
+        move only require the O(k*N) pairs that involve a moved atom. The generalized Born
+        pair energies are then recomputed for the pairs involving any atom whose radius
+        changed. With a cutoff these are only the atoms near the moved ones, without one
+        every radius changes and the energy delta costs O(N^2), albeit without redoing
+        the descreening sums.
+
+        Usage is propose() followed by either accept() or another propose(). The cached
+        sums accumulate roundoff over many accepted moves, reset() recomputes them.
+
+        Parameters
+        ----------
+        conf: shape [N, 3] np.array
+            initial coordinates
+
+        params, param_idxs, ...:
+            as in gbsa()
+
+        """
+        self.params = params
+        self.param_idxs = param_idxs
+        self.dielectric_offset = dielectric_offset
+        self.cutoff = cutoff
+        self.alpha_obc = alpha_obc
+        self.beta_obc = beta_obc
+        self.gamma_obc = gamma_obc
+        self.solute_dielectric = solute_dielectric
+        self.solvent_dielectric = solvent_dielectric
+        self.electric_constant = electric_constant
+        self.probe_radius = probe_radius
+        self.surface_area_energy = surface_area_energy
+
+        self.prefactor = _gb_prefactor(solute_dielectric, solvent_dielectric, electric_constant)
+        self.charges = params[param_idxs[:, 0]]
+        self.atomic_radii = params[param_idxs[:, 1]]
+        self.oR = self.atomic_radii - dielectric_offset
+        self.sR = self.oR * params[param_idxs[:, 2]]
+
+        self._pending = None
+        self.reset(conf)
+
+    def _born_radii(self, summ):
+        return _obc_radii(summ, self.oR, self.atomic_radii, self.alpha_obc, self.beta_obc, self.gamma_obc)
+
+    def _atom_energies(self, br):
+        # self energies and the non-polar term
+        r = self.atomic_radii + self.probe_radius
+        nonpolar = 4*np.pi*self.surface_area_energy*r*r*np.power(self.atomic_radii/br, 6)
+        return self.prefactor*self.charges*self.charges/br/2.0 + nonpolar
+
+    def reset(self, conf):
+        """
+        Recompute the cached state of conf from scratch.
+        """
+        self.conf = onp.array(conf, dtype=onp.float64)
+        pair_idxs = upper_triangle_pair_idxs(self.conf.shape[0])
+        self.born_sums = _descreening_sums(self.conf, self.oR, self.sR, pair_idxs, self.cutoff)
+        self.born_radii = self._born_radii(self.born_sums)
+        self.energy = gbsa(
+            self.conf,
+            self.params,
+            None,
+            self.param_idxs,
+            dielectric_offset=self.dielectric_offset,
+            cutoff=self.cutoff,
+            alpha_obc=self.alpha_obc,
+            beta_obc=self.beta_obc,
+            gamma_obc=self.gamma_obc,
+            solute_dielectric=self.solute_dielectric,
+            solvent_dielectric=self.solvent_dielectric,
+            electric_constant=self.electric_constant,
+            probe_radius=self.probe_radius,
+            surface_area_energy=self.surface_area_energy)
+        self._pending = None
+
+    def propose(self, moved_idxs, moved_conf):
+        """
+        Compute the energy change of moving a subset of the atoms, without committing it.
+
+        Parameters
+        ----------
+        moved_idxs: shape [k,] np.array
+            unique indices of the moved atoms
+
+        moved_conf: shape [k, 3] np.array
+            new coordinates of the moved atoms
+
+        Returns
+        -------
+        float
+            energy of the proposed state minus the current energy
+
+        """
+        num_atoms = self.conf.shape[0]
+        moved_idxs = onp.asarray(moved_idxs, dtype=onp.int32)
+        assert len(onp.unique(moved_idxs)) == len(moved_idxs)
+
+        new_conf = self.conf.copy()
+        new_conf[moved_idxs] = moved_conf
+
+        rows, row_rank = _pad_rows(moved_idxs, num_atoms)
+        delta_sums = _descreening_sums_delta(self.conf, new_conf, self.oR, self.sR, rows, row_rank, self.cutoff)
+        new_sums = self.born_sums + delta_sums
+        new_radii = self._born_radii(new_sums)
+
+        # atoms beyond the cutoff of a moved atom keep exactly the same radius
+        changed_idxs = onp.union1d(moved_idxs, onp.flatnonzero(onp.asarray(delta_sums))).astype(onp.int32)
+        rows, row_rank = _pad_rows(changed_idxs, num_atoms)
+        delta_pairs = _gpol_row_sum(new_conf, self.charges, new_radii, rows, row_rank, self.cutoff)
+        delta_pairs -= _gpol_row_sum(self.conf, self.charges, self.born_radii, rows, row_rank, self.cutoff)
+        delta_atoms = np.sum(self._atom_energies(new_radii) - self._atom_energies(self.born_radii))
+
+        delta = self.prefactor*delta_pairs + delta_atoms
+        self._pending = (new_conf, new_sums, new_radii, self.energy + delta)
+
+        return delta
+
+    def accept(self):
+        """
+        Commit the last proposed move.
+        """
+        assert self._pending is not None, "No move has been proposed."
+        self.conf, self.born_sums, self.born_radii, self.energy = self._pending
+        self._pending = None
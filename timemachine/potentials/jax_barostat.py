@@ -1,90 +1,212 @@
 import numpy as onp
+import jax
 import jax.numpy as np
 
-from timemachine.jax_functionals import jax_utils
-from timeachine.constants import AVOGRADRO, BOLTZ
+from timemachine.potentials import jax_utils
+from timemachine.constants import AVOGADRO, BOLTZ
 
 
-class IsotropicMonteCarloBarostat():
+def intermolecular_pair_idxs(pair_idxs, molecule_idxs):
     """
-    This is an isotropic barostat
+    Mask out the intramolecular rows of a padded pair list.
+
+    Scaling molecular centroids translates every molecule rigidly, so as long as no
+    molecule spans half of the box the intramolecular pair energies never change during
+    a barostat move. Energy functions evaluated over only the intermolecular pairs have
+    the same energy deltas at a fraction of the cost.
+
+    Parameters
+    ----------
+    pair_idxs: shape [num_pairs, 2] np.array
+        pair indices, where padded rows are denoted by negative indices
+
+    molecule_idxs: shape [N,] np.array
+        molecule index of each atom
+
+    Returns
+    -------
+    shape [num_pairs, 2] np.array
+        pair_idxs where the intramolecular rows are replaced by padding
+
     """
+    pair_idxs = onp.array(pair_idxs, dtype=onp.int32)
+    molecule_idxs = onp.asarray(molecule_idxs)
+    valid = pair_idxs[:, 0] >= 0
+    intra = onp.logical_and(valid, molecule_idxs[pair_idxs[:, 0]] == molecule_idxs[pair_idxs[:, 1]])
+    pair_idxs[intra] = -1
+    return pair_idxs
+
+
+class IsotropicMonteCarloBarostat():
+
+    def __init__(self, pressure, temperature, frequency, molecule_idxs, pair_energy_fn, neighbor_list=None,
+        seed=None):
+        """
+        Isotropic Monte Carlo barostat that scales the molecular centroids.
+
+        Every frequency steps a random volume change is proposed and accepted with the
+        Metropolis criterion of the NPT ensemble. Since molecules are translated rigidly
+        every intramolecular term is unchanged, so only the intermolecular nonbonded
+        energy is evaluated, over intermolecular_pair_idxs of the pair list. The energy
+        of the state returned by the last move is cached, keyed on the identity of the
+        returned arrays, so back to back moves on that state, eg. when equilibrating the
+        volume with move(), cost a single evaluation per trial. Dynamics in between moves
+        changes the coordinates, so in a step loop such as integrator.simulate every trial
+        evaluates both the current and the rescaled energies. The molecule segments are
+        computed once here and each trial is a single jitted call that rescales the
+        coordinates and evaluates the energy.
+
+        Parameters
+        ----------
+        pressure: float
+            units of bar
+
+        temperature: float
+            units of Kelvin
+
+        frequency: int
+            number of steps in between volume moves
+
+        molecule_idxs: shape [N,] np.array
+            molecule index of each atom, between [0, num_mols)
+
+        pair_energy_fn: function
+            nonbonded energy of a padded pair list, called as
+            pair_energy_fn(conf, box=box, pair_idxs=pair_idxs), eg. a functools.partial
+            of nonbonded.nonbonded. It must be jittable, and since pair_idxs is traced
+            any arrays it indexes, ie. the params, must be jax rather than numpy arrays.
 
-    def __init__(self, pressure, temperature, frequency):
+        neighbor_list: neighborlist.NeighborList or None
+            source of the pair list, which is rebuilt after every accepted move. Trials
+            reuse the list of the current state, so its skin must cover the change in
+            distances of a single volume move. If None then all pairs are evaluated.
+
+        seed: int or None
+            seed of the volume move and acceptance random numbers
+
+        """
+        assert frequency > 0
         self.pressure = pressure
         self.frequency = frequency
         self.temperature = temperature
+        self.molecule_idxs = onp.asarray(molecule_idxs, dtype=onp.int32)
+        self.num_mols = int(onp.amax(self.molecule_idxs)) + 1
+        self.pair_energy_fn = pair_energy_fn
+        self.neighbor_list = neighbor_list
+
         self._volume_scale = None
         self._step = 0
-
         self._num_accepted = 0
         self._num_attempted = 0
+        self._rng = onp.random.RandomState(seed)
 
-    def update(self, conf, box, molecule_idxs, energy_fn, num_mols):
-        """
-        Parameters
-        ----------
+        # (conf, box, energy) of the last state returned by move()
+        self._state = None
+        self._inter_idxs = None
+        self._num_builds = None
+        if neighbor_list is None:
+            num_atoms = len(self.molecule_idxs)
+            self._inter_idxs = intermolecular_pair_idxs(jax_utils.upper_triangle_pair_idxs(num_atoms), self.molecule_idxs)
+
+        molecule_idxs = self.molecule_idxs
+        num_mols = self.num_mols
 
-        conf: np.array
-            An n x 3 conformation
+        def energy(conf, box, pair_idxs):
+            return pair_energy_fn(conf, box=box, pair_idxs=pair_idxs)
 
-        box: np.array
-            A 3 x 3 box
+        def trial(conf, box, pair_idxs, length_scale):
+            scales = np.ones(3)*length_scale
+            new_conf, new_box = jax_utils.rescale_coordinates(conf, molecule_idxs, box, scales, num_mols)
+            return new_conf, new_box, energy(new_conf, new_box, pair_idxs)
 
-        molecule_idxs: np.array 
-            List of integers denoting molecule id that each atom is in
+        self._energy = jax.jit(energy)
+        self._trial = jax.jit(trial)
+
+    def pair_idxs(self, conf, box):
+        """
+        Intermolecular rows of the pair list of (conf, box), see intermolecular_pair_idxs.
+        """
+        if self.neighbor_list is None:
+            return self._inter_idxs
 
-        energy_fn: function
-            A function that takes in a conformation and box
+        pair_idxs = self.neighbor_list.update(conf, box)
+        # the list may also be shared with, and rebuilt by, the integrator
+        if self._num_builds != self.neighbor_list.num_builds:
+            self._inter_idxs = intermolecular_pair_idxs(pair_idxs, self.molecule_idxs)
+            self._num_builds = self.neighbor_list.num_builds
+        return self._inter_idxs
 
+    def update(self, conf, box):
         """
+        Advance the step counter and attempt a volume move every frequency steps.
 
-        if self._step < self.frequency:
-            self._step += 1
+        Parameters
+        ----------
+        conf: shape [N, 3] np.array
+            atomic coordinates
+
+        box: shape [3, 3] np.array
+            orthorhombic periodic boundary vectors
+
+        Returns
+        -------
+        (conf, box)
+            the new coordinates and box if a move was accepted, else the inputs
+
+        """
+        self._step += 1
+        if self._step % self.frequency != 0:
+            return conf, box
 
-        step = 0
+        return self.move(conf, box)
 
+    def move(self, conf, box):
+        """
+        Unconditionally attempt a single volume move, see update() for arguments.
+        """
         volume = box[0][0]*box[1][1]*box[2][2]
- 
+
         if self._volume_scale is None:
             self._volume_scale = 0.01*volume
 
-        delta_volume = self._volume_scale * 2 * (onp.random.rand() - 0.5)
+        pair_idxs = self.pair_idxs(conf, box)
+        # only valid for the very arrays returned by the last move, anything else,
+        # including a copy, may have been changed by the caller
+        if self._state is not None and self._state[0] is conf and self._state[1] is box:
+            energy = self._state[2]
+        else:
+            energy = float(self._energy(conf, box, pair_idxs))
+
+        delta_volume = self._volume_scale * 2 * (self._rng.rand() - 0.5)
         new_volume = volume + delta_volume
-        length_scales = np.array([
-            np.power(new_volume/volume, 1.0/3.0),
-            np.power(new_volume/volume, 1.0/3.0),
-            np.power(new_volume/volume, 1.0/3.0)
-        ])
-
-        new_conf = jax_utils.rescale_coordinates(
-            conf,
-            molecule_idxs,
-            box,
-            length_scales
-        )
-
-        new_box = box*length_scale
-        initial_energy = energy_fn(conf, box)
-        final_energy = energy_fn(new_conf, new_box)
-        pressure = self.pressure * AVOGRADRO * 1e-25
+        length_scale = onp.power(new_volume/volume, 1.0/3.0)
+
+        new_conf, new_box, new_energy = self._trial(conf, box, pair_idxs, length_scale)
+        new_energy = float(new_energy)
+
+        # pressure*volume from bar*nm^3 to kJ/mol
+        pressure = self.pressure * AVOGADRO * 1e-25
         kT = BOLTZ*self.temperature
-        w = final_energy - initial_energy + pressure*delta_volume - num_mols * kT * np.log(new_volume/volume)
-        # (ytz): is this differentiable?
-        if w > 0 and onp.random.rand() > np.exp(-w/kT):
-            # reject
-        else:
+        w = new_energy - energy + pressure*delta_volume - self.num_mols * kT * onp.log(new_volume/volume)
+
+        accepted = w <= 0 or self._rng.rand() < onp.exp(-w/kT)
+        if accepted:
             self._num_accepted += 1
+            conf, box, energy = new_conf, new_box, new_energy
+            if self.neighbor_list is not None:
+                self.neighbor_list.build(conf, box)
         self._num_attempted += 1
+        self._state = (conf, box, energy)
+
+        # tune the proposal towards an acceptance rate between 25% and 75%
         if self._num_attempted >= 10:
             if self._num_accepted < 0.25 * self._num_attempted:
                 self._volume_scale /= 1.1
                 self._num_attempted = 0
                 self._num_accepted = 0
-            elif _num_accepted > 0.75 * self._num_attempted:
-                self._volume_scale = np.min(self._volume_scale*1.1, volume*0.3)
+            elif self._num_accepted > 0.75 * self._num_attempted:
+                self._volume_scale = min(self._volume_scale*1.1, volume*0.3)
                 self._num_attempted = 0
                 self._num_accepted = 0
 
-
-
+        return conf, box
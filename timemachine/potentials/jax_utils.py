@@ -1,21 +1,49 @@
+import functools
+
+import numpy as onp
+import jax
 import jax.numpy as np
 
 def rescale_coordinates(
     conf,
     indices,
     box,
-    scales):
-    
-    mol_sizes = np.expand_dims(onp.bincount(indices), axis=1)
-    mol_centers = jax.ops.segment_sum(coords, indices)/mol_sizes
+    scales,
+    num_mols=None):
+    """
+    Scale the centroid of every molecule by scales, translating each molecule rigidly
+    so that its internal geometry is unchanged.
+
+    Parameters
+    ----------
+    conf: shape [N, 3] np.array
+        atomic coordinates
+
+    indices: shape [N,] np.array
+        molecule index of each atom, between [0, num_mols)
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors
+
+    scales: shape [3,] np.array
+        scale factor along each dimension
+
+    num_mols: int
+        number of molecules, defaults to max(indices)+1. Pass it explicitly under jit.
 
-    new_centers = mol_centers - box[2]*np.floor(np.expand_dims(mol_centers[...,2], axis=-1)/box[2][2])
-    new_centers -= box[1]*np.floor(np.expand_dims(new_centers[...,1], axis=-1)/box[1][1])
-    new_centers -= box[0]*np.floor(np.expand_dims(new_centers[...,0], axis=-1)/box[0][0])
+    Returns
+    -------
+    (shape [N, 3] np.array, shape [3, 3] np.array)
+        rescaled coordinates and the box scaled by the same factors
 
-    offset = new_centers - mol_centers
+    """
+    if num_mols is None:
+        num_mols = int(onp.amax(indices)) + 1
+    mol_sizes = jax.ops.segment_sum(np.ones_like(conf[:, :1]), indices, num_mols)
+    mol_centers = jax.ops.segment_sum(conf, indices, num_mols)/mol_sizes
+    offset = mol_centers*(scales - 1)
 
-    return conf + offset[indices]
+    return conf + offset[indices], box*scales
 
 
 def delta_r(ri, rj, box=None):
@@ -32,3 +60,81 @@ def distance(ri, rj, box=None):
     dij = np.sqrt(np.sum(dxdydz, axis=-1))
     return dij
 
+
+def pair_distance(conf, pair_idxs, box=None):
+    """
+    Compute the distances of a padded pair list, as produced by neighborlist.NeighborList.
+
+    Parameters
+    ----------
+    conf: shape [num_atoms, D] np.array
+        atomic coordinates
+
+    pair_idxs: shape [num_pairs, 2] np.array
+        pair indices, where padded rows are denoted by negative indices
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, if not None
+
+    Returns
+    -------
+    (dij, mask)
+        shape [num_pairs,] distances and shape [num_pairs,] bool mask of non-padded pairs.
+        padded pairs are assigned a distance of 1 so that they remain differentiable.
+
+    """
+    mask = pair_idxs[:, 0] >= 0
+    ri = conf[pair_idxs[:, 0]]
+    rj = conf[pair_idxs[:, 1]]
+    d2ij = np.sum(np.power(delta_r(ri, rj, box), 2), axis=-1)
+    # trick used to avoid nans in the gradient of the sqrt for padded pairs
+    d2ij = np.where(mask, d2ij, np.ones_like(d2ij))
+    return np.sqrt(d2ij), mask
+
+
+@functools.lru_cache(maxsize=None)
+def upper_triangle_pair_idxs(num_atoms):
+    """
+    Indices of every unique pair (i, j) with i < j. Since this only depends on the number
+    of atoms it is built once per topology, and is embedded as a constant when traced.
+
+    Returns
+    -------
+    shape [num_atoms*(num_atoms-1)/2, 2] np.array
+        read-only int32 pair indices, in the format of pair_distance
+
+    """
+    pair_idxs = onp.stack(onp.triu_indices(num_atoms, k=1), axis=-1).astype(onp.int32)
+    pair_idxs.flags.writeable = False
+    return pair_idxs
+
+
+def upper_triangle_pair_scales(num_atoms, exclusion_idxs, exclusion_scales):
+    """
+    Scale of each pair of upper_triangle_pair_idxs, which is 1 except for the exclusions,
+    so that excluded interactions can be scaled in place rather than evaluated in full and
+    subtracted.
+
+    Parameters
+    ----------
+    num_atoms: int
+        number of atoms
+
+    exclusion_idxs: shape [num_exclusions, 2] np.array
+        unique pairs (i, j) with i != j, in either order
+
+    exclusion_scales: shape [num_exclusions,] np.array
+        scale of each excluded pair
+
+    Returns
+    -------
+    shape [num_atoms*(num_atoms-1)/2,] np.array
+
+    """
+    src_idxs = np.minimum(exclusion_idxs[:, 0], exclusion_idxs[:, 1])
+    dst_idxs = np.maximum(exclusion_idxs[:, 0], exclusion_idxs[:, 1])
+    # row-major offset of (i, j) within the strict upper triangle
+    offsets = src_idxs*num_atoms - (src_idxs*(src_idxs + 1))//2 + dst_idxs - src_idxs - 1
+    num_pairs = (num_atoms*(num_atoms - 1))//2
+    pair_scales = np.ones(num_pairs, dtype=np.result_type(exclusion_scales, float))
+    return pair_scales.at[offsets].set(exclusion_scales)
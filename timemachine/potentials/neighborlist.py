@@ -0,0 +1,235 @@
+import itertools
+
+import numpy as onp
+
+
+def _orthorhombic_lengths(box):
+    """
+    Return the box lengths of an orthorhombic box, or raise if the box is triclinic.
+    """
+    box = onp.asarray(box, dtype=onp.float64)
+    if onp.any(box - onp.diag(onp.diag(box)) != 0):
+        raise ValueError("Neighbor lists only support orthorhombic boxes.")
+    return onp.diag(box)
+
+
+def minimum_image(diff, box_lengths):
+    """
+    Numpy equivalent of jax_utils.delta_r for an orthorhombic box.
+    """
+    return diff - box_lengths*onp.floor(diff/box_lengths+0.5)
+
+
+class NeighborList():
+
+    def __init__(self, cutoff, skin=0.1, capacity=None, capacity_multiplier=1.25):
+        """
+        A Verlet list of all pairs within cutoff + skin, built using a cell list.
+
+        The pairs are stored in a padded, fixed-capacity [capacity, 2] array of int32s.
+        Each row (i, j) satisfies i < j, and padded rows are filled with -1. Keeping the
+        shape fixed in between rebuilds lets the potentials that consume the list be jit
+        compiled once, and since the list only selects which pairs are evaluated, the
+        potentials remain fully differentiable w.r.t. coordinates and parameters.
+
+        Parameters
+        ----------
+        cutoff: float
+            interaction cutoff of the potentials consuming this list
+
+        skin: float
+            extra buffer distance. The list is only rebuilt when some atom has moved more
+            than skin/2 since the last build.
+
+        capacity: int or None
+            number of pair slots. If None then it is sized on the first build. If a rebuild
+            ever finds more pairs than slots then the capacity is grown, which triggers
+            a recompilation of any jitted consumer.
+
+        capacity_multiplier: float
+            headroom used when the capacity is (re)sized.
+
+        """
+        assert cutoff > 0
+        assert skin >= 0
+        self.cutoff = cutoff
+        self.skin = skin
+        self.capacity = capacity
+        self.capacity_multiplier = capacity_multiplier
+
+        self.pair_idxs = None
+        self.num_pairs = 0
+        self.num_builds = 0
+        self._ref_conf = None
+        self._ref_box = None
+
+    def needs_rebuild(self, conf, box=None):
+        """
+        Returns True if the stored list may no longer contain every pair within cutoff.
+        """
+        if self.pair_idxs is None:
+            return True
+
+        if (box is None) != (self._ref_box is None):
+            return True
+
+        conf = onp.asarray(conf, dtype=onp.float64)[:, :3]
+        if conf.shape != self._ref_conf.shape:
+            return True
+
+        diff = conf - self._ref_conf
+        if box is not None:
+            box = onp.asarray(box, dtype=onp.float64)
+            if not onp.array_equal(box, self._ref_box):
+                return True
+            diff = minimum_image(diff, onp.diag(box))
+
+        max_disp = onp.sqrt(onp.amax(onp.sum(diff*diff, axis=-1)))
+
+        return max_disp > self.skin/2
+
+    def update(self, conf, box=None):
+        """
+        Rebuild the list if needed.
+
+        Parameters
+        ----------
+        conf: shape [num_atoms, 3] np.array
+            atomic coordinates
+
+        box: shape [3, 3] np.array
+            orthorhombic periodic boundary vectors, if not None
+
+        Returns
+        -------
+        shape [capacity, 2] np.array
+            padded pair indices
+
+        """
+        if self.needs_rebuild(conf, box):
+            self.build(conf, box)
+        return self.pair_idxs
+
+    def build(self, conf, box=None):
+        """
+        Unconditionally rebuild the list, see update() for arguments.
+        """
+        conf = onp.asarray(conf, dtype=onp.float64)[:, :3]
+        pairs = cell_list_pairs(conf, box, self.cutoff + self.skin)
+
+        num_pairs = pairs.shape[0]
+        if self.capacity is None or num_pairs > self.capacity:
+            self.capacity = max(int(onp.ceil(num_pairs*self.capacity_multiplier)), 1)
+
+        pair_idxs = onp.full((self.capacity, 2), -1, dtype=onp.int32)
+        pair_idxs[:num_pairs] = pairs
+
+        self.pair_idxs = pair_idxs
+        self.num_pairs = num_pairs
+        self.num_builds += 1
+        self._ref_conf = conf.copy()
+        self._ref_box = None if box is None else onp.array(box, dtype=onp.float64)
+
+        return self.pair_idxs
+
+
+def cell_list_pairs(conf, box, list_cutoff):
+    """
+    Find all pairs (i, j), i < j, whose (minimum image) distance is less than list_cutoff.
+
+    Atoms are binned into cells whose sides are at least list_cutoff long so that only
+    the 27 neighboring cells of each cell need to be searched, making this O(N) for
+    a system of uniform density.
+
+    Parameters
+    ----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    box: shape [3, 3] np.array or None
+        orthorhombic periodic boundary vectors, if not None
+
+    list_cutoff: float
+        pairs at or beyond this distance are discarded
+
+    Returns
+    -------
+    shape [num_pairs, 2] np.array
+        sorted int32 pair indices
+
+    """
+    conf = onp.asarray(conf, dtype=onp.float64)[:, :3]
+    num_atoms = conf.shape[0]
+
+    if box is not None:
+        box_lengths = _orthorhombic_lengths(box)
+        # this is the same assumption made by the Ewald code, only a single image of
+        # each atom can be within the cutoff
+        if onp.any(box_lengths < 2*list_cutoff):
+            raise ValueError("Box lengths cannot be smaller than twice the cutoff plus skin.")
+        # wrap into the primary cell
+        origin = onp.zeros(3)
+        extent = box_lengths
+        pos = conf - box_lengths*onp.floor(conf/box_lengths)
+    else:
+        box_lengths = None
+        origin = onp.amin(conf, axis=0)
+        extent = onp.maximum(onp.amax(conf, axis=0) - origin, list_cutoff)
+        pos = conf
+
+    num_cells = onp.maximum(onp.floor(extent/list_cutoff).astype(onp.int64), 1)
+    cell_xyz = onp.floor((pos - origin)/extent*num_cells).astype(onp.int64)
+    cell_xyz = onp.clip(cell_xyz, 0, num_cells-1)
+    cell_ids = onp.ravel_multi_index(cell_xyz.T, num_cells)
+
+    # pad each cell's atoms into a [num_total_cells, max_occupancy] table
+    perm = onp.argsort(cell_ids, kind='stable')
+    sorted_ids = cell_ids[perm]
+    total_cells = int(onp.prod(num_cells))
+    counts = onp.bincount(sorted_ids, minlength=total_cells)
+    starts = onp.concatenate([[0], onp.cumsum(counts)[:-1]])
+    max_occupancy = int(onp.amax(counts))
+    slots = onp.arange(num_atoms) - starts[sorted_ids]
+    cell_atoms = onp.full((total_cells, max_occupancy), -1, dtype=onp.int64)
+    cell_atoms[sorted_ids, slots] = perm
+
+    all_cells = onp.stack(onp.unravel_index(onp.arange(total_cells), num_cells), axis=-1)
+
+    # with fewer than three cells along a dimension some offsets alias the same cell
+    offsets = set()
+    for offset in itertools.product([-1, 0, 1], repeat=3):
+        offset = onp.array(offset)
+        if box_lengths is not None:
+            offset = offset % num_cells
+        offsets.add(tuple(offset))
+
+    all_pairs = []
+    for offset in sorted(offsets):
+        nbr_cells = all_cells + onp.array(offset)
+        if box_lengths is not None:
+            nbr_cells = nbr_cells % num_cells
+            valid = onp.ones(total_cells, dtype=bool)
+        else:
+            valid = onp.all((nbr_cells >= 0) & (nbr_cells < num_cells), axis=-1)
+        src = cell_atoms[valid]                                     # [C, M]
+        nbr_ids = onp.ravel_multi_index(nbr_cells[valid].T, num_cells)
+        dst = cell_atoms[nbr_ids]                                   # [C, M]
+
+        ii = onp.broadcast_to(src[:, :, None], (src.shape[0], max_occupancy, max_occupancy))
+        jj = onp.broadcast_to(dst[:, None, :], (src.shape[0], max_occupancy, max_occupancy))
+        keep = (ii >= 0) & (jj >= 0) & (ii < jj)
+        ii = ii[keep]
+        jj = jj[keep]
+
+        diff = conf[ii] - conf[jj]
+        if box_lengths is not None:
+            diff = minimum_image(diff, box_lengths)
+        d2 = onp.sum(diff*diff, axis=-1)
+        within = d2 < list_cutoff*list_cutoff
+        all_pairs.append(onp.stack([ii[within], jj[within]], axis=-1))
+
+    pairs = onp.concatenate(all_pairs, axis=0)
+    # the same pair can be found through more than one offset when cells alias
+    pairs = onp.unique(pairs, axis=0)
+
+    return pairs.astype(onp.int32).reshape(-1, 2)
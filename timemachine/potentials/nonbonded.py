@@ -1,16 +1,26 @@
+import functools
+
 import numpy as onp
+import jax
 import jax.numpy as np
 from jax.scipy.special import erf, erfc
 
 from timemachine.constants import ONE_4PI_EPS0
-from timemachine.potentials.jax_utils import delta_r, distance
+from timemachine.potentials import pme, tiling
+from timemachine.potentials.jax_utils import pair_distance, upper_triangle_pair_idxs, upper_triangle_pair_scales
 
 
-def lennard_jones(conf, params, box, param_idxs, scale_matrix, cutoff=None):
+def lennard_jones(conf, params, box, param_idxs, exclusion_idxs, exclusion_scales, cutoff=None, pair_idxs=None, tile_size=None,
+    type_tables=None):
     """
     Implements a non-periodic LJ612 potential using the Lorentz−Berthelot combining
     rules, where sig_ij = (sig_i + sig_j)/2 and eps_ij = sqrt(eps_i * eps_j).
 
+    When all pairs are evaluated, the exclusions are scaled in place using the
+    upper_triangle_pair_scales of the topology. Otherwise every pair is first evaluated
+    unscaled, and the exclusions are then removed by subtracting (1-s_ij) times their
+    interaction. In neither case is a dense [N, N] scale matrix built.
+
     Parameters
     ----------
     conf: shape [num_atoms, 3] np.array
@@ -25,40 +35,168 @@ def lennard_jones(conf, params, box, param_idxs, scale_matrix, cutoff=None):
     param_idxs: shape [num_atoms, 2] np.array
         each tuple (sig, eps) is used as part of the combining rules
 
-    scale_matrix: shape [num_atoms, num_atoms] np.array
-        scale mask denoting how we should scale interaction e[i,j].
-        The elements should be between [0, 1]. If e[i,j] is 1 then the interaction
-        is fully included, 0 implies it is discarded.
+    exclusion_idxs: shape [num_exclusions, 2] np.array
+        unique pairs (i, j) whose interaction is scaled. Each pair must be listed
+        only once.
+
+    exclusion_scales: shape [num_exclusions,] np.array
+        how much of each excluded interaction is kept. The elements should be
+        between [0, 1]. If s_ij is 1 then the interaction is fully included,
+        0 implies it is discarded.
 
     cutoff: float
         Whether or not we apply cutoffs to the system. Any interactions
         greater than cutoff is fully discarded.
-    
+
+    pair_idxs: shape [num_pairs, 2] np.array
+        If not None, then only these pairs are evaluated instead of all N^2 pairs. This
+        is typically the padded output of a neighborlist.NeighborList, whose padded rows
+        are denoted by negative indices.
+
+    tile_size: int
+        If not None, and pair_idxs is None, then all pairs are evaluated in blocks of
+        [tile_size, tile_size] so that no [N, N] intermediates are formed.
+
+    type_tables: tuple
+        If not None, the (atom_types, sig_table, eps_table) of lj_type_tables, in which case
+        sig_ij and eps_ij are looked up by atom type instead of being combined per pair,
+        and params and param_idxs are not used.
+
+    If neither pair_idxs nor tile_size are set, then all N(N-1)/2 unique pairs are evaluated.
+
+    """
+    if type_tables is not None:
+        lj_args = tuple(type_tables)
+    else:
+        lj_args = (params[param_idxs[:, 0]], params[param_idxs[:, 1]])
+
+    pair_scales = None
+    if pair_idxs is None and tile_size is None:
+        pair_idxs = upper_triangle_pair_idxs(conf.shape[0])
+        pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, exclusion_scales)
+
+    if pair_idxs is not None:
+        src_idxs = pair_idxs[:, 0]
+        dst_idxs = pair_idxs[:, 1]
+
+        dij, keep_mask = pair_distance(conf, pair_idxs, box)
+        sig_ij, eps_ij = lj_combine(lj_args, src_idxs, dst_idxs)
+        if pair_scales is not None:
+            eps_ij *= pair_scales
+
+        if cutoff is not None:
+            keep_mask = np.logical_and(keep_mask, dij < cutoff)
+
+        # pairs are unique so there is no double counting
+        energy = np.sum(lj_pair_energy(dij, sig_ij, eps_ij, keep_mask))
+
+        if pair_scales is not None:
+            # the exclusions are already scaled
+            return energy
+
+    else:
+        tile_fn = functools.partial(_lj_tile, cutoff=cutoff)
+        energy = tiling.tiled_pair_sum(tile_fn, (conf, lj_args, box), conf.shape[0], tile_size)
+
+    # remove the over-counted part of the excluded interactions
+    src_idxs = exclusion_idxs[:, 0]
+    dst_idxs = exclusion_idxs[:, 1]
+
+    dij, keep_mask = pair_distance(conf, exclusion_idxs, box)
+    sig_ij, eps_ij = lj_combine(lj_args, src_idxs, dst_idxs)
+    eps_ij = (1 - exclusion_scales) * eps_ij
+
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, dij < cutoff)
+
+    return energy - np.sum(lj_pair_energy(dij, sig_ij, eps_ij, keep_mask))
+
+
+def lj_type_tables(params, param_idxs):
+    """
+    Precompute the Lorentz-Berthelot sig_ij and eps_ij between every pair of Lennard-Jones
+    atom types, where a type is a unique (sig, eps) row of param_idxs. Force fields map
+    many atoms onto a few dozen types, so the tables are much smaller than the number of
+    pairs. They are differentiable w.r.t. params, and only need to be rebuilt when the
+    params change.
+
+    Parameters
+    ----------
+    params: shape [num_params,] np.array
+        unique parameters
+
+    param_idxs: shape [num_atoms, 2] np.array
+        the (sig, eps) parameters of each atom
+
+    Returns
+    -------
+    (atom_types, sig_table, eps_table)
+        shape [num_atoms,] int32 type of each atom, and shape [T, T] tables
+
+    """
+    type_param_idxs, atom_types = lj_atom_types(param_idxs)
+    sig = params[type_param_idxs[:, 0]]
+    eps = params[type_param_idxs[:, 1]]
+    sig_table = (np.expand_dims(sig, 1) + np.expand_dims(sig, 0))/2
+    eps_table = np.sqrt(np.expand_dims(eps, 1) * np.expand_dims(eps, 0))
+    return atom_types, sig_table, eps_table
+
+
+def lj_atom_types(param_idxs):
+    """
+    Group the atoms by their (sig, eps) parameter indices, reusing the result for an
+    unchanged topology.
+
+    Returns
+    -------
+    (type_param_idxs, atom_types)
+        shape [T, 2] parameter indices of each type, and shape [num_atoms,] type of each atom
+
     """
-    sig = params[param_idxs[:, 0]]
-    eps = params[param_idxs[:, 1]]
+    param_idxs = onp.ascontiguousarray(param_idxs, dtype=onp.int32)
+    return _cached_lj_atom_types(param_idxs.tobytes(), param_idxs.shape[0])
+
 
-    sig_i = np.expand_dims(sig, 0)
-    sig_j = np.expand_dims(sig, 1)
-    sig_ij = (sig_i + sig_j)/2
-    sig_ij_raw = sig_ij
+@functools.lru_cache(maxsize=8)
+def _cached_lj_atom_types(param_idxs_bytes, num_atoms):
+    param_idxs = onp.frombuffer(param_idxs_bytes, dtype=onp.int32).reshape(num_atoms, 2)
+    type_param_idxs, atom_types = onp.unique(param_idxs, axis=0, return_inverse=True)
+    atom_types = atom_types.reshape(-1).astype(onp.int32)
+    type_param_idxs.flags.writeable = False
+    atom_types.flags.writeable = False
+    return type_param_idxs, atom_types
 
-    eps_i = np.expand_dims(eps, 0)
-    eps_j = np.expand_dims(eps, 1)
-    eps_ij = scale_matrix * np.sqrt(eps_i * eps_j)
 
-    eps_ij_raw = eps_ij
+def lj_combine(lj_args, i_idxs, j_idxs):
+    """
+    sig_ij and eps_ij of the atoms i_idxs and j_idxs, which are broadcast against each
+    other. lj_args is either the per-atom (sig, eps), which are combined with the
+    Lorentz-Berthelot rules, or the (atom_types, sig_table, eps_table) of lj_type_tables.
+    """
+    if len(lj_args) == 3:
+        atom_types, sig_table, eps_table = lj_args
+        type_i = atom_types[i_idxs]
+        type_j = atom_types[j_idxs]
+        return sig_table[type_i, type_j], eps_table[type_i, type_j]
 
-    ri = np.expand_dims(conf, 0)
-    rj = np.expand_dims(conf, 1)
+    sig, eps = lj_args
+    return (sig[i_idxs] + sig[j_idxs])/2, np.sqrt(eps[i_idxs] * eps[j_idxs])
 
-    dij = distance(ri, rj, box)
 
+def _lj_tile(args, i_idxs, j_idxs, keep_mask, cutoff):
+    conf, lj_args, box = args
+    dij = tiling.tile_distance(conf[i_idxs], conf[j_idxs], keep_mask, box)
+    sig_ij, eps_ij = lj_combine(lj_args, np.expand_dims(i_idxs, 1), np.expand_dims(j_idxs, 0))
     if cutoff is not None:
-        eps_ij = np.where(dij < cutoff, eps_ij, np.zeros_like(eps_ij))
+        keep_mask = np.logical_and(keep_mask, dij < cutoff)
+    return lj_pair_energy(dij, sig_ij, eps_ij, keep_mask)
 
-    keep_mask = scale_matrix > 0
 
+def lj_pair_energy(dij, sig_ij, eps_ij, keep_mask):
+    """
+    Elementwise LJ612 energy 4*eps_ij*((sig_ij/dij)^12 - (sig_ij/dij)^6), zeroed
+    wherever keep_mask is False.
+    """
     # (ytz): this avoids a nan in the gradient in both jax and tensorflow
     sig_ij = np.where(keep_mask, sig_ij, np.zeros_like(sig_ij))
     eps_ij = np.where(keep_mask, eps_ij, np.zeros_like(eps_ij))
@@ -70,38 +208,132 @@ def lennard_jones(conf, params, box, param_idxs, scale_matrix, cutoff=None):
     energy = 4*eps_ij*(sig6-1.0)*sig6
     energy = np.where(keep_mask, energy, np.zeros_like(energy))
 
-    # divide by two to deal with symmetry
-    return np.sum(energy)/2
+    return energy
 
 
-def pairwise_energy(conf, box, charges, cutoff):
+def pairwise_energy(conf, box, charges, cutoff, pair_idxs=None):
     """
     Numerically stable implementation of the pairwise term:
     
     eij = qi*qj/dij
 
+    If pair_idxs is None then this returns a symmetric [N, N] matrix with a zero
+    diagonal, otherwise this returns one value per row of pair_idxs, with padded
+    rows set to zero.
+
     """
 
+    if pair_idxs is not None:
+        dij, keep_mask = pair_distance(conf, pair_idxs, box)
+        qij = charges[pair_idxs[:, 0]] * charges[pair_idxs[:, 1]]
+        if cutoff is not None:
+            keep_mask = np.logical_and(keep_mask, dij < cutoff)
+        return np.where(keep_mask, qij/dij, np.zeros_like(qij))
 
-    qi = np.expand_dims(charges, 0) # (1, N)
-    qj = np.expand_dims(charges, 1) # (N, 1)
-    qij = np.multiply(qi, qj)
-    ri = np.expand_dims(conf, 0)
-    rj = np.expand_dims(conf, 1)
-    dij = distance(ri, rj, box)
+    # only the unique pairs are evaluated, which also avoids nans along the diagonal
+    num_atoms = conf.shape[0]
+    src_idxs, dst_idxs = upper_triangle_pair_idxs(num_atoms).T
+    eij = pairwise_energy(conf, box, charges, cutoff, upper_triangle_pair_idxs(num_atoms))
 
-    # (ytz): trick used to avoid nans in the diagonal due to the 1/dij term.
-    keep_mask = 1 - np.eye(conf.shape[0])
-    qij = np.where(keep_mask, qij, np.zeros_like(qij))
-    dij = np.where(keep_mask, dij, np.zeros_like(dij))
-    eij = np.where(keep_mask, qij/dij, np.zeros_like(dij)) # zero out diagonals
+    return np.zeros((num_atoms, num_atoms), dtype=eij.dtype).at[src_idxs, dst_idxs].set(eij).at[dst_idxs, src_idxs].set(eij)
+
+
+def reaction_field_constants(cutoff, rf_dielectric):
+    """
+    Constants (k_rf, c_rf) of the reaction field pair energy
+
+    eij = qi*qj*(1/dij + k_rf*dij^2 - c_rf)
+
+    where k_rf = (eps_rf - 1)/((2*eps_rf + 1)*cutoff^3), and c_rf = 1/cutoff + k_rf*cutoff^2
+    shifts the energy to zero at the cutoff. An infinite dielectric (conducting boundary)
+    gives k_rf = 1/(2*cutoff^3), for which the force also vanishes at the cutoff.
+    """
+    assert cutoff is not None and cutoff > 0, "reaction field electrostatics require a cutoff"
+    assert rf_dielectric >= 1.0
+    if onp.isinf(rf_dielectric):
+        k_rf = 1/(2*cutoff**3)
+    else:
+        k_rf = (rf_dielectric - 1)/((2*rf_dielectric + 1)*cutoff**3)
+    c_rf = 1/cutoff + k_rf*cutoff**2
+    return k_rf, c_rf
 
+
+def coulomb_pair_energy(dij, qij, keep_mask, alpha=None, reaction_field=None):
+    """
+    Elementwise Coulomb energy qij/dij without the Coulomb constant, zeroed wherever keep_mask
+    is False. If alpha is not None then the energy is screened by erfc(alpha*dij), and if
+    reaction_field is a tuple (k_rf, c_rf) the reaction field energy is used instead.
+    """
+    eij = qij/dij
+    if alpha is not None:
+        eij = eij * erfc(alpha*dij)
+    if reaction_field is not None:
+        k_rf, c_rf = reaction_field
+        eij = eij + qij*(k_rf*dij*dij - c_rf)
+    return np.where(keep_mask, eij, np.zeros_like(eij))
+
+
+def _coulomb_tile(args, i_idxs, j_idxs, keep_mask, cutoff, alpha, reaction_field=None):
+    conf, charges, box = args
+    dij = tiling.tile_distance(conf[i_idxs], conf[j_idxs], keep_mask, box)
+    qij = np.expand_dims(charges[i_idxs], 1) * np.expand_dims(charges[j_idxs], 0)
     if cutoff is not None:
-        eij = np.where(dij > cutoff, np.zeros_like(eij), eij)
+        keep_mask = np.logical_and(keep_mask, dij < cutoff)
+    return coulomb_pair_energy(dij, qij, keep_mask, alpha, reaction_field)
+
+
+def tiled_pairwise_energy(conf, box, charges, cutoff, tile_size, alpha=None, reaction_field=None):
+    """
+    Memory efficient equivalent of sum_{i<j} pairwise_energy(conf, box, charges, cutoff),
+    where each term is additionally scaled by erfc(alpha*dij) if alpha is not None, see
+    coulomb_pair_energy.
+    """
+    tile_fn = functools.partial(_coulomb_tile, cutoff=cutoff, alpha=alpha, reaction_field=reaction_field)
+    return tiling.tiled_pair_sum(tile_fn, (conf, charges, box), conf.shape[0], tile_size)
+
+
+def reaction_field_energy(conf, box, charges, exclusion_idxs, exclusion_scales, cutoff, rf_dielectric, pair_idxs=None,
+    tile_size=None):
+    """
+    Reaction field electrostatics, where each atom is surrounded by a continuum of dielectric
+    rf_dielectric beyond the cutoff. The energy and forces are continuous at the cutoff, there
+    is no reciprocal space, and periodic boxes only use the minimum image convention, so the
+    cost is linear in the number of pairs evaluated.
+    """
+    reaction_field = reaction_field_constants(cutoff, rf_dielectric)
+
+    if box is not None:
+        check_box_lengths(box, cutoff)
 
-    return eij
+    pair_scales = None
+    if pair_idxs is None and tile_size is None:
+        pair_idxs = upper_triangle_pair_idxs(conf.shape[0])
+        pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, exclusion_scales)
 
-def electrostatics(conf, params, box, param_idxs, scale_matrix, cutoff=None, alpha=None, kmax=None):
+    if pair_idxs is not None:
+        dij, keep_mask = pair_distance(conf, pair_idxs, box)
+        qij = charges[pair_idxs[:, 0]] * charges[pair_idxs[:, 1]]
+        if pair_scales is not None:
+            qij *= pair_scales
+        keep_mask = np.logical_and(keep_mask, dij < cutoff)
+        eij = np.sum(coulomb_pair_energy(dij, qij, keep_mask, reaction_field=reaction_field))
+    else:
+        eij = tiled_pairwise_energy(conf, box, charges, cutoff, tile_size, reaction_field=reaction_field)
+
+    if pair_scales is not None:
+        # the exclusions are already scaled
+        return ONE_4PI_EPS0*eij
+
+    dij, keep_mask = pair_distance(conf, exclusion_idxs, box)
+    qij = (1 - exclusion_scales) * charges[exclusion_idxs[:, 0]] * charges[exclusion_idxs[:, 1]]
+    keep_mask = np.logical_and(keep_mask, dij < cutoff)
+    eij_exc = coulomb_pair_energy(dij, qij, keep_mask, reaction_field=reaction_field)
+
+    return ONE_4PI_EPS0*(eij - np.sum(eij_exc))
+
+
+def electrostatics(conf, params, box, param_idxs, exclusion_idxs, exclusion_scales, cutoff=None, alpha=None, kmax=None, pair_idxs=None,
+    grid_spacing=None, tolerance=None, pme_order=5, tile_size=None, rf_dielectric=None):
     """
     Compute the electrostatic potential: sum_ij qi*qj/dij
 
@@ -114,118 +346,591 @@ def electrostatics(conf, params, box, param_idxs, scale_matrix, cutoff=None, alp
         unique parameters
 
     box: shape [3, 3] np.array
-        periodic boundary vectors, if not None then Ewald summation is used.
+        periodic boundary vectors, if not None then Ewald summation is used. The
+        reciprocal space is summed directly if kmax is set, and otherwise using
+        smooth particle mesh Ewald.
 
-    param_idxs: shape [num_atoms, 2] np.array
-        each tuple (sig, eps) is used as part of the combining rules
+    param_idxs: shape [num_atoms,] np.array
+        the charge parameter of each atom
 
-    scale_matrix: shape [num_atoms, num_atoms] np.array
-        scale mask denoting how we should scale interaction e[i,j].
-        The elements should be between [0, 1]. If e[i,j] is 1 then the interaction
-        is fully included, 0 implies it is discarded.
+    exclusion_idxs: shape [num_exclusions, 2] np.array
+        unique pairs (i, j) whose interaction is scaled, see lennard_jones.
+
+    exclusion_scales: shape [num_exclusions,] np.array
+        how much of each excluded interaction is kept, between [0, 1].
 
     cutoff: float
         must be less than half the periodic boundary condition for each dim
 
     alpha: float
-        alpha term controlling the erf adjustment
+        alpha term controlling the erf adjustment. When using PME this may be
+        omitted if tolerance is set.
 
     kmax: int
         number of images by which we tile out reciprocal space.
 
+    pair_idxs: shape [num_pairs, 2] np.array
+        If not None, then the pairwise (direct space) terms are only evaluated
+        over these pairs, see lennard_jones.
+
+    grid_spacing: float
+        maximum PME grid spacing. Takes precedence over tolerance in determining
+        the grid size.
+
+    tolerance: float
+        target relative error of PME, used to pick alpha and the grid size if they
+        are not otherwise given.
+
+    pme_order: int
+        B-spline interpolation order used by PME
+
+    tile_size: int
+        If not None, and pair_idxs is None, then the pairwise terms are evaluated in
+        blocks of [tile_size, tile_size], see lennard_jones.
+
+    rf_dielectric: float
+        If not None, then the reaction field approximation with this dielectric constant
+        is used in place of Ewald summation, and requires a cutoff. This is also valid
+        without a box. Pass np.inf for conducting boundary conditions.
+
     """
     charges = params[param_idxs]
 
+    if rf_dielectric is not None:
+        assert alpha is None and kmax is None and grid_spacing is None and tolerance is None
+        return reaction_field_energy(conf, box, charges, exclusion_idxs, exclusion_scales, cutoff, rf_dielectric,
+            pair_idxs=pair_idxs, tile_size=tile_size)
+
     # if we use periodic boundary conditions, then the following three parameters
     # must be set in order for Ewald to make sense.
     if box is not None:
+        alpha, grid_size = ewald_parameters(box, cutoff, alpha, kmax, grid_spacing, tolerance, pme_order)
+        return ewald_energy(conf, box, charges, exclusion_idxs, exclusion_scales, cutoff, alpha, kmax, pair_idxs,
+            grid_size=grid_size, pme_order=pme_order, tile_size=tile_size)
 
-        # note that periodic boundary conditions are subject to the following
-        # convention and constraints:
-        # http://docs.openmm.org/latest/userguide/theory.html#periodic-boundary-conditions
-        box_lengths = np.linalg.norm(box, axis=-1)
-        assert cutoff is not None and cutoff >= 0.00
-        assert alpha is not None
-        assert kmax is not None
+    # non periodic electrostatics is straightforward.
+    if pair_idxs is None and tile_size is None:
+        # every unique pair, with the exclusions scaled in place
+        pair_idxs = upper_triangle_pair_idxs(conf.shape[0])
+        pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, exclusion_scales)
+        eij = pair_scales * pairwise_energy(conf, box, charges, cutoff, pair_idxs)
+        return ONE_4PI_EPS0*np.sum(eij)
+
+    if pair_idxs is not None:
+        eij = np.sum(pairwise_energy(conf, box, charges, cutoff, pair_idxs))
+    else:
+        eij = tiled_pairwise_energy(conf, box, charges, cutoff, tile_size)
+
+    eij_exc = (1 - exclusion_scales) * pairwise_energy(conf, box, charges, cutoff, exclusion_idxs)
+
+    return ONE_4PI_EPS0*(eij - np.sum(eij_exc))
 
-        # this is an implicit assumption in the Ewald calculation. If it were any larger
-        # then there may be more than N^2 number of interactions.
+
+def check_box_lengths(box, cutoff):
+    """
+    Raise a ValueError if any box vector is shorter than twice the cutoff. The check is
+    evaluated eagerly, so that a concrete box closed over by a jitted function is allowed.
+    """
+    with jax.ensure_compile_time_eval():
+        box_lengths = np.linalg.norm(box, axis=-1)
         if np.any(box_lengths < 2*cutoff):
             raise ValueError("Box lengths cannot be smaller than twice the cutoff.")
 
-        return ewald_energy(conf, box, charges, scale_matrix, cutoff, alpha, kmax)
 
-    else:    
-        # non periodic electrostatics is straightforward.
-        # note that we do not support reaction field approximations.
-        eij = scale_matrix*pairwise_energy(conf, box, charges, cutoff)
+def ewald_parameters(box, cutoff, alpha=None, kmax=None, grid_spacing=None, tolerance=None, pme_order=5):
+    """
+    Validate a periodic system and resolve the Ewald parameters, see electrostatics
+    for a description of the arguments.
 
-        return ONE_4PI_EPS0*np.sum(eij)/2
+    Returns
+    -------
+    (alpha, grid_size)
+        the splitting parameter, and the PME grid size, which is None if the reciprocal
+        space is summed directly over kmax.
+
+    """
+    # note that periodic boundary conditions are subject to the following
+    # convention and constraints:
+    # http://docs.openmm.org/latest/userguide/theory.html#periodic-boundary-conditions
+    assert cutoff is not None and cutoff >= 0.00
+
+    # this is an implicit assumption in the Ewald calculation. If it were any larger
+    # then there may be more than N^2 number of interactions.
+    check_box_lengths(box, cutoff)
+
+    if kmax is not None:
+        assert alpha is not None
+        return alpha, None
+
+    assert grid_spacing is not None or tolerance is not None, "one of kmax, grid_spacing, or tolerance must be set"
+
+    if alpha is None:
+        assert tolerance is not None
+        alpha = pme.alpha_from_tolerance(cutoff, tolerance)
+
+    if grid_spacing is not None:
+        grid_size = pme.grid_size_from_spacing(box, grid_spacing)
+    else:
+        grid_size = pme.grid_size_from_tolerance(box, alpha, tolerance)
+
+    grid_size = tuple(max(n, pme_order) for n in grid_size)
+
+    return alpha, grid_size
 
 
 def self_energy(conf, charges, alpha):
     return np.sum(ONE_4PI_EPS0 * np.power(charges, 2) * alpha/np.sqrt(np.pi))
 
 
-def ewald_energy(conf, box, charges, scale_matrix, cutoff, alpha, kmax):
-    eij = pairwise_energy(conf, box, charges, cutoff)
+def ewald_energy(conf, box, charges, exclusion_idxs, exclusion_scales, cutoff, alpha, kmax, pair_idxs=None, grid_size=None, pme_order=5,
+    tile_size=None):
+    """
+    Ewald energy, where the reciprocal space is either summed directly over a kmax^3
+    lattice, or, if grid_size is not None, approximated with smooth PME.
+    """
 
     assert cutoff is not None
 
-    # 1. Assume scale matrix is not used at all (no exceptions, no exclusions)
+    # 1. Assume there are no exclusions at all, unless all pairs are evaluated in which
+    # case the direct space part of the exclusions is scaled in place.
     # 1a. Direct Space
-    eij_direct = eij * erfc(alpha*eij)
-    eij_direct = ONE_4PI_EPS0*np.sum(eij_direct)/2
+    pair_scales = None
+    if pair_idxs is None and tile_size is None:
+        pair_idxs = upper_triangle_pair_idxs(conf.shape[0])
+        pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, exclusion_scales)
+
+    if pair_idxs is not None:
+        eij = pairwise_energy(conf, box, charges, cutoff, pair_idxs)
+        if pair_scales is not None:
+            eij *= pair_scales
+        dij, _ = pair_distance(conf, pair_idxs, box)
+        eij_direct = ONE_4PI_EPS0*np.sum(eij * erfc(alpha*dij))
+    else:
+        eij_direct = ONE_4PI_EPS0*tiled_pairwise_energy(conf, box, charges, cutoff, tile_size, alpha)
 
     # 1b. Reciprocal Space
-    eij_recip = reciprocal_energy(conf, box, charges, alpha, kmax)
-
-    # 2. Remove over estimated scale matrix contribution scaled by erf
-    eij_offset = (1-scale_matrix) * eij
-    eij_offset *= erf(alpha*eij_offset)
-    eij_offset = ONE_4PI_EPS0*np.sum(eij_offset)/2
+    if grid_size is not None:
+        eij_recip = pme.reciprocal_energy(conf, box, charges, alpha, grid_size, pme_order)
+    else:
+        eij_recip = reciprocal_energy(conf, box, charges, alpha, kmax)
+
+    # 2. Remove the over estimated contribution of the exclusions. The direct space
+    # part only exists within the cutoff, whereas the reciprocal space part, which
+    # is scaled by erf, is always present.
+    dij_exc, _ = pair_distance(conf, exclusion_idxs, box)
+    eij_exc = pairwise_energy(conf, box, charges, None, exclusion_idxs) * erf(alpha*dij_exc)
+    if pair_scales is None:
+        eij_exc += pairwise_energy(conf, box, charges, cutoff, exclusion_idxs) * erfc(alpha*dij_exc)
+    eij_offset = (1 - exclusion_scales) * eij_exc
+    eij_offset = ONE_4PI_EPS0*np.sum(eij_offset)
 
     return eij_direct + eij_recip - eij_offset - self_energy(conf, charges, alpha)
 
+def nonbonded(conf, params, box, lj_param_idxs, charge_param_idxs, exclusion_idxs, lj_scales, es_scales,
+    cutoff=None, alpha=None, kmax=None, pair_idxs=None, grid_spacing=None, tolerance=None, pme_order=5, tile_size=None,
+    rf_dielectric=None):
+    """
+    Fused Lennard-Jones and electrostatic potential, equal to the sum of lennard_jones and
+    electrostatics, where each pair distance and its masks are only computed once. If box is
+    not None then the electrostatics use Ewald summation exactly as in electrostatics, unless
+    rf_dielectric is set.
+
+    Parameters
+    ----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    params: shape [num_params,] np.array
+        unique parameters
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, if not None
+
+    lj_param_idxs: shape [num_atoms, 2] np.array
+        the (sig, eps) parameters of each atom
+
+    charge_param_idxs: shape [num_atoms,] np.array
+        the charge parameter of each atom
+
+    exclusion_idxs: shape [num_exclusions, 2] np.array
+        unique pairs (i, j) whose interactions are scaled, see lennard_jones.
+
+    lj_scales: shape [num_exclusions,] np.array
+        how much of each excluded Lennard-Jones interaction is kept, between [0, 1].
+
+    es_scales: shape [num_exclusions,] np.array
+        how much of each excluded electrostatic interaction is kept, between [0, 1].
+
+    The remaining arguments are the same as those of electrostatics.
+
+    """
+    sig = params[lj_param_idxs[:, 0]]
+    eps = params[lj_param_idxs[:, 1]]
+    charges = params[charge_param_idxs]
+    num_atoms = conf.shape[0]
+
+    reaction_field = None
+    if rf_dielectric is not None:
+        assert alpha is None and kmax is None and grid_spacing is None and tolerance is None
+        reaction_field = reaction_field_constants(cutoff, rf_dielectric)
+        if box is not None:
+            check_box_lengths(box, cutoff)
+        grid_size = None
+    elif box is not None:
+        alpha, grid_size = ewald_parameters(box, cutoff, alpha, kmax, grid_spacing, tolerance, pme_order)
+    else:
+        alpha, grid_size = None, None
+
+    args = (conf, sig, eps, charges, box)
+
+    lj_pair_scales = None
+    es_pair_scales = None
+    if pair_idxs is None and tile_size is None:
+        pair_idxs = upper_triangle_pair_idxs(num_atoms)
+        lj_pair_scales = upper_triangle_pair_scales(num_atoms, exclusion_idxs, lj_scales)
+        es_pair_scales = upper_triangle_pair_scales(num_atoms, exclusion_idxs, es_scales)
+
+    if pair_idxs is not None:
+        src_idxs = pair_idxs[:, 0]
+        dst_idxs = pair_idxs[:, 1]
+        dij, keep_mask = pair_distance(conf, pair_idxs, box)
+        sig_ij = (sig[src_idxs] + sig[dst_idxs])/2
+        eps_ij = np.sqrt(eps[src_idxs] * eps[dst_idxs])
+        qij = charges[src_idxs] * charges[dst_idxs]
+        if lj_pair_scales is not None:
+            eps_ij *= lj_pair_scales
+            qij *= es_pair_scales
+        energy = np.sum(nonbonded_pair_energy(dij, keep_mask, sig_ij, eps_ij, qij, cutoff, alpha, reaction_field))
+    else:
+        tile_fn = functools.partial(_nonbonded_tile, cutoff=cutoff, alpha=alpha, reaction_field=reaction_field)
+        energy = tiling.tiled_pair_sum(tile_fn, args, num_atoms, tile_size)
+
+    # remove the over-counted part of the excluded interactions, unless they were scaled in place
+    src_idxs = exclusion_idxs[:, 0]
+    dst_idxs = exclusion_idxs[:, 1]
+    dij, keep_mask = pair_distance(conf, exclusion_idxs, box)
+    qij = (1 - es_scales) * charges[src_idxs] * charges[dst_idxs]
+    if lj_pair_scales is None:
+        sig_ij = (sig[src_idxs] + sig[dst_idxs])/2
+        eps_ij = (1 - lj_scales) * np.sqrt(eps[src_idxs] * eps[dst_idxs])
+        energy -= np.sum(nonbonded_pair_energy(dij, keep_mask, sig_ij, eps_ij, qij, cutoff, alpha, reaction_field))
+
+    if alpha is not None:
+        # the reciprocal space part of the exclusions is present at all distances
+        eij_exc_recip = np.where(keep_mask, qij*erf(alpha*dij)/dij, np.zeros_like(qij))
+        energy -= ONE_4PI_EPS0*np.sum(eij_exc_recip)
+
+        if grid_size is not None:
+            energy += pme.reciprocal_energy(conf, box, charges, alpha, grid_size, pme_order)
+        else:
+            energy += reciprocal_energy(conf, box, charges, alpha, kmax)
+
+        energy -= self_energy(conf, charges, alpha)
+
+    return energy
+
+
+def nonbonded_pair_energy(dij, keep_mask, sig_ij, eps_ij, qij, cutoff, alpha, reaction_field=None):
+    """
+    Elementwise sum of the LJ612 and the Coulomb energies, zeroed wherever keep_mask is
+    False or dij >= cutoff. See coulomb_pair_energy for alpha and reaction_field.
+    """
+    if cutoff is not None:
+        keep_mask = np.logical_and(keep_mask, dij < cutoff)
+
+    eij = coulomb_pair_energy(dij, qij, keep_mask, alpha, reaction_field)
+
+    return lj_pair_energy(dij, sig_ij, eps_ij, keep_mask) + ONE_4PI_EPS0*eij
+
+
+def _nonbonded_tile(args, i_idxs, j_idxs, keep_mask, cutoff, alpha, reaction_field=None):
+    conf, sig, eps, charges, box = args
+    dij = tiling.tile_distance(conf[i_idxs], conf[j_idxs], keep_mask, box)
+    sig_ij = (np.expand_dims(sig[i_idxs], 1) + np.expand_dims(sig[j_idxs], 0))/2
+    eps_ij = np.sqrt(np.expand_dims(eps[i_idxs], 1) * np.expand_dims(eps[j_idxs], 0))
+    qij = np.expand_dims(charges[i_idxs], 1) * np.expand_dims(charges[j_idxs], 0)
+    return nonbonded_pair_energy(dij, keep_mask, sig_ij, eps_ij, qij, cutoff, alpha, reaction_field)
+
+
+def softcore_lj_pair_energy(dij, sig_ij, eps_ij, keep_mask, lamb, sc_alpha):
+    """
+    Elementwise soft-core LJ612 energy of Beutler et al. (1994)
+
+    4*eps_ij*(1-lamb)*(1/x^2 - 1/x), where x = sc_alpha*lamb + (dij/sig_ij)^6
+
+    which is the plain LJ612 energy at lamb = 0 and remains finite as dij goes to zero
+    for lamb > 0. lamb may have additional leading dimensions, eg. [K, P] for K lambda
+    windows, over which dij and the parameters are broadcast.
+    """
+    keep_mask = np.logical_and(keep_mask, sig_ij > 0)
+    sig_ij = np.where(keep_mask, sig_ij, np.ones_like(sig_ij))
+    eps_ij = np.where(keep_mask, eps_ij, np.zeros_like(eps_ij))
+
+    r2 = dij/sig_ij
+    r2 *= r2
+    x = sc_alpha*lamb + r2*r2*r2
+    inv_x = 1/x
+
+    energy = 4*eps_ij*(1 - lamb)*inv_x*(inv_x - 1)
+    energy = np.where(keep_mask, energy, np.zeros_like(energy))
+
+    return energy
+
+
+def softcore_coulomb_pair_energy(dij, qij, keep_mask, lamb, sc_beta, reaction_field=None):
+    """
+    Elementwise soft-core Coulomb energy (1-lamb)*qij/sqrt(sc_beta*lamb + dij^2), without the
+    Coulomb constant. If reaction_field is not None then the reaction field energy of
+    coulomb_pair_energy is evaluated at the same soft-core distance. lamb is broadcast as
+    in softcore_lj_pair_energy.
+    """
+    dij_sc = np.sqrt(sc_beta*lamb + dij*dij)
+    return (1 - lamb)*coulomb_pair_energy(dij_sc, qij, keep_mask, reaction_field=reaction_field)
+
+
+def softcore_nonbonded(conf, params, box, lj_param_idxs, charge_param_idxs, exclusion_idxs, lj_scales, es_scales,
+    lambdas, alchemical_flags, cutoff=None, sc_alpha=0.5, sc_beta=0.12, pair_idxs=None, rf_dielectric=None):
+    """
+    Soft-core Lennard-Jones and electrostatic potential used to alchemically decouple a set
+    of atoms, such as a guest, from the rest of the system.
+
+    Pairs between an alchemical and a non-alchemical atom are scaled by (1-lambda) and
+    softened as in softcore_lj_pair_energy and softcore_coulomb_pair_energy, so that
+    lambda = 0 is fully interacting and lambda = 1 is decoupled. All other pairs are
+    independent of lambda. If lambdas is a vector of K windows, then the energies of all
+    windows are computed from a single evaluation of the pair distances, as is needed by
+    MBAR.
+
+    Parameters
+    ----------
+    lambdas: float or shape [K,] np.array
+        alchemical coupling parameter of each window, between [0, 1]
+
+    alchemical_flags: shape [num_atoms,] np.array
+        True (or 1) for the atoms that are decoupled
+
+    sc_alpha: float
+        soft-core parameter of the Lennard-Jones interactions
+
+    sc_beta: float
+        soft-core parameter of the electrostatic interactions, in units of length^2
+
+    rf_dielectric: float
+        dielectric constant of the reaction field, see electrostatics. This is required
+        for periodic boxes since Ewald summation is not supported.
+
+    pair_idxs: shape [num_pairs, 2] np.array
+        If not None, then only these pairs are evaluated, see lennard_jones. Otherwise
+        all N(N-1)/2 unique pairs are evaluated.
+
+    The remaining arguments are the same as those of nonbonded.
+
+    Returns
+    -------
+    float or shape [K,] np.array
+        the energy at each lambda, with the same shape as lambdas
+
+    """
+    sig = params[lj_param_idxs[:, 0]] if lj_param_idxs is not None else None
+    eps = params[lj_param_idxs[:, 1]] if lj_param_idxs is not None else None
+    charges = params[charge_param_idxs] if charge_param_idxs is not None else None
+
+    reaction_field = None
+    if charges is not None:
+        if rf_dielectric is not None:
+            reaction_field = reaction_field_constants(cutoff, rf_dielectric)
+        elif box is not None:
+            raise ValueError("Periodic soft-core electrostatics require rf_dielectric.")
+    if box is not None:
+        assert cutoff is not None
+        check_box_lengths(box, cutoff)
+
+    lambdas = np.asarray(lambdas, dtype=conf.dtype)
+    lamb = np.reshape(lambdas, (-1, 1)) # [K, 1]
+    alchemical_flags = np.asarray(alchemical_flags, dtype=bool)
+
+    def pair_sum(pair_idxs, lj_weights, es_weights):
+        src_idxs = pair_idxs[:, 0]
+        dst_idxs = pair_idxs[:, 1]
+        dij, keep_mask = pair_distance(conf, pair_idxs, box)
+        if cutoff is not None:
+            keep_mask = np.logical_and(keep_mask, dij < cutoff)
+
+        # pairs between an alchemical and a non-alchemical atom are decoupled
+        is_alchemical = alchemical_flags[src_idxs] != alchemical_flags[dst_idxs]
+        lamb_ij = np.where(is_alchemical, lamb, np.zeros_like(lamb)) # [K, P]
+
+        energy = np.zeros_like(lamb_ij)
+        if sig is not None:
+            sig_ij = (sig[src_idxs] + sig[dst_idxs])/2
+            eps_ij = lj_weights * np.sqrt(eps[src_idxs] * eps[dst_idxs])
+            energy += softcore_lj_pair_energy(dij, sig_ij, eps_ij, keep_mask, lamb_ij, sc_alpha)
+        if charges is not None:
+            qij = es_weights * charges[src_idxs] * charges[dst_idxs]
+            energy += ONE_4PI_EPS0*softcore_coulomb_pair_energy(dij, qij, keep_mask, lamb_ij, sc_beta, reaction_field)
+
+        return np.sum(energy, axis=-1)
+
+    if pair_idxs is None:
+        # every unique pair, with the exclusions scaled in place
+        pair_idxs = upper_triangle_pair_idxs(conf.shape[0])
+        lj_pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, lj_scales)
+        es_pair_scales = upper_triangle_pair_scales(conf.shape[0], exclusion_idxs, es_scales)
+        energy = pair_sum(pair_idxs, lj_pair_scales, es_pair_scales)
+    else:
+        energy = pair_sum(pair_idxs, 1.0, 1.0)
+        # remove the over-counted part of the excluded interactions
+        energy -= pair_sum(exclusion_idxs, 1 - lj_scales, 1 - es_scales)
+
+    return np.reshape(energy, lambdas.shape)
+
+
+def softcore_lennard_jones(conf, params, box, param_idxs, exclusion_idxs, exclusion_scales, lambdas, alchemical_flags,
+    cutoff=None, sc_alpha=0.5, pair_idxs=None):
+    """
+    Soft-core variant of lennard_jones, see softcore_nonbonded.
+    """
+    return softcore_nonbonded(conf, params, box, param_idxs, None, exclusion_idxs, exclusion_scales, exclusion_scales,
+        lambdas, alchemical_flags, cutoff=cutoff, sc_alpha=sc_alpha, pair_idxs=pair_idxs)
+
+
+def softcore_electrostatics(conf, params, box, param_idxs, exclusion_idxs, exclusion_scales, lambdas, alchemical_flags,
+    cutoff=None, sc_beta=0.12, pair_idxs=None, rf_dielectric=None):
+    """
+    Soft-core variant of electrostatics, see softcore_nonbonded.
+    """
+    return softcore_nonbonded(conf, params, box, None, param_idxs, exclusion_idxs, exclusion_scales, exclusion_scales,
+        lambdas, alchemical_flags, cutoff=cutoff, sc_beta=sc_beta, pair_idxs=pair_idxs, rf_dielectric=rf_dielectric)
+
+
+def half_space_lattice(kmax):
+    """
+    Integer reciprocal lattice vectors (mx, my, mz) with 0 <= mx < kmax and |my|, |mz| < kmax,
+    keeping only one of each pair of vectors m, -m and excluding m = 0.
+    """
+    return _half_space_lattice(int(kmax)).copy()
+
+
+@functools.lru_cache(maxsize=None)
+def _half_space_lattice(kmax):
+    mx = onp.arange(kmax)
+    myz = onp.arange(1-kmax, kmax)
+    mg = onp.stack(onp.meshgrid(mx, myz, myz, indexing='ij'), axis=-1).reshape(-1, 3)
+    rx, ry, rz = mg[:, 0], mg[:, 1], mg[:, 2]
+    keep = (rx > 0) | ((rx == 0) & (ry > 0)) | ((rx == 0) & (ry == 0) & (rz > 0))
+    return mg[keep]
+
+
+class ReciprocalPlan():
+
+    def __init__(self, box, alpha, kmax):
+        """
+        Precomputed parts of the Ewald reciprocal sum that depend only on (box, alpha, kmax):
+        the half-space lattice, and the prefactors exp(-k^2/4a^2)/k^2 combined with the
+        Coulomb constant, volume, and the factor of two from the omitted -k vectors.
+
+        Parameters
+        ----------
+        box: shape [3, 3] np.array
+            periodic boundary vectors, one per row. Triclinic boxes are supported.
+
+        alpha: float
+            alpha term controlling the erf adjustment
+
+        kmax: int
+            number of images by which we tile out reciprocal space.
+
+        """
+        assert kmax > 0
+        assert box is not None
+        assert alpha > 0
+
+        self.kmax = int(kmax)
+        self.lattice = half_space_lattice(self.kmax) # [nk, 3]
+
+        # reciprocal vectors are the columns of inv(box)
+        self.recip_box = np.linalg.inv(box)
+        ki = 2*np.pi*np.matmul(self.lattice, self.recip_box.T) # [nk, 3]
+        k2 = np.sum(ki*ki, axis=-1)
+        volume = np.abs(np.linalg.det(box))
+
+        self.weights = (ONE_4PI_EPS0*4*np.pi/volume)*np.exp(-k2/(4*alpha*alpha))/k2 # [nk]
+
+    def structure_factor(self, conf, charges):
+        """
+        Compute S(k) = sum_i q_i exp(i k.r_i) for every lattice vector.
+
+        Since k.r = 2*pi*(mx*sx + my*sy + mz*sz), where s are the fractional coordinates,
+        exp(i k.r) is the product of integer powers of exp(2*pi*i*s) along each axis.
+        These powers are built by repeated multiplication so that only 3N
+        trigonometric functions are evaluated.
+
+        Returns
+        -------
+        (real, imag)
+            shape [nk,] real and imaginary parts of S(k)
+
+        """
+        s = np.matmul(conf[:, :3], self.recip_box) # [N, 3]
+        theta = 2*np.pi*s
+        e_real = np.cos(theta)
+        e_imag = np.sin(theta)
+
+        pow_real = [np.ones_like(e_real)]
+        pow_imag = [np.zeros_like(e_imag)]
+        for _ in range(1, self.kmax):
+            pr, pi = pow_real[-1], pow_imag[-1]
+            pow_real.append(pr*e_real - pi*e_imag)
+            pow_imag.append(pr*e_imag + pi*e_real)
+
+        # table of powers for m = 1-kmax, ..., kmax-1, where negative powers are conjugates
+        table_real = np.stack(pow_real[:0:-1] + pow_real) # [2*kmax-1, N, 3]
+        table_imag = np.stack([-p for p in pow_imag[:0:-1]] + pow_imag)
+
+        idxs = self.lattice + self.kmax - 1
+
+        xr, xi = table_real[idxs[:, 0], :, 0], table_imag[idxs[:, 0], :, 0] # [nk, N]
+        yr, yi = table_real[idxs[:, 1], :, 1], table_imag[idxs[:, 1], :, 1]
+        zr, zi = table_real[idxs[:, 2], :, 2], table_imag[idxs[:, 2], :, 2]
+
+        xyr = xr*yr - xi*yi
+        xyi = xr*yi + xi*yr
+        eikr_real = xyr*zr - xyi*zi
+        eikr_imag = xyr*zi + xyi*zr
+
+        return np.matmul(eikr_real, charges), np.matmul(eikr_imag, charges)
+
+    def energy(self, conf, charges):
+        Sk_real, Sk_imag = self.structure_factor(conf, charges)
+        return np.sum(self.weights*(Sk_real*Sk_real + Sk_imag*Sk_imag))
+
+
+@functools.lru_cache(maxsize=8)
+def _cached_reciprocal_plan(box_bytes, alpha, kmax):
+    box = onp.frombuffer(box_bytes, dtype=onp.float64).reshape(3, 3)
+    # evaluate eagerly even if called while tracing, so that no tracers are cached
+    with jax.ensure_compile_time_eval():
+        return ReciprocalPlan(box, alpha, kmax)
+
+
+def get_reciprocal_plan(box, alpha, kmax):
+    """
+    Return a ReciprocalPlan, reusing a previously constructed one if (box, alpha, kmax)
+    are concrete and unchanged, as is the case at every step of an NVT simulation.
+    """
+    if isinstance(box, jax.core.Tracer) or isinstance(alpha, jax.core.Tracer):
+        return ReciprocalPlan(box, alpha, kmax)
+
+    box_bytes = onp.ascontiguousarray(box, dtype=onp.float64).tobytes()
+    return _cached_reciprocal_plan(box_bytes, float(alpha), int(kmax))
+
+
 def reciprocal_energy(conf, box, charges, alpha, kmax):
 
     assert kmax > 0
     assert box is not None
     assert alpha > 0
 
-    recipBoxSize = (2*np.pi)/np.diag(box)
-
-    mg = []
-    lowry = 0
-    lowrz = 1
-
-    numRx, numRy, numRz = kmax, kmax, kmax
-
-    for rx in range(numRx):
-        for ry in range(lowry, numRy):
-            for rz in range(lowrz, numRz):
-                mg.append([rx, ry, rz])
-                lowrz = 1 - numRz
-            lowry = 1 - numRy
-
-    mg = np.array(onp.array(mg))
-
-    # lattice vectors
-    ki = np.expand_dims(recipBoxSize, axis=0) * mg # [nk, 3]
-    ri = np.expand_dims(conf, axis=0) # [1, N, 3]
-    rik = np.sum(np.multiply(ri, np.expand_dims(ki, axis=1)), axis=-1) # [nk, N]
-    real = np.cos(rik)
-    imag = np.sin(rik)
-    eikr = real + 1j*imag # [nk, N]
-    qi = charges +0j
-    Sk = np.sum(qi*eikr, axis=-1)  # [nk]
-    n2Sk = np.power(np.abs(Sk), 2)
-    k2 = np.sum(np.multiply(ki, ki), axis=-1) # [nk]
-    factorEwald = -1/(4*alpha*alpha)
-    ak = np.exp(k2*factorEwald)/k2 # [nk]
-    nrg = np.sum(ak * n2Sk)
-    # the following volume calculation assumes the reduced PBC convention consistent
-    # with that of OpenMM
-    recipCoeff = (ONE_4PI_EPS0*4*np.pi)/(box[0][0]*box[1][1]*box[2][2]) 
-
-    return recipCoeff * nrg
+    plan = get_reciprocal_plan(box, alpha, kmax)
+
+    return plan.energy(conf, charges)
@@ -0,0 +1,236 @@
+import functools
+
+import numpy as onp
+import jax
+import jax.numpy as np
+
+from timemachine.constants import ONE_4PI_EPS0
+
+
+def _concrete_box_lengths(box):
+    # grid sizes determine array shapes, so they can only be derived from a box
+    # whose value is known at trace time
+    box = jax.core.concrete_or_error(onp.asarray, box,
+        "PME grid sizes cannot be derived from a traced box, pass a concrete box instead.")
+    return onp.linalg.norm(onp.asarray(box, dtype=onp.float64), axis=-1)
+
+
+def alpha_from_tolerance(cutoff, tolerance):
+    """
+    Ewald splitting parameter such that erfc(alpha*cutoff) ~ tolerance, following
+    the convention used by OpenMM.
+    """
+    return onp.sqrt(-onp.log(2*tolerance))/cutoff
+
+
+def grid_size_from_tolerance(box, alpha, tolerance):
+    """
+    Number of PME grid points along each box vector required to reach the
+    desired relative force error, following the convention used by OpenMM.
+    """
+    box_lengths = _concrete_box_lengths(box)
+    grid_size = onp.ceil(2*alpha*box_lengths/(3*onp.power(tolerance, 0.2)))
+    return tuple(int(max(n, 1)) for n in grid_size)
+
+
+def grid_size_from_spacing(box, grid_spacing):
+    """
+    Number of PME grid points along each box vector such that neighboring grid
+    points are at most grid_spacing apart.
+    """
+    box_lengths = _concrete_box_lengths(box)
+    grid_size = onp.ceil(box_lengths/grid_spacing)
+    return tuple(int(max(n, 1)) for n in grid_size)
+
+
+def bspline_weights(w, order):
+    """
+    Cardinal B-spline weights M_n(w + j) for j = 0, ..., order-1.
+
+    Parameters
+    ----------
+    w: np.array
+        fractional offsets in [0, 1)
+
+    order: int
+        interpolation order n, the splines are piecewise polynomials of degree n-1
+
+    Returns
+    -------
+    shape w.shape + (order,) np.array
+        weights that sum to one along the last axis
+
+    """
+    assert order >= 2
+    x = np.expand_dims(w, -1) + np.arange(order)
+
+    # M_2(x - s) = 1 - |x - s - 1| on [s, s+2], built up using the recursion
+    # M_m(x) = x/(m-1) M_{m-1}(x) + (m-x)/(m-1) M_{m-1}(x-1)
+    vals = [np.maximum(0, 1 - np.abs(x - s - 1)) for s in range(order-1)]
+    for m in range(3, order+1):
+        vals = [((x - s)*vals[s] + (m - (x - s))*vals[s+1])/(m-1) for s in range(order-m+1)]
+
+    return vals[0]
+
+
+@functools.lru_cache(maxsize=None)
+def bspline_moduli(grid_size, order):
+    """
+    Squared moduli |b(m)|^2 of the Euler exponential spline along one grid axis,
+    see eq. 4.4 of Essmann et al. (1995).
+    """
+    knots = onp.arange(1, order, dtype=onp.float64)
+    # M_n evaluated at the integer knots 1, ..., n-1
+    M = onp.array(bspline_weights(np.zeros(()), order))[1:]
+    m = onp.arange(grid_size)
+    arg = 2*onp.pi*onp.outer(m, knots - 1)/grid_size
+    denom = onp.abs(onp.sum(M*onp.exp(1j*arg), axis=-1))**2
+
+    # for odd orders the denominator vanishes at the Nyquist frequency, replace it
+    # with the average of its neighbors
+    for i in range(grid_size):
+        if denom[i] < 1e-7:
+            denom[i] = (denom[(i-1) % grid_size] + denom[(i+1) % grid_size])/2
+
+    return 1/denom
+
+
+@functools.lru_cache(maxsize=None)
+def _grid_constants(grid_size, order):
+    """
+    Box independent parts of the reciprocal sum on the rfftn half-grid: the integer
+    frequencies along each axis, the B-spline moduli, and the symmetry weights that
+    account for the frequencies dropped by the real FFT.
+    """
+    Kx, Ky, Kz = grid_size
+    mx = onp.fft.fftfreq(Kx)*Kx
+    my = onp.fft.fftfreq(Ky)*Ky
+    mz = onp.arange(Kz//2 + 1, dtype=onp.float64)
+
+    bx = bspline_moduli(Kx, order)
+    by = bspline_moduli(Ky, order)
+    bz = bspline_moduli(Kz, order)[:Kz//2 + 1]
+    B = bx[:, None, None]*by[None, :, None]*bz[None, None, :]
+
+    # each non-redundant column of the half-grid stands in for itself and its conjugate
+    weights = onp.full(Kz//2 + 1, 2.0)
+    weights[0] = 1.0
+    if Kz % 2 == 0:
+        weights[-1] = 1.0
+
+    m = onp.stack(onp.meshgrid(mx, my, mz, indexing='ij'), axis=-1) # [Kx, Ky, Kz//2+1, 3]
+    is_zero = onp.all(m == 0, axis=-1)
+
+    return m, B*weights[None, None, :], is_zero
+
+
+def spread_charges(conf, box, charges, grid_size, order=5):
+    """
+    Spread the charges onto a periodic grid using B-spline interpolation.
+
+    Parameters
+    ----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, one per row
+
+    charges: shape [num_atoms,] np.array
+        atomic charges
+
+    grid_size: tuple of 3 ints
+        number of grid points along each box vector
+
+    order: int
+        B-spline interpolation order
+
+    Returns
+    -------
+    shape grid_size np.array
+        charge grid Q
+
+    """
+    Kx, Ky, Kz = grid_size
+    K = np.array(grid_size)
+
+    # scaled fractional coordinates, valid for triclinic boxes
+    u = np.matmul(conf[:, :3], np.linalg.inv(box))*K
+    base = np.floor(u)
+    w = u - base
+    base = base.astype(np.int32)
+
+    theta = bspline_weights(w, order) # [N, 3, order]
+
+    # grid point base - j receives weight M_n(w + j)
+    grid_idxs = np.mod(base[:, :, None] - np.arange(order), K[:, None]) # [N, 3, order]
+
+    ix = grid_idxs[:, 0, :, None, None]
+    iy = grid_idxs[:, 1, None, :, None]
+    iz = grid_idxs[:, 2, None, None, :]
+    flat_idxs = (ix*Ky + iy)*Kz + iz # [N, order, order, order]
+
+    tx = theta[:, 0, :, None, None]
+    ty = theta[:, 1, None, :, None]
+    tz = theta[:, 2, None, None, :]
+    vals = charges[:, None, None, None]*tx*ty*tz
+
+    Q = jax.ops.segment_sum(vals.reshape(-1), flat_idxs.reshape(-1), num_segments=Kx*Ky*Kz)
+
+    return Q.reshape(grid_size)
+
+
+def reciprocal_energy(conf, box, charges, alpha, grid_size, order=5):
+    """
+    Smooth particle mesh Ewald approximation of the reciprocal space energy
+    (Essmann et al., 1995). This is a drop-in replacement for the direct
+    structure-factor sum of nonbonded.reciprocal_energy that costs
+    O(N order^3 + K log K) instead of O(N kmax^3).
+
+    Forces are the exact derivatives of the interpolated energy, obtained by
+    differentiating through the B-spline weights, and the energy remains
+    differentiable w.r.t. the charges and the box.
+
+    Parameters
+    ----------
+    conf: shape [num_atoms, 3] np.array
+        atomic coordinates
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors, one per row. Triclinic boxes are supported.
+
+    charges: shape [num_atoms,] np.array
+        atomic charges
+
+    alpha: float
+        Ewald splitting parameter
+
+    grid_size: tuple of 3 ints
+        number of grid points along each box vector. This must be static.
+
+    order: int
+        B-spline interpolation order
+
+    """
+    assert box is not None
+    assert alpha > 0
+
+    grid_size = tuple(int(n) for n in grid_size)
+    assert min(grid_size) >= order, "grid must have at least order points per dimension"
+
+    m_int, B, is_zero = _grid_constants(grid_size, order)
+
+    Q = spread_charges(conf, box, charges, grid_size, order)
+    FQ = np.fft.rfftn(Q)
+    FQ2 = np.real(FQ)**2 + np.imag(FQ)**2
+
+    # reciprocal vectors are the columns of inv(box)
+    m = np.matmul(m_int, np.linalg.inv(box).T)
+    m2 = np.sum(m*m, axis=-1)
+    m2 = np.where(is_zero, 1.0, m2) # avoid dividing by zero at m = 0
+    ak = np.exp(-(np.pi*np.pi/(alpha*alpha))*m2)/m2
+    ak = np.where(is_zero, 0.0, ak)
+
+    volume = np.abs(np.linalg.det(box))
+
+    return ONE_4PI_EPS0/(2*np.pi*volume)*np.sum(ak*B*FQ2)
@@ -0,0 +1,118 @@
+import numpy as onp
+import jax
+import jax.numpy as np
+from jax import lax
+
+from timemachine.potentials.jax_utils import delta_r
+
+
+def tile_blocks(num_atoms, tile_size):
+    """
+    Split range(num_atoms) into blocks of tile_size indices, padding the last block
+    with indices >= num_atoms.
+
+    Returns
+    -------
+    shape [num_blocks, tile_size] np.array
+        int32 atom indices of each block
+
+    """
+    assert tile_size > 0
+    num_blocks = -(-num_atoms // tile_size)
+    return onp.arange(num_blocks*tile_size, dtype=onp.int32).reshape(num_blocks, tile_size)
+
+
+def tile_distance(conf_i, conf_j, mask, box=None):
+    """
+    Distances between every row of conf_i and every row of conf_j. Entries where mask
+    is False, such as i == j or padded atoms, are assigned a distance of 1 so that
+    their gradients remain finite.
+
+    Returns
+    -------
+    shape [T, T] np.array
+
+    """
+    ri = np.expand_dims(conf_i, 1)
+    rj = np.expand_dims(conf_j, 0)
+    d2ij = np.sum(np.power(delta_r(ri, rj, box), 2), axis=-1)
+    d2ij = np.where(mask, d2ij, np.ones_like(d2ij))
+    return np.sqrt(d2ij)
+
+
+def _clip(idxs, num_atoms):
+    # padded indices are redirected to the last atom, and must be masked out
+    return np.minimum(idxs, num_atoms - 1)
+
+
+def tiled_pair_sum(pair_fn, args, num_atoms, tile_size):
+    """
+    Compute sum_{i<j} f_ij by evaluating pair_fn over [tile_size, tile_size] blocks.
+
+    Only the blocks on or above the diagonal are visited. They are evaluated one at a
+    time with lax.map, and each block is rematerialized in the backwards pass, so that
+    the peak memory of the energy, its gradients, and its Hessian-vector products is
+    O(num_blocks + tile_size^2) rather than O(num_atoms^2).
+
+    Parameters
+    ----------
+    pair_fn: callable
+        pair_fn(args, i_idxs, j_idxs, mask) returns the shape [T, T] values f_ij of the
+        atoms i_idxs [T] and j_idxs [T]. Values where mask is False must be zero and have
+        finite derivatives.
+
+    args: pytree of np.arrays
+        arrays that the energy is differentiated w.r.t., passed through to pair_fn
+
+    num_atoms: int
+        number of atoms
+
+    tile_size: int
+        number of atoms per block
+
+    """
+    blocks = tile_blocks(num_atoms, tile_size)
+    bi, bj = onp.triu_indices(blocks.shape[0])
+
+    @jax.checkpoint
+    def block_fn(args, i_idxs, j_idxs):
+        mask = np.logical_and(
+            np.expand_dims(i_idxs, 1) < np.expand_dims(j_idxs, 0),
+            np.expand_dims(j_idxs, 0) < num_atoms
+        )
+        vals = pair_fn(args, _clip(i_idxs, num_atoms), _clip(j_idxs, num_atoms), mask)
+        return np.sum(vals)
+
+    block_sums = lax.map(lambda x: block_fn(args, x[0], x[1]), (blocks[bi], blocks[bj]))
+
+    return np.sum(block_sums)
+
+
+def tiled_row_sum(pair_fn, args, num_atoms, tile_size):
+    """
+    Compute sum_{j != i} f_ij for every atom i, where f_ij need not be symmetric,
+    by evaluating pair_fn over [tile_size, tile_size] blocks. See tiled_pair_sum.
+
+    Returns
+    -------
+    shape [num_atoms,] np.array
+
+    """
+    blocks = tile_blocks(num_atoms, tile_size)
+
+    @jax.checkpoint
+    def block_fn(args, i_idxs, j_idxs):
+        valid_i = np.expand_dims(i_idxs, 1) < num_atoms
+        valid_j = np.expand_dims(j_idxs, 0) < num_atoms
+        not_diag = np.expand_dims(i_idxs, 1) != np.expand_dims(j_idxs, 0)
+        mask = np.logical_and(np.logical_and(valid_i, valid_j), not_diag)
+        vals = pair_fn(args, _clip(i_idxs, num_atoms), _clip(j_idxs, num_atoms), mask)
+        return np.sum(vals, axis=-1)
+
+    def row_fn(i_idxs):
+        col_sums = lax.map(lambda j_idxs: block_fn(args, i_idxs, j_idxs), blocks)
+        return np.sum(col_sums, axis=0)
+
+    row_sums = lax.map(row_fn, blocks)
+
+    return row_sums.reshape(-1)[:num_atoms]
@@ -0,0 +1,125 @@
+import numpy as onp
+import jax
+import jax.numpy as np
+
+from timemachine.constants import AVOGADRO
+
+
+def derivatives_with_virial(energy_fn):
+    """
+    Wrap an energy function so that the 3x3 virial tensor is computed in the same
+    backwards pass as the forces.
+
+    The virial is minus the derivative of the energy w.r.t. a homogeneous strain
+    x -> x(I + e) of both the coordinates and the box rows, taken at e = 0:
+
+        W = -(conf^T dE/dconf + box^T dE/dbox)
+
+    Minimum image shifts are piecewise constant in the box, so they stay fixed, and
+    for pairwise potentials this reduces to the familiar sum of r_ij (x) f_ij over
+    pairs. The explicit box dependence, eg. of the Ewald reciprocal space sum, is
+    picked up through dE/dbox. If box is None only the first term is present.
+
+    This works for every potential in bonded, nonbonded and pme, as well as the
+    non-periodic implicit.gbsa, whose energies are all functions of conf, params and
+    box alone. Since the PME grid and Ewald checks need a concrete box, fn is not
+    jitted here.
+
+    Parameters
+    ----------
+    energy_fn: function
+        energy_fn(conf, params, box) -> scalar
+
+    Returns
+    -------
+    function
+        fn(conf, params, box) -> (E, dE_dx, virial), with virial of shape [3, 3]
+
+    """
+    def fn(conf, params, box):
+        if box is None:
+            E, dE_dx = jax.value_and_grad(energy_fn, argnums=0)(conf, params, box)
+            return E, dE_dx, -np.matmul(conf.T, dE_dx)
+
+        E, (dE_dx, dE_dbox) = jax.value_and_grad(energy_fn, argnums=(0, 2))(conf, params, box)
+        virial = -(np.matmul(conf.T, dE_dx) + np.matmul(box.T, dE_dbox))
+        return E, dE_dx, virial
+
+    return fn
+
+
+def kinetic_tensor(v, masses):
+    """
+    Twice the kinetic energy tensor, sum_i m_i v_i (x) v_i, in kJ/mol.
+    """
+    return np.matmul(v.T*masses, v)
+
+
+def pressure_tensor(virial, v, masses, box):
+    """
+    Instantaneous pressure tensor (2K + W)/V in bar.
+
+    Parameters
+    ----------
+    virial: shape [3, 3] np.array
+        virial in kJ/mol, see derivatives_with_virial
+
+    v: shape [N, 3] np.array
+        velocities in nm/ps
+
+    masses: shape [N,] np.array
+        masses in amu
+
+    box: shape [3, 3] np.array
+        periodic boundary vectors in nm
+
+    """
+    volume = np.abs(np.linalg.det(box))
+    # kJ/mol/nm^3 to bar
+    return (kinetic_tensor(v, masses) + virial)/volume/(AVOGADRO*1e-25)
+
+
+class PressureReporter():
+
+    def __init__(self, energy_fn, params, masses):
+        """
+        Report the instantaneous pressure of a periodic system from a single force and
+        virial evaluation, without any trial volume moves.
+
+        Parameters
+        ----------
+        energy_fn: function
+            total energy_fn(conf, params, box) of the system
+
+        params: np.array
+            parameters passed to energy_fn
+
+        masses: shape [N,] np.array
+            masses in amu
+
+        """
+        self.params = params
+        self.masses = onp.asarray(masses, dtype=onp.float64)
+        self._derivatives_fn = derivatives_with_virial(energy_fn)
+
+    def pressure_tensor(self, conf, v, box):
+        _, _, virial = self._derivatives_fn(conf, self.params, box)
+        return pressure_tensor(virial, v, self.masses, box)
+
+    def pressure(self, conf, v, box):
+        """
+        Scalar pressure in bar, one third of the trace of the pressure tensor.
+
+        Parameters
+        ----------
+        conf: shape [N, 3] np.array
+            coordinates in nm
+
+        v: shape [N, 3] np.array
+            velocities in nm/ps
+
+        box: shape [3, 3] np.array
+            periodic boundary vectors in nm
+
+        """
+        return np.trace(self.pressure_tensor(conf, v, box))/3